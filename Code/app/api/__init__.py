@@ -0,0 +1,5 @@
+"""HTTP/JSON API模块"""
+
+from app.api.server import ApiServer, create_api_server, run_api_server
+
+__all__ = ["ApiServer", "create_api_server", "run_api_server"]
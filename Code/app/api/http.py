@@ -0,0 +1,187 @@
+"""基于asyncio的最小HTTP/1.1实现
+
+只覆盖API服务需要的部分：带Content-Length的请求体、keep-alive、JSON响应和
+Server-Sent Events流式响应。不依赖第三方Web框架。
+"""
+
+import json
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional
+from http.cookies import SimpleCookie, CookieError
+from urllib.parse import urlsplit, parse_qs
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content",
+    400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 411: "Length Required",
+    413: "Payload Too Large", 429: "Too Many Requests", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+MAX_HEADER_LINES = 100
+
+
+class HttpError(Exception):
+    """以指定状态码结束请求的错误，消息以JSON形式返回给客户端"""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+@dataclass
+class Request:
+    """已解析的HTTP请求"""
+
+    method: str
+    target: str
+    version: str
+    headers: Dict[str, str]
+    body: bytes = b""
+    path: str = ""
+    query: Dict[str, str] = field(default_factory=dict)
+    params: Dict[str, str] = field(default_factory=dict)  # 路由中的路径参数
+    peer: str = ""
+    response_headers: Dict[str, str] = field(default_factory=dict)  # 处理过程中需要附加到响应的头（如轮换后的会话令牌）
+
+    def __post_init__(self):
+        parts = urlsplit(self.target)
+        self.path = parts.path
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    @property
+    def cookies(self) -> Dict[str, str]:
+        cookie = SimpleCookie()
+        try:
+            cookie.load(self.headers.get("cookie", ""))
+        except CookieError:
+            return {}
+        return {name: morsel.value for name, morsel in cookie.items()}
+
+    def json(self) -> Dict[str, Any]:
+        """解析JSON请求体，空请求体视为空对象"""
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except (ValueError, UnicodeDecodeError):
+            raise HttpError(400, "请求体不是有效的JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "请求体必须是JSON对象")
+        return data
+
+
+@dataclass
+class Response:
+    """完整缓冲的HTTP响应"""
+
+    status: int = 200
+    body: bytes = b""
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def json(cls, payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> 'Response':
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        merged = {"Content-Type": "application/json; charset=utf-8"}
+        merged.update(headers or {})
+        return cls(status, body, merged)
+
+
+async def read_request(reader: asyncio.StreamReader, max_body: int) -> Optional[Request]:
+    """从连接读取一个请求
+
+    Returns:
+        请求对象；连接在请求开始前被关闭时返回None
+
+    Raises:
+        HttpError: 请求格式错误或超出大小限制
+    """
+    try:
+        line = await reader.readline()
+    except (asyncio.LimitOverrunError, ValueError):
+        raise HttpError(400, "请求行过长")
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "无效的请求行")
+
+    headers: Dict[str, str] = {}
+    for _ in range(MAX_HEADER_LINES):
+        try:
+            line = await reader.readline()
+        except (asyncio.LimitOverrunError, ValueError):
+            raise HttpError(431, "请求头过长")
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(431, "请求头过多")
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "不支持分块请求体，请提供Content-Length")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "无效的Content-Length")
+    if length > max_body:
+        raise HttpError(413, f"请求体超过 {max_body} 字节")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, version, headers, body)
+
+
+async def write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+    """写出完整响应"""
+    head = [f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}"]
+    headers = dict(response.headers)
+    headers["Content-Length"] = str(len(response.body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    head.extend(f"{name}: {value}" for name, value in headers.items())
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + response.body)
+    await writer.drain()
+
+
+class EventStream:
+    """Server-Sent Events响应
+
+    响应头发出后不带Content-Length，以关闭连接表示结束，因此SSE响应不复用连接。
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.started = False
+
+    async def start(self, headers: Optional[Dict[str, str]] = None) -> None:
+        head = [
+            "HTTP/1.1 200 OK",
+            "Content-Type: text/event-stream; charset=utf-8",
+            "Cache-Control: no-cache",
+            "Connection: close",
+            "X-Accel-Buffering: no",
+        ]
+        head.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        await self.writer.drain()
+        self.started = True
+
+    async def send(self, event: str, data: Any) -> None:
+        """发送一个事件，data序列化为单行JSON
+
+        Raises:
+            ConnectionError: 客户端已断开
+        """
+        payload = json.dumps(data, ensure_ascii=False)
+        self.writer.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+        await self.writer.drain()
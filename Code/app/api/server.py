@@ -0,0 +1,563 @@
+"""晓昊助手HTTP/JSON API服务
+
+在asyncio事件循环上处理连接，存储读写和模型调用等阻塞操作交给线程池，
+复用与Streamlit界面相同的 UserManager / ChatManager / MessageHandler / FileStorage。
+
+认证方式（用户名/密码与界面登录相同）：
+    - POST /api/sessions 换取会话令牌，之后以 Authorization: Bearer <令牌> 或Cookie携带；
+      令牌轮换时响应头 X-Session-Token 给出新令牌（同时更新Cookie）
+    - 或每个请求使用HTTP Basic认证
+
+接口：
+    GET    /api/health
+    POST   /api/users                       注册 {"username", "password"}
+    POST   /api/sessions                    登录 {"username", "password"}，返回会话令牌
+    DELETE /api/sessions                    注销当前会话令牌
+    GET    /api/chats                       当前用户的对话列表
+    POST   /api/chats                       新建对话 {"persona_id"}
+    GET    /api/chats/{chat_id}             加载对话
+    POST   /api/chats/{chat_id}/messages    发送消息 {"content", "deep_thinking", "stream"}
+    POST   /api/chats/{chat_id}/stop        停止该对话正在进行的生成，已生成的部分保存为截断的回复
+    GET    /api/personas                    角色列表
+    POST   /api/personas                    创建角色
+    GET    /api/personas/{persona_id}
+    PUT    /api/personas/{persona_id}
+    DELETE /api/personas/{persona_id}
+
+发送消息时 "stream": true（或 Accept: text/event-stream）以SSE返回：
+    event: delta  data: {"text": "..."}       模型输出的原始片段（含<think>标签）
+    event: done   data: {"content": "...", "stats": {...}, "truncated": false}   格式化后的回复，已保存
+    event: error  data: {"error": "...", "kind": "..."}      生成失败，本轮不保存
+客户端中途断开时停止生成，已生成的部分同样保存为截断的回复（"truncated": true）。
+"""
+
+import re
+import time
+import base64
+import asyncio
+import logging
+import weakref
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple, Awaitable
+
+from app.api.http import HttpError, Request, Response, EventStream, read_request, write_response
+from app.auth.user_manager import UserManager
+from app.auth.errors import RateLimitedError, AuthBusyError
+from app.auth.session_store import SessionStore, session_store
+from app.chat.chat_manager import ChatManager
+from app.chat.message_handler import MessageHandler
+from app.chat.persona_registry import PERSONA_ID_PATTERN, PersonaRegistry
+from app.llm.cancellation import CancelToken, generations
+from app.config import API_CONFIG, PERSONAS_DATA, SESSION_CONFIG, RETENTION_CONFIG
+from app.models.persona import Persona
+from app.models.reply import Reply
+from app.models.message import Message, Role
+from app.storage.file_storage import FileStorage
+from app.telemetry.tracing import request_context
+from app.telemetry.metrics import TURNS, API_REQUESTS, API_REQUEST_DURATION
+
+logger = logging.getLogger("xiaohaochat.api")
+
+
+Handler = Callable[[Request, asyncio.StreamWriter], Awaitable[Optional[Response]]]
+
+
+class ApiServer:
+    """HTTP/JSON API服务"""
+
+    def __init__(self, user_manager: UserManager, chat_manager: ChatManager,
+                 message_handler: MessageHandler, storage: FileStorage,
+                 host: str = API_CONFIG["host"], port: int = API_CONFIG["port"],
+                 sessions: Optional[SessionStore] = None, personas: Optional[PersonaRegistry] = None):
+        """初始化API服务
+
+        Args:
+            user_manager: 用户管理器
+            chat_manager: 聊天管理器
+            message_handler: 消息处理器
+            storage: 存储实例（角色的增删改查）
+            host: 监听地址
+            port: 监听端口，0表示随机端口
+            sessions: 会话存储，默认使用与界面共享的进程级会话表
+            personas: 角色注册表，默认基于storage创建
+        """
+        self.user_manager = user_manager
+        self.chat_manager = chat_manager
+        self.message_handler = message_handler
+        self.storage = storage
+        self.sessions = sessions or session_store
+        self.personas = personas or PersonaRegistry(storage)
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=API_CONFIG["worker_threads"], thread_name_prefix="api-worker")
+        self._server: Optional[asyncio.AbstractServer] = None
+        # 同一对话同时只允许一轮生成
+        self._chat_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._routes: List[Tuple[str, "re.Pattern", str, Handler]] = []
+        self._route("GET", r"/api/health", self.health)
+        self._route("POST", r"/api/users", self.register)
+        self._route("POST", r"/api/sessions", self.login)
+        self._route("DELETE", r"/api/sessions", self.logout)
+        self._route("GET", r"/api/chats", self.list_chats)
+        self._route("POST", r"/api/chats", self.create_chat)
+        self._route("GET", r"/api/chats/(?P<chat_id>[A-Za-z0-9-]+)", self.get_chat)
+        self._route("DELETE", r"/api/chats/(?P<chat_id>[A-Za-z0-9-]+)", self.delete_chat)
+        self._route("POST", r"/api/chats/(?P<chat_id>[A-Za-z0-9-]+)/archive", self.archive_chat)
+        self._route("POST", r"/api/chats/(?P<chat_id>[A-Za-z0-9-]+)/messages", self.send_message)
+        self._route("POST", r"/api/chats/(?P<chat_id>[A-Za-z0-9-]+)/stop", self.stop_generation)
+        self._route("GET", r"/api/personas", self.list_personas)
+        self._route("POST", r"/api/personas", self.create_persona)
+        self._route("GET", r"/api/personas/(?P<persona_id>[^/]+)", self.get_persona)
+        self._route("PUT", r"/api/personas/(?P<persona_id>[^/]+)", self.update_persona)
+        self._route("DELETE", r"/api/personas/(?P<persona_id>[^/]+)", self.delete_persona)
+
+    def _route(self, method: str, pattern: str, handler: Handler) -> None:
+        self._routes.append((method, re.compile(pattern + "$"), pattern, handler))
+
+    # ---- 生命周期 ----
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"API服务已启动: http://{self.host}:{self.port}")
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    # ---- 连接与分发 ----
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        read_request(reader, API_CONFIG["max_body_bytes"]), API_CONFIG["keepalive_timeout"]
+                    )
+                except HttpError as e:
+                    await write_response(writer, Response.json({"error": e.message}, e.status), keep_alive=False)
+                    break
+                if request is None:
+                    break
+                request.peer = peer[0] if peer else ""
+                keep_alive = await self._dispatch(request, writer)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        """处理一个请求，返回连接是否可以继续复用"""
+        started = time.perf_counter()
+        route_name = "unmatched"
+        keep_alive = request.keep_alive
+        with request_context("api.request", method=request.method, path=request.path) as root:
+            try:
+                handler, route_name = self._match(request)
+                root.set("route", route_name)
+                response = await handler(request, writer)
+            except HttpError as e:
+                response = Response.json({"error": e.message}, e.status, e.headers)
+            except Exception as e:
+                logger.exception(f"处理请求出错: {request.method} {request.path}: {str(e)}")
+                response = Response.json({"error": "服务器内部错误"}, 500)
+
+            if response is None:
+                # 流式响应已自行写出并需要关闭连接
+                status, keep_alive = 200, False
+            else:
+                status = response.status
+                response.headers.update(request.response_headers)
+                await write_response(writer, response, keep_alive)
+            root.set("status", status)
+
+        elapsed = time.perf_counter() - started
+        API_REQUESTS.labels(route=route_name, status=str(status)).inc()
+        API_REQUEST_DURATION.labels(route=route_name).observe(elapsed)
+        logger.info(f"{request.peer} {request.method} {request.path} {status} {elapsed * 1000:.1f}ms")
+        return keep_alive
+
+    def _match(self, request: Request) -> Tuple[Handler, str]:
+        allowed = []
+        for method, regex, name, handler in self._routes:
+            match = regex.match(request.path)
+            if not match:
+                continue
+            if method != request.method:
+                allowed.append(method)
+                continue
+            request.params = match.groupdict()
+            return handler, f"{method} {name}"
+        if allowed:
+            raise HttpError(405, "方法不允许", {"Allow": ", ".join(allowed)})
+        raise HttpError(404, "接口不存在")
+
+    async def _run_blocking(self, func: Callable, *args, **kwargs):
+        """在线程池中运行阻塞函数，沿用当前请求的追踪上下文"""
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    @staticmethod
+    def _session_token(request: Request) -> Optional[str]:
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and credentials:
+            return credentials.strip()
+        return request.cookies.get(SESSION_CONFIG["cookie_name"])
+
+    @staticmethod
+    def _session_cookie(token: str, max_age: int) -> str:
+        return (f"{SESSION_CONFIG['cookie_name']}={token}; Max-Age={max_age}; Path=/api; "
+                f"HttpOnly; SameSite=Lax")
+
+    async def _authenticate(self, request: Request) -> str:
+        """校验会话令牌或HTTP Basic认证，返回用户ID"""
+        token = self._session_token(request)
+        if token:
+            # 会话表在内存中，O(1)校验，不需要放到线程池
+            session, rotated = self.sessions.validate(token)
+            if session is None:
+                raise HttpError(401, "会话已过期，请重新登录")
+            if rotated:
+                request.response_headers["X-Session-Token"] = rotated
+                request.response_headers["Set-Cookie"] = self._session_cookie(
+                    rotated, int(SESSION_CONFIG["max_lifetime"])
+                )
+            return session.user_id
+
+        header = request.headers.get("authorization", "")
+        scheme, _, credentials = header.partition(" ")
+        if scheme.lower() != "basic" or not credentials:
+            raise HttpError(401, "需要登录", {"WWW-Authenticate": 'Basic realm="xiaohao"'})
+        try:
+            username, _, password = base64.b64decode(credentials).decode("utf-8").partition(":")
+        except (ValueError, UnicodeDecodeError):
+            raise HttpError(401, "无效的认证信息", {"WWW-Authenticate": 'Basic realm="xiaohao"'})
+        user_id = await self._run_blocking(self._call_auth, self.user_manager.authenticate_user,
+                                           username, password, request.peer)
+        if not user_id:
+            raise HttpError(401, "用户名或密码错误", {"WWW-Authenticate": 'Basic realm="xiaohao"'})
+        return user_id
+
+    @staticmethod
+    def _call_auth(func: Callable, *args):
+        """调用认证函数，把限流和过载错误转换为HTTP错误"""
+        try:
+            return func(*args)
+        except RateLimitedError as e:
+            raise HttpError(429, str(e), {"Retry-After": str(int(e.retry_after) + 1)})
+        except AuthBusyError as e:
+            raise HttpError(503, str(e), {"Retry-After": "1"})
+
+    # ---- 接口 ----
+
+    async def health(self, request: Request, writer) -> Response:
+        client = self.message_handler.client
+        return Response.json({"status": "ok", "model": client.model, "llm_circuit": client.breaker.state})
+
+    async def register(self, request: Request, writer) -> Response:
+        data = request.json()
+        username = str(data.get("username", "")).strip()
+        password = str(data.get("password", ""))
+        if not username or not password:
+            raise HttpError(400, "用户名和密码不能为空")
+        user_id = await self._run_blocking(self._call_auth, self.user_manager.register_user,
+                                           username, password, request.peer)
+        if not user_id:
+            raise HttpError(409, "用户名已存在")
+        return Response.json({"user_id": user_id, "username": username}, 201)
+
+    async def login(self, request: Request, writer) -> Response:
+        data = request.json()
+        username = str(data.get("username", "")).strip()
+        password = str(data.get("password", ""))
+        if not username or not password:
+            raise HttpError(400, "用户名和密码不能为空")
+        user_id = await self._run_blocking(self._call_auth, self.user_manager.authenticate_user,
+                                           username, password, request.peer)
+        if not user_id:
+            raise HttpError(401, "用户名或密码错误")
+        token = self.sessions.create(user_id, username)
+        max_age = int(SESSION_CONFIG["max_lifetime"])
+        return Response.json(
+            {"token": token, "user_id": user_id, "idle_timeout": SESSION_CONFIG["idle_timeout"]},
+            201,
+            {"Set-Cookie": self._session_cookie(token, max_age)}
+        )
+
+    async def logout(self, request: Request, writer) -> Response:
+        token = self._session_token(request)
+        if token:
+            self.sessions.revoke(token)
+        return Response(204, headers={"Set-Cookie": self._session_cookie("", 0)})
+
+    async def list_chats(self, request: Request, writer) -> Response:
+        user_id = await self._authenticate(request)
+        chats = await self._run_blocking(self.chat_manager.get_user_chats, user_id)
+        return Response.json({"chats": chats})
+
+    async def create_chat(self, request: Request, writer) -> Response:
+        user_id = await self._authenticate(request)
+        persona_id = str(request.json().get("persona_id") or "default")
+        if await self._run_blocking(self._load_persona, persona_id) is None:
+            raise HttpError(400, f"角色不存在: {persona_id}")
+        chat_id = await self._run_blocking(self.chat_manager.create_chat, user_id, persona_id)
+        if not chat_id:
+            raise HttpError(500, "创建对话失败")
+        chat = await self._run_blocking(self.chat_manager.load_chat, user_id, chat_id)
+        return Response.json(self._chat_payload(chat), 201)
+
+    async def get_chat(self, request: Request, writer) -> Response:
+        user_id = await self._authenticate(request)
+        chat = await self._run_blocking(self.chat_manager.load_chat, user_id, request.params["chat_id"])
+        if chat is None:
+            raise HttpError(404, "对话不存在")
+        return Response.json(self._chat_payload(chat))
+
+    @staticmethod
+    def _chat_payload(chat: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(chat, messages=[message.to_dict() for message in chat["messages"]])
+
+    async def delete_chat(self, request: Request, writer) -> Response:
+        user_id = await self._authenticate(request)
+        if not await self._run_blocking(self.chat_manager.delete_chat, user_id, request.params["chat_id"]):
+            raise HttpError(404, "对话不存在")
+        return Response(204)
+
+    async def archive_chat(self, request: Request, writer) -> Response:
+        user_id = await self._authenticate(request)
+        if not await self._run_blocking(self.chat_manager.archive_chat, user_id, request.params["chat_id"]):
+            raise HttpError(404, "对话不存在")
+        return Response(204)
+
+    async def send_message(self, request: Request, writer: asyncio.StreamWriter) -> Optional[Response]:
+        user_id = await self._authenticate(request)
+        chat_id = request.params["chat_id"]
+        data = request.json()
+        content = str(data.get("content", ""))
+        if not content.strip():
+            raise HttpError(400, "消息内容不能为空")
+        deep_thinking = bool(data.get("deep_thinking", False))
+        stream = bool(data.get("stream", "text/event-stream" in request.headers.get("accept", "")))
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        if lock.locked():
+            raise HttpError(409, "该对话正在生成回复")
+        async with lock:
+            chat = await self._run_blocking(self.chat_manager.load_chat, user_id, chat_id)
+            if chat is None:
+                raise HttpError(404, "对话不存在")
+            persona = await self._run_blocking(self._load_persona, chat["persona_id"])
+            if persona is None:
+                persona = Persona.from_dict("default", PERSONAS_DATA["default"])
+            history = list(chat["messages"])
+
+            owner = self._generation_owner(user_id, chat_id)
+            cancel = generations.register(owner)
+            try:
+                if stream:
+                    events = EventStream(writer)
+                    await events.start(request.response_headers)
+                    reply = await self._stream_reply(events, content, history, persona, deep_thinking, cancel, user_id)
+                else:
+                    reply = await self._run_blocking(
+                        self.message_handler.get_response, content, history, persona.system_prompt, deep_thinking,
+                        cancel=cancel, persona_id=persona.id, user_id=user_id
+                    )
+            finally:
+                generations.unregister(owner, cancel)
+
+            TURNS.labels(
+                persona=persona.persona_id,
+                mode="deep" if deep_thinking else "normal",
+                outcome=("truncated" if reply.truncated else "ok") if reply.ok else reply.error_kind
+            ).inc()
+            # 与界面一致：失败的回复不写入聊天历史，被停止的回复保存已生成的部分
+            if reply.ok:
+                history.append(Message(Role.USER, content))
+                history.append(Message(Role.ASSISTANT, reply.content, truncated=reply.truncated))
+                await self._run_blocking(self.chat_manager.save_chat, user_id, chat_id, history, persona.persona_id)
+
+        if stream:
+            try:
+                if reply.ok:
+                    await events.send("done", {"chat_id": chat_id, "content": reply.content, "stats": reply.stats,
+                                               "truncated": reply.truncated})
+                else:
+                    await events.send("error", {"error": reply.error, "kind": reply.error_kind})
+            except ConnectionError:
+                pass
+            return None
+        if not reply.ok:
+            return Response.json({"error": reply.error, "kind": reply.error_kind}, 503)
+        return Response.json({"chat_id": chat_id, "content": reply.content, "stats": reply.stats,
+                              "truncated": reply.truncated})
+
+    @staticmethod
+    def _generation_owner(user_id: str, chat_id: str) -> str:
+        """生成登记表中的键，包含用户ID，只有对话的所有者能停止生成"""
+        return f"api:{user_id}:{chat_id}"
+
+    async def stop_generation(self, request: Request, writer) -> Response:
+        user_id = await self._authenticate(request)
+        if not generations.cancel(self._generation_owner(user_id, request.params["chat_id"]), "stopped"):
+            raise HttpError(404, "该对话没有正在进行的生成")
+        return Response(202)
+
+    async def _stream_reply(self, events: EventStream, content: str, history: List[Message],
+                            persona: Persona, deep_thinking: bool, cancel: CancelToken,
+                            user_id: Optional[str] = None) -> Reply:
+        """在线程池中以流式方式获取回复，并把每个片段作为SSE事件转发给客户端
+
+        客户端中途断开时取消生成，关闭与模型的连接并释放线程池中的工作线程，已生成的部分作为
+        截断的回复保存，与界面上关闭页面时的行为一致。
+        """
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+        def on_delta(text: str) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, text)
+
+        future = asyncio.ensure_future(self._run_blocking(
+            self.message_handler.get_response, content, history, persona.system_prompt, deep_thinking, on_delta, cancel,
+            persona.id, user_id
+        ))
+        # 片段与完成回调都经由call_soon_threadsafe按顺序进入事件循环，结束标记一定排在最后一个片段之后
+        future.add_done_callback(lambda _: queue.put_nowait(None))
+
+        connected = True
+        while True:
+            text = await queue.get()
+            if text is None:
+                break
+            if connected:
+                try:
+                    await events.send("delta", {"text": text})
+                except ConnectionError:
+                    connected = False
+                    cancel.cancel("disconnected")
+                    logger.info("客户端已断开，停止生成并保存已生成的部分")
+        return await future
+
+    # ---- 角色 ----
+
+    def _load_persona(self, persona_id: str) -> Optional[Persona]:
+        """加载角色，内置角色优先"""
+        return self.personas.get(persona_id)
+
+    def _all_personas(self) -> List[Dict[str, Any]]:
+        return [self._persona_json(p) for p in self.personas.all()]
+
+    @staticmethod
+    def _persona_json(persona: Persona) -> Dict[str, Any]:
+        data = persona.to_dict()
+        data["persona_id"] = persona.persona_id
+        data["builtin"] = persona.persona_id in PERSONAS_DATA
+        return data
+
+    @staticmethod
+    def _persona_from_body(persona_id: str, data: Dict[str, Any]) -> Persona:
+        name = str(data.get("name", "")).strip()
+        system_prompt = str(data.get("system_prompt", "")).strip()
+        if not name or not system_prompt:
+            raise HttpError(400, "角色名称和系统提示词不能为空")
+        return Persona(
+            persona_id=persona_id,
+            name=name,
+            description=str(data.get("description", "")),
+            system_prompt=system_prompt
+        )
+
+    @staticmethod
+    def _check_writable(persona_id: str) -> None:
+        if not PERSONA_ID_PATTERN.match(persona_id):
+            raise HttpError(400, "角色ID只能包含英文字母、数字、下划线和连字符")
+        if persona_id in PERSONAS_DATA:
+            raise HttpError(403, "内置角色不可修改")
+
+    async def list_personas(self, request: Request, writer) -> Response:
+        return Response.json({"personas": await self._run_blocking(self._all_personas)})
+
+    async def get_persona(self, request: Request, writer) -> Response:
+        persona = await self._run_blocking(self._load_persona, request.params["persona_id"])
+        if persona is None:
+            raise HttpError(404, "角色不存在")
+        return Response.json(self._persona_json(persona))
+
+    async def create_persona(self, request: Request, writer) -> Response:
+        await self._authenticate(request)
+        data = request.json()
+        persona_id = str(data.get("persona_id", ""))
+        self._check_writable(persona_id)
+        persona = self._persona_from_body(persona_id, data)
+        if not await self._run_blocking(self.personas.create, persona):
+            if await self._run_blocking(self.storage.persona_exists, persona_id):
+                raise HttpError(409, "角色ID已存在")
+            raise HttpError(500, "保存角色失败")
+        return Response.json(self._persona_json(persona), 201)
+
+    async def update_persona(self, request: Request, writer) -> Response:
+        await self._authenticate(request)
+        persona_id = request.params["persona_id"]
+        self._check_writable(persona_id)
+        existing = await self._run_blocking(self.storage.load_persona, persona_id)
+        if existing is None:
+            raise HttpError(404, "角色不存在")
+        persona = self._persona_from_body(persona_id, request.json())
+        persona.created_at = existing.created_at
+        if not await self._run_blocking(self.personas.save, persona):
+            raise HttpError(500, "保存角色失败")
+        return Response.json(self._persona_json(persona))
+
+    async def delete_persona(self, request: Request, writer) -> Response:
+        await self._authenticate(request)
+        persona_id = request.params["persona_id"]
+        self._check_writable(persona_id)
+        if not await self._run_blocking(self.personas.delete, persona_id):
+            raise HttpError(404, "角色不存在")
+        return Response(204)
+
+
+def create_api_server(host: str = API_CONFIG["host"], port: int = API_CONFIG["port"]) -> ApiServer:
+    """按默认依赖组装API服务"""
+    from app.llm.ollama_client import OllamaClient
+
+    storage = FileStorage()
+    return ApiServer(
+        UserManager(storage),
+        ChatManager(storage),
+        MessageHandler(OllamaClient()),
+        storage,
+        host,
+        port
+    )
+
+
+def run_api_server(host: str = API_CONFIG["host"], port: int = API_CONFIG["port"]) -> None:
+    """启动API服务并阻塞运行，Ctrl+C退出"""
+    from app.chat.retention import retention_engine
+
+    server = create_api_server(host, port)
+    if RETENTION_CONFIG["enabled"]:
+        retention_engine.start()
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        logger.info("API服务已停止")
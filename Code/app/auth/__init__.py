@@ -1,5 +1,6 @@
 """认证与用户管理模块"""
 
 from app.auth.user_manager import UserManager
+from app.auth.errors import AuthError, RateLimitedError, AuthBusyError
 
-__all__ = ["UserManager"] 
\ No newline at end of file
+__all__ = ["UserManager", "AuthError", "RateLimitedError", "AuthBusyError"] 
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""Typed errors raised by the authentication layer."""
+
+
+class AuthError(Exception):
+    """Base class for authentication failures other than wrong credentials."""
+
+    #: Short machine-readable error kind
+    kind = "auth_error"
+
+
+class RateLimitedError(AuthError):
+    """Too many attempts for this username or client address."""
+
+    kind = "rate_limited"
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AuthBusyError(AuthError):
+    """The password hashing pool is saturated; the attempt was shed instead of queued."""
+
+    kind = "busy"
@@ -0,0 +1,156 @@
+import hmac
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple
+
+import bcrypt
+
+from app.auth.errors import AuthBusyError
+from app.config import AUTH_CONFIG
+
+logger = logging.getLogger("xiaohaochat.auth.hasher")
+
+# bcrypt只使用密码的前72字节
+BCRYPT_MAX_BYTES = 72
+
+
+def is_password_hash(stored: str) -> bool:
+    """判断存储的密码字段是否已是bcrypt哈希（否则为旧版本的明文）"""
+    return stored.startswith(("$2a$", "$2b$", "$2y$")) and len(stored) == 60
+
+
+class PasswordHasher:
+    """bcrypt密码哈希服务
+
+    哈希运算在独立的小线程池中执行（bcrypt计算时释放GIL），并发的哈希数量受线程数限制，
+    排队数量超过上限时直接拒绝而不是无限排队，大量登录请求不会挤占对话处理的CPU。
+    """
+
+    def __init__(self, rounds: int, workers: int, max_pending: int):
+        """初始化哈希服务
+
+        Args:
+            rounds: bcrypt成本因子（log2轮数）
+            workers: 哈希线程数
+            max_pending: 执行中和排队中的哈希任务上限
+        """
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._dummy_hash: Optional[bytes] = None
+
+    @staticmethod
+    def _encode(password: str) -> bytes:
+        return password.encode("utf-8")[:BCRYPT_MAX_BYTES]
+
+    def _submit(self, func, *args):
+        """提交到哈希线程池并等待结果，池已饱和时抛出AuthBusyError"""
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusyError("登录请求过多，请稍后再试")
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        """计算密码哈希
+
+        Args:
+            password: 明文密码
+
+        Returns:
+            bcrypt哈希字符串
+        """
+        hashed = self._submit(lambda: bcrypt.hashpw(self._encode(password), bcrypt.gensalt(self.rounds)))
+        return hashed.decode("ascii")
+
+    def verify(self, password: str, stored_hash: str) -> bool:
+        """校验密码与哈希是否匹配
+
+        Args:
+            password: 明文密码
+            stored_hash: 存储的bcrypt哈希
+
+        Returns:
+            匹配返回True
+        """
+        try:
+            return self._submit(bcrypt.checkpw, self._encode(password), stored_hash.encode("ascii"))
+        except ValueError:
+            logger.error("存储的密码哈希格式无效")
+            return False
+
+    def verify_dummy(self, password: str) -> None:
+        """对不存在的用户做一次等价的哈希校验，使响应时间不暴露用户名是否存在"""
+        if self._dummy_hash is None:
+            self._dummy_hash = bcrypt.hashpw(b"dummy-password", bcrypt.gensalt(self.rounds))
+        self._submit(bcrypt.checkpw, self._encode(password), self._dummy_hash)
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """哈希的成本因子低于当前配置时需要在下次登录时重新计算"""
+        try:
+            return int(stored_hash.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+class VerifiedCredentialCache:
+    """近期验证成功的凭据缓存
+
+    键是进程内随机密钥下的HMAC-SHA256(用户名, 密码)，不保存明文或可离线破解的快速哈希。
+    命中时跳过bcrypt，使API的Basic认证等需要重复验证的场景不必每次重新哈希。
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = secrets.token_bytes(32)
+        self._entries: Dict[bytes, Tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        message = username.encode("utf-8") + b"\0" + password.encode("utf-8")
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def get(self, username: str, password: str) -> Optional[str]:
+        """返回缓存的用户ID，未命中或已过期返回None"""
+        digest = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                del self._entries[digest]
+                return None
+            return entry[1]
+
+    def put(self, username: str, password: str, user_id: str) -> None:
+        digest = self._digest(username, password)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                for key in [k for k, v in self._entries.items() if v[2] < now]:
+                    del self._entries[key]
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[digest] = (username, user_id, time.monotonic() + self.ttl)
+
+    def invalidate_user(self, username: str) -> None:
+        """移除用户的所有缓存条目（例如修改密码后）"""
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v[0] == username]:
+                del self._entries[key]
+
+
+# 进程级单例，所有会话共享哈希线程池和验证缓存
+password_hasher = PasswordHasher(
+    rounds=AUTH_CONFIG["bcrypt_rounds"],
+    workers=AUTH_CONFIG["hash_workers"],
+    max_pending=AUTH_CONFIG["max_pending_hashes"]
+)
+verified_credentials = VerifiedCredentialCache(AUTH_CONFIG["verified_ttl"])
@@ -0,0 +1,118 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import AUTH_CONFIG
+from app.storage.shared_state import SharedState, shared_state
+
+
+class TokenBucket:
+    """令牌桶：容量为capacity，每秒补充refill_rate个令牌"""
+
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, refill_rate: float, now: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def try_consume(self, now: float) -> Tuple[bool, float]:
+        """尝试取一个令牌
+
+        Returns:
+            (是否成功, 失败时距下一个令牌的秒数)
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.refill_rate if self.refill_rate > 0 else float("inf")
+
+
+class KeyedRateLimiter:
+    """按键（用户名、客户端IP等）独立限流的令牌桶集合
+
+    桶数量有上限，超出时淘汰最久未使用的桶（通常早已补满，等价于新桶）。给出跨进程的共享状态时
+    桶保存在共享状态中，多进程部署时所有工作进程共用同一个限额；桶在补满所需的时间后自动过期。
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, max_keys: int = 100000,
+                 state: Optional[SharedState] = None, name: str = ""):
+        """初始化限流器
+
+        Args:
+            capacity: 每个键的突发尝试次数
+            refill_rate: 每秒恢复的尝试次数
+            max_keys: 最多跟踪的键数（只用于进程内的桶）
+            state: 共享状态，不是跨进程共享的实现时使用进程内的桶
+            name: 在共享状态中区分不同限流器的名称
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._state = state if state is not None and state.shared else None
+        self._namespace = f"ratelimit:{name}"
+
+    def try_acquire(self, key: str) -> Tuple[bool, float]:
+        """为键消耗一次尝试
+
+        Args:
+            key: 限流键
+
+        Returns:
+            (是否允许, 不允许时建议的重试等待秒数)
+        """
+        if self._state is not None:
+            return self._try_acquire_shared(key)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.capacity, self.refill_rate, now)
+                self._buckets[key] = bucket
+                self._evict()
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.try_consume(now)
+
+    def _try_acquire_shared(self, key: str) -> Tuple[bool, float]:
+        result = []
+
+        def consume(record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            now = time.time()
+            bucket = TokenBucket(self.capacity, self.refill_rate, now)
+            if record is not None:
+                bucket.tokens, bucket.updated = record["tokens"], record["updated"]
+            result.append(bucket.try_consume(now))
+            return {"tokens": bucket.tokens, "updated": bucket.updated}
+
+        refill_time = self.capacity / self.refill_rate if self.refill_rate > 0 else None
+        self._state.update(self._namespace, key, consume, refill_time)
+        return result[-1]
+
+    def reset(self, key: str) -> None:
+        """清除键的限流状态（例如登录成功后）"""
+        if self._state is not None:
+            self._state.delete(self._namespace, key)
+            return
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _evict(self) -> None:
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+# 进程级单例：登录尝试按用户名和客户端地址分别限流，多进程部署时限额由所有工作进程共用
+username_limiter = KeyedRateLimiter(AUTH_CONFIG["username_attempts"], AUTH_CONFIG["username_refill_per_minute"] / 60,
+                                    state=shared_state, name="username")
+ip_limiter = KeyedRateLimiter(AUTH_CONFIG["ip_attempts"], AUTH_CONFIG["ip_refill_per_minute"] / 60,
+                              state=shared_state, name="ip")
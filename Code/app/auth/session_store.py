@@ -0,0 +1,278 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+import secrets
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Tuple
+
+from app.config import SESSION_CONFIG
+from app.storage.shared_state import SharedState, shared_state
+
+logger = logging.getLogger("xiaohaochat.auth.session")
+
+
+@dataclass
+class Session:
+    """一个登录会话（时间均为Unix时间戳）"""
+
+    session_id: str
+    user_id: str
+    username: str
+    created_at: float
+    issued_at: float  # 当前令牌的签发时间，用于判断是否需要轮换
+    last_seen: float
+    expires_at: float  # 绝对过期时间；轮换后旧会话缩短为宽限期
+    replaced_by: Optional[str] = None  # 轮换后的新会话ID
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class SessionStore:
+    """签名会话令牌与共享会话表
+
+    令牌格式为 "<会话ID>.<签发时间>.<HMAC-SHA256签名>"。校验先验证签名（伪造的令牌不查表），
+    再按会话ID在共享状态中查找会话并检查空闲超时与绝对过期。多进程部署时会话表由所有工作进程
+    共用，任何一个进程都能恢复登录，注销和轮换立即对所有进程生效，进程重启后已登录的浏览器
+    也无需重新输入密码。会话的活跃时间最多每 touch_interval 秒写入一次。
+    """
+
+    NAMESPACE = "sessions"
+
+    def __init__(self, secret: bytes, idle_timeout: float, max_lifetime: float, rotate_after: float,
+                 rotation_grace: float, touch_interval: float, state: Optional[SharedState] = None,
+                 legacy_path: Optional[str] = None):
+        """初始化会话存储
+
+        Args:
+            secret: HMAC签名密钥
+            idle_timeout: 空闲超时秒数，超过后需要重新登录
+            max_lifetime: 会话从登录起的最长有效秒数
+            rotate_after: 令牌签发超过该秒数后在下次校验时换发新令牌
+            rotation_grace: 轮换后旧令牌继续有效的秒数（避免多个标签页同时刷新时被登出）
+            touch_interval: 活跃时间写入共享状态的最小间隔秒数
+            state: 共享状态，默认使用进程级单例
+            legacy_path: 旧版本的会话表文件，存在时导入共享状态
+        """
+        self.secret = secret
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.rotate_after = rotate_after
+        self.rotation_grace = rotation_grace
+        self.touch_interval = touch_interval
+        self.state = state or shared_state
+        if legacy_path:
+            self._import_legacy(legacy_path)
+
+    # ---- 令牌 ----
+
+    def _sign(self, session_id: str, issued_at: int) -> str:
+        message = f"{session_id}.{issued_at}".encode("ascii")
+        return _b64(hmac.new(self.secret, message, hashlib.sha256).digest())
+
+    def _token(self, session: Session) -> str:
+        issued = int(session.issued_at)
+        return f"{session.session_id}.{issued}.{self._sign(session.session_id, issued)}"
+
+    def _parse(self, token: str) -> Optional[Tuple[str, int]]:
+        """校验令牌签名，返回(会话ID, 签发时间)"""
+        try:
+            session_id, issued, signature = token.split(".")
+            issued_at = int(issued)
+        except (ValueError, AttributeError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(session_id, issued_at)):
+            return None
+        return session_id, issued_at
+
+    # ---- 会话 ----
+
+    def _ttl(self, session: Session, now: float) -> float:
+        """会话在共享状态中的保留时间：到绝对过期或空闲超时中较早的一个"""
+        return max(0.0, min(session.expires_at, session.last_seen + self.idle_timeout) - now)
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        record = self.state.get(self.NAMESPACE, session_id)
+        return Session(**record) if record else None
+
+    def _save(self, session: Session, now: float) -> None:
+        self.state.set(self.NAMESPACE, session.session_id, asdict(session), self._ttl(session, now))
+
+    def _touch(self, session: Session, now: float) -> None:
+        """刷新活跃时间，距上次写入不足 touch_interval 时只更新内存中的对象"""
+        if now - session.last_seen < self.touch_interval:
+            return
+        session.last_seen = now
+
+        def touch(record: Optional[Dict]) -> Optional[Dict]:
+            return record if record is None else dict(record, last_seen=now)
+
+        # 原子地只修改活跃时间，不覆盖其他进程同时写入的轮换信息
+        self.state.update(self.NAMESPACE, session.session_id, touch, self._ttl(session, now))
+
+    def create(self, user_id: str, username: str) -> str:
+        """为登录成功的用户创建会话
+
+        Args:
+            user_id: 用户ID
+            username: 用户名
+
+        Returns:
+            会话令牌
+        """
+        now = time.time()
+        session = Session(_b64(secrets.token_bytes(18)), user_id, username, now, now, now, now + self.max_lifetime)
+        self._save(session, now)
+        logger.info(f"用户 {username} 创建会话")
+        return self._token(session)
+
+    def validate(self, token: str) -> Tuple[Optional[Session], Optional[str]]:
+        """校验令牌并刷新会话活跃时间
+
+        Args:
+            token: 会话令牌
+
+        Returns:
+            (会话, 新令牌)：令牌无效或已过期时会话为None；需要轮换时返回新令牌，否则新令牌为None
+        """
+        parsed = self._parse(token)
+        if parsed is None:
+            return None, None
+        session_id, issued_at = parsed
+        now = time.time()
+        session = self._load(session_id)
+        if session is None or int(session.issued_at) != issued_at:
+            return None, None
+        if now > session.expires_at or now - session.last_seen > self.idle_timeout:
+            self.state.delete(self.NAMESPACE, session_id)
+            return None, None
+        if session.replaced_by is not None:
+            # 已轮换的旧令牌（例如另一个标签页）在宽限期内换成同一个新令牌
+            return self._replacement(session.replaced_by, now)
+        if now - session.issued_at < self.rotate_after:
+            self._touch(session, now)
+            return session, None
+
+        # 轮换：新会话继承登录时间和绝对过期时间，旧令牌只在宽限期内有效
+        rotated = Session(_b64(secrets.token_bytes(18)), session.user_id, session.username,
+                          session.created_at, now, now, session.expires_at)
+        self._save(rotated, now)
+
+        def retire(record: Optional[Dict]) -> Optional[Dict]:
+            if record is None or record.get("replaced_by"):
+                return record
+            return dict(record, replaced_by=rotated.session_id,
+                        expires_at=min(record["expires_at"], now + self.rotation_grace))
+
+        record = self.state.update(self.NAMESPACE, session_id, retire, self.rotation_grace)
+        if record is None or record["replaced_by"] != rotated.session_id:
+            # 另一个进程同时轮换了同一个令牌（或会话刚被注销），使用它的结果
+            self.state.delete(self.NAMESPACE, rotated.session_id)
+            return self._replacement(record["replaced_by"], now) if record else (None, None)
+        return rotated, self._token(rotated)
+
+    def _replacement(self, session_id: str, now: float) -> Tuple[Optional[Session], Optional[str]]:
+        replacement = self._load(session_id)
+        if replacement is None:
+            return None, None
+        self._touch(replacement, now)
+        return replacement, self._token(replacement)
+
+    def revoke(self, token: str) -> None:
+        """注销令牌对应的会话"""
+        parsed = self._parse(token)
+        if parsed is None:
+            return
+        self.state.delete(self.NAMESPACE, parsed[0])
+
+    def revoke_user(self, user_id: str) -> int:
+        """注销用户的所有会话（例如修改密码后），返回注销的数量"""
+        doomed = [sid for sid, record in self.state.items(self.NAMESPACE).items() if record["user_id"] == user_id]
+        for sid in doomed:
+            self.state.delete(self.NAMESPACE, sid)
+        return len(doomed)
+
+    def active_count(self) -> int:
+        return len(self.state.items(self.NAMESPACE))
+
+    # ---- 旧版本会话表 ----
+
+    def _import_legacy(self, path: str) -> None:
+        """把旧版本定期写入磁盘的会话表导入共享状态，导入后文件改名，不再重复导入"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"加载旧会话表失败: {str(e)}")
+            return
+        now = time.time()
+        imported = 0
+        for record in records:
+            session = Session(**record)
+            if now <= session.expires_at and now - session.last_seen <= self.idle_timeout:
+                imported += self.state.add(self.NAMESPACE, session.session_id, asdict(session),
+                                           self._ttl(session, now))
+        try:
+            os.replace(path, path + ".imported")
+        except OSError:
+            pass
+        logger.info(f"已导入 {imported} 个旧会话")
+
+
+def load_session_secret(path: str, attempts: int = 20) -> bytes:
+    """读取签名密钥：优先使用环境变量 XIAOHAO_SESSION_SECRET，否则使用（必要时生成）密钥文件
+
+    密钥先完整写入临时文件，再以硬链接放到目标位置：多个进程同时启动时只有一个链接成功，
+    其余进程读到的总是完整的密钥。空密钥永远不会被使用。
+
+    Raises:
+        RuntimeError: 密钥文件存在但为空（例如旧版本写入时中断），需要删除后重新启动
+    """
+    secret = os.environ.get("XIAOHAO_SESSION_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    for attempt in range(attempts):
+        try:
+            with open(path, 'rb') as f:
+                existing = f.read()
+            if existing:
+                return existing
+            time.sleep(0.05 * (attempt + 1))
+            continue
+        except FileNotFoundError:
+            pass
+        secret_bytes = secrets.token_bytes(32)
+        tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(secret_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+            # 目标已存在时链接失败，说明另一个进程先写入了密钥，下一轮读取它的密钥
+            os.link(tmp_path, path)
+            return secret_bytes
+        except FileExistsError:
+            continue
+        finally:
+            os.remove(tmp_path)
+    raise RuntimeError(f"会话密钥文件为空: {path}，请删除后重新启动")
+
+
+# 进程级单例
+session_store = SessionStore(
+    secret=load_session_secret(SESSION_CONFIG["secret_path"]),
+    idle_timeout=SESSION_CONFIG["idle_timeout"],
+    max_lifetime=SESSION_CONFIG["max_lifetime"],
+    rotate_after=SESSION_CONFIG["rotate_after"],
+    rotation_grace=SESSION_CONFIG["rotation_grace"],
+    touch_interval=SESSION_CONFIG["touch_interval"],
+    legacy_path=SESSION_CONFIG["store_path"]
+)
@@ -1,77 +1,125 @@
+import hmac
 import logging
 from typing import Optional
-import json
-import os
 
 from app.models.user import User
 from app.storage.file_storage import FileStorage
-from app.config import USERS_DIR
+from app.auth.errors import RateLimitedError
+from app.auth.password_hasher import (
+    PasswordHasher, VerifiedCredentialCache, password_hasher, verified_credentials, is_password_hash
+)
+from app.auth.rate_limiter import KeyedRateLimiter, username_limiter, ip_limiter
+from app.telemetry.metrics import AUTH_ATTEMPTS
 
 logger = logging.getLogger("xiaohaochat.auth")
 
 class UserManager:
     """用户管理类，处理用户认证、注册等功能"""
-    
-    def __init__(self, storage: FileStorage):
+
+    def __init__(self, storage: FileStorage, hasher: Optional[PasswordHasher] = None,
+                 credential_cache: Optional[VerifiedCredentialCache] = None,
+                 user_limiter: Optional[KeyedRateLimiter] = None,
+                 address_limiter: Optional[KeyedRateLimiter] = None):
         self.storage = storage
-    
-    def authenticate_user(self, username: str, password: str) -> Optional[str]:
+        self.hasher = hasher or password_hasher
+        self.credential_cache = credential_cache or verified_credentials
+        self.user_limiter = user_limiter or username_limiter
+        self.address_limiter = address_limiter or ip_limiter
+
+    def _check_rate(self, limiter: KeyedRateLimiter, key: str, what: str) -> None:
+        """消耗一次尝试，超出限制时抛出RateLimitedError"""
+        allowed, retry_after = limiter.try_acquire(key)
+        if not allowed:
+            AUTH_ATTEMPTS.labels(outcome="rate_limited").inc()
+            logger.warning(f"{what} {key} 尝试过于频繁")
+            raise RateLimitedError(f"尝试次数过多，请 {int(retry_after) + 1} 秒后再试", retry_after)
+
+    def authenticate_user(self, username: str, password: str, client_ip: Optional[str] = None) -> Optional[str]:
         """认证用户并返回用户ID
-        
+
+        旧版本以明文保存的密码在认证成功后自动迁移为bcrypt哈希。
+
         Args:
             username: 用户名
             password: 密码
-            
+            client_ip: 客户端地址，用于按地址限流
+
         Returns:
             如果认证成功，返回用户ID，否则返回None
+
+        Raises:
+            RateLimitedError: 该用户名或地址的尝试次数超过限制
+            AuthBusyError: 密码哈希线程池已饱和
         """
-        # 直接检查文件内容以排除可能的问题
-        user_file = os.path.join(USERS_DIR, f"{username}.json")
-        if not os.path.exists(user_file):
+        # 近期验证过的凭据直接通过，不消耗限流额度也不重新哈希
+        user_id = self.credential_cache.get(username, password)
+        if user_id:
+            AUTH_ATTEMPTS.labels(outcome="cached").inc()
+            return user_id
+
+        if client_ip:
+            self._check_rate(self.address_limiter, client_ip, "地址")
+        self._check_rate(self.user_limiter, username, "用户")
+
+        user = self.storage.load_user(username)
+        if user is None:
+            # 仍做一次哈希校验，响应时间不暴露用户名是否存在
+            self.hasher.verify_dummy(password)
+            AUTH_ATTEMPTS.labels(outcome="invalid").inc()
             logger.info(f"认证失败: 用户 {username} 不存在")
             return None
-            
-        try:
-            # 直接读取用户文件
-            with open(user_file, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
-                logger.info(f"成功读取用户数据: {username}")
-                logger.info(f"用户数据: {json.dumps(user_data, ensure_ascii=False)}")
-                
-            stored_password = user_data.get("password", "")
-            
-            # 对比密码
-            if stored_password == password:
-                logger.info(f"用户 {username} 认证成功")
-                return user_data.get("user_id", "")
-            else:
-                logger.info(f"认证失败: 用户 {username} 密码不匹配, 输入: {password}, 存储: {stored_password}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"认证过程中出错: {str(e)}")
+
+        stored_password = user.password
+        if is_password_hash(stored_password):
+            matched = self.hasher.verify(password, stored_password)
+        else:
+            matched = hmac.compare_digest(stored_password.encode("utf-8"), password.encode("utf-8"))
+
+        if not matched:
+            AUTH_ATTEMPTS.labels(outcome="invalid").inc()
+            logger.info(f"认证失败: 用户 {username} 密码不匹配")
             return None
-    
-    def register_user(self, username: str, password: str) -> Optional[str]:
+
+        # 明文密码或成本因子过低的哈希，借本次登录升级
+        if not is_password_hash(stored_password) or self.hasher.needs_rehash(stored_password):
+            user.password = self.hasher.hash(password)
+            if self.storage.save_user(user):
+                logger.info(f"用户 {username} 的密码已迁移为新的哈希")
+
+        self.user_limiter.reset(username)
+        self.credential_cache.put(username, password, user.user_id)
+        AUTH_ATTEMPTS.labels(outcome="ok").inc()
+        logger.info(f"用户 {username} 认证成功")
+        return user.user_id
+
+    def register_user(self, username: str, password: str, client_ip: Optional[str] = None) -> Optional[str]:
         """注册新用户并返回用户ID
-        
+
         Args:
             username: 用户名
             password: 密码
-            
+            client_ip: 客户端地址，用于按地址限流
+
         Returns:
             如果注册成功，返回用户ID，否则返回None
+
+        Raises:
+            RateLimitedError: 该地址的尝试次数超过限制
+            AuthBusyError: 密码哈希线程池已饱和
         """
-        # 检查用户是否已存在
+        if client_ip:
+            self._check_rate(self.address_limiter, client_ip, "地址")
+
+        # 先查内存中的用户目录，已存在的用户名不必计算哈希
         if self.storage.user_exists(username):
             logger.info(f"注册失败: 用户名 {username} 已存在")
             return None
-        
-        # TODO: 生产环境应该对密码进行哈希处理
-        user = User(username=username, password=password)
-        if self.storage.save_user(user):
+
+        # 原子创建：并发注册同一用户名时只有一个成功
+        user = User(username=username, password=self.hasher.hash(password))
+        if self.storage.create_user(user):
             logger.info(f"用户注册成功: {username}")
             return user.user_id
-        
-        logger.error(f"用户注册失败: {username}")
-        return None 
\ No newline at end of file
+
+        logger.info(f"注册失败: 用户名 {username} 已存在或无效")
+        return None
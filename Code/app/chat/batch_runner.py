@@ -0,0 +1,316 @@
+"""批量/离线推理
+
+从JSONL文件读取问题，以指定角色和模式通过 MessageHandler.get_response 获取回复，
+以有界并发请求Ollama，每完成一条即追加写入JSONL结果文件。
+
+结果文件同时是检查点：中断后以同样的参数重新运行，已完成的条目会被跳过；
+使用retry_failed时失败的条目会重新处理，新结果追加在后面，同一ID以最后一条记录为准。
+
+输入每行一个JSON对象：
+    {"id": "q1", "prompt": "问题", "persona_id": "legal", "deep_thinking": false, "history": [...]}
+只有prompt是必需的；id默认为行号，persona_id / deep_thinking 缺省时使用命令行参数。
+角色不存在或角色ID无效的条目记为失败（error_kind 为 "invalid_persona"），
+不是有效JSON或缺少prompt的行也记为失败（error_kind 为 "invalid_line"），都不影响其余条目。
+
+输出每行一个JSON对象：
+    {"id", "prompt", "persona_id", "deep_thinking", "ok", "content", "error", "error_kind", "stats", "latency_s"}
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Dict, Any, Iterator, Optional, Set, TextIO
+
+from app.chat.message_handler import MessageHandler
+from app.chat.persona_registry import PERSONA_ID_PATTERN
+from app.config import BATCH_CONFIG, LLM_RESILIENCE_CONFIG
+from app.models.persona import Persona
+from app.storage.file_storage import FileStorage
+from app.telemetry.tracing import request_context
+
+logger = logging.getLogger("xiaohaochat.batch")
+
+
+@dataclass
+class BatchItem:
+    """一条待处理的问题"""
+
+    item_id: str
+    prompt: str
+    persona_id: str
+    deep_thinking: bool
+    history: list = field(default_factory=list)
+    error: Optional[str] = None  # 输入行无效时的原因，这样的条目直接记为失败
+
+
+@dataclass
+class BatchReport:
+    """批量运行统计"""
+
+    total: int = 0  # 输入文件中的条目数
+    skipped: int = 0  # 检查点中已完成而跳过的条目数
+    ok: int = 0
+    failed: int = 0
+    tokens: int = 0  # 本次运行生成的token数
+    eval_seconds: float = 0.0  # Ollama报告的生成耗时总和
+    elapsed: float = 0.0
+    interrupted: bool = False
+
+    @property
+    def tokens_per_second(self) -> float:
+        """整体吞吐量：本次生成的token数 / 墙钟时间"""
+        return self.tokens / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def generation_tokens_per_second(self) -> float:
+        """单请求平均生成速度：token数 / Ollama生成耗时"""
+        return self.tokens / self.eval_seconds if self.eval_seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "skipped": self.skipped,
+            "ok": self.ok,
+            "failed": self.failed,
+            "tokens": self.tokens,
+            "elapsed_s": round(self.elapsed, 2),
+            "tokens_per_s": round(self.tokens_per_second, 2),
+            "generation_tokens_per_s": round(self.generation_tokens_per_second, 2),
+            "interrupted": self.interrupted,
+        }
+
+
+def read_checkpoint(output_path: str, retry_failed: bool) -> Set[str]:
+    """读取已有结果文件，返回无需再处理的条目ID
+
+    中断时可能留下写了一半的最后一行，会被截断，使后续追加从完整的行开始。
+
+    Args:
+        output_path: 结果文件路径
+        retry_failed: 为True时失败的条目不算完成，会重新处理
+
+    Returns:
+        已完成的条目ID集合
+    """
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    valid_bytes = 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_bytes += len(line)
+            if record.get("ok") or not retry_failed:
+                done.add(str(record.get("id")))
+    if valid_bytes < os.path.getsize(output_path):
+        logger.warning(f"结果文件末尾有不完整的记录，已截断: {output_path}")
+        with open(output_path, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+def read_items(input_path: str, persona_id: str, deep_thinking: bool) -> Iterator[BatchItem]:
+    """逐行读取输入文件
+
+    Args:
+        input_path: JSONL输入文件
+        persona_id: 默认角色ID
+        deep_thinking: 默认是否启用深度思考
+
+    Yields:
+        待处理的条目；无效的行也作为条目返回，error 说明原因，ID为行号（有id字段时用id）
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+                error = f"{input_path}:{line_number} 不是有效的JSON"
+            else:
+                if isinstance(data, str):
+                    data = {"prompt": data}
+                if not isinstance(data, dict):
+                    data = None
+                    error = f"{input_path}:{line_number} 不是JSON对象"
+                elif not data.get("prompt") or not isinstance(data["prompt"], str):
+                    error = f"{input_path}:{line_number} 缺少prompt字段"
+                else:
+                    error = None
+            if error:
+                data = data or {}
+                yield BatchItem(
+                    item_id=str(data.get("id", line_number)),
+                    prompt=line if not data else str(data.get("prompt") or ""),
+                    persona_id=str(data.get("persona_id", persona_id)),
+                    deep_thinking=bool(data.get("deep_thinking", deep_thinking)),
+                    error=error
+                )
+                continue
+            yield BatchItem(
+                item_id=str(data.get("id", line_number)),
+                prompt=data["prompt"],
+                persona_id=data.get("persona_id", persona_id),
+                deep_thinking=bool(data.get("deep_thinking", deep_thinking)),
+                history=data.get("history", [])
+            )
+
+
+class BatchRunner:
+    """有界并发的批量推理"""
+
+    def __init__(self, message_handler: MessageHandler, storage: FileStorage,
+                 concurrency: int = BATCH_CONFIG["concurrency"]):
+        """初始化批量运行器
+
+        Args:
+            message_handler: 消息处理器
+            storage: 存储实例，用于加载角色
+            concurrency: 同时进行的请求数
+        """
+        self.message_handler = message_handler
+        self.storage = storage
+        self.concurrency = max(1, concurrency)
+        self._personas: Dict[str, Persona] = {}
+        self._stop = threading.Event()
+
+    def _persona(self, persona_id: str) -> Persona:
+        persona = self._personas.get(persona_id)
+        if persona is None:
+            if not isinstance(persona_id, str) or not PERSONA_ID_PATTERN.match(persona_id):
+                raise ValueError(f"无效的角色ID: {persona_id!r}")
+            persona = self.storage.resolve_persona(persona_id)
+            if persona is None:
+                raise ValueError(f"角色不存在: {persona_id}")
+            self._personas[persona_id] = persona
+        return persona
+
+    def _process(self, item: BatchItem) -> Dict[str, Any]:
+        """处理一条问题，熔断器打开时等待其恢复后重试"""
+        persona = self._persona(item.persona_id)
+        started = time.perf_counter()
+        with request_context("batch.item", item_id=item.item_id, persona_id=item.persona_id):
+            for _ in range(BATCH_CONFIG["circuit_open_retries"] + 1):
+                reply = self.message_handler.get_response(
+                    item.prompt, item.history, persona.system_prompt, item.deep_thinking,
+                    persona_id=persona.id
+                )
+                if reply.error_kind != "circuit_open" or self._stop.is_set():
+                    break
+                logger.warning(f"模型服务熔断中，等待后重试: {item.item_id}")
+                self._stop.wait(LLM_RESILIENCE_CONFIG["breaker_reset_timeout"])
+        return {
+            "id": item.item_id,
+            "prompt": item.prompt,
+            "persona_id": item.persona_id,
+            "deep_thinking": item.deep_thinking,
+            "ok": reply.ok,
+            "content": reply.content,
+            "error": reply.error,
+            "error_kind": reply.error_kind,
+            "stats": reply.stats,
+            "latency_s": round(time.perf_counter() - started, 3),
+        }
+
+    def run(self, input_path: str, output_path: str, persona_id: str = "default",
+            deep_thinking: bool = False, retry_failed: bool = False,
+            progress: Optional[TextIO] = None) -> BatchReport:
+        """运行批量推理
+
+        Args:
+            input_path: JSONL输入文件
+            output_path: JSONL结果文件，已存在时作为检查点续跑
+            persona_id: 默认角色ID
+            deep_thinking: 默认是否启用深度思考
+            retry_failed: 续跑时是否重新处理之前失败的条目
+            progress: 进度输出流，None表示不输出
+
+        Returns:
+            运行统计
+        """
+        report = BatchReport()
+        self._persona(persona_id)  # 尽早发现无效的默认角色
+        done = read_checkpoint(output_path, retry_failed)
+        started = time.perf_counter()
+        in_flight: Dict[Future, BatchItem] = {}
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-worker")
+
+        with open(output_path, 'a', encoding='utf-8') as out:
+            def failed(item: BatchItem, error: str, error_kind: str) -> Dict[str, Any]:
+                return {"id": item.item_id, "prompt": item.prompt, "persona_id": item.persona_id,
+                        "deep_thinking": item.deep_thinking, "ok": False, "content": "",
+                        "error": error, "error_kind": error_kind, "stats": {}, "latency_s": 0.0}
+
+            def collect(futures) -> None:
+                for future in futures:
+                    item = in_flight.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        logger.error(f"处理条目出错: {item.item_id}: {str(e)}")
+                        record = failed(item, str(e), type(e).__name__)
+                    write(record)
+
+            def write(record: Dict[str, Any]) -> None:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if record["ok"]:
+                    report.ok += 1
+                else:
+                    report.failed += 1
+                report.tokens += record["stats"].get("eval_count", 0)
+                report.eval_seconds += record["stats"].get("eval_duration", 0) / 1e9
+                completed = report.ok + report.failed
+                if progress and completed % BATCH_CONFIG["progress_every"] == 0:
+                    report.elapsed = time.perf_counter() - started
+                    print(f"已完成 {completed} 条（失败 {report.failed}），"
+                          f"{report.tokens_per_second:.1f} tokens/s", file=progress, flush=True)
+
+            try:
+                for item in read_items(input_path, persona_id, deep_thinking):
+                    report.total += 1
+                    if item.item_id in done:
+                        report.skipped += 1
+                        continue
+                    done.add(item.item_id)
+                    if item.error:
+                        logger.error(f"跳过无效的输入行: {item.error}")
+                        write(failed(item, item.error, "invalid_line"))
+                        continue
+                    try:
+                        self._persona(item.persona_id)
+                    except ValueError as e:
+                        # 角色无效的条目记为失败，继续处理其余条目
+                        logger.error(f"跳过条目 {item.item_id}: {str(e)}")
+                        write(failed(item, str(e), "invalid_persona"))
+                        continue
+                    # 有界并发：在途请求达到上限时先等待至少一个完成
+                    while len(in_flight) >= self.concurrency:
+                        finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                        collect(finished)
+                    in_flight[executor.submit(self._process, item)] = item
+            except KeyboardInterrupt:
+                # 已完成的结果都已写入；在途的条目不记录，续跑时会重新处理
+                report.interrupted = True
+                self._stop.set()
+                collect([f for f in in_flight if f.done() and not f.cancelled()])
+            finally:
+                if not report.interrupted:
+                    # 正常结束或读取输入出错时都先写入在途条目的结果，再抛出异常
+                    collect(wait(list(in_flight)).done)
+                executor.shutdown(wait=not report.interrupted, cancel_futures=True)
+
+        report.elapsed = time.perf_counter() - started
+        return report
@@ -1,18 +1,81 @@
 import datetime
 import uuid
 import logging
-from typing import List, Dict, Any, Optional
+import weakref
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 
 from app.models.chat import Chat
+from app.models.message import Message, to_messages
 from app.storage.file_storage import FileStorage
+from app.storage.write_behind import WriteBehindQueue, chat_write_queue
+from app.storage.archive_store import ArchiveStore, archive_store
+from app.chat.prefetcher import ChatPrefetcher, chat_prefetcher
+from app.chat.title_generator import ChatTitler, chat_titler
+from app.chat.user_memory import UserMemory, user_memory
+from app.telemetry.tracing import span
+from app.telemetry.metrics import CHATS_REHYDRATED
 
 logger = logging.getLogger("xiaohaochat.chat")
 
+# 同一聊天的"读取最新版本-修改-提交快照"在进程内串行执行。写入队列只保留最后提交的快照，
+# 界面保存与后台线程（如标题生成）交错执行时，后提交的旧快照会覆盖刚保存的消息
+_chat_locks: "weakref.WeakValueDictionary[str, threading.RLock]" = weakref.WeakValueDictionary()
+_chat_locks_guard = threading.Lock()
+
+
+def _chat_lock(chat_id: str) -> "threading.RLock":
+    with _chat_locks_guard:
+        lock = _chat_locks.get(chat_id)
+        if lock is None:
+            lock = threading.RLock()
+            _chat_locks[chat_id] = lock
+        return lock
+
+
 class ChatManager:
     """聊天管理类，处理聊天历史的创建、加载和保存"""
     
-    def __init__(self, storage: FileStorage):
+    def __init__(self, storage: FileStorage, prefetcher: Optional[ChatPrefetcher] = None,
+                 write_queue: Optional[WriteBehindQueue] = None, titler: Optional[ChatTitler] = None,
+                 archive: Optional[ArchiveStore] = None, memory: Optional[UserMemory] = None):
         self.storage = storage
+        self.prefetcher = prefetcher or chat_prefetcher
+        self.write_queue = write_queue or chat_write_queue
+        self.titler = titler or chat_titler
+        self.archive = archive or archive_store
+        self.memory = memory or user_memory
+        self.storage.migrate_chat_owners()
+    
+    def _get_chat(self, chat_id: str, user_id: Optional[str] = None) -> Optional[Chat]:
+        """读取聊天的最新版本，优先使用尚未落盘的快照
+        
+        指定user_id时，热存储中不存在的聊天会从该用户的归档中取回。
+        """
+        chat = self.write_queue.get_pending(chat_id) or self.storage.load_chat(chat_id, user_id=user_id)
+        if chat is None and user_id:
+            chat = self._rehydrate(user_id, chat_id)
+        return chat
+    
+    def _rehydrate(self, user_id: str, chat_id: str) -> Optional[Chat]:
+        """把已归档的聊天取回热存储"""
+        with span("chat.rehydrate", chat_id=chat_id):
+            chat = self.archive.load(user_id, chat_id)
+            if chat is None or not self.storage.save_chat(chat):
+                return None
+            self.archive.remove(user_id, [chat_id])
+        CHATS_REHYDRATED.inc()
+        logger.info(f"已从归档取回聊天: {chat_id}")
+        return self.storage.load_chat(chat_id, user_id=user_id)
+    
+    @staticmethod
+    def _owns(chat: Chat, user_id: str) -> bool:
+        """检查聊天是否属于该用户
+
+        以用户名标记归属的旧聊天已在初始化时迁移为用户ID，不再按用户名匹配
+        （否则注册与他人用户ID相同的用户名即可读取其聊天）。
+        """
+        return chat.user_id == user_id
     
     def create_chat(self, user_id: str, persona_id: str = "default") -> str:
         """创建新的聊天会话
@@ -61,13 +124,14 @@ class ChatManager:
         Returns:
             包含聊天数据的字典，如果不存在则返回None
         """
-        chat = self.storage.load_chat(chat_id)
+        with span("chat.load", chat_id=chat_id):
+            chat = self._get_chat(chat_id, user_id)
         if not chat:
             logger.error(f"加载聊天失败: 聊天 {chat_id} 不存在")
             return None
         
         # 确保只能访问自己的聊天
-        if chat.user_id != user_id:
+        if not self._owns(chat, user_id):
             logger.error(f"加载聊天失败: 用户 {user_id} 无权访问聊天 {chat_id}")
             return None
         
@@ -87,7 +151,43 @@ class ChatManager:
         Returns:
             聊天记录摘要列表
         """
-        return self.storage.get_user_chats(user_id)
+        chats = self.storage.get_user_chats(user_id)
+        
+        # 已归档的聊天同样列出，打开时自动取回
+        hot_ids = {summary["chat_id"] for summary in chats}
+        archived = [summary for summary in self.archive.summaries(user_id) if summary["chat_id"] not in hot_ids]
+        if archived:
+            chats.extend(archived)
+            chats.sort(key=lambda x: x.get("updated_at") or "", reverse=True)
+        
+        # 用尚未落盘的快照覆盖磁盘上的摘要
+        pending = {chat.chat_id: chat for chat in self.write_queue.pending_chats() if chat.user_id == user_id}
+        if pending:
+            for summary in chats:
+                chat = pending.get(summary["chat_id"])
+                if chat:
+                    summary["title"] = chat.metadata.get("title", summary["title"])
+                    summary["updated_at"] = chat.updated_at
+                    summary["persona_id"] = chat.metadata.get("persona_id", summary["persona_id"])
+            chats.sort(key=lambda x: x.get("updated_at") or "", reverse=True)
+        return chats
+    
+    def prefetch_chats(self, user_id: str, chat_ids: List[str]) -> None:
+        """在后台预取聊天记录到缓存，使切换对话时无需等待磁盘读取
+        
+        Args:
+            user_id: 用户ID
+            chat_ids: 要预取的聊天ID列表，按优先级排列
+        """
+        self.prefetcher.prefetch(user_id, chat_ids)
+    
+    def cancel_prefetch(self, user_id: str) -> None:
+        """取消用户尚未完成的预取任务
+        
+        Args:
+            user_id: 用户ID
+        """
+        self.prefetcher.cancel(user_id)
     
     def save_message(self, chat_id: str, role: str, content: str) -> bool:
         """向聊天中添加新消息并保存
@@ -100,24 +200,22 @@ class ChatManager:
         Returns:
             保存成功返回True，否则返回False
         """
-        chat = self.storage.load_chat(chat_id)
-        if not chat:
-            logger.error(f"添加消息失败: 聊天 {chat_id} 不存在")
-            return False
-        
-        # 添加新消息
-        chat.messages.append({
-            "role": role,
-            "content": content
-        })
-        
-        # 更新时间戳
-        chat.updated_at = datetime.datetime.now().isoformat()
-        
-        # 保存到存储
-        return self.storage.save_chat(chat)
+        with _chat_lock(chat_id):
+            chat = self._get_chat(chat_id)
+            if not chat:
+                logger.error(f"添加消息失败: 聊天 {chat_id} 不存在")
+                return False
+
+            # 添加新消息
+            chat.set_path(chat.messages + [Message(role, content)])
+
+            # 更新时间戳
+            chat.updated_at = datetime.datetime.now().isoformat()
+
+            # 交给后台队列保存
+            return self.write_queue.submit(chat)
     
-    def save_chat(self, user_id: str, chat_id: str, messages: List[Dict[str, str]], persona_id: str) -> bool:
+    def save_chat(self, user_id: str, chat_id: str, messages: List[Message], persona_id: str) -> bool:
         """保存完整的聊天记录
         
         Args:
@@ -129,25 +227,119 @@ class ChatManager:
         Returns:
             保存成功返回True，否则返回False
         """
-        chat = self.storage.load_chat(chat_id)
-        if not chat:
-            logger.error(f"保存聊天失败: 聊天 {chat_id} 不存在")
-            return False
+        with span("chat.save", chat_id=chat_id, messages=len(messages)), _chat_lock(chat_id):
+            chat = self._get_chat(chat_id, user_id)
+            if not chat:
+                logger.error(f"保存聊天失败: 聊天 {chat_id} 不存在")
+                return False
         
-        # 确保只能修改自己的聊天
-        if chat.user_id != user_id:
-            logger.error(f"保存聊天失败: 用户 {user_id} 无权修改聊天 {chat_id}")
-            return False
+            # 确保只能修改自己的聊天
+            if not self._owns(chat, user_id):
+                logger.error(f"保存聊天失败: 用户 {user_id} 无权修改聊天 {chat_id}")
+                return False
         
-        # 更新消息和元数据
-        chat.messages = messages
-        chat.metadata["persona_id"] = persona_id
+            # 更新消息和元数据（拷贝消息列表，调用方之后的修改不影响待写入的快照）
+            # 编辑或重新生成之前的消息时，新路径从分叉处起作为新分支并入消息树
+            chat.set_path(to_messages(messages))
+            chat.user_id = chat.metadata["user_id"] = user_id
+            chat.metadata["persona_id"] = persona_id
         
-        # 更新时间戳
-        chat.updated_at = datetime.datetime.now().isoformat()
+            # 更新时间戳
+            chat.updated_at = datetime.datetime.now().isoformat()
         
-        # 保存到存储
-        return self.storage.save_chat(chat)
+            # 交给后台队列保存
+            saved = self.write_queue.submit(chat)
+        
+        # 完成第一轮问答后在后台生成标题
+        if saved and not chat.metadata.get("title_generated") and any(m.get("role") == "assistant" for m in messages):
+            self.titler.submit(chat_id, chat.messages)
+        # 聊天结束（一段时间不再保存）后在后台提取关于用户的事实
+        if saved and any(m.get("role") == "assistant" for m in messages):
+            self.memory.submit(user_id, chat_id)
+        return saved
+    
+    def add_fan_out_replies(self, user_id: str, chat_id: str, persona_id: str,
+                            replies: List[Tuple[str, Message]]) -> bool:
+        """把多角色对比中其他角色的回答保存为当前回答的兄弟节点
+        
+        当前聊天（已保存本轮的回答）的消息树中，其他回答与当前回答挂在同一条用户消息下，
+        界面把同一轮的回答并排显示，也可以切换到其中任一个回答继续对话。
+        
+        Args:
+            user_id: 用户ID
+            chat_id: 聊天ID
+            persona_id: 当前回答（当前路径最后一条消息）的角色
+            replies: 其他角色的回答 [(角色ID, 消息)]
+            
+        Returns:
+            保存成功返回True
+        """
+        with span("chat.add_fan_out", chat_id=chat_id, replies=len(replies)), _chat_lock(chat_id):
+            chat = self._get_chat(chat_id, user_id)
+            if not chat or not self._owns(chat, user_id):
+                logger.error(f"保存对比回答失败: 聊天 {chat_id} 不存在或无权访问")
+                return False
+            if not chat.add_fan_out(persona_id, replies):
+                logger.error(f"保存对比回答失败: 聊天 {chat_id} 的最后一条消息不是回答")
+                return False
+            return self.write_queue.submit(chat)
+    
+    def get_fan_out_replies(self, user_id: str, chat_id: str) -> Dict[int, List[Tuple[str, Message]]]:
+        """当前路径上多角色对比的回答及同一轮其他角色的回答，用于并排显示
+        
+        Args:
+            user_id: 用户ID
+            chat_id: 聊天ID
+            
+        Returns:
+            回答在当前路径中的位置 -> [(角色ID, 消息)]，当前路径上的回答在最前
+        """
+        chat = self._get_chat(chat_id)
+        if not chat or chat.tree is None or not chat.tree.fan_out or not self._owns(chat, user_id):
+            return {}
+        tree = chat.tree
+        return {position: [(tree.fan_out[node][0], tree.messages[node]) for node in nodes]
+                for position, nodes in tree.fan_out_rounds().items()}
+    
+    def get_alternatives(self, user_id: str, chat_id: str) -> Dict[int, Tuple[int, int]]:
+        """当前路径上被编辑或重新生成过、有其他版本的消息
+        
+        Args:
+            user_id: 用户ID
+            chat_id: 聊天ID
+            
+        Returns:
+            消息位置 -> (当前版本的序号, 版本数)，线性的聊天返回空字典
+        """
+        chat = self._get_chat(chat_id)
+        if not chat or chat.tree is None or not self._owns(chat, user_id):
+            return {}
+        return chat.tree.alternatives()
+    
+    def switch_branch(self, user_id: str, chat_id: str, position: int, offset: int) -> Optional[List[Message]]:
+        """把当前路径切换到第position条消息的另一个版本
+        
+        切换后沿该版本最近的后续消息走到末端。只改变当前路径，不更新聊天的修改时间。
+        
+        Args:
+            user_id: 用户ID
+            chat_id: 聊天ID
+            position: 消息在当前路径中的位置
+            offset: -1为上一个版本，1为下一个版本
+            
+        Returns:
+            切换后的当前路径，没有其他版本或聊天不存在时返回None
+        """
+        with _chat_lock(chat_id):
+            chat = self._get_chat(chat_id, user_id)
+            if not chat or not self._owns(chat, user_id):
+                logger.error(f"切换分支失败: 聊天 {chat_id} 不存在或无权访问")
+                return None
+            if not chat.switch_branch(position, offset):
+                return None
+            if not self.write_queue.submit(chat):
+                return None
+            return list(chat.messages)
     
     def update_chat_persona(self, user_id: str, chat_id: str, persona_id: str) -> bool:
         """更新聊天的角色
@@ -160,45 +352,124 @@ class ChatManager:
         Returns:
             更新成功返回True，否则返回False
         """
-        chat = self.storage.load_chat(chat_id)
-        if not chat:
-            logger.error(f"更新角色失败: 聊天 {chat_id} 不存在")
-            return False
-        
-        # 确保只能修改自己的聊天
-        if chat.user_id != user_id:
-            logger.error(f"更新角色失败: 用户 {user_id} 无权修改聊天 {chat_id}")
-            return False
-        
-        # 更新元数据
-        chat.metadata["persona_id"] = persona_id
+        with _chat_lock(chat_id):
+            chat = self._get_chat(chat_id, user_id)
+            if not chat:
+                logger.error(f"更新角色失败: 聊天 {chat_id} 不存在")
+                return False
+
+            # 确保只能修改自己的聊天
+            if not self._owns(chat, user_id):
+                logger.error(f"更新角色失败: 用户 {user_id} 无权修改聊天 {chat_id}")
+                return False
+
+            # 更新元数据
+            chat.user_id = chat.metadata["user_id"] = user_id
+            chat.metadata["persona_id"] = persona_id
+
+            # 更新时间戳
+            chat.updated_at = datetime.datetime.now().isoformat()
+
+            # 交给后台队列保存
+            return self.write_queue.submit(chat)
+    
+    def _delete_hot(self, chat: Chat) -> bool:
+        """删除热存储中的聊天文件，从未落盘的聊天视为删除成功"""
+        if self.storage.delete_chat(chat.chat_id, user_id=chat.user_id):
+            return True
+        return self.storage.load_chat(chat.chat_id, cache=False, user_id=chat.user_id) is None
+    
+    def delete_chat(self, user_id: str, chat_id: str) -> bool:
+        """删除聊天（包括已归档的聊天）
         
-        # 更新时间戳
-        chat.updated_at = datetime.datetime.now().isoformat()
+        Args:
+            user_id: 用户ID
+            chat_id: 聊天ID
+            
+        Returns:
+            删除成功返回True，聊天不存在、无权删除或删除文件失败返回False
+        """
+        # 持有聊天锁：删除期间的保存或标题写入不会把快照重新放回写入队列
+        with _chat_lock(chat_id):
+            chat = self._get_chat(chat_id)
+            if chat is None:
+                # 只存在于归档中
+                if self.archive.remove(user_id, [chat_id]):
+                    self.memory.forget_chat(user_id, chat_id)
+                    logger.info(f"已删除归档聊天: {chat_id}")
+                    return True
+                logger.error(f"删除聊天失败: 聊天 {chat_id} 不存在")
+                return False
+            
+            if not self._owns(chat, user_id):
+                logger.error(f"删除聊天失败: 用户 {user_id} 无权删除聊天 {chat_id}")
+                return False
+            
+            # 先丢弃待写入的快照，避免后台写入让聊天重新出现
+            self.write_queue.discard(chat_id)
+            if not self._delete_hot(chat):
+                logger.error(f"删除聊天失败: 无法删除聊天文件 {chat_id}")
+                return False
+            self.archive.remove(user_id, [chat_id])
+        # 删除聊天时一并忘记从中提取的事实
+        self.memory.forget_chat(user_id, chat_id)
+        return True
+    
+    def archive_chat(self, user_id: str, chat_id: str) -> bool:
+        """立即把聊天移入归档，打开时会自动取回
         
-        # 保存到存储
-        return self.storage.save_chat(chat)
+        Args:
+            user_id: 用户ID
+            chat_id: 聊天ID
+            
+        Returns:
+            归档成功返回True，否则返回False
+        """
+        with _chat_lock(chat_id):
+            chat = self._get_chat(chat_id)
+            if chat is None or not self._owns(chat, user_id):
+                logger.error(f"归档聊天失败: 聊天 {chat_id} 不存在或用户 {user_id} 无权访问")
+                return False
+            
+            chat.user_id = chat.metadata["user_id"] = user_id
+            try:
+                self.archive.archive(user_id, [chat])
+            except Exception as e:
+                logger.error(f"归档聊天失败: {chat_id}: {str(e)}")
+                return False
+            self.write_queue.discard(chat_id)
+            if not self._delete_hot(chat):
+                # 聊天仍在热存储中：撤销归档避免同时存在于两处，并放回刚才丢弃的快照
+                self.archive.remove(user_id, [chat_id])
+                self.write_queue.submit(chat)
+                logger.error(f"归档聊天失败: 无法删除聊天文件 {chat_id}")
+                return False
+        logger.info(f"聊天已归档: {chat_id}")
+        return True
     
-    def update_chat_metadata(self, chat_id: str, metadata: Dict[str, Any]) -> bool:
+    def update_chat_metadata(self, chat_id: str, metadata: Dict[str, Any], touch: bool = True) -> bool:
         """更新聊天元数据
         
         Args:
             chat_id: 聊天ID
             metadata: 要更新的元数据字典
+            touch: 是否更新时间戳（为False时聊天在列表中的位置不变）
             
         Returns:
             更新成功返回True，否则返回False
         """
-        chat = self.storage.load_chat(chat_id)
-        if not chat:
-            logger.error(f"更新元数据失败: 聊天 {chat_id} 不存在")
-            return False
-        
-        # 更新元数据
-        chat.metadata.update(metadata)
-        
-        # 更新时间戳
-        chat.updated_at = datetime.datetime.now().isoformat()
-        
-        # 保存到存储
-        return self.storage.save_chat(chat) 
\ No newline at end of file
+        with _chat_lock(chat_id):
+            chat = self._get_chat(chat_id)
+            if not chat:
+                logger.error(f"更新元数据失败: 聊天 {chat_id} 不存在")
+                return False
+
+            # 更新元数据
+            chat.metadata.update(metadata)
+
+            # 更新时间戳
+            if touch:
+                chat.updated_at = datetime.datetime.now().isoformat()
+
+            # 交给后台队列保存
+            return self.write_queue.submit(chat) 
\ No newline at end of file
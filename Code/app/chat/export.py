@@ -0,0 +1,341 @@
+"""聊天记录的流式导出与批量导入
+
+导出按目录顺序逐个读取聊天并立即写出，任意时刻只在内存中持有一个聊天，
+输出可按扩展名压缩（.gz / .bz2 / .xz / .zip），压缩流同样是边写边压缩。
+
+格式：
+    jsonl     每行一个聊天（与存储格式相同的字典），可以无损导入
+    markdown  便于阅读的文本，zip归档中每个聊天一个文件
+    html      独立的网页，zip归档中每个聊天一个文件
+
+导入只接受jsonl格式，按批写入存储层。
+"""
+
+import io
+import os
+import bz2
+import gzip
+import html
+import json
+import lzma
+import zipfile
+import logging
+import datetime
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, Optional, Set, TextIO, Callable, List
+
+from app.config import EXPORT_CONFIG
+from app.models.chat import Chat
+from app.storage.file_storage import FileStorage
+
+logger = logging.getLogger("xiaohaochat.export")
+
+FORMATS = ("jsonl", "markdown", "html")
+FORMAT_EXTENSIONS = {".jsonl": "jsonl", ".md": "markdown", ".markdown": "markdown", ".html": "html", ".htm": "html"}
+COMPRESSED_OPENERS: Dict[str, Callable[..., TextIO]] = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+MEMBER_EXTENSIONS = {"jsonl": ".jsonl", "markdown": ".md", "html": ".html"}
+ROLE_NAMES = {"user": "用户", "assistant": "助手", "system": "系统"}
+TRUNCATED_NOTE = "（回复已中断）"
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 860px; margin: 2em auto; color: #222; }}
+section.chat {{ border-top: 2px solid #ccc; margin-top: 2em; }}
+.meta {{ color: #777; font-size: 0.9em; }}
+.message {{ margin: 1em 0; padding: 0.6em 0.9em; border-radius: 6px; white-space: pre-wrap; }}
+.user {{ background: #eef4ff; }}
+.assistant {{ background: #f5f5f5; }}
+.role {{ font-weight: bold; display: block; margin-bottom: 0.3em; }}
+</style>
+</head>
+<body>
+"""
+HTML_TAIL = "</body>\n</html>\n"
+
+
+def detect_format(path: str) -> Optional[str]:
+    """根据文件名（去掉压缩扩展名后）推断格式"""
+    stem, ext = os.path.splitext(path.lower())
+    if ext in COMPRESSED_OPENERS or ext == ".zip":
+        ext = os.path.splitext(stem)[1]
+    return FORMAT_EXTENSIONS.get(ext)
+
+
+def parse_date(value: Optional[str], end: bool = False) -> Optional[datetime.datetime]:
+    """解析命令行中的日期/时间；只有日期的结束时间包含当天"""
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += datetime.timedelta(days=1)
+    return parsed
+
+
+def _in_range(chat: Chat, since: Optional[datetime.datetime], until: Optional[datetime.datetime]) -> bool:
+    if since is None and until is None:
+        return True
+    try:
+        updated = datetime.datetime.fromisoformat(chat.updated_at)
+    except (TypeError, ValueError):
+        return False
+    return (since is None or updated >= since) and (until is None or updated < until)
+
+
+def render_markdown(chat: Chat, username: str) -> str:
+    lines = [f"# {chat.metadata.get('title', '无标题对话')}", "",
+             f"- 聊天ID: {chat.chat_id}",
+             f"- 用户: {username}",
+             f"- 角色: {chat.metadata.get('persona_id', 'default')}",
+             f"- 更新时间: {chat.updated_at}", ""]
+    for message in chat.messages:
+        lines.append(f"### {ROLE_NAMES.get(message.get('role'), message.get('role'))}")
+        lines.append("")
+        lines.append(message.get("content", ""))
+        if message.truncated:
+            lines.append("")
+            lines.append(f"*{TRUNCATED_NOTE}*")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def render_html(chat: Chat, username: str) -> str:
+    parts = [f'<section class="chat" id="{html.escape(chat.chat_id)}">',
+             f"<h2>{html.escape(chat.metadata.get('title', '无标题对话'))}</h2>",
+             f'<p class="meta">聊天ID {html.escape(chat.chat_id)} · 用户 {html.escape(username)} · '
+             f"角色 {html.escape(chat.metadata.get('persona_id', 'default'))} · 更新于 {html.escape(chat.updated_at)}</p>"]
+    for message in chat.messages:
+        role = message.get("role", "")
+        note = f'<span class="meta">{TRUNCATED_NOTE}</span>' if message.truncated else ""
+        parts.append(f'<div class="message {html.escape(role)}"><span class="role">'
+                     f"{html.escape(ROLE_NAMES.get(role, role))}</span>{message.html}{note}</div>")
+    parts.append("</section>")
+    return "\n".join(parts) + "\n"
+
+
+def render_chat(chat: Chat, fmt: str, username: str) -> str:
+    if fmt == "jsonl":
+        return json.dumps(chat.to_dict(), ensure_ascii=False) + "\n"
+    if fmt == "markdown":
+        return render_markdown(chat, username)
+    return render_html(chat, username)
+
+
+@dataclass
+class ExportReport:
+    """导出统计"""
+
+    chats: int = 0
+    messages: int = 0
+    bytes_written: int = 0  # 输出文件（压缩后）的大小
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"chats": self.chats, "messages": self.messages, "bytes": self.bytes_written}
+
+
+@dataclass
+class ImportReport:
+    """导入统计"""
+
+    read: int = 0
+    imported: int = 0
+    skipped: int = 0  # 已存在而跳过的聊天
+    invalid: int = 0  # 格式错误的行
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"read": self.read, "imported": self.imported, "skipped": self.skipped, "invalid": self.invalid}
+
+
+class ChatExporter:
+    """流式聊天导出器"""
+
+    def __init__(self, storage: FileStorage):
+        self.storage = storage
+        self._usernames: Dict[str, str] = {}
+
+    def _username(self, user_id: str) -> str:
+        if user_id not in self._usernames:
+            user = self.storage.load_user_by_id(user_id)
+            self._usernames[user_id] = user.username if user else user_id
+        return self._usernames[user_id]
+
+    def iter_chats(self, user_ids: Optional[Set[str]] = None, since: Optional[datetime.datetime] = None,
+                   until: Optional[datetime.datetime] = None) -> Iterator[Chat]:
+        """逐个产出符合条件的聊天
+
+        Args:
+            user_ids: 只导出这些用户的聊天，None表示全部用户
+            since: 只导出在该时间及之后更新的聊天
+            until: 只导出在该时间之前更新的聊天
+        """
+        owners = None
+        if user_ids is not None:
+            # 尚未迁移的旧聊天以用户名标记归属
+            owners = set(user_ids)
+            for user_id in user_ids:
+                user = self.storage.load_user_by_id(user_id)
+                if user is not None:
+                    owners.add(user.username)
+        for chat in self.storage.iter_chats(owners):
+            if _in_range(chat, since, until):
+                yield chat
+
+    def export(self, output_path: str, fmt: Optional[str] = None, user_ids: Optional[Set[str]] = None,
+               since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+               progress: Optional[TextIO] = None) -> ExportReport:
+        """导出聊天到文件
+
+        先写入同目录下的临时文件，完成后再改名，中断不会留下看似完整的导出文件。
+
+        Args:
+            output_path: 输出路径，扩展名决定压缩方式（.gz / .bz2 / .xz / .zip）
+            fmt: 导出格式，None时按扩展名推断
+            user_ids: 只导出这些用户的聊天，None表示全部用户
+            since: 只导出在该时间及之后更新的聊天
+            until: 只导出在该时间之前更新的聊天
+            progress: 进度输出流，None表示不输出
+
+        Returns:
+            导出统计
+
+        Raises:
+            ValueError: 无法确定导出格式
+        """
+        fmt = fmt or detect_format(output_path)
+        if fmt not in FORMATS:
+            raise ValueError(f"无法确定导出格式，请使用 --format 指定: {output_path}")
+        report = ExportReport()
+        chats = self.iter_chats(user_ids, since, until)
+        tmp_path = output_path + ".part"
+        ext = os.path.splitext(output_path.lower())[1]
+        try:
+            if ext == ".zip":
+                self._export_zip(tmp_path, fmt, chats, report, progress)
+            else:
+                self._export_stream(tmp_path, fmt, COMPRESSED_OPENERS.get(ext), chats, report, progress)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        report.bytes_written = os.path.getsize(output_path)
+        logger.info(f"导出完成: {output_path}: {report.chats} 个聊天, {report.messages} 条消息")
+        return report
+
+    def _count(self, chat: Chat, report: ExportReport, progress: Optional[TextIO]) -> None:
+        report.chats += 1
+        report.messages += len(chat.messages)
+        if progress and report.chats % EXPORT_CONFIG["progress_every"] == 0:
+            print(f"已导出 {report.chats} 个聊天，{report.messages} 条消息", file=progress, flush=True)
+
+    def _export_stream(self, path: str, fmt: str, opener: Optional[Callable[..., TextIO]],
+                       chats: Iterator[Chat], report: ExportReport, progress: Optional[TextIO]) -> None:
+        """导出为单个文件，opener不为None时边写边压缩"""
+        if opener is not None:
+            out = opener(path, 'wt', encoding='utf-8')
+        else:
+            out = open(path, 'w', encoding='utf-8', buffering=EXPORT_CONFIG["buffer_bytes"])
+        with out:
+            if fmt == "html":
+                out.write(HTML_HEAD.format(title="晓昊助手对话导出"))
+            for chat in chats:
+                out.write(render_chat(chat, fmt, self._username(chat.user_id)))
+                self._count(chat, report, progress)
+            if fmt == "html":
+                out.write(HTML_TAIL)
+
+    def _export_zip(self, path: str, fmt: str, chats: Iterator[Chat], report: ExportReport,
+                    progress: Optional[TextIO]) -> None:
+        """导出为zip归档：jsonl为单个成员，markdown/html每个聊天一个成员"""
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            if fmt == "jsonl":
+                with archive.open("chats.jsonl", 'w', force_zip64=True) as member, \
+                        io.TextIOWrapper(member, encoding='utf-8') as out:
+                    for chat in chats:
+                        out.write(render_chat(chat, fmt, self._username(chat.user_id)))
+                        self._count(chat, report, progress)
+                return
+            for chat in chats:
+                username = self._username(chat.user_id)
+                body = render_chat(chat, fmt, username)
+                if fmt == "html":
+                    body = HTML_HEAD.format(title=html.escape(chat.metadata.get("title", chat.chat_id))) + body + HTML_TAIL
+                name = f"{username}/{chat.chat_id}{MEMBER_EXTENSIONS[fmt]}"
+                archive.writestr(name, body)
+                self._count(chat, report, progress)
+
+
+def _open_input(path: str) -> TextIO:
+    ext = os.path.splitext(path.lower())[1]
+    if ext in COMPRESSED_OPENERS:
+        return COMPRESSED_OPENERS[ext](path, 'rt', encoding='utf-8')
+    if ext == ".zip":
+        archive = zipfile.ZipFile(path)
+        names = [name for name in archive.namelist() if name.endswith(".jsonl")]
+        if not names:
+            archive.close()
+            raise ValueError(f"归档中没有jsonl文件: {path}")
+        return io.TextIOWrapper(archive.open(names[0]), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+class ChatImporter:
+    """批量聊天导入器，读取jsonl导出文件，按批写入存储层"""
+
+    def __init__(self, storage: FileStorage, batch_size: int = EXPORT_CONFIG["import_batch_size"]):
+        self.storage = storage
+        self.batch_size = max(1, batch_size)
+
+    def import_file(self, input_path: str, owner_id: Optional[str] = None, overwrite: bool = False,
+                    progress: Optional[TextIO] = None) -> ImportReport:
+        """导入jsonl导出文件
+
+        Args:
+            input_path: 导出文件，可以是 .gz / .bz2 / .xz 压缩或jsonl格式的zip归档
+            owner_id: 把所有聊天归属到该用户ID，None时保留原归属
+            overwrite: 是否覆盖已存在的同ID聊天
+            progress: 进度输出流，None表示不输出
+
+        Returns:
+            导入统计
+        """
+        report = ImportReport()
+        batch: List[Chat] = []
+
+        def flush() -> None:
+            written = self.storage.save_chats(batch, overwrite)
+            report.imported += written
+            report.skipped += len(batch) - written
+            batch.clear()
+            if progress:
+                print(f"已读取 {report.read} 个聊天，导入 {report.imported} 个", file=progress, flush=True)
+
+        with _open_input(input_path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    chat = Chat.from_dict(data)
+                    if not isinstance(data.get("chat_id"), str) or os.path.basename(chat.chat_id) != chat.chat_id \
+                            or chat.chat_id.startswith(".") or not isinstance(chat.messages, list):
+                        raise ValueError("无效的聊天ID或消息列表")
+                except (ValueError, KeyError, AttributeError, TypeError) as e:
+                    report.invalid += 1
+                    logger.warning(f"{input_path}:{line_number} 不是有效的聊天记录: {str(e)}")
+                    continue
+                report.read += 1
+                if owner_id is not None:
+                    chat.user_id = chat.metadata["user_id"] = owner_id
+                batch.append(chat)
+                if len(batch) >= self.batch_size:
+                    flush()
+        if batch:
+            flush()
+        logger.info(f"导入完成: {input_path}: 导入 {report.imported} 个聊天，跳过 {report.skipped} 个")
+        return report
@@ -0,0 +1,563 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, TextIO, Tuple
+
+import numpy as np
+
+from app.config import KNOWLEDGE_DIR, KNOWLEDGE_CONFIG, VECTOR_INDEX_CONFIG
+from app.llm.embeddings import create_embedder
+from app.storage.file_storage import _atomic_write_json
+from app.storage.vector_index import VectorIndex
+from app.telemetry.tracing import span
+from app.telemetry.metrics import KNOWLEDGE_RETRIEVAL_DURATION
+
+logger = logging.getLogger("xiaohaochat.chat.knowledge")
+
+_PERSONA_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+# 一个句子：到中英文句末标点（连同其后的引号）、后面跟空白的英文句号或换行为止
+_SENTENCE = re.compile(r".*?(?:[。！？!?；;]+[”’\"」』）)]*|\.(?=\s)|\n|$)", re.DOTALL)
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"  # 每行一个片段：来源、内容哈希和文本
+OFFSETS_FILE = "offsets.i64"  # 每个片段在 chunks.jsonl 中的起始字节，按需读取检索到的片段
+INDEX_DIR = "index"  # 片段向量，键为片段ID
+
+CONTEXT_HEADER = "以下是从知识库中检索到的参考资料，回答时可以参考，与问题无关的资料请忽略："
+
+
+def split_sentences(text: str) -> List[str]:
+    """把一段文本切分为句子，保留句末标点和换行"""
+    return [sentence for sentence in _SENTENCE.findall(text) if sentence.strip()]
+
+
+def chunk_text(text: str, chunk_chars: int, overlap: int) -> List[str]:
+    """把文档切分为适合检索的片段
+
+    按段落和句子边界把连续的句子合并为不超过chunk_chars个字符的片段，单个句子过长时硬切。
+    每个片段开头重复前一个片段末尾不超过overlap个字符的完整句子，跨片段的内容检索时仍有上下文。
+
+    Args:
+        text: 文档内容
+        chunk_chars: 片段的目标长度（字符）
+        overlap: 相邻片段重复的最大长度（字符）
+
+    Returns:
+        片段列表
+    """
+    sentences = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        units = split_sentences(paragraph)
+        for position, sentence in enumerate(units):
+            sentence = re.sub(r"\s+", " ", sentence).strip()
+            if position == len(units) - 1:
+                sentence += "\n"  # 段落结束
+            while len(sentence) > chunk_chars:
+                sentences.append(sentence[:chunk_chars])
+                sentence = sentence[max(1, chunk_chars - overlap):]
+            sentences.append(sentence)
+
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for sentence in sentences:
+        if current and size + len(sentence) > chunk_chars:
+            chunks.append("".join(current).strip())
+            # 保留末尾的句子作为下一个片段的开头
+            tail: List[str] = []
+            tail_size = 0
+            for previous in reversed(current):
+                if tail_size + len(previous) > overlap:
+                    break
+                tail.insert(0, previous)
+                tail_size += len(previous)
+            while tail and tail_size + len(sentence) > chunk_chars:
+                tail_size -= len(tail.pop(0))
+            current, size = tail, tail_size
+        current.append(sentence)
+        size += len(sentence)
+    if current and "".join(current).strip():
+        chunks.append("".join(current).strip())
+    return chunks
+
+
+def build_prompt(message: str, passages: List['Passage'], max_chars: int) -> str:
+    """把检索到的资料加在用户问题之前
+
+    Args:
+        message: 用户的问题
+        passages: 按相关程度排列的资料
+        max_chars: 资料文本的总长度上限
+
+    Returns:
+        发送给模型的用户消息；没有可用资料时为原问题
+    """
+    parts = []
+    used = 0
+    for passage in passages:
+        if parts and used + len(passage.text) > max_chars:
+            break
+        parts.append(f"[{len(parts) + 1}] 《{passage.source}》\n{passage.text[:max_chars]}")
+        used += len(passage.text)
+    if not parts:
+        return message
+    return CONTEXT_HEADER + "\n\n" + "\n\n".join(parts) + f"\n\n问题：{message}"
+
+
+@dataclass
+class Passage:
+    """检索到的一段资料"""
+
+    source: str  # 来源文件名
+    text: str
+    score: float  # 与问题的余弦相似度
+
+
+@dataclass
+class IngestReport:
+    """一次导入的统计"""
+
+    persona_id: str
+    files_added: int = 0
+    files_updated: int = 0
+    files_unchanged: int = 0
+    files_removed: int = 0
+    chunks_embedded: int = 0
+    chunks_reused: int = 0  # 内容未变、沿用原有向量的片段
+    chunks_total: int = 0
+    rebuilt: bool = False  # 是否写出了新版本（更换嵌入模型，或回收已删除的片段）
+    elapsed: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "persona_id": self.persona_id,
+            "files_added": self.files_added,
+            "files_updated": self.files_updated,
+            "files_unchanged": self.files_unchanged,
+            "files_removed": self.files_removed,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_reused": self.chunks_reused,
+            "chunks_total": self.chunks_total,
+            "rebuilt": self.rebuilt,
+            "elapsed_s": round(self.elapsed, 2),
+        }
+
+
+class _Collection:
+    """知识库的一个版本目录：片段文本、偏移量和向量索引，片段ID即其在 offsets 中的行号"""
+
+    __slots__ = ("directory", "mtime", "embedder", "count", "offsets", "index")
+
+    def __init__(self, directory: str, mtime: int, manifest: Dict[str, Any], readonly: bool = True):
+        self.directory = directory
+        self.mtime = mtime
+        self.embedder = manifest["embedder"]
+        self.count = manifest["next_id"]
+        self.offsets = np.memmap(os.path.join(directory, OFFSETS_FILE), dtype=np.int64, mode="r",
+                                 shape=(self.count,))
+        self.index = VectorIndex(os.path.join(directory, INDEX_DIR), readonly=readonly)
+
+    def read_chunks(self, ids: List[int]) -> List[Dict[str, Any]]:
+        with open(os.path.join(self.directory, CHUNKS_FILE), "rb") as f:
+            chunks = []
+            for chunk_id in ids:
+                f.seek(int(self.offsets[chunk_id]))
+                chunks.append(json.loads(f.readline()))
+            return chunks
+
+
+class KnowledgeBase:
+    """角色知识库
+
+    每个角色一个文档集合，保存在 knowledge/<角色ID>/ 下：manifest.json 记录已导入的文件及其
+    内容哈希、每个文件的片段ID范围；片段文本和向量索引（VectorIndex）保存在当前版本目录中。
+
+    导入是增量的：内容哈希未变的文件直接跳过；新文件和修改过的文件的片段追加到当前版本，
+    修改过的文件中内容未变的片段沿用原有向量，只有新片段需要请求嵌入模型；旧片段在索引中
+    标记删除，最后原子替换 manifest 提交。已删除的片段过多或更换了嵌入模型时写出新版本目录。
+    """
+
+    def __init__(self, root: str = KNOWLEDGE_DIR, embedder=None, chunk_chars: Optional[int] = None,
+                 chunk_overlap: Optional[int] = None, top_k: Optional[int] = None,
+                 min_score: Optional[float] = None, enabled: bool = True):
+        """初始化知识库
+
+        Args:
+            root: 知识库根目录
+            embedder: 嵌入模型，默认按 KNOWLEDGE_CONFIG["embedder"] 在首次使用时创建
+            chunk_chars: 片段的目标长度（字符）
+            chunk_overlap: 相邻片段重复的最大长度（字符）
+            top_k: 每个问题检索的片段数
+            min_score: 低于该相似度的片段不使用
+            enabled: 为False时检索总是返回空列表
+        """
+        self.root = root
+        self._embedder = embedder
+        self.chunk_chars = chunk_chars or KNOWLEDGE_CONFIG["chunk_chars"]
+        self.chunk_overlap = KNOWLEDGE_CONFIG["chunk_overlap"] if chunk_overlap is None else chunk_overlap
+        self.top_k = top_k or KNOWLEDGE_CONFIG["top_k"]
+        self.min_score = KNOWLEDGE_CONFIG["min_score"] if min_score is None else min_score
+        self.enabled = enabled
+        self._collections: Dict[str, _Collection] = {}
+        self._mismatch_logged = set()
+        self._lock = threading.Lock()
+        self._ingest_lock = threading.Lock()
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = create_embedder()
+        return self._embedder
+
+    def _directory(self, persona_id: str) -> str:
+        if not _PERSONA_ID.match(persona_id or ""):
+            raise ValueError(f"无效的角色ID: {persona_id}")
+        return os.path.join(self.root, persona_id)
+
+    def _load_manifest(self, persona_id: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self._directory(persona_id), MANIFEST_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _collection(self, persona_id: str) -> Optional[_Collection]:
+        """已加载的知识库，manifest 被导入程序替换后重新加载；没有文档时返回None"""
+        directory = self._directory(persona_id)
+        try:
+            mtime = os.stat(os.path.join(directory, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            self._collections.pop(persona_id, None)
+            return None
+        collection = self._collections.get(persona_id)
+        if collection is not None and collection.mtime == mtime:
+            return collection
+        with self._lock:
+            manifest = self._load_manifest(persona_id)
+            if manifest is None or not manifest["files"] or not manifest["next_id"]:
+                self._collections.pop(persona_id, None)
+                return None
+            collection = _Collection(os.path.join(directory, manifest["generation"]), mtime, manifest)
+            self._collections[persona_id] = collection
+            logger.info(f"已加载知识库: {persona_id}: {len(collection.index)} 个片段")
+            return collection
+
+    def has_documents(self, persona_id: str) -> bool:
+        """该角色是否有已导入的文档"""
+        return self.enabled and self._collection(persona_id) is not None
+
+    def search(self, persona_id: str, query: str, top_k: Optional[int] = None) -> List[Passage]:
+        """检索与问题最相关的片段
+
+        Args:
+            persona_id: 角色ID
+            query: 问题
+            top_k: 返回的片段数，默认取配置值
+
+        Returns:
+            按相似度从高到低排列、不低于 min_score 的片段；没有知识库时为空列表
+
+        Raises:
+            LLMError: 问题的嵌入请求失败
+        """
+        if not self.enabled:
+            return []
+        collection = self._collection(persona_id)
+        if collection is None:
+            return []
+        if collection.embedder != self.embedder.name:
+            # 不同嵌入模型的向量不可比较，需要用当前模型重新导入
+            if persona_id not in self._mismatch_logged:
+                self._mismatch_logged.add(persona_id)
+                logger.warning(f"知识库 {persona_id} 由 {collection.embedder} 生成，与当前嵌入模型 "
+                               f"{self.embedder.name} 不一致，请使用 --rebuild 重新导入")
+            return []
+        started = time.perf_counter()
+        query_vector = self.embedder.embed([query])[0]
+        with span("knowledge.search", persona_id=persona_id, chunks=len(collection.index)):
+            keys, scores = collection.index.search(query_vector, top_k or self.top_k)
+            # 索引先于 manifest 提交，可能含有本次加载之后追加的片段
+            hits = [(int(key), float(score)) for key, score in zip(keys, scores)
+                    if score >= self.min_score and key < collection.count]
+            chunks = collection.read_chunks([chunk_id for chunk_id, _ in hits])
+            passages = [Passage(chunk["source"], chunk["text"], score) for (_, score), chunk in zip(hits, chunks)]
+        KNOWLEDGE_RETRIEVAL_DURATION.observe(time.perf_counter() - started)
+        return passages
+
+    def ingest(self, persona_id: str, paths: List[str], rebuild: bool = False,
+               progress: Optional[TextIO] = None) -> IngestReport:
+        """把文件导入角色的知识库
+
+        目录中按 KNOWLEDGE_CONFIG["extensions"] 递归查找文件，直接指定的文件不限扩展名（PDF请先
+        转换为文本）。已导入、但已经不存在的文件从知识库中删除。
+
+        Args:
+            persona_id: 角色ID
+            paths: 文件或目录
+            rebuild: 重新切分和嵌入所有文件（更换嵌入模型或切分参数后使用）
+            progress: 进度输出流
+
+        Returns:
+            导入统计
+
+        Raises:
+            ValueError: 角色ID无效或路径不存在
+            LLMError: 嵌入请求失败，此时知识库保持导入前的状态
+        """
+        started = time.perf_counter()
+        report = IngestReport(persona_id)
+        directory = self._directory(persona_id)
+        files = self._discover(paths)
+        with self._ingest_lock, span("knowledge.ingest", persona_id=persona_id, files=len(files)):
+            os.makedirs(directory, exist_ok=True)
+            manifest = self._load_manifest(persona_id) or {
+                "embedder": self.embedder.name, "dim": 0, "generation": "", "next_id": 0,
+                "chunks_bytes": 0, "files": {}
+            }
+            if manifest["embedder"] != self.embedder.name:
+                rebuild = True
+            old_files: Dict[str, Dict[str, Any]] = manifest["files"]
+
+            # 需要重新切分的文件：路径 -> (内容哈希, 片段)
+            changed: Dict[str, Tuple[str, List[str]]] = {}
+            for path in files:
+                with open(path, "rb") as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                entry = old_files.get(path)
+                if entry is not None and entry["hash"] == digest and not rebuild:
+                    report.files_unchanged += 1
+                    continue
+                if entry is None:
+                    report.files_added += 1
+                else:
+                    report.files_updated += 1
+                text = data.decode("utf-8-sig", errors="replace")
+                changed[path] = (digest, chunk_text(text, self.chunk_chars, self.chunk_overlap))
+            if rebuild:
+                # 本次没有指定、但仍然存在的文件也要用当前参数重新处理
+                for path in old_files:
+                    if path not in changed and path not in files and os.path.isfile(path):
+                        with open(path, "rb") as f:
+                            data = f.read()
+                        text = data.decode("utf-8-sig", errors="replace")
+                        changed[path] = (hashlib.sha256(data).hexdigest(),
+                                         chunk_text(text, self.chunk_chars, self.chunk_overlap))
+                        report.files_updated += 1
+            removed = [path for path in old_files if path not in changed and not os.path.isfile(path)]
+            report.files_removed = len(removed)
+
+            if not changed and not removed:
+                report.chunks_total = sum(entry["chunks"] for entry in old_files.values())
+                report.elapsed = time.perf_counter() - started
+                return report
+            if rebuild or not manifest["generation"]:
+                report.rebuilt = bool(manifest["generation"])
+                manifest = self._rewrite(directory, manifest, changed, removed, not rebuild, report, progress)
+            else:
+                manifest = self._update(directory, manifest, changed, removed, report, progress)
+            _atomic_write_json(os.path.join(directory, MANIFEST_FILE), manifest)
+            self._remove_stale_generations(directory, manifest["generation"])
+            report.chunks_total = sum(entry["chunks"] for entry in manifest["files"].values())
+        report.elapsed = time.perf_counter() - started
+        logger.info(f"知识库导入完成: {json.dumps(report.to_dict(), ensure_ascii=False)}")
+        return report
+
+    def _discover(self, paths: List[str]) -> List[str]:
+        extensions = tuple(KNOWLEDGE_CONFIG["extensions"])
+        files = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isfile(path):
+                files.append(path)
+            elif os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    files.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                                 if name.lower().endswith(extensions))
+            else:
+                raise ValueError(f"路径不存在: {path}")
+        return list(dict.fromkeys(files))
+
+    def _embed(self, texts: List[str], report: IngestReport, progress: Optional[TextIO]) -> np.ndarray:
+        """嵌入新片段，分批请求以便输出进度"""
+        batch = max(1, KNOWLEDGE_CONFIG["embed_batch_size"]) * 8
+        parts = []
+        for start in range(0, len(texts), batch):
+            parts.append(self.embedder.embed(texts[start:start + batch]))
+            report.chunks_embedded += len(parts[-1])
+            if progress is not None:
+                print(f"已嵌入 {report.chunks_embedded} 个片段", file=progress)
+        return np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _chunk_hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _resolve_vectors(self, items: List[Tuple[List[str], Optional[Dict[str, Any]]]],
+                         old: Optional[_Collection], report: IngestReport,
+                         progress: Optional[TextIO]) -> List[np.ndarray]:
+        """求出每个文件所有片段的向量
+
+        Args:
+            items: 每个文件的 (片段文本, 原来的manifest条目或None)
+            old: 可以沿用向量的原版本，为None时全部重新嵌入
+
+        Returns:
+            与items对应的向量数组列表
+        """
+        hashes = [[self._chunk_hash(text) for text in texts] for texts, _ in items]
+        # 每个文件原有的片段：内容哈希 -> 片段ID
+        previous: List[Dict[str, int]] = []
+        missing: Dict[str, str] = {}
+        for (texts, entry), file_hashes in zip(items, hashes):
+            known: Dict[str, int] = {}
+            if old is not None and entry is not None and entry["chunks"]:
+                ids = list(range(entry["start"], entry["start"] + entry["chunks"]))
+                known = {chunk["hash"]: chunk_id for chunk_id, chunk in zip(ids, old.read_chunks(ids))}
+            previous.append(known)
+            for digest, text in zip(file_hashes, texts):
+                if digest not in known:
+                    missing.setdefault(digest, text)
+        vectors: Dict[str, np.ndarray] = dict(zip(missing, self._embed(list(missing.values()), report, progress)))
+
+        results = []
+        for (texts, _), file_hashes, known in zip(items, hashes, previous):
+            reused = sorted({known[digest] for digest in file_hashes if digest in known})
+            if reused:
+                try:
+                    found = dict(zip(reused, old.index.get(reused)))
+                except KeyError:
+                    # 索引中缺少原有片段（上次导入中断），这些片段重新嵌入
+                    texts_by_hash = dict(zip(file_hashes, texts))
+                    lost = [digest for digest in texts_by_hash if digest in known and digest not in vectors]
+                    vectors.update(zip(lost, self._embed([texts_by_hash[d] for d in lost], report, progress)))
+                    known, found = {}, {}
+                report.chunks_reused += sum(1 for digest in file_hashes if digest in known)
+                rows = [found[known[digest]] if digest in known else vectors[digest] for digest in file_hashes]
+            else:
+                rows = [vectors[digest] for digest in file_hashes]
+            results.append(np.asarray(rows, dtype=np.float32))
+        return results
+
+    def _write_chunks(self, generation: str, manifest: Dict[str, Any],
+                      items: List[Tuple[str, str, List[str]]]) -> List[Tuple[int, int]]:
+        """把片段追加到版本目录的 chunks.jsonl 和 offsets.i64，更新 manifest 中的ID和字节数
+
+        Returns:
+            每个文件的 (起始片段ID, 片段数)
+        """
+        next_id, chunks_bytes = manifest["next_id"], manifest["chunks_bytes"]
+        ranges = []
+        with open(os.path.join(generation, CHUNKS_FILE), "ab") as cf, \
+                open(os.path.join(generation, OFFSETS_FILE), "ab") as of:
+            # 丢弃上次导入中断时写了一半、未被 manifest 提交的内容
+            cf.truncate(chunks_bytes)
+            of.truncate(next_id * 8)
+            offsets = []
+            for path, _, texts in items:
+                ranges.append((next_id + len(offsets), len(texts)))
+                for text in texts:
+                    line = (json.dumps({"source": os.path.basename(path), "hash": self._chunk_hash(text),
+                                        "text": text}, ensure_ascii=False) + "\n").encode("utf-8")
+                    offsets.append(chunks_bytes)
+                    cf.write(line)
+                    chunks_bytes += len(line)
+            of.write(np.asarray(offsets, dtype=np.int64).tobytes())
+            for f in (cf, of):
+                f.flush()
+                os.fsync(f.fileno())
+        manifest["next_id"] = next_id + len(offsets)
+        manifest["chunks_bytes"] = chunks_bytes
+        return ranges
+
+    def _update(self, directory: str, manifest: Dict[str, Any], changed: Dict[str, Tuple[str, List[str]]],
+                removed: List[str], report: IngestReport, progress: Optional[TextIO]) -> Dict[str, Any]:
+        """在当前版本中追加新片段、删除旧片段；已删除的片段过多时写出新版本回收空间"""
+        generation = os.path.join(directory, manifest["generation"])
+        current = _Collection(generation, 0, manifest, readonly=False)
+        index = current.index
+        first_id = manifest["next_id"]
+        # 上次导入中断时可能留下未被 manifest 提交的向量
+        if index.max_key() >= first_id:
+            index.delete(np.arange(first_id, index.max_key() + 1))
+
+        items = [(path, digest, chunks) for path, (digest, chunks) in changed.items()]
+        vectors = self._resolve_vectors([(chunks, manifest["files"].get(path)) for path, _, chunks in items],
+                                        current, report, progress)
+        new_vectors = [v for v in vectors if len(v)]
+        if new_vectors and new_vectors[0].shape[1] != index.dim:
+            raise ValueError(f"嵌入维度与知识库不一致: {new_vectors[0].shape[1]} != {index.dim}")
+        stale = [manifest["files"][path] for path in list(changed) + removed if path in manifest["files"]]
+        ranges = self._write_chunks(generation, manifest, items)
+        if new_vectors:
+            index.add(np.concatenate(new_vectors), np.arange(first_id, manifest["next_id"]))
+        if stale:
+            index.delete(np.concatenate([np.arange(e["start"], e["start"] + e["chunks"]) for e in stale]))
+        for (path, digest, _), (start, count) in zip(items, ranges):
+            manifest["files"][path] = {"hash": digest, "start": start, "chunks": count}
+        for path in removed:
+            del manifest["files"][path]
+
+        live = sum(entry["chunks"] for entry in manifest["files"].values())
+        if manifest["next_id"] - live > VECTOR_INDEX_CONFIG["compact_deleted_fraction"] * manifest["next_id"]:
+            report.rebuilt = True
+            return self._rewrite(directory, manifest, {}, [], True, report, progress)
+        index.optimize()
+        return manifest
+
+    def _rewrite(self, directory: str, manifest: Dict[str, Any], changed: Dict[str, Tuple[str, List[str]]],
+                 removed: List[str], reuse: bool, report: IngestReport,
+                 progress: Optional[TextIO]) -> Dict[str, Any]:
+        """写出新版本目录，片段ID从0重新编号
+
+        未变的文件从原版本复制片段；reuse为True时修改过的文件中内容未变的片段沿用原有向量。
+        """
+        old = None
+        if manifest["generation"] and manifest["next_id"]:
+            old = _Collection(os.path.join(directory, manifest["generation"]), 0, manifest)
+        items = []
+        for path, entry in manifest["files"].items():
+            if path not in changed and path not in removed:
+                ids = list(range(entry["start"], entry["start"] + entry["chunks"]))
+                items.append((path, entry["hash"], [chunk["text"] for chunk in old.read_chunks(ids)]))
+        items.extend((path, digest, chunks) for path, (digest, chunks) in changed.items())
+        vectors = self._resolve_vectors([(texts, manifest["files"].get(path)) for path, _, texts in items],
+                                        old if reuse else None, report, progress)
+        new_vectors = [v for v in vectors if len(v)]
+        dim = int(new_vectors[0].shape[1]) if new_vectors else manifest["dim"]
+
+        number = int(manifest["generation"].rsplit("-", 1)[-1]) if manifest["generation"] else 0
+        generation = f"gen-{number + 1:06d}"
+        target = os.path.join(directory, generation)
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        rewritten = {"embedder": self.embedder.name, "dim": dim, "generation": generation, "next_id": 0,
+                     "chunks_bytes": 0, "files": {}}
+        ranges = self._write_chunks(target, rewritten, items)
+        index = VectorIndex(os.path.join(target, INDEX_DIR), max(dim, 1))
+        if new_vectors:
+            index.add(np.concatenate(new_vectors), np.arange(rewritten["next_id"]))
+            index.optimize()
+        for (path, digest, _), (start, count) in zip(items, ranges):
+            rewritten["files"][path] = {"hash": digest, "start": start, "chunks": count}
+        return rewritten
+
+    @staticmethod
+    def _remove_stale_generations(directory: str, current: str) -> None:
+        """删除已被替换的版本目录（读取方仍打开的内存映射不受影响）"""
+        for name in os.listdir(directory):
+            if name.startswith("gen-") and name != current:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+# 进程级单例，跨会话共享已加载的知识库
+knowledge_base = KnowledgeBase(enabled=KNOWLEDGE_CONFIG["enabled"])
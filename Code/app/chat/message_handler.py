@@ -1,21 +1,78 @@
-import logging
 import re
-from typing import List, Dict, Any, Optional
+import queue
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable
 
-from app.llm.ollama_client import OllamaClient
+from app.llm.ollama_client import OllamaClient, response_stats
+from app.llm.errors import LLMError, CircuitOpenError, LLMTimeoutError, LLMConnectionError, GenerationCancelled
+from app.llm.cancellation import CancelToken
+from app.chat.knowledge import KnowledgeBase, knowledge_base, build_prompt
+from app.chat.user_memory import UserMemory, user_memory, build_memory_prompt
+from app.config import FANOUT_CONFIG, KNOWLEDGE_CONFIG, MEMORY_CONFIG
+from app.models.persona import Persona
+from app.models.reply import Reply
+from app.models.message import Message, to_ollama
+from app.telemetry.tracing import span
+from app.telemetry.metrics import KNOWLEDGE_RETRIEVALS, MEMORY_RECALLS
 
 logger = logging.getLogger("xiaohaochat.message")
 
 class MessageHandler:
     """消息处理类，负责与LLM交互，处理消息内容"""
     
-    def __init__(self, llm_client: OllamaClient):
+    def __init__(self, llm_client: OllamaClient, knowledge: Optional[KnowledgeBase] = None,
+                 memory: Optional[UserMemory] = None):
         """初始化消息处理器
         
         Args:
             llm_client: LLM客户端实例
+            knowledge: 角色知识库，默认使用进程级单例
+            memory: 用户长期记忆，默认使用进程级单例
         """
         self.client = llm_client
+        self.knowledge = knowledge or knowledge_base
+        self.memory = memory or user_memory
+    
+    def _with_knowledge(self, message: str, persona_id: Optional[str]) -> str:
+        """在问题前加上从角色知识库中检索到的资料
+        
+        资料只加在本轮发给模型的用户消息中，不写入聊天历史，之前各轮的prompt前缀保持不变。
+        检索失败时不影响回答，直接使用原问题。
+        """
+        if not persona_id or not self.knowledge.has_documents(persona_id):
+            return message
+        try:
+            with span("message.retrieve", persona_id=persona_id) as s:
+                passages = self.knowledge.search(persona_id, message)
+                s.set("passages", len(passages))
+        except Exception as e:
+            KNOWLEDGE_RETRIEVALS.labels(outcome="error").inc()
+            logger.warning(f"知识库检索失败，不使用参考资料: {persona_id}: {e}")
+            return message
+        KNOWLEDGE_RETRIEVALS.labels(outcome="hit" if passages else "miss").inc()
+        if passages:
+            logger.info(f"检索到 {len(passages)} 段参考资料: {', '.join(p.source for p in passages)}")
+        return build_prompt(message, passages, KNOWLEDGE_CONFIG["max_context_chars"])
+    
+    def _with_memory(self, system_prompt: str, message: str, user_id: Optional[str]) -> str:
+        """在系统提示词后加上从用户之前的对话中记住的相关事实
+        
+        检索失败时不影响回答，直接使用原系统提示词。
+        """
+        if not user_id:
+            return system_prompt
+        try:
+            with span("message.recall", user_id=user_id) as s:
+                facts = self.memory.recall(user_id, message)
+                s.set("facts", len(facts))
+        except Exception as e:
+            MEMORY_RECALLS.labels(outcome="error").inc()
+            logger.warning(f"长期记忆检索失败，不使用记忆: {user_id}: {e}")
+            return system_prompt
+        MEMORY_RECALLS.labels(outcome="hit" if facts else "miss").inc()
+        return build_memory_prompt(system_prompt, facts, MEMORY_CONFIG["max_tokens"])
     
     def _format_thinking(self, response: str) -> str:
         """格式化思考内容，将<think>标签转换为Markdown引用块
@@ -58,8 +115,31 @@ class MessageHandler:
         clean_response = re.sub(pattern, '', response, flags=re.DOTALL)
         return clean_response.strip()
     
-    def get_response(self, message: str, history: List[Dict[str, str]], 
-                    system_prompt: str, deep_thinking_mode: bool = False) -> str:
+    def format_partial(self, response: str, deep_thinking_mode: bool) -> str:
+        """格式化尚未生成完的回复（流式显示或生成被停止时）
+        
+        未闭合的<think>标签在深度思考模式下补全后按思考内容显示，普通模式下连同之后的内容一起移除
+        
+        Args:
+            response: 已生成的原始文本
+            deep_thinking_mode: 是否启用深度思考模式
+            
+        Returns:
+            格式化后的文本
+        """
+        open_at = response.rfind('<think>')
+        if open_at != -1 and response.find('</think>', open_at) == -1:
+            response = response + '</think>' if deep_thinking_mode else response[:open_at]
+        if deep_thinking_mode:
+            return self._format_thinking(response)
+        return self._remove_thinking(response)
+    
+    def get_response(self, message: str, history: List[Message], 
+                    system_prompt: str, deep_thinking_mode: bool = False,
+                    on_delta: Optional[Callable[[str], None]] = None,
+                    cancel: Optional[CancelToken] = None,
+                    persona_id: Optional[str] = None,
+                    user_id: Optional[str] = None) -> Reply:
         """处理用户消息，获取AI回复
         
         Args:
@@ -67,52 +147,135 @@ class MessageHandler:
             history: 聊天历史记录
             system_prompt: 系统提示词
             deep_thinking_mode: 是否启用深度思考模式
+            on_delta: 流式回调，提供时以流式方式请求模型，每收到一段原始文本（含<think>标签）即调用一次
+            cancel: 取消令牌，被取消时关闭与模型的连接
+            persona_id: 角色ID，该角色有知识库时检索相关资料加入本轮的问题
+            user_id: 用户ID，给出时从该用户之前的对话中记住的事实里检索相关的加入系统提示词
             
         Returns:
-            AI的回复内容
+            Reply对象，失败时reply.ok为False且content为空，调用方不应将其保存为助手消息；
+            生成被取消时reply.truncated为True，content为已生成部分（没有任何内容时按失败返回）
         """
         try:
             logger.info(f"处理消息: 深度思考={deep_thinking_mode}")
             
-            # 准备发送给API的消息，首先添加系统提示词
-            current_prompt = system_prompt
-            
-            # 如果启用深度思考模式，添加思考指令到系统提示词
-            if deep_thinking_mode:
-                current_prompt += "\n\n当你需要思考复杂问题时，请使用<think>标签包围你的思考过程，如：<think>这里是我的分析...</think>，然后再给出你的回答。"
-            
-            messages_for_api = [
-                {"role": "system", "content": current_prompt}
-            ]
-            
-            # 添加历史消息
-            messages_for_api.extend(history)
-            
-            # 添加当前用户消息
-            messages_for_api.append({"role": "user", "content": message})
+            with span("message.prompt_assemble", history=len(history)):
+                # 准备发送给API的消息，首先添加系统提示词（附带记住的关于用户的事实）
+                current_prompt = self._with_memory(system_prompt, message, user_id)
+                
+                # 如果启用深度思考模式，添加思考指令到系统提示词
+                if deep_thinking_mode:
+                    current_prompt += "\n\n当你需要思考复杂问题时，请使用<think>标签包围你的思考过程，如：<think>这里是我的分析...</think>，然后再给出你的回答。"
+                
+                messages_for_api = [
+                    {"role": "system", "content": current_prompt}
+                ]
+                
+                # 添加历史消息
+                messages_for_api.extend(to_ollama(history))
+                
+                # 添加当前用户消息（附带检索到的参考资料）
+                messages_for_api.append({"role": "user", "content": self._with_knowledge(message, persona_id)})
             
             # 发送到Ollama API
-            response = self.client.chat(messages_for_api, deep_thinking_mode)
+            response = self.client.chat(messages_for_api, deep_thinking_mode, on_delta=on_delta, cancel=cancel)
+        except GenerationCancelled as e:
+            logger.info(f"生成已停止({e.reason})，已生成 {e.tokens} 个token")
+            content = self.format_partial(e.partial, deep_thinking_mode)
+            if not content:
+                return Reply.failure("已停止生成。", e.kind)
+            return Reply(content=content, truncated=True)
+        except CircuitOpenError as e:
+            logger.error(f"获取AI回复失败: {str(e)}")
+            return Reply.failure(f"模型服务暂时不可用，请约 {int(e.retry_after) + 1} 秒后再试。", e.kind)
+        except LLMTimeoutError as e:
+            logger.error(f"获取AI回复失败: {str(e)}")
+            return Reply.failure("模型响应超时，请稍后再试。", e.kind)
+        except LLMConnectionError as e:
+            logger.error(f"获取AI回复失败: {str(e)}")
+            return Reply.failure("无法连接到模型服务，请稍后再试。", e.kind)
+        except LLMError as e:
+            logger.error(f"获取AI回复失败: {str(e)}")
+            return Reply.failure(f"模型服务出错: {str(e)}", e.kind)
+        
+        # 提取回复内容
+        if response and 'message' in response and 'content' in response['message']:
+            ai_response = response['message']['content']
+            logger.info("成功获取AI回复")
             
-            # 提取回复内容
-            if response and 'message' in response and 'content' in response['message']:
-                ai_response = response['message']['content']
-                logger.info("成功获取AI回复")
-                
-                # 处理回复内容
+            # 处理回复内容
+            with span("message.format_thinking", deep_thinking=deep_thinking_mode, length=len(ai_response)):
                 if deep_thinking_mode:
                     # 如果启用深度思考模式，将<think>标签转换为Markdown引用块
-                    return self._format_thinking(ai_response)
+                    content = self._format_thinking(ai_response)
                 else:
                     # 如果未启用深度思考模式，移除<think>标签及其内容
-                    return self._remove_thinking(ai_response)
-            else:
-                logger.error("AI回复格式错误")
-                return "抱歉，我无法生成回复。请稍后再试。"
-                
-        except Exception as e:
-            logger.error(f"获取AI回复失败: {str(e)}")
-            return f"抱歉，发生了错误: {str(e)}" 
+                    content = self._remove_thinking(ai_response)
+            return Reply(content=content, stats=response_stats(response))
+        else:
+            logger.error("AI回复格式错误")
+            return Reply.failure("抱歉，我无法生成回复。请稍后再试。", "malformed_response")
+    
+    def fan_out(self, message: str, history: List[Message], personas: List[Persona],
+                deep_thinking_mode: bool = False,
+                on_delta: Optional[Callable[[str, str], None]] = None,
+                cancel: Optional[CancelToken] = None,
+                max_parallel: Optional[int] = None,
+                user_id: Optional[str] = None) -> Dict[str, Reply]:
+        """把同一条消息同时发给多个角色，总耗时约为最慢的一个而不是各自耗时之和
+        
+        每个角色在工作线程中通过同一个LLM客户端请求回复，同时进行的请求数不超过max_parallel。
+        工作线程收到的片段放入队列，由调用线程取出后调用on_delta，因此on_delta与get_response
+        中一样在调用线程上执行（Streamlit只允许在脚本线程中更新页面）。
+        
+        Args:
+            message: 用户输入的消息
+            history: 聊天历史记录（各角色共享）
+            personas: 回答该消息的角色
+            deep_thinking_mode: 是否启用深度思考模式
+            on_delta: 流式回调，参数为角色ID和原始文本片段
+            cancel: 取消令牌，所有角色共享，被取消时全部停止
+            max_parallel: 同时进行的请求数，默认取 FANOUT_CONFIG["max_parallel"]
+            user_id: 用户ID，记住的事实只检索一次，加入每个角色的系统提示词
+            
+        Returns:
+            角色ID -> Reply，顺序与personas相同
+        """
+        personas = list({persona.id: persona for persona in personas}.values())
+        events: "queue.Queue" = queue.Queue()
+        memory_prompt = self._with_memory("", message, user_id)
+        
+        def run(persona: Persona) -> Reply:
+            try:
+                return self.get_response(
+                    message, history, persona.system_prompt + memory_prompt, deep_thinking_mode,
+                    on_delta=(lambda text: events.put((persona.id, text))) if on_delta else None,
+                    cancel=cancel,
+                    persona_id=persona.id
+                )
+            finally:
+                events.put((persona.id, None))
+        
+        workers = max(1, min(len(personas), max_parallel or FANOUT_CONFIG["max_parallel"]))
+        with span("message.fan_out", personas=len(personas), parallel=workers), \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fan-out") as executor:
+            # 每个任务沿用调用方的追踪上下文，各角色的span归入同一轮对话
+            futures = {persona.id: executor.submit(contextvars.copy_context().run, run, persona)
+                       for persona in personas}
+            remaining = len(futures)
+            try:
+                while remaining:
+                    persona_id, text = events.get()
+                    if text is None:
+                        remaining -= 1
+                    elif on_delta is not None:
+                        on_delta(persona_id, text)
+            except BaseException:
+                # 回调出错时停止其余角色的生成，不等它们生成完
+                if cancel is not None:
+                    cancel.cancel("error")
+                raise
+        return {persona_id: future.result() for persona_id, future in futures.items()}
     
     # 保留旧方法以兼容可能的调用
     def process_message(self, message: str, history: List[Dict[str, str]], 
@@ -126,6 +289,7 @@ class MessageHandler:
             deep_thinking: 是否启用深度思考模式
             
         Returns:
-            AI的回复内容
+            AI的回复内容，失败时为错误描述
         """
-        return self.get_response(message, history, persona.system_prompt, deep_thinking) 
\ No newline at end of file
+        reply = self.get_response(message, history, persona.system_prompt, deep_thinking, persona_id=persona.id)
+        return reply.content if reply.ok else reply.error 
\ No newline at end of file
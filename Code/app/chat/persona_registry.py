@@ -0,0 +1,103 @@
+import re
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+from app.config import PERSONAS_DATA, get_default_personas
+from app.models.persona import Persona
+from app.storage.file_storage import FileStorage
+from app.storage.shared_state import SharedState, shared_state
+
+logger = logging.getLogger("xiaohaochat.chat.personas")
+
+PERSONA_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class PersonaRegistry:
+    """角色注册表：内置角色加上保存在 data/personas 中的自定义角色
+
+    角色文件由所有进程共用，共享状态中的版本号在每次保存或删除角色后递增。各进程缓存角色列表，
+    版本号变化时才重新读取目录，在一个工作进程（或API服务）中创建的角色随即出现在所有进程的会话中。
+    """
+
+    NAMESPACE = "personas"
+
+    def __init__(self, storage: FileStorage, state: Optional[SharedState] = None):
+        """初始化角色注册表
+
+        Args:
+            storage: 存储实例
+            state: 共享状态，默认使用进程级单例
+        """
+        self.storage = storage
+        self.state = state or shared_state
+        self._cache: Optional[Tuple[int, List[Persona]]] = None
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        """角色列表的版本号，任何进程保存或删除角色后变化"""
+        return self.state.get(self.NAMESPACE, "version", 0)
+
+    def all(self) -> List[Persona]:
+        """所有角色，内置角色在前；返回新列表，角色对象只读共享"""
+        version = self.version()
+        cache = self._cache
+        if cache is None or cache[0] != version:
+            with self._lock:
+                personas = list(get_default_personas())
+                custom = self.storage.load_all_personas()
+                personas.extend(persona for persona_id, persona in sorted(custom.items())
+                                if persona_id not in PERSONAS_DATA)
+                cache = self._cache = (version, personas)
+        return list(cache[1])
+
+    def get(self, persona_id: str) -> Optional[Persona]:
+        """按ID查找角色，内置角色优先"""
+        if persona_id not in PERSONAS_DATA and not PERSONA_ID_PATTERN.match(persona_id):
+            return None
+        return self.storage.resolve_persona(persona_id)
+
+    def save(self, persona: Persona) -> bool:
+        """保存自定义角色并通知其他进程
+
+        Returns:
+            保存成功返回True；角色ID无效或与内置角色相同时返回False
+        """
+        if persona.persona_id in PERSONAS_DATA or not PERSONA_ID_PATTERN.match(persona.persona_id):
+            logger.error(f"保存角色失败: 无效的角色ID {persona.persona_id}")
+            return False
+        if not self.storage.save_persona(persona):
+            return False
+        self.state.incr(self.NAMESPACE, "version")
+        return True
+
+    def create(self, persona: Persona) -> bool:
+        """创建新的自定义角色并通知其他进程，不覆盖已有的角色
+
+        Returns:
+            创建成功返回True；角色ID无效、与内置角色相同、已存在或保存失败时返回False
+        """
+        if persona.persona_id in PERSONAS_DATA or not PERSONA_ID_PATTERN.match(persona.persona_id):
+            logger.error(f"创建角色失败: 无效的角色ID {persona.persona_id}")
+            return False
+        if not self.storage.create_persona(persona):
+            return False
+        self.state.incr(self.NAMESPACE, "version")
+        return True
+
+    def delete(self, persona_id: str) -> bool:
+        """删除自定义角色并通知其他进程
+
+        Returns:
+            删除成功返回True，角色不存在返回False
+        """
+        if persona_id in PERSONAS_DATA or not PERSONA_ID_PATTERN.match(persona_id):
+            return False
+        if not self.storage.delete_persona(persona_id):
+            return False
+        self.state.incr(self.NAMESPACE, "version")
+        return True
+
+
+# 进程级单例
+persona_registry = PersonaRegistry(FileStorage())
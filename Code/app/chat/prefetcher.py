@@ -0,0 +1,89 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Set, Tuple
+
+from app.config import CHAT_CACHE_CONFIG
+from app.storage.file_storage import FileStorage
+from app.storage.chat_cache import chat_cache
+
+logger = logging.getLogger("xiaohaochat.chat.prefetch")
+
+class ChatPrefetcher:
+    """聊天记录预取器，在后台线程池中将最近的聊天加载到缓存中
+
+    每个用户同一时间只有一批预取任务，新的一批会取消旧的一批中尚未完成的任务。
+    """
+
+    def __init__(self, storage: FileStorage, max_workers: int, max_cache_bytes: int):
+        """初始化预取器
+
+        Args:
+            storage: 存储实例
+            max_workers: 预取线程数
+            max_cache_bytes: 缓存占用超过该值后不再预取
+        """
+        self.storage = storage
+        self.max_cache_bytes = max_cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-prefetch")
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self._pending: Dict[str, List[Tuple[str, Future]]] = {}
+        self._in_flight: Set[str] = set()
+
+    def prefetch(self, owner: str, chat_ids: List[str]) -> None:
+        """为指定用户预取一批聊天记录
+
+        Args:
+            owner: 预取任务的归属（用户ID），用于取消
+            chat_ids: 按优先级排列的聊天ID列表
+        """
+        with self._lock:
+            self._cancel_locked(owner)
+            generation = self._generations.get(owner, 0)
+            futures = []
+            for chat_id in chat_ids:
+                if chat_id in self._in_flight:
+                    continue
+                self._in_flight.add(chat_id)
+                futures.append((chat_id, self._executor.submit(self._load, owner, generation, chat_id)))
+            self._pending[owner] = futures
+
+    def cancel(self, owner: str) -> None:
+        """取消指定用户尚未完成的预取任务
+
+        Args:
+            owner: 预取任务的归属（用户ID）
+        """
+        with self._lock:
+            self._cancel_locked(owner)
+
+    def _cancel_locked(self, owner: str) -> None:
+        # 递增代数，已开始的任务会在检查点放弃；未开始的任务直接取消
+        self._generations[owner] = self._generations.get(owner, 0) + 1
+        for chat_id, future in self._pending.pop(owner, []):
+            if future.cancel():
+                self._in_flight.discard(chat_id)
+
+    def _load(self, owner: str, generation: int, chat_id: str) -> None:
+        try:
+            if self._generations.get(owner) != generation:
+                return
+            if chat_cache.size_bytes >= self.max_cache_bytes:
+                return
+            if self.storage.is_chat_cached(chat_id, user_id=owner):
+                return
+            self.storage.load_chat(chat_id, user_id=owner)
+        except Exception as e:
+            logger.warning(f"预取聊天失败: {chat_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(chat_id)
+
+
+# 进程级单例，跨Streamlit重新运行和会话共享线程池
+chat_prefetcher = ChatPrefetcher(
+    FileStorage(),
+    max_workers=CHAT_CACHE_CONFIG["prefetch_workers"],
+    max_cache_bytes=CHAT_CACHE_CONFIG["prefetch_max_bytes"]
+)
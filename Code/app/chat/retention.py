@@ -0,0 +1,207 @@
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Tuple
+
+from app.config import RETENTION_CONFIG
+from app.models.chat import Chat
+from app.storage.archive_store import ArchiveStore, archive_store
+from app.storage.file_storage import FileStorage
+from app.storage.shared_state import SharedState, shared_state, process_id
+from app.storage.write_behind import WriteBehindQueue, chat_write_queue
+from app.telemetry.metrics import REGISTRY, CHATS_ARCHIVED
+from app.telemetry.tracing import request_context
+
+logger = logging.getLogger("xiaohaochat.chat.retention")
+
+
+@dataclass
+class RetentionReport:
+    """一次保留策略运行的统计"""
+
+    scanned: int = 0  # 热存储中的聊天文件数
+    eligible: int = 0  # 超过保留期的聊天数
+    archived: int = 0
+    skipped: int = 0  # 读取后又被修改或仍有待写入快照而跳过的聊天数
+    bytes_read: int = 0
+    bytes_written: int = 0  # 写入归档包的字节数（压缩后）
+    elapsed: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "scanned": self.scanned,
+            "eligible": self.eligible,
+            "archived": self.archived,
+            "skipped": self.skipped,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "elapsed_s": round(self.elapsed, 2),
+        }
+
+
+class RetentionEngine:
+    """聊天保留策略
+
+    定期扫描热存储，把超过保留期未修改的聊天（以文件修改时间判断，不需要解析文件）
+    按用户写入压缩归档包，再从热存储删除，使侧边栏列表等目录扫描只面对活跃的聊天。
+    读取速率受限，后台运行时不会占满磁盘带宽。多进程部署时后台运行由共享状态中的租约协调，
+    同一时刻只有一个进程执行扫描；持有租约的进程退出后由其他进程接替。
+    """
+
+    LEASE = "retention"
+
+    def __init__(self, storage: FileStorage, archive: Optional[ArchiveStore] = None,
+                 write_queue: Optional[WriteBehindQueue] = None,
+                 archive_after_days: float = RETENTION_CONFIG["archive_after_days"],
+                 max_bytes_per_second: float = RETENTION_CONFIG["max_bytes_per_second"],
+                 bundle_max_chats: int = RETENTION_CONFIG["bundle_max_chats"],
+                 max_buffered_chats: int = RETENTION_CONFIG["max_buffered_chats"],
+                 state: Optional[SharedState] = None):
+        """初始化保留策略
+
+        Args:
+            storage: 存储实例
+            archive: 归档存储
+            write_queue: 后台写入队列，仍有待写入快照的聊天不归档
+            archive_after_days: 未修改超过该天数的聊天被归档
+            max_bytes_per_second: 读取聊天文件的速率上限，0表示不限
+            bundle_max_chats: 每个归档包最多包含的聊天数
+            max_buffered_chats: 所有用户合计在内存中等待写入归档包的聊天数上限
+            state: 共享状态（后台运行的租约），默认使用进程级单例
+        """
+        self.storage = storage
+        self.archive = archive or archive_store
+        self.write_queue = write_queue or chat_write_queue
+        self.archive_after_days = archive_after_days
+        self.max_bytes_per_second = max_bytes_per_second
+        self.bundle_max_chats = max(1, bundle_max_chats)
+        self.max_buffered_chats = max(1, max_buffered_chats)
+        self.state = state or shared_state
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self.last_report: Optional[RetentionReport] = None
+
+    def _owner(self, chat: Chat) -> str:
+        """聊天的归属用户ID；尚未迁移、以用户名标记的旧聊天换成对应的用户ID"""
+        if self.storage.load_user_by_id(chat.user_id) is None:
+            user = self.storage.load_user(chat.user_id)
+            if user is not None:
+                return user.user_id
+        return chat.user_id
+
+    def run_once(self, dry_run: bool = False, archive_after_days: Optional[float] = None) -> RetentionReport:
+        """执行一次归档
+
+        Args:
+            dry_run: 为True时只统计符合条件的聊天，不做任何修改
+            archive_after_days: 覆盖配置的保留天数
+
+        Returns:
+            运行统计
+        """
+        days = self.archive_after_days if archive_after_days is None else archive_after_days
+        cutoff_ns = int((time.time() - days * 86400) * 1e9)
+        report = RetentionReport()
+        started = time.perf_counter()
+        buffered: Dict[str, List[Tuple[Chat, int]]] = {}  # 用户ID -> [(聊天, 读取时的mtime)]
+
+        with self._run_lock, request_context("chat.retention", dry_run=dry_run):
+            for chat_id, mtime_ns, size in self.storage.list_chat_files():
+                if self._stop.is_set():
+                    break
+                report.scanned += 1
+                if mtime_ns >= cutoff_ns:
+                    continue
+                report.eligible += 1
+                if dry_run:
+                    continue
+                self._throttle(report, size, started)
+                chat = self.storage.load_chat(chat_id, cache=False)
+                if chat is None:
+                    continue
+                report.bytes_read += size
+                owner = self._owner(chat)
+                if not owner:
+                    report.skipped += 1
+                    continue
+                chat.user_id = chat.metadata["user_id"] = owner
+                group = buffered.setdefault(owner, [])
+                group.append((chat, mtime_ns))
+                if len(group) >= self.bundle_max_chats:
+                    self._flush(owner, buffered.pop(owner), report)
+                elif sum(len(g) for g in buffered.values()) >= self.max_buffered_chats:
+                    for user_id in list(buffered):
+                        self._flush(user_id, buffered.pop(user_id), report)
+            for user_id in list(buffered):
+                self._flush(user_id, buffered.pop(user_id), report)
+
+        report.elapsed = time.perf_counter() - started
+        self.last_report = report
+        if report.eligible:
+            logger.info(f"保留策略运行完成: {report.to_dict()}")
+        return report
+
+    def _throttle(self, report: RetentionReport, next_size: int, started: float) -> None:
+        """读取速率超过上限时等待"""
+        if self.max_bytes_per_second <= 0:
+            return
+        ahead = (report.bytes_read + next_size) / self.max_bytes_per_second - (time.perf_counter() - started)
+        if ahead > 0:
+            self._stop.wait(ahead)
+
+    def _flush(self, user_id: str, group: List[Tuple[Chat, int]], report: RetentionReport) -> None:
+        """写入一个归档包，再删除读取后未被修改的热存储文件"""
+        try:
+            report.bytes_written += self.archive.archive(user_id, [chat for chat, _ in group])
+        except Exception as e:
+            logger.error(f"写入归档包失败: {user_id}: {str(e)}")
+            report.skipped += len(group)
+            return
+        stale = []
+        for chat, mtime_ns in group:
+            # 读取后又被写入（或仍在写入队列中）的聊天保留在热存储，撤销其归档记录
+            if self.write_queue.get_pending(chat.chat_id) is None and \
+                    self.storage.delete_chat(chat.chat_id, expected_mtime_ns=mtime_ns,
+                                             user_id=chat.user_id):
+                report.archived += 1
+                CHATS_ARCHIVED.inc()
+            else:
+                stale.append(chat.chat_id)
+        if stale:
+            self.archive.remove(user_id, stale)
+            report.skipped += len(stale)
+
+    def start(self, interval: float = RETENTION_CONFIG["interval"],
+              initial_delay: float = RETENTION_CONFIG["initial_delay"]) -> None:
+        """启动后台定期运行（重复调用只启动一次）"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, args=(interval, initial_delay),
+                                        name="chat-retention", daemon=True)
+        self._worker.start()
+
+    def _run(self, interval: float, initial_delay: float) -> None:
+        delay = initial_delay
+        owner = process_id()
+        while not self._stop.wait(delay):
+            delay = interval
+            # 租约在两个周期后过期：持有者每个周期续期，退出后其他进程最迟两个周期后接替
+            if not self.state.acquire_lease(self.LEASE, owner, 2 * interval):
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"保留策略运行失败: {str(e)}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.state.release_lease(self.LEASE, process_id())
+
+
+# 进程级单例
+retention_engine = RetentionEngine(FileStorage())
+REGISTRY.gauge("xiaohao_retention_last_run_archived", "Chats archived by the last retention run").set_function(
+    lambda: retention_engine.last_report.archived if retention_engine.last_report else 0
+)
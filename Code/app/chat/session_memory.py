@@ -0,0 +1,263 @@
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, MutableMapping
+
+from app.config import SESSION_MEMORY_CONFIG
+from app.models.message import Message
+from app.storage.file_storage import FileStorage
+from app.telemetry.metrics import REGISTRY, SESSION_EVICTIONS, SESSION_REHYDRATIONS, register_debug_page
+
+logger = logging.getLogger("xiaohaochat.chat.session_memory")
+
+
+def estimate_history_bytes(messages: List[Any]) -> int:
+    """估算一段聊天历史占用的内存（消息对象和内容字符串，不含共享的角色对象）"""
+    total = sys.getsizeof(messages)
+    for message in messages:
+        total += sys.getsizeof(message) + sys.getsizeof(message.get("content", ""))
+    return total
+
+
+class _SessionEntry:
+    """一个Streamlit会话的内存记录"""
+
+    __slots__ = ("session_id", "username", "user_id", "chat_id", "messages", "messages_id", "bytes",
+                 "last_active", "busy", "evicted_count")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.username: Optional[str] = None
+        self.user_id: Optional[str] = None
+        self.chat_id: Optional[str] = None
+        self.messages: Optional[List[Message]] = None  # 与会话状态中的 messages 是同一个列表
+        self.messages_id: Optional[int] = None  # 该列表的id，移除列表引用后仍可识别
+        self.bytes = 0
+        self.last_active = time.monotonic()
+        self.busy = False  # 脚本正在运行，列表可能正被修改
+        self.evicted_count = 0  # 被裁剪掉、需要从存储重新加载的消息数，0表示完整
+
+
+class SessionMemoryManager:
+    """Streamlit会话的内存预算
+
+    每次脚本运行开始时调用 acquire，结束时调用 release。运行结束时记录会话历史列表和估算的
+    字节数；空闲超过一定时间、超过单会话预算，或所有会话合计超过全局上限（按最近最少使用的
+    顺序）的会话，其 messages 列表被原地裁剪为最后几条，只保留 chat_id。聊天内容已经由
+    ChatManager 保存，下次该会话运行时在 acquire 中从存储重新加载。
+
+    会话状态只在该会话自己的脚本线程中读取；其他线程只原地裁剪记录下的列表，且只在会话
+    没有运行时进行，两者由同一把锁互斥。
+    """
+
+    # 历史已被裁剪、长期未出现的会话最多记录的数量
+    MAX_DORMANT = 10000
+
+    def __init__(self, storage: FileStorage, idle_seconds: float, tail_messages: int,
+                 max_session_bytes: int, max_total_bytes: int, sweep_interval: float,
+                 forget_after: float, enabled: bool = True):
+        """初始化会话内存管理器
+
+        Args:
+            storage: 存储实例，重新加载聊天时使用
+            idle_seconds: 空闲超过该秒数的会话被裁剪
+            tail_messages: 裁剪后保留的消息数
+            max_session_bytes: 单个会话的预算，超过时每次运行结束后即被裁剪
+            max_total_bytes: 所有会话合计的上限
+            sweep_interval: 两次空闲扫描之间的最短间隔（秒）
+            forget_after: 超过该秒数未出现的会话从记录中移除
+            enabled: 为False时不裁剪，只统计
+        """
+        self.storage = storage
+        self.idle_seconds = idle_seconds
+        self.tail_messages = max(0, tail_messages)
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.sweep_interval = sweep_interval
+        self.forget_after = forget_after
+        self.enabled = enabled
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()  # 按最近活跃时间排序
+        # 长期未出现但历史已被裁剪的会话：不再持有列表，只保留重新加载所需的信息
+        self._dormant: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+        self._chat_manager = None
+
+    @property
+    def total_bytes(self) -> int:
+        """所有会话历史的估算字节数"""
+        return self._total_bytes
+
+    @property
+    def session_count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def acquire(self, session_id: str, state: MutableMapping[str, Any]) -> None:
+        """脚本运行开始：标记会话忙碌，被裁剪过的历史从存储重新加载
+
+        Args:
+            session_id: Streamlit会话ID
+            state: 该会话的 st.session_state
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._dormant.pop(session_id, None) or _SessionEntry(session_id)
+                self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            entry.busy = True
+            entry.last_active = time.monotonic()
+            evicted = entry.evicted_count
+        messages = state.get("messages")
+        if evicted and entry.messages_id == id(messages):
+            self._rehydrate(entry, messages, state)
+
+    def release(self, session_id: str, state: MutableMapping[str, Any]) -> None:
+        """脚本运行结束：记录会话当前的历史和占用，并按预算裁剪
+
+        Args:
+            session_id: Streamlit会话ID
+            state: 该会话的 st.session_state
+        """
+        messages = state.get("messages")
+        size = estimate_history_bytes(messages) if isinstance(messages, list) else 0
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            entry.busy = False
+            entry.last_active = time.monotonic()
+            if entry.messages_id != id(messages):
+                # 切换或新建了聊天，旧列表不再属于该会话
+                entry.evicted_count = 0
+            entry.messages = messages if isinstance(messages, list) else None
+            entry.messages_id = id(messages) if entry.messages is not None else None
+            entry.chat_id = state.get("current_chat_id")
+            entry.user_id = state.get("current_user_id")
+            entry.username = state.get("current_user")
+            self._total_bytes += size - entry.bytes
+            entry.bytes = size
+            if self.enabled and size > self.max_session_bytes:
+                self._evict_locked(entry, "budget")
+            self._enforce_ceiling_locked()
+            if entry.last_active - self._last_sweep >= self.sweep_interval:
+                self._sweep_locked(entry.last_active)
+
+    def sweep(self) -> None:
+        """裁剪空闲会话并移除长期未出现的会话"""
+        with self._lock:
+            self._sweep_locked(time.monotonic())
+
+    def _sweep_locked(self, now: float) -> None:
+        self._last_sweep = now
+        for session_id, entry in list(self._sessions.items()):
+            if entry.busy:
+                continue
+            idle = now - entry.last_active
+            if idle >= self.forget_after:
+                # 会话多半已经关闭；若仍存在，其列表由会话状态持有，id不变
+                self._total_bytes -= entry.bytes
+                del self._sessions[session_id]
+                if entry.evicted_count:
+                    entry.messages, entry.bytes = None, 0
+                    self._dormant[session_id] = entry
+                    while len(self._dormant) > self.MAX_DORMANT:
+                        self._dormant.popitem(last=False)
+            elif self.enabled and idle >= self.idle_seconds:
+                self._evict_locked(entry, "idle")
+
+    def _enforce_ceiling_locked(self) -> None:
+        if not self.enabled:
+            return
+        # 从最久未活跃的会话开始裁剪
+        for entry in list(self._sessions.values()):
+            if self._total_bytes <= self.max_total_bytes:
+                return
+            if not entry.busy:
+                self._evict_locked(entry, "ceiling")
+
+    def _evict_locked(self, entry: _SessionEntry, reason: str) -> None:
+        """把会话历史原地裁剪为最后几条；没有已保存聊天的会话不裁剪"""
+        messages = entry.messages
+        if not entry.chat_id or not messages or len(messages) <= self.tail_messages:
+            return
+        dropped = len(messages) - self.tail_messages
+        del messages[:dropped]
+        entry.evicted_count += dropped
+        size = estimate_history_bytes(messages)
+        self._total_bytes += size - entry.bytes
+        entry.bytes = size
+        SESSION_EVICTIONS.labels(reason=reason).inc()
+        logger.info(f"会话历史已裁剪({reason}): {entry.session_id}: 释放 {dropped} 条消息")
+
+    def _rehydrate(self, entry: _SessionEntry, messages: List[Message], state: MutableMapping[str, Any]) -> None:
+        """从存储重新加载被裁剪的会话历史（在该会话的脚本线程中调用）"""
+        if self._chat_manager is None:
+            from app.chat.chat_manager import ChatManager  # 避免循环导入
+            self._chat_manager = ChatManager(self.storage)
+        chat = self._chat_manager.load_chat(entry.user_id, entry.chat_id) if entry.user_id else None
+        with self._lock:
+            if chat is None or len(chat["messages"]) < len(messages):
+                # 聊天已被删除或无法读取：不能继续在只剩最后几条的历史上对话，
+                # 否则下次保存会用残缺的历史覆盖聊天记录
+                SESSION_REHYDRATIONS.labels(outcome="failed").inc()
+                logger.warning(f"重新加载会话历史失败: {entry.session_id}: {entry.chat_id}")
+                state["current_chat_id"] = None
+                state["messages"] = []
+            else:
+                messages[:] = chat["messages"]
+                SESSION_REHYDRATIONS.labels(outcome="ok").inc()
+            entry.evicted_count = 0
+
+    def top_sessions(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """占用内存最多的会话，供运维查看"""
+        now = time.monotonic()
+        with self._lock:
+            entries = sorted(self._sessions.values(), key=lambda e: e.bytes, reverse=True)[:limit]
+            return [{
+                "session_id": entry.session_id,
+                "username": entry.username,
+                "chat_id": entry.chat_id,
+                "messages": len(entry.messages) if entry.messages is not None else 0,
+                "evicted_messages": entry.evicted_count,
+                "bytes": entry.bytes,
+                "idle_s": round(now - entry.last_active, 1),
+                "busy": entry.busy,
+            } for entry in entries]
+
+    def report(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """调试页面内容：?top=N 指定列出的会话数"""
+        try:
+            limit = max(1, int(params.get("top", 20)))
+        except ValueError:
+            limit = 20
+        return {
+            "sessions": self.session_count,
+            "total_bytes": self.total_bytes,
+            "max_total_bytes": self.max_total_bytes,
+            "top": self.top_sessions(limit),
+        }
+
+
+# 进程级单例，跨Streamlit会话共享
+session_memory = SessionMemoryManager(
+    FileStorage(),
+    idle_seconds=SESSION_MEMORY_CONFIG["idle_seconds"],
+    tail_messages=SESSION_MEMORY_CONFIG["tail_messages"],
+    max_session_bytes=SESSION_MEMORY_CONFIG["max_session_bytes"],
+    max_total_bytes=SESSION_MEMORY_CONFIG["max_total_bytes"],
+    sweep_interval=SESSION_MEMORY_CONFIG["sweep_interval"],
+    forget_after=SESSION_MEMORY_CONFIG["forget_after"],
+    enabled=SESSION_MEMORY_CONFIG["enabled"]
+)
+REGISTRY.gauge("xiaohao_session_memory_bytes", "Estimated bytes of chat history held by Streamlit sessions").set_function(
+    lambda: session_memory.total_bytes
+)
+REGISTRY.gauge("xiaohao_sessions_tracked", "Streamlit sessions tracked by the memory manager").set_function(
+    lambda: session_memory.session_count
+)
+register_debug_page("/debug/sessions", session_memory.report)
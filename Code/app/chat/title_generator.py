@@ -0,0 +1,208 @@
+import re
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import TITLE_CONFIG
+from app.llm.errors import LLMError
+from app.llm.ollama_client import OllamaClient
+from app.llm.priority import GenerationGate, generation_gate
+from app.models.message import Message
+from app.storage.file_storage import FileStorage
+from app.telemetry.metrics import REGISTRY, TITLES, TITLE_BATCH_SIZE
+from app.telemetry.tracing import request_context
+
+logger = logging.getLogger("xiaohaochat.chat.titles")
+
+# 模型输出中 "1. 标题" 形式的一行
+_NUMBERED_LINE = re.compile(r"^\s*(\d+)\s*[.、:：)）]\s*(.+?)\s*$")
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+_TITLE_STRIP = "\"'“”‘’《》「」【】[]()（）*#`:：,，.。!！?？ \t"
+
+
+def clean_title(text: str, max_chars: int) -> str:
+    """去掉模型输出中的思考过程、"标题："前缀、引号和首尾标点，并截断到指定长度"""
+    text = _THINK_BLOCK.sub("", text).strip()
+    text = text.splitlines()[0] if text else ""
+    text = re.sub(r"^\s*标题\s*[:：]\s*", "", text).strip(_TITLE_STRIP)
+    return text[:max_chars]
+
+
+def fallback_title(first_message: str, max_chars: int) -> str:
+    """模型不可用时使用第一条用户消息的开头作为标题"""
+    text = " ".join(first_message.split())
+    if len(text) > max_chars:
+        return text[:max_chars - 1] + "…"
+    return text or "无标题对话"
+
+
+def _excerpt(content: str, max_chars: int) -> str:
+    # 回复中的思考过程以引用块保存，标题只看正式回答
+    lines = [line for line in _THINK_BLOCK.sub("", content).splitlines() if not line.startswith(">")]
+    return " ".join(" ".join(lines).split())[:max_chars]
+
+
+class ChatTitler:
+    """后台对话标题生成器
+
+    聊天完成第一轮问答后提交到这里，由单个后台线程在没有交互式生成进行时请求一个小模型
+    生成标题，再通过 ChatManager.update_chat_metadata 写回。队列积压时多个聊天合并为一次
+    请求。模型不可用时使用第一条用户消息的开头作为标题，同样标记为已生成，不再重复请求。
+    """
+
+    def __init__(self, storage: FileStorage, llm_client: Optional[OllamaClient], max_batch: int,
+                 max_pending: int, quiet_period: float, gate: Optional[GenerationGate] = None,
+                 enabled: bool = True):
+        """初始化标题生成器
+
+        Args:
+            storage: 存储实例
+            llm_client: 后台模式的LLM客户端，None时只使用后备标题
+            max_batch: 一次请求最多包含的聊天数
+            max_pending: 等待生成标题的聊天数上限，超出的聊天在下次保存时重新提交
+            quiet_period: 最后一次交互式生成结束后需要等待的秒数
+            gate: 交互式生成的计数门
+            enabled: 为False时不生成标题
+        """
+        self.storage = storage
+        self.llm_client = llm_client
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max_pending
+        self.quiet_period = quiet_period
+        self.gate = gate or generation_gate
+        self.enabled = enabled
+        self._pending: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()  # chat_id -> (问题, 回答)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def backlog(self) -> int:
+        """等待生成标题的聊天数"""
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, chat_id: str, messages: List[Message]) -> bool:
+        """提交一个需要标题的聊天
+
+        Args:
+            chat_id: 聊天ID
+            messages: 聊天消息，使用其中第一轮问答
+
+        Returns:
+            已加入队列返回True
+        """
+        if not self.enabled or self._stop.is_set():
+            return False
+        question = next((m["content"] for m in messages if m.get("role") == "user"), "")
+        answer = next((m["content"] for m in messages if m.get("role") == "assistant"), "")
+        if not question:
+            return False
+        with self._cond:
+            if chat_id not in self._pending and len(self._pending) >= self.max_pending:
+                return False
+            self._pending[chat_id] = (question, answer)
+            self._ensure_worker()
+            self._cond.notify()
+        return True
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="chat-titler", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._pending and not self._stop.is_set():
+                    self._cond.wait()
+            # 等交互式生成空闲后再发请求，用户的回复不会排在标题请求后面
+            if not self.gate.wait_idle(self.quiet_period, self._stop):
+                return
+            with self._cond:
+                batch = []
+                while self._pending and len(batch) < self.max_batch:
+                    batch.append(self._pending.popitem(last=False))
+            if not batch:
+                continue
+            try:
+                with request_context("chat.titles", chats=len(batch)):
+                    self._apply(self._generate(batch))
+            except Exception as e:
+                logger.error(f"生成对话标题失败: {str(e)}")
+
+    def _generate(self, batch: List[Tuple[str, Tuple[str, str]]]) -> Dict[str, Tuple[str, str]]:
+        """为一批聊天生成标题
+
+        Returns:
+            chat_id -> (标题, 来源)，来源为 "model" 或 "fallback"
+        """
+        max_chars = TITLE_CONFIG["max_title_chars"]
+        excerpt_chars = TITLE_CONFIG["excerpt_chars"]
+        titles = {chat_id: (fallback_title(question, max_chars), "fallback") for chat_id, (question, _) in batch}
+        if self.llm_client is None:
+            return titles
+
+        sections = []
+        for number, (_, (question, answer)) in enumerate(batch, 1):
+            sections.append(f"对话{number}:\n用户: {_excerpt(question, excerpt_chars)}\n"
+                            f"助手: {_excerpt(answer, excerpt_chars)}")
+        system_prompt = (f"你负责为对话起标题。下面有{len(batch)}段对话，请为每段对话生成一个不超过{max_chars}个字的简洁中文标题。"
+                         "按编号每行输出一个，格式为“编号. 标题”，不要输出其他内容。")
+        options = dict(TITLE_CONFIG["options"])
+        options["num_predict"] = options.get("num_predict", 32) * len(batch)
+        try:
+            response = self.llm_client.chat(
+                [{"role": "system", "content": system_prompt}, {"role": "user", "content": "\n\n".join(sections)}],
+                options=options
+            )
+        except LLMError as e:
+            logger.warning(f"标题模型不可用，使用后备标题: {str(e)}")
+            return titles
+        TITLE_BATCH_SIZE.observe(len(batch))
+
+        content = _THINK_BLOCK.sub("", response["message"]["content"])
+        lines = [line for line in content.splitlines() if line.strip()]
+        for line in lines:
+            match = _NUMBERED_LINE.match(line)
+            if match and 1 <= int(match.group(1)) <= len(batch):
+                title = clean_title(match.group(2), max_chars)
+                if title:
+                    titles[batch[int(match.group(1)) - 1][0]] = (title, "model")
+        # 单个聊天时模型常常省略编号
+        if len(batch) == 1 and titles[batch[0][0]][1] == "fallback" and lines:
+            title = clean_title(lines[0], max_chars)
+            if title:
+                titles[batch[0][0]] = (title, "model")
+        return titles
+
+    def _apply(self, titles: Dict[str, Tuple[str, str]]) -> None:
+        from app.chat.chat_manager import ChatManager  # 避免循环导入
+        chat_manager = ChatManager(self.storage, titler=self)
+        for chat_id, (title, source) in titles.items():
+            if chat_manager.update_chat_metadata(chat_id, {"title": title, "title_generated": True}, touch=False):
+                TITLES.labels(source=source).inc()
+                logger.info(f"对话标题已生成: {chat_id}: {title}")
+
+    def shutdown(self) -> None:
+        """停止后台线程，尚未处理的聊天在下次保存时重新提交"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+
+# 进程级单例，跨Streamlit重新运行和会话共享后台线程
+chat_titler = ChatTitler(
+    FileStorage(),
+    OllamaClient(model=TITLE_CONFIG["model"], background=True),
+    max_batch=TITLE_CONFIG["max_batch"],
+    max_pending=TITLE_CONFIG["max_pending"],
+    quiet_period=TITLE_CONFIG["idle_quiet_period"],
+    enabled=TITLE_CONFIG["enabled"]
+)
+atexit.register(chat_titler.shutdown)
+REGISTRY.gauge("xiaohao_chat_title_backlog", "Chats waiting for a generated title").set_function(
+    lambda: chat_titler.backlog
+)
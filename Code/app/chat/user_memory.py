@@ -0,0 +1,494 @@
+import os
+import re
+import time
+import json
+import atexit
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+import numpy as np
+
+from app.config import MEMORY_DIR, MEMORY_CONFIG
+from app.llm.errors import LLMError
+from app.llm.embeddings import create_embedder
+from app.llm.ollama_client import OllamaClient
+from app.llm.priority import GenerationGate, generation_gate
+from app.models.message import Message, estimate_tokens
+from app.storage.file_lock import directory_lock
+from app.storage.file_storage import FileStorage, _atomic_write_json
+from app.storage.vector_index import LOCK_FILE as INDEX_LOCK_FILE, VectorIndex
+from app.telemetry.metrics import REGISTRY, MEMORY_FACTS, MEMORY_RECALL_DURATION
+from app.telemetry.tracing import span, request_context
+
+logger = logging.getLogger("xiaohaochat.chat.memory")
+
+_USER_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+# 模型输出中的一条事实："- 事实"、"• 事实" 或 "1. 事实"
+_FACT_LINE = re.compile(r"^\s*(?:[-*•·]|\d+\s*[.、)）])\s*(.+?)\s*$")
+_NO_FACTS = {"无", "没有", "无。", "none", "n/a"}
+
+STATE_FILE = "memory.json"  # 记住的事实、已处理到的消息位置和嵌入模型
+INDEX_DIR = "index"  # 事实的向量，键为事实ID
+LOCK_FILE = "memory.lock"  # 记忆文件和向量索引的读取-修改-写入在它的文件锁下进行
+
+MEMORY_HEADER = "以下是你在之前的对话中了解到的关于用户的信息，与当前对话相关时可以参考，不要逐条复述："
+
+
+def parse_facts(text: str, max_chars: int, limit: int) -> List[str]:
+    """从模型输出中取出事实，每行一条
+
+    Args:
+        text: 模型输出
+        max_chars: 单条事实的长度上限，更长的事实丢弃
+        limit: 最多取出的条数
+
+    Returns:
+        去重后的事实列表
+    """
+    facts = []
+    for line in _THINK_BLOCK.sub("", text).splitlines():
+        match = _FACT_LINE.match(line)
+        fact = (match.group(1) if match else line).strip().strip("\"'“”")
+        if not fact or fact.lower() in _NO_FACTS or len(fact) > max_chars:
+            continue
+        if fact not in facts:
+            facts.append(fact)
+        if len(facts) >= limit:
+            break
+    return facts
+
+
+def build_memory_prompt(system_prompt: str, facts: List[str], max_tokens: int) -> str:
+    """把记住的事实加在系统提示词之后
+
+    Args:
+        system_prompt: 角色的系统提示词
+        facts: 按相关程度排列的事实
+        max_tokens: 事实部分的token预算，超出预算的事实不加入
+
+    Returns:
+        系统提示词；没有可用事实时原样返回
+    """
+    lines = []
+    used = estimate_tokens(MEMORY_HEADER)
+    for fact in facts:
+        tokens = estimate_tokens(fact) + 1
+        if used + tokens > max_tokens:
+            break
+        lines.append(f"- {fact}")
+        used += tokens
+    if not lines:
+        return system_prompt
+    return system_prompt + "\n\n" + MEMORY_HEADER + "\n" + "\n".join(lines)
+
+
+class _UserFacts:
+    """内存中的一个用户的事实：事实ID -> 文本，以及只读打开的向量索引"""
+
+    __slots__ = ("mtime", "embedder", "texts", "index")
+
+    def __init__(self, mtime: int, embedder: str, texts: Dict[int, str], index: Optional[VectorIndex]):
+        self.mtime = mtime
+        self.embedder = embedder
+        self.texts = texts
+        self.index = index
+
+
+class UserMemory:
+    """跨对话的用户长期记忆
+
+    聊天保存后提交到这里；一段时间（settle_seconds）没有再保存的聊天视为已经结束，由单个后台
+    线程在没有交互式生成进行时，把同一用户的几个已结束聊天中新增的用户消息合并为一次请求，
+    让模型提取值得长期记住的关于用户的事实，嵌入后与已有事实去重，保存在 memory/<用户ID>/ 下。
+
+    每轮对话开始时嵌入用户的消息，在该用户的事实中检索最相关的几条，按token预算加入系统提示词。
+    检索只访问内存中的事实和内存映射的向量索引，不读取聊天文件；没有事实的用户不请求嵌入模型。
+
+    多进程部署时每个工作进程（和API服务）都有自己的后台线程，同一用户的记忆文件和向量索引
+    在用户目录的文件锁（flock）下修改，不同进程的提取和删除依次进行。
+    """
+
+    def __init__(self, storage: FileStorage, llm_client: Optional[OllamaClient], root: str = MEMORY_DIR,
+                 embedder=None, gate: Optional[GenerationGate] = None, enabled: bool = True):
+        """初始化长期记忆
+
+        Args:
+            storage: 存储实例，后台线程从中读取已结束的聊天
+            llm_client: 后台模式的LLM客户端，None时不提取事实
+            root: 记忆根目录
+            embedder: 嵌入模型，默认按 KNOWLEDGE_CONFIG["embedder"] 在首次使用时创建
+            gate: 交互式生成的计数门
+            enabled: 为False时不提取也不检索
+        """
+        self.storage = storage
+        self.llm_client = llm_client
+        self.root = root
+        self._embedder = embedder
+        self.gate = gate or generation_gate
+        self.enabled = enabled
+        self.settle_seconds = MEMORY_CONFIG["settle_seconds"]
+        self._pending: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # chat_id -> (用户ID, 提交时间)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._users: "OrderedDict[str, _UserFacts]" = OrderedDict()
+        self._users_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = create_embedder()
+        return self._embedder
+
+    @property
+    def backlog(self) -> int:
+        """等待提取事实的聊天数"""
+        with self._cond:
+            return len(self._pending)
+
+    def _directory(self, user_id: str) -> str:
+        if not _USER_ID.match(user_id or ""):
+            raise ValueError(f"无效的用户ID: {user_id}")
+        return os.path.join(self.root, user_id)
+
+    @contextmanager
+    def _locked(self, user_id: str) -> Iterator[None]:
+        """在进程内的锁和用户目录的文件锁下修改记忆，用户目录不存在时创建"""
+        directory = self._directory(user_id)
+        os.makedirs(directory, exist_ok=True)
+        with directory_lock(directory, LOCK_FILE, self._write_lock):
+            yield
+
+    def _load_state(self, user_id: str) -> Dict[str, Any]:
+        path = os.path.join(self._directory(user_id), STATE_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"embedder": self.embedder.name, "next_id": 0, "facts": [], "chats": {}}
+
+    # 检索
+
+    def _user_facts(self, user_id: str) -> Optional[_UserFacts]:
+        """内存中该用户的事实，记忆文件被后台线程（或其他进程）替换后重新加载；没有事实时返回None"""
+        directory = self._directory(user_id)
+        try:
+            mtime = os.stat(os.path.join(directory, STATE_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        entry = self._users.get(user_id)
+        if entry is not None and entry.mtime == mtime:
+            with self._users_lock:
+                if user_id in self._users:
+                    self._users.move_to_end(user_id)
+            return entry
+        state = self._load_state(user_id)
+        index = None
+        if state["facts"]:
+            index = VectorIndex(os.path.join(directory, INDEX_DIR), readonly=True)
+        entry = _UserFacts(mtime, state["embedder"], {fact["id"]: fact["text"] for fact in state["facts"]}, index)
+        with self._users_lock:
+            self._users[user_id] = entry
+            self._users.move_to_end(user_id)
+            while len(self._users) > MEMORY_CONFIG["max_cached_users"]:
+                self._users.popitem(last=False)
+        return entry
+
+    def recall(self, user_id: str, message: str, top_k: Optional[int] = None) -> List[str]:
+        """检索与本轮消息最相关的事实
+
+        Args:
+            user_id: 用户ID
+            message: 用户本轮的消息
+            top_k: 返回的事实数，默认取配置值
+
+        Returns:
+            按相关程度排列、相似度不低于 min_score 的事实；没有记忆时为空列表
+
+        Raises:
+            LLMError: 消息的嵌入请求失败
+        """
+        if not self.enabled or not user_id:
+            return []
+        entry = self._user_facts(user_id)
+        if entry is None or not entry.texts or entry.index is None:
+            return []
+        if entry.embedder != self.embedder.name:
+            # 更换嵌入模型后，后台线程下次处理该用户时重新嵌入全部事实
+            return []
+        started = time.perf_counter()
+        query = self.embedder.embed([message])[0]
+        with span("memory.search", user_id=user_id, facts=len(entry.texts)):
+            keys, scores = entry.index.search(query, top_k or MEMORY_CONFIG["top_k"])
+            facts = [entry.texts[int(key)] for key, score in zip(keys, scores)
+                     if score >= MEMORY_CONFIG["min_score"] and int(key) in entry.texts]
+        MEMORY_RECALL_DURATION.observe(time.perf_counter() - started)
+        return facts
+
+    # 提取
+
+    def submit(self, user_id: str, chat_id: str) -> bool:
+        """提交一个刚保存过的聊天，聊天在 settle_seconds 内没有再次提交时提取其中的事实
+
+        Args:
+            user_id: 聊天所属的用户ID
+            chat_id: 聊天ID
+
+        Returns:
+            已加入队列返回True
+        """
+        if not self.enabled or self.llm_client is None or self._stop.is_set() or not _USER_ID.match(user_id or ""):
+            return False
+        with self._cond:
+            if chat_id not in self._pending and len(self._pending) >= MEMORY_CONFIG["max_pending"]:
+                return False
+            # 重新计时：只有不再继续的聊天才算结束
+            self._pending[chat_id] = (user_id, time.monotonic())
+            self._pending.move_to_end(chat_id)
+            self._ensure_worker()
+            self._cond.notify()
+        return True
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="user-memory", daemon=True)
+            self._worker.start()
+
+    def _take_batch(self) -> List[Tuple[str, str]]:
+        """等到最早提交的聊天结束，取出同一用户已经结束的聊天
+
+        Returns:
+            [(用户ID, 聊天ID)]，停止时为空列表
+        """
+        with self._cond:
+            while not self._stop.is_set():
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                chat_id, (user_id, submitted) = next(iter(self._pending.items()))
+                remaining = submitted + self.settle_seconds - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                now = time.monotonic()
+                batch = [(user, chat) for chat, (user, at) in self._pending.items()
+                         if user == user_id and at + self.settle_seconds <= now][:MEMORY_CONFIG["max_batch"]]
+                for _, chat in batch:
+                    del self._pending[chat]
+                return batch
+        return []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if not batch:
+                continue
+            # 等交互式生成空闲后再发请求，用户的回复不会排在提取请求后面
+            if not self.gate.wait_idle(MEMORY_CONFIG["idle_quiet_period"], self._stop):
+                return
+            user_id = batch[0][0]
+            try:
+                with request_context("memory.extract", user_id=user_id, chats=len(batch)):
+                    self._process(user_id, [chat_id for _, chat_id in batch])
+            except Exception as e:
+                logger.error(f"提取长期记忆失败: {user_id}: {str(e)}")
+
+    def _excerpt(self, messages: List[Message]) -> str:
+        """聊天中新增的用户消息，超出长度上限时保留最近的部分"""
+        excerpt_chars = MEMORY_CONFIG["excerpt_chars"]
+        lines = [" ".join(m.content.split())[:excerpt_chars] for m in messages if m.get("role") == "user"]
+        kept: List[str] = []
+        size = 0
+        for line in reversed(lines):
+            if kept and size + len(line) > MEMORY_CONFIG["max_excerpt_chars"]:
+                break
+            kept.insert(0, line)
+            size += len(line)
+        return "\n".join(f"用户: {line}" for line in kept)
+
+    def _extract(self, excerpts: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+        """请求模型从几段对话中提取关于用户的事实
+
+        Args:
+            excerpts: [(聊天ID, 对话摘录)]
+
+        Returns:
+            聊天ID -> 事实
+
+        Raises:
+            LLMError: 模型请求失败
+        """
+        sections = [f"对话{number}:\n{excerpt}" for number, (_, excerpt) in enumerate(excerpts, 1)]
+        system_prompt = ("你负责整理关于用户的长期记忆。从下面的对话中找出以后的对话中仍然有用的、关于用户本人的事实，"
+                         "例如身份、职业、所在地、家庭、长期目标、偏好和健康等长期状况；不要记录一次性的问题、寒暄或助手的观点。"
+                         "每条事实写成一句以“用户”开头的简短陈述，按对话编号分组输出，格式为：\n"
+                         "对话1:\n- 事实\n- 事实\n没有值得记住的内容时该对话下输出“无”。")
+        options = dict(MEMORY_CONFIG["options"])
+        options["num_predict"] = options.get("num_predict", 256) * len(excerpts)
+        response = self.llm_client.chat(
+            [{"role": "system", "content": system_prompt}, {"role": "user", "content": "\n\n".join(sections)}],
+            options=options
+        )
+        content = _THINK_BLOCK.sub("", response["message"]["content"])
+        # 按 "对话N:" 分组，单段对话时模型常常省略编号
+        groups: Dict[int, List[str]] = {}
+        current = 1
+        for line in content.splitlines():
+            header = re.match(r"^\s*对话\s*(\d+)\s*[:：]?\s*$", line)
+            if header:
+                current = int(header.group(1))
+                continue
+            groups.setdefault(current, []).append(line)
+        facts = {}
+        for number, (chat_id, _) in enumerate(excerpts, 1):
+            facts[chat_id] = parse_facts("\n".join(groups.get(number, [])), MEMORY_CONFIG["max_fact_chars"],
+                                         MEMORY_CONFIG["max_facts_per_chat"])
+        return facts
+
+    def _process(self, user_id: str, chat_ids: List[str]) -> None:
+        """提取一个用户几个已结束聊天中的事实并保存"""
+        state = self._load_state(user_id)
+        excerpts = []
+        positions = {}
+        for chat_id in chat_ids:
+            chat = self.storage.load_chat(chat_id, cache=False, user_id=user_id)
+            if chat is None or chat.user_id != user_id:
+                continue
+            done = state["chats"].get(chat_id, 0)
+            # 编辑过之前的消息时当前路径可能变短，重新处理整个聊天（重复的事实会被去掉）
+            start = done if done <= len(chat.messages) else 0
+            excerpt = self._excerpt(chat.messages[start:])
+            positions[chat_id] = len(chat.messages)
+            if excerpt:
+                excerpts.append((chat_id, excerpt))
+        if not positions:
+            return
+        extracted: Dict[str, List[str]] = {}
+        if excerpts:
+            try:
+                extracted = self._extract(excerpts)
+            except LLMError as e:
+                # 不记录处理位置，聊天下次保存时重新提交
+                logger.warning(f"记忆提取模型不可用: {str(e)}")
+                return
+        self._remember(user_id, extracted, positions)
+
+    def _remember(self, user_id: str, extracted: Dict[str, List[str]], positions: Dict[str, int]) -> None:
+        """嵌入新事实，去掉与已有事实重复的，超出上限时忘记最早的事实，最后原子替换记忆文件
+
+        Args:
+            user_id: 用户ID
+            extracted: 聊天ID -> 新事实
+            positions: 聊天ID -> 已处理到的消息数
+        """
+        directory = self._directory(user_id)
+        with self._locked(user_id):
+            state = self._load_state(user_id)
+            index_dir = os.path.join(directory, INDEX_DIR)
+            if state["facts"] and state["embedder"] != self.embedder.name:
+                # 更换了嵌入模型，用当前模型重新嵌入全部事实
+                state = self._reembed(directory, state)
+            new = [(chat_id, fact) for chat_id, facts in extracted.items() for fact in facts]
+            known = {fact["text"] for fact in state["facts"]}
+            new = [(chat_id, fact) for chat_id, fact in new if fact not in known]
+            if new:
+                vectors = self.embedder.embed([fact for _, fact in new])
+                index = VectorIndex(index_dir, int(vectors.shape[1]))
+                # 丢弃上次处理中断时写入、但未被记忆文件提交的向量
+                if index.max_key() >= state["next_id"]:
+                    index.delete(np.arange(state["next_id"], index.max_key() + 1))
+                keep = []
+                for row, (chat_id, fact) in enumerate(new):
+                    vector = vectors[row]
+                    _, scores = index.search(vector, 1)
+                    # 同一批中的新事实之间也要去重
+                    if (len(scores) and scores[0] >= MEMORY_CONFIG["duplicate_score"]) or any(
+                            float(vector @ vectors[other]) >= MEMORY_CONFIG["duplicate_score"] for other in keep):
+                        MEMORY_FACTS.labels(outcome="duplicate").inc()
+                        continue
+                    keep.append(row)
+                if keep:
+                    ids = np.arange(state["next_id"], state["next_id"] + len(keep))
+                    index.add(vectors[keep], ids)
+                    created_at = datetime.datetime.now().isoformat()
+                    for fact_id, row in zip(ids.tolist(), keep):
+                        state["facts"].append({"id": fact_id, "text": new[row][1], "chat_id": new[row][0],
+                                               "created_at": created_at})
+                    state["next_id"] += len(keep)
+                    MEMORY_FACTS.labels(outcome="added").inc(len(keep))
+                    logger.info(f"记住了 {len(keep)} 条关于用户 {user_id} 的事实")
+                overflow = len(state["facts"]) - MEMORY_CONFIG["max_facts"]
+                if overflow > 0:
+                    forgotten, state["facts"] = state["facts"][:overflow], state["facts"][overflow:]
+                    index.delete(np.asarray([fact["id"] for fact in forgotten], dtype=np.int64))
+                    MEMORY_FACTS.labels(outcome="forgotten").inc(overflow)
+                index.optimize()
+            state["embedder"] = self.embedder.name
+            state["chats"].update(positions)
+            _atomic_write_json(os.path.join(directory, STATE_FILE), state)
+
+    def _reembed(self, directory: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """用当前嵌入模型重建该用户的向量索引"""
+        vectors = self.embedder.embed([fact["text"] for fact in state["facts"]])
+        index_dir = os.path.join(directory, INDEX_DIR)
+        # 旧索引的维度可能不同，整个替换；记忆文件之后才提交，读取方在此之前不使用索引
+        for name in os.listdir(index_dir) if os.path.isdir(index_dir) else []:
+            if name != INDEX_LOCK_FILE:
+                os.remove(os.path.join(index_dir, name))
+        index = VectorIndex(index_dir, int(vectors.shape[1]))
+        index.add(vectors, np.asarray([fact["id"] for fact in state["facts"]], dtype=np.int64))
+        state["embedder"] = self.embedder.name
+        return state
+
+    def forget_chat(self, user_id: str, chat_id: str) -> int:
+        """忘记从一个聊天中提取的事实（删除聊天时调用）
+
+        Returns:
+            忘记的事实数
+        """
+        with self._cond:
+            self._pending.pop(chat_id, None)
+        if not self.enabled or not _USER_ID.match(user_id or ""):
+            return 0
+        directory = self._directory(user_id)
+        if not os.path.exists(os.path.join(directory, STATE_FILE)):
+            return 0
+        with self._locked(user_id):
+            if not os.path.exists(os.path.join(directory, STATE_FILE)):
+                return 0
+            state = self._load_state(user_id)
+            forgotten = [fact["id"] for fact in state["facts"] if fact["chat_id"] == chat_id]
+            if forgotten:
+                VectorIndex(os.path.join(directory, INDEX_DIR)).delete(np.asarray(forgotten, dtype=np.int64))
+                state["facts"] = [fact for fact in state["facts"] if fact["chat_id"] != chat_id]
+            if forgotten or chat_id in state["chats"]:
+                state["chats"].pop(chat_id, None)
+                _atomic_write_json(os.path.join(directory, STATE_FILE), state)
+        if forgotten:
+            MEMORY_FACTS.labels(outcome="forgotten").inc(len(forgotten))
+            logger.info(f"已忘记聊天 {chat_id} 中的 {len(forgotten)} 条事实")
+        return len(forgotten)
+
+    def shutdown(self) -> None:
+        """停止后台线程，尚未处理的聊天在下次保存时重新提交"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+
+# 进程级单例，跨Streamlit重新运行和会话共享后台线程和已加载的记忆
+user_memory = UserMemory(
+    FileStorage(),
+    OllamaClient(model=MEMORY_CONFIG["model"], background=True),
+    enabled=MEMORY_CONFIG["enabled"]
+)
+atexit.register(user_memory.shutdown)
+REGISTRY.gauge("xiaohao_memory_backlog", "Chats waiting for fact extraction").set_function(
+    lambda: user_memory.backlog
+)
@@ -5,22 +5,236 @@ from typing import Dict, List
 
 # Base paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+# XIAOHAO_DATA_DIR allows running against a separate data directory (load tests, benchmarks)
+DATA_DIR = os.environ.get("XIAOHAO_DATA_DIR", os.path.join(BASE_DIR, "data"))
 
 # Ensure data directories exist
 CHATS_DIR = os.path.join(DATA_DIR, "chats")
 USERS_DIR = os.path.join(DATA_DIR, "users")
 PERSONAS_DIR = os.path.join(DATA_DIR, "personas")
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")  # Cold storage for chats moved out by the retention policy
+KNOWLEDGE_DIR = os.path.join(DATA_DIR, "knowledge")  # Per-persona document collections for retrieval
+MEMORY_DIR = os.path.join(DATA_DIR, "memory")  # Per-user facts remembered across chats
 
-for directory in [CHATS_DIR, USERS_DIR, PERSONAS_DIR]:
+for directory in [CHATS_DIR, USERS_DIR, PERSONAS_DIR, ARCHIVE_DIR, KNOWLEDGE_DIR, MEMORY_DIR]:
     os.makedirs(directory, exist_ok=True)
 
 # Ollama configuration
 OLLAMA_CONFIG = {
     "default_model": "deepseek-r1:7b",
     "available_models": ["deepseek-r1:7b"],  # Can be expanded later
-    "ollama_host": "http://localhost:11434",  # For local development
+    "ollama_host": os.environ.get("XIAOHAO_OLLAMA_HOST", "http://localhost:11434"),  # For local development
     # "ollama_host": "SERVER_URL_PLACEHOLDER",  # For production deployment
+    "connect_timeout": 5.0,  # Seconds to establish the TCP connection
+    "read_timeout": 300.0,  # Seconds to wait for the reply (between chunks when streaming)
+}
+
+# Retry and circuit-breaker policy for LLM calls
+LLM_RESILIENCE_CONFIG = {
+    "max_retries": 2,  # Retries on connection errors only, never on read timeouts
+    "backoff_base": 0.5,  # Seconds, doubled per retry, full jitter
+    "backoff_max": 4.0,
+    "breaker_failure_threshold": 3,  # Consecutive failures before the circuit opens
+    "breaker_reset_timeout": 30.0,  # Seconds before a half-open probe is allowed
+}
+
+# Chat cache and sidebar prefetch configuration
+CHAT_CACHE_CONFIG = {
+    "max_bytes": 64 * 1024 * 1024,  # Memory ceiling of the chat cache (approximated by file size)
+    "prefetch_top_k": 5,  # Most recent chats to prefetch after the sidebar renders
+    "prefetch_workers": 2,
+    "prefetch_max_bytes": 32 * 1024 * 1024,  # Prefetch stops once the cache holds this much
+    "index_max_entries": 200000,  # Sidebar summaries kept in memory; evicted ones are re-parsed on the next listing
+}
+
+# Chat persistence configuration
+PERSISTENCE_CONFIG = {
+    "write_behind": True,  # Persist chats on a background thread instead of the UI thread
+    "max_pending": 256,  # Distinct chats waiting to be written before submitters block
+    "flush_timeout": 10.0,  # Seconds to wait for the backlog to drain at exit
+}
+
+# Latency tracing configuration
+TRACING_CONFIG = {
+    "enabled": True,
+    "export_path": os.path.join(BASE_DIR, "traces.jsonl"),  # JSON-lines span export, None to disable
+    "flush_every": 64,  # Spans buffered before the exporter writes to disk
+}
+
+# Metrics endpoint configuration
+METRICS_CONFIG = {
+    "enabled": True,
+    "host": "127.0.0.1",
+    "port": int(os.environ.get("XIAOHAO_METRICS_PORT", "9108")),  # Prometheus scrape port
+    "active_session_window": 300,  # Seconds a session counts as active after its last interaction
+}
+
+# State shared by all worker processes (sessions, persona versions, rate limits, LLM scheduling)
+SHARED_STATE_CONFIG = {
+    "backend": os.environ.get("XIAOHAO_STATE_BACKEND", "sqlite"),  # "sqlite", or "memory" for single-process tests
+    "path": os.path.join(DATA_DIR, "state.sqlite3"),
+    "busy_timeout": 5.0,  # Seconds to wait for another process holding the write lock
+}
+
+# Multi-process deployment (python run.py serve): N Streamlit workers behind a sticky reverse proxy
+DEPLOY_CONFIG = {
+    "host": "0.0.0.0",  # Proxy listen address
+    "port": 8501,  # Proxy port, the address users open
+    "workers": None,  # Streamlit worker processes, None for one per CPU core
+    "worker_base_port": 8700,  # Worker i listens on 127.0.0.1:(worker_base_port + i); keep clear of API_CONFIG["port"]
+    "worker_metrics_base_port": 9110,  # Worker i exports metrics on worker_metrics_base_port + i
+    "cookie_name": "xiaohao_worker",  # Sticky-session cookie naming the worker a browser is pinned to
+    "connect_timeout": 2.0,  # Seconds to connect to a worker before trying another one
+    "header_timeout": 30.0,  # Seconds a client may take to send request headers
+    "max_header_bytes": 64 * 1024,
+    "startup_timeout": 60.0,  # Seconds to wait for a worker's health check after (re)start
+    "restart_backoff_max": 30.0,  # Upper bound of the delay before restarting a crashed worker
+    "shutdown_timeout": 10.0,  # Seconds workers get to exit after SIGTERM before they are killed
+    "gate_ttl": 900.0,  # Seconds a process's interactive-generation count stays valid without updates
+}
+
+# Credential handling
+AUTH_CONFIG = {
+    "bcrypt_rounds": 12,  # log2 cost factor; older hashes are upgraded on next login
+    "hash_workers": 2,  # Dedicated hashing threads, bounds the CPU logins can take from chat traffic
+    "max_pending_hashes": 16,  # Hashes running or queued before new attempts are shed
+    "verified_ttl": 300.0,  # Seconds a verified username/password pair skips rehashing
+    "username_attempts": 5,  # Burst of login attempts per username
+    "username_refill_per_minute": 5.0,
+    "ip_attempts": 20,  # Burst of login/registration attempts per client address
+    "ip_refill_per_minute": 20.0,
+}
+
+# Login sessions (signed tokens kept in the URL query / API cookie)
+SESSION_CONFIG = {
+    "store_path": os.path.join(DATA_DIR, "sessions.json"),  # Legacy session table, imported into the shared state
+    "secret_path": os.path.join(DATA_DIR, "session.key"),  # HMAC key, generated on first start
+    "idle_timeout": 24 * 3600.0,  # Seconds without activity before a session expires
+    "max_lifetime": 30 * 24 * 3600.0,  # Seconds from login until re-authentication is required
+    "rotate_after": 3600.0,  # Seconds before a token is exchanged for a fresh one
+    "rotation_grace": 120.0,  # Seconds a rotated-out token is still honoured
+    "touch_interval": 60.0,  # Seconds between writes of a session's last activity to the shared state
+    "query_param": "session",
+    "cookie_name": "xiaohao_session",
+}
+
+# Memory budget for Streamlit sessions: idle histories are dropped and reloaded from storage on demand
+SESSION_MEMORY_CONFIG = {
+    "enabled": True,
+    "idle_seconds": 900.0,  # Sessions without interaction for this long keep only a tail of their history
+    "tail_messages": 6,  # Messages kept in memory for an evicted session
+    "max_session_bytes": 16 * 1024 * 1024,  # Sessions above this are trimmed after every interaction
+    "max_total_bytes": 512 * 1024 * 1024,  # Global ceiling, least recently used sessions are trimmed first
+    "sweep_interval": 30.0,  # Seconds between idle sweeps (run opportunistically on interactions)
+    "forget_after": 12 * 3600.0,  # Seconds after which an unseen session is dropped from the registry
+}
+
+# Multi-persona fan-out: one question answered by several personas side by side
+FANOUT_CONFIG = {
+    "max_parallel": 3,  # Persona replies generated at once; keep <= OLLAMA_NUM_PARALLEL on the server
+    "max_personas": 4,  # Personas that can be selected for one question
+}
+
+# Per-persona knowledge bases (python run.py ingest): retrieved passages are added to the user's turn
+KNOWLEDGE_CONFIG = {
+    "enabled": True,
+    "embedder": os.environ.get("XIAOHAO_EMBEDDER", "ollama"),  # "ollama", or "hashing" for the deterministic local fallback
+    "embedding_model": "nomic-embed-text",  # Pulled separately: ollama pull nomic-embed-text
+    "embed_batch_size": 32,  # Texts per embedding request
+    "hashing_dim": 384,  # Vector size of the hashing embedder
+    "extensions": [".txt", ".md", ".markdown"],  # Files picked up when a directory is ingested
+    "chunk_chars": 500,  # Target chunk size in characters
+    "chunk_overlap": 80,  # Characters of trailing context repeated at the start of the next chunk
+    "top_k": 4,  # Passages retrieved per question
+    "min_score": 0.2,  # Cosine similarity below which a passage is not used
+    "max_context_chars": 2000,  # Upper bound on retrieved text added to one prompt
+}
+
+# Memory-mapped vector index (app/storage/vector_index.py) behind the knowledge bases
+VECTOR_INDEX_CONFIG = {
+    "ivf_min_rows": 50000,  # Below this many vectors search is an exact scan, above it an IVF index is trained
+    "nlist": None,  # IVF clusters, None for sqrt(rows)
+    "nprobe": 16,  # Clusters scanned per query; higher means better recall and slower search
+    "train_points_per_list": 40,  # k-means sample size per cluster
+    "kmeans_iterations": 10,
+    "rebuild_tail_fraction": 0.2,  # Re-cluster once vectors appended after training exceed this share
+    "compact_deleted_fraction": 0.25,  # Compact once tombstoned vectors exceed this share
+    "seed": 42,  # k-means initialisation, fixed so rebuilds are reproducible
+}
+
+# HTTP API server configuration (python run.py api)
+API_CONFIG = {
+    "host": "127.0.0.1",
+    "port": int(os.environ.get("XIAOHAO_API_PORT", "8600")),
+    "worker_threads": 32,  # Threads for blocking storage and LLM calls
+    "max_body_bytes": 1024 * 1024,
+    "keepalive_timeout": 15.0,  # Seconds an idle keep-alive connection is held open
+}
+
+# Batch inference configuration (python run.py batch)
+BATCH_CONFIG = {
+    "concurrency": 4,  # Prompts in flight against Ollama at once
+    "progress_every": 10,  # Completed prompts between progress lines
+    "circuit_open_retries": 3,  # Times a prompt waits out an open circuit before it is recorded as failed
+}
+
+# Automatic chat titles, generated on a background worker after the first exchange
+TITLE_CONFIG = {
+    "enabled": True,
+    "model": "qwen2.5:0.5b",  # Small, fast model; chats keep a fallback title if it is unavailable
+    "options": {"temperature": 0.3, "num_predict": 32},  # num_predict is scaled by the batch size
+    "max_batch": 4,  # Pending chats titled together in one request once the queue builds up
+    "max_pending": 256,  # Chats waiting for a title; further ones are resubmitted on their next save
+    "idle_quiet_period": 2.0,  # Seconds without interactive generations before a title request is sent
+    "excerpt_chars": 300,  # Characters of each message shown to the title model
+    "max_title_chars": 20,
+}
+
+# Long-term user memory: facts extracted from finished chats, recalled into later chats
+MEMORY_CONFIG = {
+    "enabled": True,
+    "model": None,  # Extraction model, None for OLLAMA_CONFIG["default_model"]
+    "options": {"temperature": 0.2, "num_predict": 256},
+    "settle_seconds": 300.0,  # A chat counts as finished once it has not been saved for this long
+    "max_batch": 4,  # Finished chats of one user handled together in one extraction request
+    "max_pending": 1024,  # Chats waiting for extraction; further ones are resubmitted on their next save
+    "idle_quiet_period": 2.0,  # Seconds without interactive generations before an extraction request is sent
+    "excerpt_chars": 400,  # Characters of each user message shown to the extraction model
+    "max_excerpt_chars": 4000,  # Characters of one chat shown to the extraction model (the latest messages)
+    "max_fact_chars": 120,
+    "max_facts_per_chat": 8,
+    "max_facts": 500,  # Facts kept per user, the oldest are forgotten first
+    "duplicate_score": 0.9,  # New facts this similar to a remembered one are dropped
+    "top_k": 8,  # Facts considered per turn
+    "min_score": 0.3,
+    "max_tokens": 200,  # Token budget of the recalled facts in the system prompt
+    "max_cached_users": 1000,  # Users whose facts are held in memory for recall
+}
+
+# Chat export/import (python run.py export / import)
+EXPORT_CONFIG = {
+    "progress_every": 1000,  # Exported chats between progress lines
+    "buffer_bytes": 1024 * 1024,  # Write buffer for uncompressed exports
+    "import_batch_size": 200,  # Chats handed to the storage layer per write batch
+}
+
+# Chat retention: chats untouched for a while move to compressed per-user archive bundles
+RETENTION_CONFIG = {
+    "enabled": True,
+    "archive_after_days": 90,  # Chats whose file was not modified for this long are archived
+    "interval": 6 * 3600.0,  # Seconds between background retention runs
+    "initial_delay": 300.0,  # Seconds after start-up before the first run
+    "max_bytes_per_second": 4 * 1024 * 1024,  # Read rate limit so the sweep never saturates the disk
+    "bundle_max_chats": 500,  # Chats per archive bundle
+    "max_buffered_chats": 2000,  # Chats held in memory across users before bundles are flushed
+}
+
+# Sharded chat layout: chats/<user_id>/<hash prefix>/<chat_id>.json (python run.py migrate-chats)
+CHAT_LAYOUT_CONFIG = {
+    "prefix_chars": 2,  # Hex digits of sha1(chat_id) used as fan-out directory (2 -> 256 per user)
+    "max_locations": 200000,  # chat_id -> owner entries remembered for lookups by chat_id only
+    "migrate_files_per_second": 200,  # Default rate of the online migration from the flat layout
+    "progress_every": 1000,  # Migrated files between progress lines
 }
 
 # UI Configuration
@@ -50,20 +264,28 @@ PERSONAS_DATA = {
     }
 }
 
+_default_personas = None
+
 def get_default_personas():
-    """返回默认角色列表，避免循环导入"""
+    """返回默认角色列表，避免循环导入
+    
+    角色对象在进程内只创建一次，各会话得到的是新列表，但共享同一批只读的角色对象。
+    """
+    global _default_personas
     from app.models.persona import Persona
     
-    return [
-        Persona(
-            persona_id=persona_id,
-            name=data["name"],
-            description=data["description"],
-            system_prompt=data["system_prompt"],
-            created_at=datetime.datetime.now().isoformat()
-        )
-        for persona_id, data in PERSONAS_DATA.items()
-    ]
+    if _default_personas is None:
+        _default_personas = [
+            Persona(
+                persona_id=persona_id,
+                name=data["name"],
+                description=data["description"],
+                system_prompt=data["system_prompt"],
+                created_at=datetime.datetime.now().isoformat()
+            )
+            for persona_id, data in PERSONAS_DATA.items()
+        ]
+    return list(_default_personas)
 
 # LLM options
 THINKING_MODE_OPTIONS = {
@@ -0,0 +1,6 @@
+"""多进程部署模块：粘性反向代理与工作进程启动器"""
+
+from app.deploy.proxy import StickyProxy, Upstream
+from app.deploy.launcher import Launcher
+
+__all__ = ["StickyProxy", "Upstream", "Launcher"]
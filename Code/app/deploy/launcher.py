@@ -0,0 +1,207 @@
+"""多进程部署的启动器
+
+启动N个Streamlit工作进程（默认每个CPU核心一个，各自只监听本机端口）和一个粘性反向代理，
+定期检查工作进程的健康状态，退出的工作进程按指数退避重新启动。收到SIGTERM/SIGINT时先让
+工作进程正常退出，超时后强制结束。
+
+工作进程之间共享的状态（登录会话、角色列表版本、登录限流、交互式生成计数、后台任务租约、
+ngrok地址）都在SQLite共享状态中；启用ngrok时由启动器为代理端口建立唯一的隧道。
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import subprocess
+from typing import List, Optional
+
+from app.config import DEPLOY_CONFIG, METRICS_CONFIG
+from app.deploy.proxy import StickyProxy, Upstream
+from app.storage.shared_state import SharedState, shared_state
+from app.telemetry.metrics import REGISTRY, WORKER_RESTARTS, start_http_server
+
+logger = logging.getLogger("xiaohaochat.deploy.launcher")
+
+# ngrok公网地址在共享状态中的位置，所有工作进程显示同一个地址
+NGROK_URL_KEY = ("deploy", "ngrok_url")
+
+HEALTH_CHECK_INTERVAL = 1.0
+
+
+class Worker:
+    """一个Streamlit工作进程"""
+
+    def __init__(self, index: int, port: int, metrics_port: int):
+        self.index = index
+        self.port = port
+        self.metrics_port = metrics_port
+        self.upstream = Upstream(index, "127.0.0.1", port)
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.failures = 0  # 连续启动失败次数，决定退避时间
+        self.restart_at = 0.0
+
+
+class Launcher:
+    """启动并看护工作进程和代理"""
+
+    def __init__(self, script: str, workers: Optional[int] = DEPLOY_CONFIG["workers"],
+                 host: str = DEPLOY_CONFIG["host"], port: int = DEPLOY_CONFIG["port"],
+                 state: Optional[SharedState] = None):
+        """初始化启动器
+
+        Args:
+            script: 工作进程运行的Streamlit脚本（run.py）
+            workers: 工作进程数，None表示每个CPU核心一个
+            host: 代理监听地址
+            port: 代理监听端口
+            state: 共享状态，默认使用进程级单例
+        """
+        self.script = script
+        count = workers or os.cpu_count() or 1
+        self.workers = [Worker(i, DEPLOY_CONFIG["worker_base_port"] + i, DEPLOY_CONFIG["worker_metrics_base_port"] + i)
+                        for i in range(count)]
+        self.proxy = StickyProxy([w.upstream for w in self.workers], host, port)
+        self.state = state or shared_state
+        self._stop: Optional[asyncio.Event] = None
+        REGISTRY.gauge("xiaohao_healthy_workers", "Streamlit workers passing their health check").set_function(
+            lambda: sum(w.upstream.healthy for w in self.workers)
+        )
+
+    def run(self) -> None:
+        """运行到收到SIGTERM/SIGINT为止"""
+        asyncio.run(self._main())
+
+    async def _main(self) -> None:
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stop.set)
+        if METRICS_CONFIG["enabled"]:
+            start_http_server(METRICS_CONFIG["port"], METRICS_CONFIG["host"])
+
+        # 上次运行留下的地址已失效
+        self.state.delete(*NGROK_URL_KEY)
+        for worker in self.workers:
+            self._spawn(worker)
+        await self.proxy.start()
+        print(f"晓昊助手已启动 {len(self.workers)} 个工作进程: http://{self.proxy.host}:{self.proxy.port}")
+        if os.environ.get("USE_NGROK") == "true":
+            await loop.run_in_executor(None, self._start_ngrok)
+
+        try:
+            while not self._stop.is_set():
+                await asyncio.gather(*(self._supervise(worker) for worker in self.workers))
+                try:
+                    await asyncio.wait_for(self._stop.wait(), HEALTH_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            logger.info("正在停止工作进程")
+            await self.proxy.close()
+            await loop.run_in_executor(None, self._shutdown)
+            self.state.delete(*NGROK_URL_KEY)
+
+    def _spawn(self, worker: Worker) -> None:
+        env = dict(os.environ)
+        # 隧道由启动器建立；工作进程必须使用跨进程的共享状态
+        env.pop("USE_NGROK", None)
+        env.update({
+            "STREAMLIT_RUNNING": "true",
+            "XIAOHAO_METRICS_PORT": str(worker.metrics_port),
+            "XIAOHAO_STATE_BACKEND": "sqlite",
+        })
+        worker.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", self.script,
+             "--server.port", str(worker.port), "--server.address", "127.0.0.1", "--server.headless", "true"],
+            env=env
+        )
+        worker.started_at = time.monotonic()
+        worker.upstream.healthy = False
+        logger.info(f"工作进程 {worker.index} 已启动: pid={worker.process.pid} port={worker.port}")
+
+    async def _supervise(self, worker: Worker) -> None:
+        """检查一个工作进程：退出的按退避时间重启，启动超时的结束后重启"""
+        now = time.monotonic()
+        if worker.process is None:
+            if now >= worker.restart_at:
+                WORKER_RESTARTS.labels(worker=str(worker.index)).inc()
+                self._spawn(worker)
+            return
+        if worker.process.poll() is not None:
+            logger.error(f"工作进程 {worker.index} 已退出: code={worker.process.returncode}")
+            self._schedule_restart(worker, now)
+            return
+        healthy = await self._health_check(worker)
+        if healthy:
+            worker.failures = 0
+        elif not worker.upstream.healthy and now - worker.started_at > DEPLOY_CONFIG["startup_timeout"]:
+            logger.error(f"工作进程 {worker.index} 启动超时，重新启动")
+            worker.process.kill()
+            await asyncio.get_running_loop().run_in_executor(None, worker.process.wait)
+            self._schedule_restart(worker, now)
+            return
+        worker.upstream.healthy = healthy
+
+    @staticmethod
+    def _schedule_restart(worker: Worker, now: float) -> None:
+        worker.process = None
+        worker.upstream.healthy = False
+        delay = min(2 ** worker.failures, DEPLOY_CONFIG["restart_backoff_max"])
+        worker.failures += 1
+        worker.restart_at = now + delay
+        logger.info(f"工作进程 {worker.index} 将在 {delay:.0f} 秒后重新启动")
+
+    @staticmethod
+    async def _health_check(worker: Worker) -> bool:
+        """请求Streamlit的 /_stcore/health"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(worker.upstream.host, worker.port), DEPLOY_CONFIG["connect_timeout"]
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        try:
+            writer.write(b"GET /_stcore/health HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+            status = await asyncio.wait_for(reader.readline(), DEPLOY_CONFIG["connect_timeout"])
+            return status.split(b" ")[1:2] == [b"200"]
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            writer.close()
+
+    def _shutdown(self) -> None:
+        """SIGTERM所有工作进程，超过 shutdown_timeout 仍未退出的强制结束"""
+        running: List[subprocess.Popen] = [w.process for w in self.workers
+                                           if w.process is not None and w.process.poll() is None]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + DEPLOY_CONFIG["shutdown_timeout"]
+        for process in running:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"工作进程 {process.pid} 未能按时退出，强制结束")
+                process.kill()
+                process.wait()
+
+    def _start_ngrok(self) -> None:
+        """为代理端口建立ngrok隧道并把地址写入共享状态"""
+        try:
+            from pyngrok import ngrok
+        except ImportError:
+            print("\n\n请先安装pyngrok: pip install pyngrok\n\n")
+            return
+        try:
+            token = os.environ.get("NGROK_TOKEN")
+            if token:
+                ngrok.set_auth_token(token)
+            url = ngrok.connect(self.proxy.port).public_url
+        except Exception as e:
+            logger.error(f"ngrok启动失败: {str(e)}")
+            return
+        self.state.set(*NGROK_URL_KEY, url)
+        print(f"\n\n晓昊助手已通过ngrok部署到: {url}\n\n")
+        logger.info(f"晓昊助手已通过ngrok部署到: {url}")
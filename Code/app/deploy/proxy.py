@@ -0,0 +1,201 @@
+"""多进程部署的粘性反向代理
+
+浏览器连接到代理，代理按Cookie把同一个浏览器始终转发到同一个Streamlit工作进程
+（Streamlit的会话状态保存在工作进程内存中）。没有Cookie或Cookie指向的工作进程不可用时，
+选择连接数最少的健康工作进程，并在第一个响应中设置Cookie。
+
+只解析请求头：请求头改写后原样转发字节，WebSocket（/_stcore/stream）和静态资源请求都适用。
+普通HTTP请求改为 Connection: close，每个连接只承载一个请求，保证每个请求的
+X-Forwarded-For 都由代理写入。
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from http.cookies import SimpleCookie, CookieError
+from typing import List, Optional, Sequence, Tuple
+
+from app.config import DEPLOY_CONFIG
+from app.telemetry.metrics import PROXY_CONNECTIONS
+
+logger = logging.getLogger("xiaohaochat.deploy.proxy")
+
+# 由代理重新生成的请求头
+_REPLACED_HEADERS = {b"x-forwarded-for", b"connection", b"keep-alive"}
+
+_BAD_GATEWAY = (b"HTTP/1.1 502 Bad Gateway\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                b"Content-Length: 29\r\nConnection: close\r\n\r\nNo worker process available.\n")
+_HEADERS_TOO_LARGE = b"HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+@dataclass
+class Upstream:
+    """一个工作进程"""
+
+    index: int
+    host: str
+    port: int
+    healthy: bool = False  # 由启动器的健康检查维护
+    active: int = 0  # 正在转发的连接数
+
+
+def _parse_head(head: bytes) -> Tuple[bytes, List[Tuple[bytes, bytes]]]:
+    """拆分请求头为(请求行, [(名称, 值)])"""
+    lines = head[:-4].split(b"\r\n")
+    headers = []
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+class StickyProxy:
+    """按Cookie粘性转发到工作进程的反向代理"""
+
+    def __init__(self, upstreams: Sequence[Upstream], host: str = DEPLOY_CONFIG["host"],
+                 port: int = DEPLOY_CONFIG["port"], cookie_name: str = DEPLOY_CONFIG["cookie_name"],
+                 connect_timeout: float = DEPLOY_CONFIG["connect_timeout"],
+                 header_timeout: float = DEPLOY_CONFIG["header_timeout"],
+                 max_header_bytes: int = DEPLOY_CONFIG["max_header_bytes"]):
+        """初始化代理
+
+        Args:
+            upstreams: 工作进程列表，下标即Cookie中的编号
+            host: 监听地址
+            port: 监听端口，0表示随机端口
+            cookie_name: 粘性会话Cookie名
+            connect_timeout: 连接工作进程的超时秒数，超时后换一个工作进程
+            header_timeout: 客户端发送请求头的超时秒数
+            max_header_bytes: 请求头的最大字节数
+        """
+        self.upstreams = list(upstreams)
+        self.host = host
+        self.port = port
+        self.cookie_name = cookie_name
+        self.connect_timeout = connect_timeout
+        self.header_timeout = header_timeout
+        self.max_header_bytes = max_header_bytes
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """开始监听；port为0时启动后更新为实际端口"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=self.max_header_bytes)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"代理已启动: http://{self.host}:{self.port}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _sticky_index(self, headers: List[Tuple[bytes, bytes]]) -> Optional[int]:
+        """请求Cookie中的工作进程编号，没有或无效时返回None"""
+        for name, value in headers:
+            if name.lower() != b"cookie":
+                continue
+            cookie = SimpleCookie()
+            try:
+                cookie.load(value.decode("latin-1"))
+            except CookieError:
+                continue
+            morsel = cookie.get(self.cookie_name)
+            if morsel is not None and morsel.value.isdigit() and int(morsel.value) < len(self.upstreams):
+                return int(morsel.value)
+        return None
+
+    def _candidates(self, sticky: Optional[int]) -> List[Upstream]:
+        """按优先顺序排列的健康工作进程：Cookie指定的在前，其余按连接数从少到多"""
+        healthy = sorted((u for u in self.upstreams if u.healthy), key=lambda u: u.active)
+        if sticky is not None and self.upstreams[sticky].healthy:
+            healthy.remove(self.upstreams[sticky])
+            healthy.insert(0, self.upstreams[sticky])
+        return healthy
+
+    async def _connect(self, candidates: List[Upstream]):
+        """依次连接候选工作进程，连接失败的标记为不健康（由健康检查恢复）"""
+        for upstream in candidates:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(upstream.host, upstream.port), self.connect_timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"连接工作进程 {upstream.index} 失败: {str(e)}")
+                upstream.healthy = False
+                continue
+            return upstream, reader, writer
+        return None
+
+    async def _handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        peer = client_writer.get_extra_info("peername")
+        try:
+            head = await asyncio.wait_for(client_reader.readuntil(b"\r\n\r\n"), self.header_timeout)
+        except asyncio.LimitOverrunError:
+            client_writer.write(_HEADERS_TOO_LARGE)
+            await self._close(client_writer)
+            return
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            await self._close(client_writer)
+            return
+
+        request_line, headers = _parse_head(head)
+        sticky = self._sticky_index(headers)
+        connected = await self._connect(self._candidates(sticky))
+        if connected is None:
+            PROXY_CONNECTIONS.labels(worker="none", outcome="unavailable").inc()
+            client_writer.write(_BAD_GATEWAY)
+            await self._close(client_writer)
+            return
+        upstream, upstream_reader, upstream_writer = connected
+        PROXY_CONNECTIONS.labels(worker=str(upstream.index),
+                                 outcome="sticky" if sticky == upstream.index else "assigned").inc()
+
+        upstream_writer.write(self._rewrite_head(request_line, headers, peer[0] if peer else ""))
+        upstream.active += 1
+        # 工作进程关闭连接（响应结束或WebSocket关闭）即结束转发
+        to_upstream = asyncio.ensure_future(self._pipe(client_reader, upstream_writer))
+        try:
+            await self._pipe(upstream_reader, client_writer, None if sticky == upstream.index else upstream.index)
+        finally:
+            to_upstream.cancel()
+            upstream.active -= 1
+            await self._close(upstream_writer)
+            await self._close(client_writer)
+
+    def _rewrite_head(self, request_line: bytes, headers: List[Tuple[bytes, bytes]], client_ip: str) -> bytes:
+        """写入X-Forwarded-For（覆盖客户端自带的值），普通请求改为 Connection: close"""
+        connection = b", ".join(value for name, value in headers if name.lower() == b"connection")
+        upgrade = b"upgrade" in connection.lower() and any(name.lower() == b"upgrade" for name, _ in headers)
+        lines = [request_line]
+        lines.extend(name + b": " + value for name, value in headers if name.lower() not in _REPLACED_HEADERS)
+        lines.append(b"Connection: " + (connection if upgrade else b"close"))
+        lines.append(b"X-Forwarded-For: " + client_ip.encode("latin-1"))
+        return b"\r\n".join(lines) + b"\r\n\r\n"
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                    set_cookie: Optional[int] = None) -> None:
+        """转发字节直到读到EOF；set_cookie不为None时在响应头中加入粘性Cookie"""
+        try:
+            if set_cookie is not None:
+                head = await reader.readuntil(b"\r\n\r\n")
+                status_line, _, rest = head.partition(b"\r\n")
+                cookie = f"Set-Cookie: {self.cookie_name}={set_cookie}; Path=/; HttpOnly; SameSite=Lax\r\n"
+                writer.write(status_line + b"\r\n" + cookie.encode("ascii") + rest)
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            # 一端断开：关闭另一端，结束另一个方向的转发
+            writer.close()
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter) -> None:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
@@ -0,0 +1,132 @@
+"""Cooperative cancellation of in-flight generations."""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from app.telemetry.metrics import REGISTRY
+
+logger = logging.getLogger("xiaohaochat.llm")
+
+
+class CancelToken:
+    """Flag shared between a generation and whoever may want to stop it.
+
+    The streaming loop checks the token after every chunk; once it is set the
+    HTTP stream to Ollama is closed, which makes the server stop generating,
+    and the call returns the partial output via GenerationCancelled. A token
+    cancelled while the prompt is still being evaluated takes effect when the
+    first chunk arrives.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "stopped") -> bool:
+        """Request cancellation; the first reason wins.
+
+        Returns:
+            True if this call cancelled the token, False if it already was
+        """
+        if self._event.is_set():
+            return False
+        self.reason = reason
+        self._event.set()
+        return True
+
+
+class GenerationRegistry:
+    """Process-wide table of running generations, keyed by their owner.
+
+    The owner key is whatever identifies who is waiting for the reply: the
+    Streamlit session ID for the UI, the chat ID for the HTTP API. A watchdog
+    thread polls a liveness check for every owner and cancels generations
+    whose owner has gone away (tab closed, websocket dropped).
+    """
+
+    def __init__(self, watch_interval: float = 2.0):
+        """
+        Args:
+            watch_interval: Seconds between liveness checks of the watchdog
+        """
+        self.watch_interval = watch_interval
+        self._tokens: Dict[str, CancelToken] = {}
+        self._checks: Dict[str, Callable[[], bool]] = {}
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> int:
+        """Number of generations currently registered."""
+        with self._lock:
+            return len(self._tokens)
+
+    def register(self, owner: str, is_alive: Optional[Callable[[], bool]] = None) -> CancelToken:
+        """Start tracking a generation for `owner` and return its token.
+
+        A generation still registered for the same owner is cancelled: its
+        owner has moved on to a new request.
+
+        Args:
+            owner: Key identifying who is waiting for the reply
+            is_alive: Polled by the watchdog; returning False cancels the generation
+                with reason "abandoned"
+        """
+        token = CancelToken()
+        with self._lock:
+            previous = self._tokens.get(owner)
+            self._tokens[owner] = token
+            if is_alive is not None:
+                self._checks[owner] = is_alive
+            else:
+                self._checks.pop(owner, None)
+            if is_alive is not None and self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch, name="generation-watchdog", daemon=True)
+                self._watchdog.start()
+        if previous is not None:
+            previous.cancel("superseded")
+        return token
+
+    def unregister(self, owner: str, token: CancelToken) -> None:
+        """Stop tracking `token`; a newer token registered for the owner is kept."""
+        with self._lock:
+            if self._tokens.get(owner) is token:
+                del self._tokens[owner]
+                self._checks.pop(owner, None)
+
+    def cancel(self, owner: str, reason: str = "stopped") -> bool:
+        """Cancel the generation running for `owner`.
+
+        Returns:
+            True if a running generation was cancelled
+        """
+        with self._lock:
+            token = self._tokens.get(owner)
+        return token is not None and token.cancel(reason)
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.watch_interval)
+            with self._lock:
+                checks = [(owner, check, self._tokens[owner]) for owner, check in self._checks.items()]
+            for owner, check, token in checks:
+                try:
+                    alive = check()
+                except Exception as e:
+                    logger.warning(f"Liveness check for generation owner {owner} failed: {e}")
+                    continue
+                if not alive and token.cancel("abandoned"):
+                    logger.info(f"Cancelled generation abandoned by {owner}")
+
+
+# Process-wide registry shared by the UI and the HTTP API
+generations = GenerationRegistry()
+REGISTRY.gauge("xiaohao_llm_generations_in_flight", "Cancellable generations currently running").set_function(
+    lambda: generations.active
+)
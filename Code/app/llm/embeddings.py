@@ -0,0 +1,91 @@
+"""Text embedders used by the persona knowledge bases."""
+
+import re
+import zlib
+import logging
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import KNOWLEDGE_CONFIG
+from app.llm.ollama_client import OllamaClient
+
+logger = logging.getLogger("xiaohaochat.llm")
+
+# ASCII words and digits are one feature each; any other word character (CJK) is its own token
+_TOKEN = re.compile(r"[0-9a-z]+|[^\W_]")
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise each row in place so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class HashingEmbedder:
+    """Deterministic local embedder based on feature hashing.
+
+    Tokens and adjacent token pairs are hashed into a fixed number of signed
+    buckets. It needs no model server and always yields the same vectors, which
+    makes it the fallback for tests and offline setups; similarity is purely
+    lexical, so retrieval quality is below a real embedding model.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _TOKEN.findall(text.lower())
+        return tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into an (n, dim) float32 array of unit vectors."""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return normalize_rows(vectors)
+
+
+class OllamaEmbedder:
+    """Embeds text through Ollama's /api/embed endpoint."""
+
+    def __init__(self, model: Optional[str] = None, client: Optional[OllamaClient] = None,
+                 batch_size: Optional[int] = None):
+        """
+        Args:
+            model: Embedding model, defaults to KNOWLEDGE_CONFIG["embedding_model"]
+            client: Client to send requests with, created for the model if omitted
+            batch_size: Texts sent per request
+        """
+        self.model = model or KNOWLEDGE_CONFIG["embedding_model"]
+        self.client = client or OllamaClient(model=self.model, background=True)
+        self.batch_size = batch_size or KNOWLEDGE_CONFIG["embed_batch_size"]
+        self.name = f"ollama:{self.model}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into an (n, dim) float32 array of unit vectors.
+
+        Raises:
+            LLMError: The embedding request failed
+        """
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            rows.extend(self.client.embed(texts[start:start + self.batch_size]))
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32)
+        return normalize_rows(np.asarray(rows, dtype=np.float32))
+
+
+def create_embedder(kind: Optional[str] = None):
+    """Create the embedder selected by KNOWLEDGE_CONFIG["embedder"] ("ollama" or "hashing")."""
+    kind = kind or KNOWLEDGE_CONFIG["embedder"]
+    if kind == "hashing":
+        return HashingEmbedder(KNOWLEDGE_CONFIG["hashing_dim"])
+    if kind == "ollama":
+        return OllamaEmbedder()
+    raise ValueError(f"Unknown embedder: {kind}")
@@ -0,0 +1,61 @@
+"""Typed errors raised by the LLM client layer."""
+
+from typing import Optional
+
+
+class LLMError(Exception):
+    """Base class for all failures talking to the LLM backend."""
+
+    #: Short machine-readable error kind, surfaced to callers in replies
+    kind = "llm_error"
+
+    def __init__(self, message: str, cause: Optional[BaseException] = None):
+        super().__init__(message)
+        self.cause = cause
+
+
+class LLMConnectionError(LLMError):
+    """The backend could not be reached (refused, DNS, connect timeout)."""
+
+    kind = "connection_error"
+
+
+class LLMTimeoutError(LLMError):
+    """The backend accepted the request but did not answer in time."""
+
+    kind = "timeout"
+
+
+class LLMResponseError(LLMError):
+    """The backend answered with an error status or a malformed payload."""
+
+    kind = "response_error"
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 cause: Optional[BaseException] = None):
+        super().__init__(message, cause)
+        self.status_code = status_code
+
+
+class CircuitOpenError(LLMError):
+    """The circuit breaker is open, the request was rejected without calling the backend."""
+
+    kind = "circuit_open"
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GenerationCancelled(LLMError):
+    """The generation was cancelled through its CancelToken before it finished."""
+
+    kind = "cancelled"
+
+    def __init__(self, message: str, reason: str, partial: str = "", tokens: int = 0):
+        super().__init__(message)
+        self.reason = reason
+        #: Content generated before the stream was closed
+        self.partial = partial
+        #: Tokens generated for nothing (one per streamed chunk)
+        self.tokens = tokens
@@ -1,49 +1,264 @@
+import time
 import ollama
+import httpx
 import logging
-from typing import Dict, List, Any, Optional
+from contextlib import nullcontext
+from typing import Dict, List, Any, Optional, Callable
 
 from app.config import OLLAMA_CONFIG, THINKING_MODE_OPTIONS
+from app.llm.errors import LLMError, LLMConnectionError, LLMTimeoutError, LLMResponseError, GenerationCancelled
+from app.llm.cancellation import CancelToken
+from app.llm.resilience import get_circuit_breaker, default_retry_policy
+from app.llm.priority import generation_gate
+from app.telemetry.tracing import span, record_span
+from app.telemetry.metrics import (
+    LLM_REQUESTS, LLM_TOKENS, LLM_TOKENS_PER_SECOND, LLM_TIME_TO_FIRST_TOKEN, LLM_REQUEST_DURATION,
+    LLM_CANCELLATIONS, LLM_WASTED_TOKENS
+)
 
 logger = logging.getLogger("xiaohaochat.llm")
 
+# Timing and token counters Ollama attaches to a finished response (durations in ns)
+RESPONSE_STAT_KEYS = (
+    "total_duration", "load_duration",
+    "prompt_eval_count", "prompt_eval_duration",
+    "eval_count", "eval_duration",
+)
+
+
+def response_stats(response: Any) -> Dict[str, int]:
+    """Extract Ollama's timing/token counters from a chat response."""
+    stats = {}
+    for key in RESPONSE_STAT_KEYS:
+        try:
+            value = response.get(key)
+        except AttributeError:
+            value = getattr(response, key, None)
+        if value is not None:
+            stats[key] = int(value)
+    return stats
+
+
 class OllamaClient:
     """Wrapper for the Ollama API client."""
-    
-    def __init__(self):
-        """Initialize the Ollama client."""
-        self.client = ollama.Client(host=OLLAMA_CONFIG["ollama_host"])
-        self.model = OLLAMA_CONFIG["default_model"]
+
+    def __init__(self, model: Optional[str] = None, background: bool = False):
+        """Initialize the Ollama client.
+
+        Args:
+            model: Model to use instead of the configured default
+            background: Calls from a background client are not registered with the
+                generation gate, so background workers waiting on it are not blocked by them
+        """
+        self.host = OLLAMA_CONFIG["ollama_host"]
+        self.client = ollama.Client(
+            host=self.host,
+            timeout=httpx.Timeout(OLLAMA_CONFIG["read_timeout"], connect=OLLAMA_CONFIG["connect_timeout"])
+        )
+        self.model = model or OLLAMA_CONFIG["default_model"]
+        self.background = background
+        self.breaker = get_circuit_breaker(self.host)
+        self.retry_policy = default_retry_policy()
         logger.info(f"Initialized Ollama client with model {self.model}")
-    
-    def chat(self, messages: List[Dict[str, str]], deep_thinking: bool = False) -> Dict[str, Any]:
+
+    def chat(self, messages: List[Dict[str, str]], deep_thinking: bool = False,
+             on_delta: Optional[Callable[[str], None]] = None,
+             options: Optional[Dict[str, Any]] = None,
+             cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
         """
         Send messages to the Ollama chat API.
-        
+
         Args:
             messages: List of message dictionaries with 'role' and 'content' keys
             deep_thinking: Whether to use deep thinking mode parameters
-            
+            on_delta: If given, the reply is streamed and each content fragment is
+                passed to this callback as it arrives (called on the calling thread)
+            options: Model options overriding the thinking-mode presets
+            cancel: If given, the reply is streamed and the stream is closed as soon
+                as the token is cancelled, which stops generation on the server
+
         Returns:
-            Response from the Ollama API
+            Response from the Ollama API; for streamed calls the fragments are
+            joined into a single response carrying the final chunk's counters
+
+        Raises:
+            GenerationCancelled: The token was cancelled; carries the partial output
+            LLMError: A typed subclass describing why the call failed
         """
-        try:
-            # Choose parameters based on thinking mode
+        # Choose parameters based on thinking mode
+        if options is None:
             options = THINKING_MODE_OPTIONS["deep"] if deep_thinking else THINKING_MODE_OPTIONS["normal"]
-            
-            logger.info(f"Sending chat request to Ollama with {len(messages)} messages (deep_thinking={deep_thinking})")
-            
-            response = self.client.chat(
+
+        logger.info(f"Sending chat request to Ollama with {len(messages)} messages (deep_thinking={deep_thinking})")
+
+        with span("llm.chat", model=self.model, messages=len(messages), deep_thinking=deep_thinking,
+                  stream=on_delta is not None or cancel is not None, background=self.background) as s:
+            started = time.perf_counter()
+            first_token = []
+            send = lambda: self._send_chat(messages, options)
+            if on_delta is not None or cancel is not None:
+                send = lambda: self._stream_chat(messages, options, on_delta, first_token, cancel)
+            try:
+                with nullcontext() if self.background else generation_gate.interactive():
+                    response = self._chat_with_policy(send)
+            except LLMError as e:
+                LLM_REQUESTS.labels(outcome=e.kind).inc()
+                if isinstance(e, GenerationCancelled):
+                    LLM_CANCELLATIONS.labels(reason=e.reason).inc()
+                    LLM_WASTED_TOKENS.labels(reason=e.reason).inc(e.tokens)
+                    s.set("cancelled", e.reason)
+                    s.set("wasted_tokens", e.tokens)
+                raise
+            LLM_REQUESTS.labels(outcome="ok").inc()
+            LLM_REQUEST_DURATION.observe(time.perf_counter() - started)
+            stats = response_stats(response)
+            self._observe_stats(stats, first_token[0] - started if first_token else None)
+            for key, value in stats.items():
+                s.set(key, value)
+            # Break the server-side time down into model load, prompt evaluation and generation
+            for key, name in (("load_duration", "ollama.load"),
+                              ("prompt_eval_duration", "ollama.prompt_eval"),
+                              ("eval_duration", "ollama.eval")):
+                if key in stats:
+                    record_span(name, stats[key] / 1e6, model=self.model)
+        return response
+
+    @staticmethod
+    def _observe_stats(stats: Dict[str, int], time_to_first_token: Optional[float] = None) -> None:
+        """Feed Ollama's counters into the metrics registry."""
+        if stats.get("eval_count"):
+            LLM_TOKENS.inc(stats["eval_count"])
+            if stats.get("eval_duration"):
+                LLM_TOKENS_PER_SECOND.observe(stats["eval_count"] / (stats["eval_duration"] / 1e9))
+        if time_to_first_token is not None:
+            LLM_TIME_TO_FIRST_TOKEN.observe(time_to_first_token)
+        # Non-streaming call: the first token follows model load and prompt evaluation
+        elif "prompt_eval_duration" in stats:
+            LLM_TIME_TO_FIRST_TOKEN.observe((stats.get("load_duration", 0) + stats["prompt_eval_duration"]) / 1e9)
+
+    def _chat_with_policy(self, send: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Run a chat or embedding request through the circuit breaker and retry policy."""
+        self.breaker.before_call()
+        try:
+            response = self.retry_policy.call(send, retry_on=(LLMConnectionError,))
+        except GenerationCancelled as e:
+            # Streamed content proves the backend is healthy; otherwise we learned nothing
+            if e.tokens:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_cancelled()
+            logger.info(f"Generation cancelled ({e.reason}) after {e.tokens} tokens")
+            raise
+        except LLMResponseError as e:
+            # 4xx means the request was bad, not that the backend is unhealthy
+            if e.status_code is None or e.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            logger.error(f"Error communicating with Ollama: {str(e)}")
+            raise
+        except LLMError as e:
+            self.breaker.record_failure()
+            logger.error(f"Error communicating with Ollama: {str(e)}")
+            raise
+
+        self.breaker.record_success()
+        logger.info("Successfully received response from Ollama")
+        return response
+
+    def _send_chat(self, messages: List[Dict[str, str]], options: Dict[str, Any]) -> Dict[str, Any]:
+        """Perform a single chat request, translating transport errors to LLMError."""
+        try:
+            return self.client.chat(
                 model=self.model,
                 messages=messages,
                 options=options
             )
-            
-            logger.info("Successfully received response from Ollama")
-            return response
         except Exception as e:
-            logger.error(f"Error communicating with Ollama: {str(e)}")
+            raise self._translate_error(e) from e
+
+    def _stream_chat(self, messages: List[Dict[str, str]], options: Dict[str, Any],
+                     on_delta: Optional[Callable[[str], None]], first_token: List[float],
+                     cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """Perform a single streamed chat request and join the fragments into one response.
+
+        Only connection failures before the first fragment are retried; once content has
+        been handed to on_delta a failure surfaces as a non-retryable response error.
+        The token is checked before the request and after every chunk; closing the
+        stream drops the HTTP connection, which stops generation on the server.
+        """
+        parts = []
+        final: Any = {}
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled("Generation cancelled before it started", cancel.reason)
+        stream = None
+        try:
+            stream = self.client.chat(model=self.model, messages=messages, options=options, stream=True)
+            for chunk in stream:
+                content = chunk["message"]["content"]
+                if content:
+                    if not first_token:
+                        first_token.append(time.perf_counter())
+                    parts.append(content)
+                    if on_delta is not None:
+                        on_delta(content)
+                if chunk.get("done"):
+                    final = chunk
+                elif cancel is not None and cancel.cancelled:
+                    raise GenerationCancelled(f"Generation cancelled ({cancel.reason})", cancel.reason,
+                                              "".join(parts), len(parts))
+        except GenerationCancelled:
             raise
-    
+        except Exception as e:
+            error = self._translate_error(e)
+            if parts and isinstance(error, LLMConnectionError):
+                error = LLMResponseError(f"Ollama stream interrupted: {e}", cause=e)
+            raise error from e
+        finally:
+            if stream is not None:
+                stream.close()
+        response = {"message": {"role": "assistant", "content": "".join(parts)}}
+        response.update(response_stats(final))
+        return response
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts with the client's model through the /api/embed endpoint.
+
+        Args:
+            texts: Texts to embed in one request
+
+        Returns:
+            One embedding per text, in order
+
+        Raises:
+            LLMError: A typed subclass describing why the call failed
+        """
+        def send() -> Dict[str, Any]:
+            try:
+                return {"embeddings": self.client.embed(model=self.model, input=texts)["embeddings"]}
+            except Exception as e:
+                raise self._translate_error(e) from e
+
+        with span("llm.embed", model=self.model, texts=len(texts)):
+            return self._chat_with_policy(send)["embeddings"]
+
+    def _translate_error(self, e: Exception) -> LLMError:
+        """Map an exception raised by the Ollama client to a typed LLMError."""
+        if isinstance(e, LLMError):
+            return e
+        if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return LLMConnectionError(f"Cannot connect to Ollama at {self.host}: {e}", e)
+        if isinstance(e, httpx.TimeoutException):
+            return LLMTimeoutError(f"Ollama did not respond within {OLLAMA_CONFIG['read_timeout']}s", e)
+        if isinstance(e, ollama.ResponseError):
+            return LLMResponseError(f"Ollama returned an error: {e.error}", e.status_code, e)
+        if isinstance(e, ConnectionError):
+            return LLMConnectionError(f"Cannot connect to Ollama at {self.host}: {e}", e)
+        if isinstance(e, httpx.HTTPError):
+            return LLMResponseError(f"Ollama request failed: {e}", cause=e)
+        return LLMError(f"Unexpected error from Ollama client: {e}", e)
+
     def get_available_models(self) -> List[str]:
         """Get list of available models from Ollama."""
         try:
@@ -54,4 +269,4 @@ class OllamaClient:
             return OLLAMA_CONFIG["available_models"]
 
 # Singleton instance
-ollama_client = OllamaClient() 
\ No newline at end of file
+ollama_client = OllamaClient()
@@ -0,0 +1,104 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from app.config import DEPLOY_CONFIG
+from app.storage.shared_state import SharedState, shared_state, process_id
+
+
+class GenerationGate:
+    """Tracks interactive generations so background LLM work can stay out of their way.
+
+    Interactive calls hold the gate while they run. Background workers call
+    wait_idle() before sending a request and only proceed once no interactive
+    generation has been in flight for a quiet period, so a user's reply never
+    queues behind a background job on the Ollama server. With a cross-process
+    shared state each process also publishes its count there, and background
+    workers wait until every worker process is idle.
+    """
+
+    NAMESPACE = "generation_gate"
+
+    def __init__(self, state: Optional[SharedState] = None, ttl: float = 900.0, poll_interval: float = 0.5):
+        """
+        Args:
+            state: Shared state to publish this process's count to; ignored unless it is
+                shared across processes
+            ttl: Seconds a published count stays valid, so a crashed process cannot hold
+                background work back forever
+            poll_interval: Seconds between checks of the other processes' counts
+        """
+        self._active = 0
+        self._last_finished = 0.0
+        self._cond = threading.Condition()
+        self._state = state if state is not None and state.shared else None
+        self._key = process_id()
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    @property
+    def active(self) -> int:
+        """Number of interactive generations currently in flight."""
+        with self._cond:
+            return self._active
+
+    @contextmanager
+    def interactive(self) -> Iterator[None]:
+        """Mark an interactive generation as running for the duration of the block."""
+        with self._cond:
+            self._active += 1
+            self._publish()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._last_finished = time.monotonic()
+                self._publish()
+                self._cond.notify_all()
+
+    def _publish(self) -> None:
+        """Share this process's count and last finish time (wall clock) with the other processes."""
+        if self._state is not None:
+            self._state.set(self.NAMESPACE, self._key, {"active": self._active, "finished": time.time()}, self.ttl)
+
+    def _remote_wait(self, quiet_period: float) -> float:
+        """Seconds until no other process has had an interactive generation for quiet_period."""
+        if self._state is None:
+            return 0.0
+        remaining = 0.0
+        now = time.time()
+        for key, entry in self._state.items(self.NAMESPACE).items():
+            if key == self._key:
+                continue
+            if entry["active"] > 0:
+                return self.poll_interval
+            remaining = max(remaining, entry["finished"] + quiet_period - now)
+        return remaining
+
+    def wait_idle(self, quiet_period: float, stop: threading.Event) -> bool:
+        """Block until no interactive generation has run for quiet_period seconds.
+
+        Args:
+            quiet_period: Seconds that must pass after the last interactive call finished
+            stop: Event that aborts the wait when set
+
+        Returns:
+            True once idle, False if stop was set first
+        """
+        with self._cond:
+            while not stop.is_set():
+                if self._active == 0:
+                    remaining = max(self._last_finished + quiet_period - time.monotonic(),
+                                    self._remote_wait(quiet_period))
+                    if remaining <= 0:
+                        return True
+                    self._cond.wait(min(remaining, self.poll_interval) if self._state is not None else remaining)
+                else:
+                    self._cond.wait(1.0)
+        return False
+
+
+# Process-wide gate shared by every OllamaClient
+generation_gate = GenerationGate(shared_state, DEPLOY_CONFIG["gate_ttl"])
@@ -0,0 +1,152 @@
+"""Retry and circuit-breaker policies for calls to the LLM backend."""
+
+import time
+import random
+import logging
+import threading
+from typing import Callable, Dict, Tuple, Type, TypeVar
+
+from app.config import LLM_RESILIENCE_CONFIG
+from app.llm.errors import CircuitOpenError
+
+logger = logging.getLogger("xiaohaochat.llm")
+
+T = TypeVar("T")
+
+
+class RetryPolicy:
+    """Bounded retries with full-jitter exponential backoff."""
+
+    def __init__(self, max_retries: int, backoff_base: float, backoff_max: float):
+        """
+        Args:
+            max_retries: Number of retries after the first attempt
+            backoff_base: Backoff ceiling of the first retry, in seconds
+            backoff_max: Upper bound of any single backoff, in seconds
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt: int) -> float:
+        """Return the sleep before retry number `attempt` (0-based)."""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def call(self, func: Callable[[], T], retry_on: Tuple[Type[BaseException], ...]) -> T:
+        """
+        Call `func`, retrying when it raises one of `retry_on`.
+
+        Any other exception, or the last retryable one, propagates unchanged.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except retry_on as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"Retryable LLM error ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    closed: calls pass through, consecutive failures are counted.
+    open: calls fail fast with CircuitOpenError until `reset_timeout` elapses.
+    half_open: a single probe call is let through; success closes the
+    circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call must not reach the backend."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_after = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(f"LLM backend '{self.name}' is unavailable, circuit open", retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_cancelled(self) -> None:
+        """The call was cancelled before it told us anything about the backend."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.error(f"Circuit '{self.name}' opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+# Breakers are shared per backend host so that state survives Streamlit reruns,
+# which construct a fresh OllamaClient every time
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for `name`, creating it on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=LLM_RESILIENCE_CONFIG["breaker_failure_threshold"],
+                reset_timeout=LLM_RESILIENCE_CONFIG["breaker_reset_timeout"],
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+def default_retry_policy() -> RetryPolicy:
+    """Build a RetryPolicy from LLM_RESILIENCE_CONFIG."""
+    return RetryPolicy(
+        max_retries=LLM_RESILIENCE_CONFIG["max_retries"],
+        backoff_base=LLM_RESILIENCE_CONFIG["backoff_base"],
+        backoff_max=LLM_RESILIENCE_CONFIG["backoff_max"],
+    )
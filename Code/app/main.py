@@ -12,7 +12,17 @@ from .ui.auth_view import AuthView
 from .ui.main_view import MainView
 from .ui.sidebar_view import SidebarView
 from .models.persona import Persona
-from .config import get_default_personas
+from .models.message import Message, Role
+from .auth.session_store import session_store
+from .chat.retention import retention_engine
+from .chat.persona_registry import PERSONA_ID_PATTERN, persona_registry
+from .chat.session_memory import session_memory
+from .llm.cancellation import generations
+from .config import SESSION_CONFIG, RETENTION_CONFIG
+from .telemetry.tracing import request_context, span, current_request_id
+from .telemetry.metrics import TURNS, session_activity
+from .storage.shared_state import shared_state
+from .deploy.launcher import NGROK_URL_KEY
 
 # 配置日志
 logging.basicConfig(
@@ -25,9 +35,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 全局变量存储ngrok URL
-ngrok_url = None
-
 class XiaoHaoAssistant:
     """晓昊助手应用的主类"""
 
@@ -48,6 +55,10 @@ class XiaoHaoAssistant:
         # 初始化聊天管理器
         self.chat_manager = ChatManager(self.file_storage)
         
+        # 后台保留策略（重复调用只启动一次）
+        if RETENTION_CONFIG["enabled"]:
+            retention_engine.start()
+        
         # 初始化UI组件
         self.auth_view = AuthView(self.user_manager)
         self.main_view = MainView(self.message_handler)
@@ -58,24 +69,34 @@ class XiaoHaoAssistant:
             st.session_state.logged_in = False
         if "current_user" not in st.session_state:
             st.session_state.current_user = None
+        if "current_user_id" not in st.session_state:
+            st.session_state.current_user_id = None
+        if "session_token" not in st.session_state:
+            st.session_state.session_token = None
         if "current_chat_id" not in st.session_state:
             st.session_state.current_chat_id = None
         if "messages" not in st.session_state:
             st.session_state.messages = []
-        if "personas" not in st.session_state:
-            st.session_state.personas = get_default_personas()
+        # 角色列表在任何进程保存或删除角色后刷新
+        personas_version = persona_registry.version()
+        if st.session_state.get("personas_version") != personas_version:
+            st.session_state.personas = persona_registry.all()
+            st.session_state.personas_version = personas_version
         if "selected_persona" not in st.session_state:
             st.session_state.selected_persona = "default"
         if "deep_thinking_mode" not in st.session_state:
             st.session_state.deep_thinking_mode = False
+        if "last_error" not in st.session_state:
+            st.session_state.last_error = None
+        if "fanout_personas" not in st.session_state:
+            st.session_state.fanout_personas = []
         
         # 初始化ngrok（如果启用）
         self._setup_ngrok()
 
     def _setup_ngrok(self):
         """设置ngrok内网穿透（如果启用）"""
-        global ngrok_url
-        if os.environ.get("USE_NGROK") == "true":
+        if os.environ.get("USE_NGROK") == "true" and not shared_state.get(*NGROK_URL_KEY):
             try:
                 # 检查pyngrok是否已安装
                 import importlib
@@ -95,6 +116,7 @@ class XiaoHaoAssistant:
                     tunnels = ngrok.get_tunnels()
                     if tunnels:
                         ngrok_url = tunnels[0].public_url
+                        shared_state.set(*NGROK_URL_KEY, ngrok_url)
                         print(f"\n\n使用已存在的ngrok隧道: {ngrok_url}\n\n")
                         logger.info(f"使用已存在的ngrok隧道: {ngrok_url}")
                         return
@@ -179,6 +201,7 @@ class XiaoHaoAssistant:
                                     data = response.json()
                                     if "tunnels" in data and len(data["tunnels"]) > 0:
                                         ngrok_url = data["tunnels"][0]["public_url"]
+                                        shared_state.set(*NGROK_URL_KEY, ngrok_url)
                                         print(f"\n\n晓昊助手已通过ngrok部署到: {ngrok_url}\n\n")
                                         logger.info(f"晓昊助手已通过ngrok部署到: {ngrok_url}")
                                         return
@@ -205,6 +228,7 @@ class XiaoHaoAssistant:
                     # 使用connect方法启动
                     public_url = ngrok.connect(8501)
                     ngrok_url = public_url.public_url
+                    shared_state.set(*NGROK_URL_KEY, ngrok_url)
                     print(f"\n\n晓昊助手已通过ngrok部署到(API方式): {ngrok_url}\n\n")
                     logger.info(f"晓昊助手已通过ngrok部署到(API方式): {ngrok_url}")
                     return
@@ -234,11 +258,28 @@ class XiaoHaoAssistant:
             initial_sidebar_state="expanded"
         )
         
+        # 记录会话活跃时间，被裁剪过的聊天历史在本次运行前重新加载
+        session_id = self._session_id()
+        if not session_id:
+            self._render()
+            return
+        session_activity.touch(session_id)
+        session_memory.acquire(session_id, st.session_state)
+        try:
+            self._render()
+        finally:
+            session_memory.release(session_id, st.session_state)
+    
+    def _render(self):
+        """渲染页面"""
         # 显示ngrok URL（如果有）
-        global ngrok_url
+        ngrok_url = shared_state.get(*NGROK_URL_KEY)
         if ngrok_url:
             st.sidebar.success(f"公网访问地址: [点击访问]({ngrok_url})")
         
+        # 用会话令牌恢复或校验登录状态（刷新页面无需重新登录）
+        self._sync_login_session()
+        
         # 检查是否有退出登录操作
         if st.session_state.logged_in and st.sidebar.button("退出登录", key="logout_button"):
             self._logout()
@@ -246,34 +287,109 @@ class XiaoHaoAssistant:
         
         # 如果用户未登录，显示登录界面
         if not st.session_state.logged_in:
+            notice = st.session_state.pop("auth_notice", None)
+            if notice:
+                st.warning(notice)
             self.auth_view.render()
             return
         
         # 用户已登录，显示主界面
-        # 侧边栏
-        self.sidebar_view.render(
-            st.session_state.current_user,
-            self._on_chat_selected,
-            self._on_new_chat,
-            self._on_persona_selected,
-            self._on_persona_created,
-            self._on_deep_thinking_toggled
-        )
+        # 沿用上一轮对话的请求ID，使回复的渲染耗时归入该轮对话
+        with request_context("ui.rerun", request_id=st.session_state.pop("last_request_id", None)):
+            # 侧边栏
+            with span("ui.sidebar"):
+                self.sidebar_view.render(
+                    st.session_state.current_user_id,
+                    st.session_state.current_user,
+                    self._on_chat_selected,
+                    self._on_new_chat,
+                    self._on_persona_selected,
+                    self._on_persona_created,
+                    self._on_deep_thinking_toggled,
+                    self._on_chat_removed
+                )
+            
+            # 主聊天界面
+            fan_out, alternatives = {}, {}
+            if st.session_state.current_chat_id:
+                fan_out = self.chat_manager.get_fan_out_replies(
+                    st.session_state.current_user_id, st.session_state.current_chat_id
+                )
+                alternatives = self.chat_manager.get_alternatives(
+                    st.session_state.current_user_id, st.session_state.current_chat_id
+                )
+            self.main_view.render(
+                st.session_state.messages,
+                self._on_message_sent,
+                st.session_state.deep_thinking_mode,
+                st.session_state.last_error,
+                fan_out,
+                alternatives,
+                self._on_regenerate,
+                self._on_edit,
+                self._on_switch_branch
+            )
+    
+    @staticmethod
+    def _session_id() -> Optional[str]:
+        """返回当前Streamlit会话ID"""
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    
+    def _sync_login_session(self):
+        """同步登录状态与会话令牌
         
-        # 主聊天界面
-        self.main_view.render(
-            st.session_state.messages,
-            self._on_message_sent,
-            st.session_state.deep_thinking_mode
-        )
+        令牌保存在URL查询参数中，浏览器刷新后仍然存在：
+        - 未登录但带有效令牌：直接恢复登录
+        - 已登录但令牌失效（超时或已注销）：退出登录
+        - 刚通过登录界面登录：签发令牌
+        """
+        param = SESSION_CONFIG["query_param"]
+        token = st.session_state.session_token or st.query_params.get(param)
+        
+        if not token:
+            if st.session_state.logged_in and st.session_state.current_user_id:
+                token = session_store.create(st.session_state.current_user_id, st.session_state.current_user)
+                st.session_state.session_token = token
+                st.query_params[param] = token
+            return
+        
+        session, rotated = session_store.validate(token)
+        if session is None:
+            if st.session_state.logged_in:
+                self._logout()
+                st.session_state.auth_notice = "登录已过期，请重新登录"
+            st.session_state.session_token = None
+            if param in st.query_params:
+                del st.query_params[param]
+            return
+        
+        token = rotated or token
+        st.session_state.session_token = token
+        if st.query_params.get(param) != token:
+            st.query_params[param] = token
+        if not st.session_state.logged_in:
+            st.session_state.logged_in = True
+            st.session_state.current_user = session.username
+            st.session_state.current_user_id = session.user_id
+            logger.info(f"用户 {session.username} 通过会话令牌恢复登录")
     
     def _logout(self):
         """处理退出登录"""
         logger.info(f"用户 {st.session_state.current_user} 退出登录")
+        self.chat_manager.cancel_prefetch(st.session_state.current_user_id)
+        if st.session_state.session_token:
+            session_store.revoke(st.session_state.session_token)
+        st.session_state.session_token = None
+        if SESSION_CONFIG["query_param"] in st.query_params:
+            del st.query_params[SESSION_CONFIG["query_param"]]
         st.session_state.logged_in = False
         st.session_state.current_user = None
+        st.session_state.current_user_id = None
         st.session_state.current_chat_id = None
         st.session_state.messages = []
+        st.session_state.last_error = None
     
     def _on_message_sent(self, message: str):
         """处理发送消息事件"""
@@ -283,47 +399,180 @@ class XiaoHaoAssistant:
         # 确保有当前聊天ID
         if not st.session_state.current_chat_id:
             self._on_new_chat()
-        
-        # 获取当前角色
-        current_persona = next(
-            (p for p in st.session_state.personas if p.id == st.session_state.selected_persona), 
-            st.session_state.personas[0]
+        self._send(st.session_state.messages + [Message(Role.USER, message)])
+    
+    def _on_regenerate(self, index: int):
+        """处理重新生成事件：为第index条（助手）消息之前的用户消息重新获取回复，原回复保留为分支"""
+        path = st.session_state.messages[:index]
+        if path and path[-1].role is Role.USER:
+            self._send(path, show_prompt=False)
+    
+    def _on_edit(self, index: int, content: str):
+        """处理编辑事件：把第index条（用户）消息替换为新内容并重新获取回复，原消息及其后续保留为分支"""
+        if content.strip():
+            self._send(st.session_state.messages[:index] + [Message(Role.USER, content)])
+    
+    def _on_switch_branch(self, index: int, offset: int):
+        """处理切换分支事件：显示第index条消息的上一个或下一个版本"""
+        messages = self.chat_manager.switch_branch(
+            st.session_state.current_user_id, st.session_state.current_chat_id, index, offset
         )
+        if messages is not None:
+            st.session_state.messages = messages
+    
+    def _send(self, path: List[Message], show_prompt: bool = True):
+        """为以用户消息结尾的路径获取回复并保存
         
-        # 添加用户消息
-        st.session_state.messages.append({"role": "user", "content": message})
+        path 与当前历史在中途分叉时（编辑或重新生成），保存时新路径作为聊天的新分支。
         
-        # 获取AI回复 - 根据深度思考模式决定是否显示"思考中"
-        if st.session_state.deep_thinking_mode:
-            # 深度思考模式下显示"思考中"
-            with st.spinner("思考中..."):
-                response = self.message_handler.get_response(
+        Args:
+            path: 新的当前路径，最后一条是本轮的用户消息
+            show_prompt: 是否显示本轮的用户消息（重新生成时它已经显示在历史中）
+        """
+        message = path[-1].content
+        with request_context("turn", deep_thinking=st.session_state.deep_thinking_mode) as turn:
+            # 获取当前角色
+            current_persona = next(
+                (p for p in st.session_state.personas if p.id == st.session_state.selected_persona), 
+                st.session_state.personas[0]
+            )
+            turn.set("persona_id", current_persona.id)
+        
+            # 清除上一次的错误提示
+            st.session_state.last_error = None
+        
+            # 添加用户消息（新列表，失败时恢复原来的历史）
+            previous = st.session_state.messages
+            st.session_state.messages = list(path)
+            
+            # 选择了两个以上角色时进行多角色对比
+            fanout = [p for p in st.session_state.personas if p.id in st.session_state.fanout_personas]
+            if len(fanout) >= 2:
+                self._fan_out(message, current_persona, fanout, previous, show_prompt)
+                return
+        
+            # 获取AI回复：流式显示，可由停止按钮、页面上的其他操作或关闭页面中断
+            session_id = self._session_id() or "local"
+            cancel = generations.register(session_id, lambda: self._session_connected(session_id))
+            stream = self.main_view.begin_reply(
+                message if show_prompt else None, st.session_state.deep_thinking_mode, cancel
+            )
+            try:
+                reply = self.message_handler.get_response(
                     message, 
                     st.session_state.messages[:-1],  # 不包括刚刚添加的用户消息
                     current_persona.system_prompt,
-                    st.session_state.deep_thinking_mode
+                    st.session_state.deep_thinking_mode,
+                    on_delta=stream.on_delta,
+                    cancel=cancel,
+                    persona_id=current_persona.id,
+                    user_id=st.session_state.current_user_id
                 )
-        else:
-            # 普通模式下不显示"思考中"
-            response = self.message_handler.get_response(
-                message, 
+            finally:
+                generations.unregister(session_id, cancel)
+        
+            # 记录请求ID，下一次渲染的span与本轮对话关联
+            st.session_state.last_request_id = current_request_id()
+            TURNS.labels(
+                persona=current_persona.id,
+                mode="deep" if st.session_state.deep_thinking_mode else "normal",
+                outcome=("truncated" if reply.truncated else "ok") if reply.ok else reply.error_kind
+            ).inc()
+            
+            # 失败的回复不写入聊天历史，撤回本轮用户消息并提示错误
+            if not reply.ok:
+                turn.set("error_kind", reply.error_kind)
+                st.session_state.messages = previous
+                st.session_state.last_error = reply.error
+                stream.reraise()
+                return
+        
+            # 添加AI回复，被停止的回复保存已生成的部分并标记为截断
+            st.session_state.messages.append(Message(Role.ASSISTANT, reply.content, truncated=reply.truncated))
+        
+            # 保存聊天历史
+            self.chat_manager.save_chat(
+                st.session_state.current_user_id,
+                st.session_state.current_chat_id,
+                st.session_state.messages,
+                current_persona.id
+            )
+            # 生成被页面上的操作中断时，保存之后交给Streamlit处理该操作
+            stream.reraise()
+    
+    def _fan_out(self, message: str, current_persona: Persona, personas: List[Persona],
+                 previous: List[Message], show_prompt: bool = True):
+        """把消息同时发给多个角色，回答并排显示
+        
+        当前角色在所选角色之中且回答成功时，其回答写入当前聊天，否则取第一个回答成功的角色并
+        切换聊天的角色；其他成功的回答保存为当前回答的兄弟节点。所有角色都失败时恢复为previous。
+        """
+        session_id = self._session_id() or "local"
+        cancel = generations.register(session_id, lambda: self._session_connected(session_id))
+        stream = self.main_view.begin_fan_out(
+            message if show_prompt else None, personas, st.session_state.deep_thinking_mode, cancel
+        )
+        try:
+            replies = self.message_handler.fan_out(
+                message,
                 st.session_state.messages[:-1],  # 不包括刚刚添加的用户消息
-                current_persona.system_prompt,
-                st.session_state.deep_thinking_mode
+                personas,
+                st.session_state.deep_thinking_mode,
+                on_delta=lambda persona_id, text: stream.on_delta(text, persona_id),
+                cancel=cancel,
+                user_id=st.session_state.current_user_id
             )
+        finally:
+            generations.unregister(session_id, cancel)
         
-        # 添加AI回复
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state.last_request_id = current_request_id()
+        for persona in personas:
+            reply = replies[persona.id]
+            TURNS.labels(
+                persona=persona.id,
+                mode="deep" if st.session_state.deep_thinking_mode else "normal",
+                outcome=("truncated" if reply.truncated else "ok") if reply.ok else reply.error_kind
+            ).inc()
+        errors = [f"{p.name}: {replies[p.id].error}" for p in personas if not replies[p.id].ok]
+        st.session_state.last_error = "\n\n".join(errors) or None
         
-        # 保存聊天历史
+        succeeded = [p for p in personas if replies[p.id].ok]
+        if not succeeded:
+            st.session_state.messages = previous
+            stream.reraise()
+            return
+        primary = current_persona if current_persona in succeeded else succeeded[0]
+        reply = replies[primary.id]
+        st.session_state.messages.append(Message(Role.ASSISTANT, reply.content, truncated=reply.truncated))
+        st.session_state.selected_persona = primary.id
         self.chat_manager.save_chat(
-            st.session_state.current_user,
+            st.session_state.current_user_id,
             st.session_state.current_chat_id,
             st.session_state.messages,
-            current_persona.id
+            primary.id
         )
+        
+        # 其他角色的回答作为当前回答的兄弟节点保存在消息树中
+        others = [(p.id, Message(Role.ASSISTANT, replies[p.id].content, truncated=replies[p.id].truncated))
+                  for p in succeeded if p is not primary]
+        if others:
+            self.chat_manager.add_fan_out_replies(
+                st.session_state.current_user_id,
+                st.session_state.current_chat_id,
+                primary.id,
+                others
+            )
+        stream.reraise()
     
-    def _on_chat_selected(self, chat_id: str, messages: List[Dict[str, str]], persona_id: str):
+    @staticmethod
+    def _session_connected(session_id: str) -> bool:
+        """浏览器是否仍连接着该会话（关闭页面或断线后为False）"""
+        from streamlit import runtime
+        if not runtime.exists():
+            return True
+        return runtime.get_instance().is_active_session(session_id)
+    
+    def _on_chat_selected(self, chat_id: str, messages: List[Message], persona_id: str):
         """处理选择聊天事件"""
         st.session_state.current_chat_id = chat_id
         st.session_state.messages = messages
@@ -332,12 +581,18 @@ class XiaoHaoAssistant:
     def _on_new_chat(self):
         """处理新建聊天事件"""
         chat_id = self.chat_manager.create_chat(
-            st.session_state.current_user,
+            st.session_state.current_user_id,
             st.session_state.selected_persona
         )
         st.session_state.current_chat_id = chat_id
         st.session_state.messages = []
     
+    def _on_chat_removed(self, chat_id: str):
+        """处理删除或归档聊天事件"""
+        if st.session_state.current_chat_id == chat_id:
+            st.session_state.current_chat_id = None
+            st.session_state.messages = []
+    
     def _on_persona_selected(self, persona_id: str):
         """处理选择角色事件"""
         st.session_state.selected_persona = persona_id
@@ -345,15 +600,30 @@ class XiaoHaoAssistant:
         # 如果当前有聊天，更新聊天的角色
         if st.session_state.current_chat_id:
             self.chat_manager.update_chat_persona(
-                st.session_state.current_user,
+                st.session_state.current_user_id,
                 st.session_state.current_chat_id,
                 persona_id
             )
     
-    def _on_persona_created(self, persona: Persona):
-        """处理创建角色事件"""
-        st.session_state.personas.append(persona)
+    def _on_persona_created(self, persona: Persona) -> Optional[str]:
+        """处理创建角色事件：加入角色注册表，所有工作进程的会话都能使用
+        
+        Returns:
+            创建失败时返回显示在表单中的错误提示，成功返回None
+        """
+        if persona_registry.create(persona):
+            st.session_state.personas = persona_registry.all()
+            st.session_state.personas_version = persona_registry.version()
+        elif persona_registry.get(persona.id) is not None or \
+                any(p.id == persona.id for p in st.session_state.personas):
+            return "角色ID已存在"
+        elif PERSONA_ID_PATTERN.match(persona.id):
+            return "保存角色失败"
+        else:
+            # 角色ID无效时只在本会话中使用
+            st.session_state.personas.append(persona)
         st.session_state.selected_persona = persona.id
+        return None
     
     def _on_deep_thinking_toggled(self, enabled: bool):
         """处理深度思考模式切换事件"""
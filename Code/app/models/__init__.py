@@ -3,5 +3,8 @@
 from app.models.user import User
 from app.models.chat import Chat
 from app.models.persona import Persona
+from app.models.reply import Reply
+from app.models.message import Message, Role
+from app.models.tree import MessageTree
 
-__all__ = ["User", "Chat", "Persona"] 
\ No newline at end of file
+__all__ = ["User", "Chat", "Persona", "Reply", "Message", "Role", "MessageTree"] 
\ No newline at end of file
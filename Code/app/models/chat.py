@@ -1,30 +1,108 @@
 import uuid
 import datetime
 from dataclasses import dataclass, field
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
-@dataclass
+from app.models.message import Message, Role, DATACLASS_SLOTS, to_messages
+from app.models.tree import MessageTree
+
+@dataclass(**DATACLASS_SLOTS)
 class Chat:
     chat_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str = ""
-    messages: List[Dict[str, str]] = field(default_factory=list)
+    messages: List[Message] = field(default_factory=list)  # 当前路径
     metadata: Dict[str, Any] = field(default_factory=dict)
     updated_at: str = field(default_factory=lambda: datetime.datetime.now().isoformat())
+    tree: Optional[MessageTree] = None  # 编辑或重新生成过消息的聊天才有消息树
+
+    def __post_init__(self):
+        # 接受字典形式的消息（从文件读取或旧代码构造），统一转换为Message
+        self.messages = to_messages(self.messages)
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Chat':
-        return cls(
+        chat = cls(
             chat_id=data.get("chat_id", str(uuid.uuid4())),
             user_id=data.get("metadata", {}).get("user_id", ""),
             messages=data.get("messages", []),
             metadata=data.get("metadata", {}),
             updated_at=data.get("updated_at", datetime.datetime.now().isoformat())
         )
+        if "tree" in data:
+            chat.tree = MessageTree.from_dict(data["tree"], chat.messages)
+        return chat
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        data = {
             "chat_id": self.chat_id,
-            "messages": self.messages,
+            "messages": [message.to_dict() for message in self.messages],
             "metadata": self.metadata,
             "updated_at": self.updated_at
-        } 
\ No newline at end of file
+        }
+        if self.tree is not None:
+            data["tree"] = self.tree.to_dict()
+        return data
+
+    def copy(self) -> 'Chat':
+        """返回浅拷贝，消息列表、元数据字典和消息树各自独立，可安全修改"""
+        return Chat(
+            chat_id=self.chat_id,
+            user_id=self.user_id,
+            messages=list(self.messages),
+            metadata=dict(self.metadata),
+            updated_at=self.updated_at,
+            tree=self.tree.copy() if self.tree is not None else None
+        )
+
+    def set_path(self, messages: List[Message]) -> None:
+        """更新当前路径
+
+        在原路径后追加消息时聊天保持线性；新路径与原路径在中途分叉（编辑或重新生成了之前的
+        消息）时建立消息树，原来的后续消息作为分支保留。
+        """
+        if self.tree is None:
+            old = self.messages
+            if len(messages) >= len(old) and all(a is b or a == b for a, b in zip(old, messages)):
+                self.messages = messages
+                return
+            self.tree = MessageTree.from_path(old)
+        self.tree.merge_path(messages)
+        self.messages = messages
+
+    def add_fan_out(self, persona_id: str, replies: List[Tuple[str, Message]]) -> bool:
+        """把多角色对比中其他角色的回答加为当前回答的兄弟节点
+
+        当前路径的最后一条消息是persona_id的回答，其他回答与它同属一轮对比，当前路径不变。
+
+        Args:
+            persona_id: 当前回答的角色
+            replies: 其他角色的回答 [(角色ID, 消息)]
+
+        Returns:
+            当前路径不以助手回答结尾时返回False
+        """
+        if not self.messages or self.messages[-1].role is not Role.ASSISTANT:
+            return False
+        if self.tree is None:
+            self.tree = MessageTree.from_path(self.messages)
+        tree = self.tree
+        group = tree.active
+        tree.fan_out[group] = (persona_id, group)
+        for reply_persona_id, message in replies:
+            tree.fan_out[tree.add(message, tree.parents[group])] = (reply_persona_id, group)
+        return True
+
+    def switch_branch(self, position: int, offset: int) -> bool:
+        """切换到当前路径第position条消息的兄弟分支，沿该分支最近的后续消息到达末端
+
+        Returns:
+            有兄弟分支并已切换时返回True
+        """
+        if self.tree is None:
+            return False
+        sibling = self.tree.sibling(position, offset)
+        if sibling is None:
+            return False
+        self.tree.active = self.tree.latest_leaf(sibling)
+        self.messages = self.tree.path()
+        return True
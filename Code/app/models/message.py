@@ -0,0 +1,139 @@
+import sys
+import html
+from enum import Enum
+from typing import Dict, Any, Iterator, List, Optional, Union, Mapping
+
+# 在支持的Python版本（3.10+）上为数据类生成 __slots__，旧版本保持普通数据类
+DATACLASS_SLOTS: Dict[str, bool] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+class Role(str, Enum):
+    """消息发送者角色
+
+    每个角色只有一个实例，大量消息共享同一个对象，不再各自持有一份角色字符串。
+    继承str，与 "user" 等字符串比较相等，也可以直接写入JSON。
+    """
+
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+    TOOL = "tool"
+
+    def __str__(self) -> str:
+        return self.value
+
+
+_FIELDS = ("role", "content")
+# 字符串 -> 角色，比 Role(value) 的枚举查找快得多，加载长历史时每条消息都要用到
+_ROLES = {role.value: role for role in Role}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数：非ASCII字符（主要是中文）按每字一个token，其余按每4个字符一个token"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+class Message:
+    """一条聊天消息
+
+    使用 __slots__ 存储，比 {"role": ..., "content": ...} 字典小得多；会话中的历史、缓存中的
+    聊天和写入队列中的快照共享同一批消息对象，因此消息创建后不应修改。
+
+    兼容原来的字典用法：message["role"]、message.get("content")、"role" in message 以及
+    dict(message)，角色按字符串返回。token数和转义后的HTML在首次使用时计算并缓存。
+    truncated 标记生成被中途停止、只保存了部分内容的回复。
+    """
+
+    __slots__ = ("role", "content", "truncated", "_tokens", "_html")
+
+    def __init__(self, role: Union[Role, str], content: str, tokens: Optional[int] = None,
+                 truncated: bool = False):
+        self.role = _ROLES.get(role) or Role(role)
+        self.content = content
+        self.truncated = truncated
+        self._tokens = tokens
+        self._html: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Union['Message', Mapping[str, Any]]) -> 'Message':
+        """从字典创建消息，已经是Message时原样返回"""
+        if data.__class__ is Message:
+            return data
+        return cls(data["role"], data.get("content", ""), truncated=bool(data.get("truncated", False)))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为与旧版本相同的字典格式，被截断的回复额外带 "truncated": true"""
+        if self.truncated:
+            return {"role": self.role.value, "content": self.content, "truncated": True}
+        return {"role": self.role.value, "content": self.content}
+
+    def to_ollama(self) -> Dict[str, str]:
+        """发送给Ollama的消息字典"""
+        return {"role": self.role.value, "content": self.content}
+
+    @property
+    def tokens(self) -> int:
+        """消息内容的token数（估计值，首次访问时计算）"""
+        if self._tokens is None:
+            self._tokens = estimate_tokens(self.content)
+        return self._tokens
+
+    @property
+    def html(self) -> str:
+        """转义后的消息内容，可直接嵌入HTML（首次访问时计算）"""
+        if self._html is None:
+            self._html = html.escape(self.content)
+        return self._html
+
+    # 字典兼容接口
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role.value
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: object) -> bool:
+        return key in _FIELDS
+
+    def keys(self):
+        return _FIELDS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_FIELDS)
+
+    def __len__(self) -> int:
+        return len(_FIELDS)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Message):
+            return self.role is other.role and self.content == other.content
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def items(self):
+        return [("role", self.role.value), ("content", self.content)]
+
+    def __repr__(self) -> str:
+        preview = self.content if len(self.content) <= 40 else self.content[:37] + "..."
+        return f"Message({self.role.value!r}, {preview!r})"
+
+
+def to_messages(items: List[Union[Message, Mapping[str, Any]]]) -> List[Message]:
+    """把字典或消息组成的列表转换为消息列表，已是Message的元素不复制"""
+    return [Message.from_dict(item) for item in items]
+
+
+def to_ollama(items: List[Union[Message, Mapping[str, Any]]]) -> List[Dict[str, str]]:
+    """转换为发送给Ollama的消息字典列表"""
+    return [item.to_ollama() if isinstance(item, Message) else dict(item) for item in items]
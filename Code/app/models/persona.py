@@ -2,7 +2,9 @@ import datetime
 from dataclasses import dataclass, field
 from typing import Dict, Any
 
-@dataclass
+from app.models.message import DATACLASS_SLOTS
+
+@dataclass(**DATACLASS_SLOTS)
 class Persona:
     persona_id: str
     name: str
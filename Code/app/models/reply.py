@@ -0,0 +1,22 @@
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional
+
+
+@dataclass
+class Reply:
+    """AI回复结果，区分正常回答和失败，失败不应作为助手消息写入聊天历史"""
+
+    content: str = ""
+    error: Optional[str] = None  # 面向用户的错误描述
+    error_kind: Optional[str] = None  # 机器可读的错误类型，如 "timeout"、"circuit_open"
+    stats: Dict[str, Any] = field(default_factory=dict)  # 后端返回的统计信息
+    truncated: bool = False  # 生成被中途停止，content 只是已生成的部分
+
+    @property
+    def ok(self) -> bool:
+        """是否成功获得回答"""
+        return self.error is None
+
+    @classmethod
+    def failure(cls, error: str, error_kind: str) -> 'Reply':
+        return cls(error=error, error_kind=error_kind)
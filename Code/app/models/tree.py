@@ -0,0 +1,195 @@
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.models.message import Message
+
+# 根节点的父节点
+ROOT = -1
+
+
+class MessageTree:
+    """对话的消息树
+
+    编辑或重新生成之前的消息时，新消息作为原消息的兄弟节点加入，共同的前缀只保存一份。
+    节点ID是节点在 messages 中的下标，父节点总是先于子节点加入；active 为当前路径末端的
+    节点，当前路径即从根到 active 的消息序列（Chat.messages）。
+
+    保存时当前路径仍写在聊天的 "messages" 中（不认识消息树的旧代码读到的是当前路径），
+    这里只序列化不在当前路径上的节点，每条不同的消息只保存一次。
+
+    多角色对比的各个回答是同一条用户消息下的兄弟节点，fan_out 记录这些节点的角色和所属的
+    一轮对比（该轮第一个回答的节点ID），界面据此把同一轮的回答并排显示。
+    """
+
+    __slots__ = ("messages", "parents", "active", "fan_out", "_children")
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.parents: List[int] = []
+        self.active = ROOT
+        self.fan_out: Dict[int, Tuple[str, int]] = {}  # 节点 -> (角色ID, 所属一轮对比)
+        self._children: Optional[Dict[int, List[int]]] = None  # 父节点 -> 子节点，按需建立
+
+    @classmethod
+    def from_path(cls, path: List[Message]) -> 'MessageTree':
+        """由一段线性历史建立消息树"""
+        tree = cls()
+        for message in path:
+            tree.active = tree.add(message, tree.active)
+        return tree
+
+    def copy(self) -> 'MessageTree':
+        """返回拷贝，节点列表各自独立，消息对象共享"""
+        tree = MessageTree()
+        tree.messages = list(self.messages)
+        tree.parents = list(self.parents)
+        tree.active = self.active
+        tree.fan_out = dict(self.fan_out)
+        return tree
+
+    def add(self, message: Message, parent: int) -> int:
+        """加入一个节点，返回节点ID"""
+        node = len(self.messages)
+        self.messages.append(message)
+        self.parents.append(parent)
+        if self._children is not None:
+            self._children.setdefault(parent, []).append(node)
+        return node
+
+    def children(self, node: int) -> List[int]:
+        """节点的子节点，按加入顺序排列"""
+        if self._children is None:
+            self._children = {}
+            for child, parent in enumerate(self.parents):
+                self._children.setdefault(parent, []).append(child)
+        return self._children.get(node, [])
+
+    def path_ids(self, node: Optional[int] = None) -> List[int]:
+        """从根到node（默认为active）的节点ID"""
+        node = self.active if node is None else node
+        ids = []
+        while node != ROOT:
+            ids.append(node)
+            node = self.parents[node]
+        ids.reverse()
+        return ids
+
+    def path(self, node: Optional[int] = None) -> List[Message]:
+        """从根到node（默认为active）的消息序列"""
+        return [self.messages[i] for i in self.path_ids(node)]
+
+    def latest_leaf(self, node: int) -> int:
+        """从node出发，每一层走最近加入的子节点，直到叶子"""
+        children = self.children(node)
+        while children:
+            node = children[-1]
+            children = self.children(node)
+        return node
+
+    def merge_path(self, path: List[Message]) -> None:
+        """把一条路径并入树中并设为当前路径
+
+        从根开始逐条匹配：已有相同消息（同一对象或角色和内容相同）的子节点时沿用该节点，
+        否则从这里分出新的分支。
+        """
+        node = ROOT
+        for message in path:
+            match = None
+            for child in reversed(self.children(node)):
+                existing = self.messages[child]
+                if existing is message or existing == message:
+                    match = child
+                    break
+            node = self.add(message, node) if match is None else match
+        self.active = node
+
+    def alternatives(self) -> Dict[int, Tuple[int, int]]:
+        """当前路径上有兄弟节点的位置
+
+        Returns:
+            路径中的位置 -> (该节点在兄弟节点中的序号, 兄弟节点数)
+        """
+        result = {}
+        for position, node in enumerate(self.path_ids()):
+            siblings = self.children(self.parents[node])
+            if len(siblings) > 1:
+                result[position] = (siblings.index(node), len(siblings))
+        return result
+
+    def fan_out_rounds(self) -> Dict[int, List[int]]:
+        """当前路径上属于多角色对比的回答及同一轮的其他回答
+
+        Returns:
+            路径中的位置 -> 同一轮回答的节点ID，当前路径上的节点在最前
+        """
+        result = {}
+        for position, node in enumerate(self.path_ids()):
+            if node not in self.fan_out:
+                continue
+            group = self.fan_out[node][1]
+            others = [child for child in self.children(self.parents[node])
+                      if child != node and self.fan_out.get(child, (None, None))[1] == group]
+            if others:
+                result[position] = [node] + others
+        return result
+
+    def sibling(self, position: int, offset: int) -> Optional[int]:
+        """当前路径上第position条消息向前或向后第offset个兄弟节点，没有兄弟节点时返回None"""
+        ids = self.path_ids()
+        if not 0 <= position < len(ids):
+            return None
+        siblings = self.children(self.parents[ids[position]])
+        if len(siblings) < 2:
+            return None
+        return siblings[(siblings.index(ids[position]) + offset) % len(siblings)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化：当前路径只记录节点ID（消息本身在聊天的 "messages" 中），其余节点完整保存
+
+        节点ID保持不变，兄弟节点的先后顺序在保存和加载之后不变。
+        """
+        path = self.path_ids()
+        on_path = set(path)
+        nodes = []
+        for node, message in enumerate(self.messages):
+            if node not in on_path:
+                entry = message.to_dict()
+                entry["id"] = node
+                entry["parent"] = self.parents[node]
+                nodes.append(entry)
+        data = {"path": path, "nodes": nodes}
+        if self.fan_out:
+            data["fan_out"] = {str(node): [persona_id, group] for node, (persona_id, group) in self.fan_out.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], path: List[Message]) -> 'MessageTree':
+        """由当前路径和序列化的其余节点重建消息树
+
+        数据与当前路径不一致时（例如文件被不认识消息树的旧版本改写过）只保留当前路径。
+        """
+        path_ids = [int(node) for node in data.get("path", [])]
+        entries = data.get("nodes", [])
+        size = len(path_ids) + len(entries)
+        tree = cls()
+        tree.messages = [None] * size
+        tree.parents = [ROOT] * size
+        try:
+            if len(path_ids) != len(path):
+                raise ValueError("path length mismatch")
+            for position, node in enumerate(path_ids):
+                tree.messages[node] = path[position]
+                tree.parents[node] = path_ids[position - 1] if position else ROOT
+            for entry in entries:
+                node = int(entry["id"])
+                tree.messages[node] = Message.from_dict(entry)
+                tree.parents[node] = int(entry["parent"])
+            if any(message is None for message in tree.messages) or \
+                    any(not ROOT <= parent < node for node, parent in enumerate(tree.parents)):
+                raise ValueError("inconsistent node ids")
+            for node, (persona_id, group) in data.get("fan_out", {}).items():
+                if int(node) < size:
+                    tree.fan_out[int(node)] = (str(persona_id), int(group))
+        except (ValueError, KeyError, IndexError, TypeError):
+            return cls.from_path(path)
+        tree.active = path_ids[-1] if path_ids else ROOT
+        return tree
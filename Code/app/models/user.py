@@ -3,13 +3,15 @@ import datetime
 from dataclasses import dataclass, field
 from typing import Dict, Any, Optional
 
+from app.models.message import DATACLASS_SLOTS
 
-@dataclass
+
+@dataclass(**DATACLASS_SLOTS)
 class User:
     """User model representing a registered user."""
     
     username: str
-    password: str  # In production, store password hash instead
+    password: str  # bcrypt hash; records written by older versions may still hold plaintext
     user_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     created_at: str = field(default_factory=lambda: datetime.datetime.now().isoformat())
     
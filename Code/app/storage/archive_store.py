@@ -0,0 +1,203 @@
+import os
+import json
+import gzip
+import uuid
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+from app.config import ARCHIVE_DIR
+from app.models.chat import Chat
+from app.storage.file_lock import directory_lock
+
+logger = logging.getLogger("xiaohaochat.storage.archive")
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+
+
+class ArchiveStore:
+    """冷存储：按用户归档的压缩聊天包
+
+    每个用户一个目录，目录下是若干gzip压缩的JSONL包（每次归档写一个新包）和一个索引文件，
+    索引记录每个已归档聊天所在的包和侧边栏需要的摘要。聊天被取回或删除时只从索引中移除，
+    包内已没有有效聊天时删除整个包，因此不需要改写压缩文件。
+
+    索引的读取-修改-写入在用户目录的文件锁（flock）下进行，多进程部署时一个进程的保留策略
+    与另一个进程的取回、删除不会互相覆盖索引；索引以原子替换写入，读取不需要加锁。
+    """
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        # user_id -> ((inode, mtime_ns, 大小), 索引)
+        self._indexes: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Dict[str, Any]]]] = {}
+        self._lock = threading.RLock()
+
+    def _user_dir(self, user_id: str) -> str:
+        if not user_id or user_id.startswith(".") or os.path.basename(user_id) != user_id:
+            raise ValueError(f"无效的用户ID: {user_id!r}")
+        return os.path.join(self.archive_dir, user_id)
+
+    def _index(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """读取用户的归档索引，文件未变化时使用内存中的副本；调用方需持有锁"""
+        path = os.path.join(self._user_dir(user_id), INDEX_FILE)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._indexes.pop(user_id, None)
+            return {}
+        # 原子替换总是产生新的inode，同一时间刻内的两次写入也能区分
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self._indexes[user_id] = (version, index)
+        return index
+
+    @contextmanager
+    def _locked(self, user_id: str) -> Iterator[None]:
+        """在进程内的锁和用户目录的文件锁下修改索引，用户目录需已存在"""
+        with directory_lock(self._user_dir(user_id), LOCK_FILE, self._lock):
+            yield
+
+    def _write_index(self, user_id: str, index: Dict[str, Dict[str, Any]]) -> None:
+        from app.storage.file_storage import _atomic_write_json  # 避免循环导入
+        path = os.path.join(self._user_dir(user_id), INDEX_FILE)
+        if not index:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._indexes.pop(user_id, None)
+            return
+        _atomic_write_json(path, index)
+        stat = os.stat(path)
+        self._indexes[user_id] = ((stat.st_ino, stat.st_mtime_ns, stat.st_size), index)
+
+    def archive(self, user_id: str, chats: List[Chat]) -> int:
+        """把一批聊天写入新的压缩包并登记到索引
+
+        调用方在本方法返回后再删除热存储中的文件；中途失败时聊天仍在热存储中。
+
+        Args:
+            user_id: 聊天所属用户ID
+            chats: 聊天对象列表
+
+        Returns:
+            写入的字节数（压缩后）
+        """
+        if not chats:
+            return 0
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        now = datetime.datetime.now()
+        bundle = f"{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        path = os.path.join(user_dir, bundle)
+        tmp_path = path + ".tmp"
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                for chat in chats:
+                    f.write(json.dumps(chat.to_dict(), ensure_ascii=False) + "\n")
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._locked(user_id):
+            index = dict(self._index(user_id))
+            replaced = {index[chat.chat_id]["bundle"] for chat in chats if chat.chat_id in index}
+            for chat in chats:
+                index[chat.chat_id] = {
+                    "bundle": bundle,
+                    "title": chat.metadata.get("title", "无标题对话"),
+                    "updated_at": chat.updated_at,
+                    "persona_id": chat.metadata.get("persona_id", "default"),
+                    "archived_at": now.isoformat(),
+                }
+            self._write_index(user_id, index)
+            self._drop_unreferenced(user_id, index, replaced)
+        return os.path.getsize(path)
+
+    def summaries(self, user_id: str) -> List[Dict[str, Any]]:
+        """返回用户已归档聊天的摘要，格式与热存储的摘要相同并带有 archived 标记"""
+        with self._lock:
+            try:
+                index = self._index(user_id)
+            except ValueError:
+                return []
+            except Exception as e:
+                logger.error(f"读取归档索引失败: {user_id}: {str(e)}")
+                return []
+            return [{"chat_id": chat_id, "title": entry["title"], "updated_at": entry["updated_at"],
+                     "persona_id": entry["persona_id"], "archived": True}
+                    for chat_id, entry in index.items()]
+
+    def contains(self, user_id: str, chat_id: str) -> bool:
+        with self._lock:
+            try:
+                return chat_id in self._index(user_id)
+            except Exception:
+                return False
+
+    def load(self, user_id: str, chat_id: str) -> Optional[Chat]:
+        """从压缩包中读取一个已归档的聊天（逐行解压，找到即停止）"""
+        with self._lock:
+            try:
+                entry = self._index(user_id).get(chat_id)
+            except ValueError:
+                return None
+        if entry is None:
+            return None
+        path = os.path.join(self._user_dir(user_id), entry["bundle"])
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    # 先做廉价的子串判断，只解析可能匹配的行
+                    if chat_id in line:
+                        data = json.loads(line)
+                        if data.get("chat_id") == chat_id:
+                            return Chat.from_dict(data)
+        except Exception as e:
+            logger.error(f"读取归档聊天失败: {chat_id}: {str(e)}")
+            return None
+        logger.error(f"归档包中没有索引记录的聊天: {entry['bundle']}: {chat_id}")
+        return None
+
+    def remove(self, user_id: str, chat_ids: List[str]) -> int:
+        """从索引中移除聊天（已取回或已删除），返回移除的数量"""
+        try:
+            if not os.path.isdir(self._user_dir(user_id)):
+                return 0
+        except ValueError:
+            return 0
+        with self._locked(user_id):
+            index = dict(self._index(user_id))
+            bundles = {index[chat_id]["bundle"] for chat_id in chat_ids if chat_id in index}
+            removed = 0
+            for chat_id in chat_ids:
+                if index.pop(chat_id, None) is not None:
+                    removed += 1
+            if removed:
+                self._write_index(user_id, index)
+                self._drop_unreferenced(user_id, index, bundles)
+            return removed
+
+    def _drop_unreferenced(self, user_id: str, index: Dict[str, Dict[str, Any]], bundles: set) -> None:
+        """删除索引中已不再引用的包"""
+        live = {entry["bundle"] for entry in index.values()}
+        for bundle in bundles - live:
+            try:
+                os.remove(os.path.join(self._user_dir(user_id), bundle))
+            except OSError as e:
+                logger.warning(f"删除归档包失败: {bundle}: {str(e)}")
+
+
+# 进程级单例
+archive_store = ArchiveStore(ARCHIVE_DIR)
@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from app.config import CHAT_CACHE_CONFIG
+from app.models.chat import Chat
+from app.telemetry.metrics import REGISTRY
+
+
+class ChatCache:
+    """进程内聊天记录LRU缓存
+
+    缓存条目以文件的修改时间(mtime_ns)校验，文件被其他进程或外部修改后自动失效。
+    内存占用以JSON文件大小近似估算，超过上限时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Chat, int, int]]" = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size_bytes(self) -> int:
+        """当前缓存占用的近似字节数"""
+        return self._size_bytes
+
+    def get(self, chat_id: str, mtime_ns: int) -> Optional[Chat]:
+        """获取缓存的聊天记录
+
+        Args:
+            chat_id: 聊天ID
+            mtime_ns: 聊天文件当前的修改时间
+
+        Returns:
+            缓存命中且未过期时返回聊天对象的拷贝，否则返回None
+        """
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None or entry[1] != mtime_ns:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return entry[0].copy()
+
+    def contains(self, chat_id: str, mtime_ns: int) -> bool:
+        """检查聊天是否已缓存且未过期，不影响LRU顺序和命中统计"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            return entry is not None and entry[1] == mtime_ns
+
+    def put(self, chat: Chat, mtime_ns: int, size: int) -> None:
+        """放入聊天记录，缓存保存独立的拷贝
+
+        Args:
+            chat: 聊天对象
+            mtime_ns: 对应文件的修改时间
+            size: 对应文件的字节数，用于估算内存占用
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(chat.chat_id, None)
+            if old is not None:
+                self._size_bytes -= old[2]
+            self._entries[chat.chat_id] = (chat.copy(), mtime_ns, size)
+            self._size_bytes += size
+            while self._size_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size_bytes -= evicted_size
+
+    def invalidate(self, chat_id: str) -> None:
+        """移除指定聊天的缓存"""
+        with self._lock:
+            old = self._entries.pop(chat_id, None)
+            if old is not None:
+                self._size_bytes -= old[2]
+
+    def hit_ratio(self) -> float:
+        """缓存命中率"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# 进程级单例，Streamlit每次重新运行脚本都会重建FileStorage，缓存需要跨运行共享
+chat_cache = ChatCache(CHAT_CACHE_CONFIG["max_bytes"])
+REGISTRY.gauge("xiaohao_chat_cache_hit_ratio", "Chat cache hit ratio since start").set_function(chat_cache.hit_ratio)
+REGISTRY.gauge("xiaohao_chat_cache_bytes", "Approximate bytes held by the chat cache").set_function(lambda: chat_cache.size_bytes)
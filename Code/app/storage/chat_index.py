@@ -0,0 +1,130 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple, Any, Iterable
+
+from app.config import CHAT_CACHE_CONFIG
+from app.models.chat import Chat
+
+logger = logging.getLogger("xiaohaochat.storage.index")
+
+
+def _summary(chat_id: str, updated_at: Any, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "chat_id": chat_id,
+        "title": metadata.get("title", "无标题对话"),
+        "updated_at": updated_at,
+        # 确保persona_id字段（兼容旧版本）
+        "persona_id": metadata.get("persona_id", metadata.get("persona", "default")),
+    }
+
+
+class ChatIndex:
+    """侧边栏使用的聊天摘要索引
+
+    按聊天文件的修改时间(mtime_ns)增量维护：列出聊天时只重新解析修改时间变化过的文件，
+    本进程保存聊天时直接写入新的摘要，标题更新等小改动不会触发对整个目录的重新解析。
+    条目数有上限，超出时淘汰最久未使用的摘要（下次列出时重新解析）；按归属分组，
+    列出一个用户的聊天只访问该用户的条目。
+    """
+
+    def __init__(self, max_entries: int = CHAT_CACHE_CONFIG["index_max_entries"]):
+        # chat_id -> (mtime_ns, 归属, 摘要)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[int, str, Dict[str, Any]]]" = OrderedDict()
+        self._by_owner: Dict[str, Set[str]] = {}  # 归属 -> chat_id集合
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+
+    def _store(self, chat_id: str, entry: Tuple[int, str, Dict[str, Any]]) -> None:
+        """写入条目并淘汰超出上限的条目，调用方需持有锁"""
+        self._drop(chat_id)
+        self._entries[chat_id] = entry
+        self._by_owner.setdefault(entry[1], set()).add(chat_id)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, chat_id: str) -> None:
+        """删除条目，调用方需持有锁"""
+        entry = self._entries.pop(chat_id, None)
+        if entry is None:
+            return
+        chat_ids = self._by_owner.get(entry[1])
+        if chat_ids is not None:
+            chat_ids.discard(chat_id)
+            if not chat_ids:
+                del self._by_owner[entry[1]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, chat: Chat, mtime_ns: int) -> None:
+        """写入刚保存的聊天的摘要
+
+        Args:
+            chat: 聊天对象
+            mtime_ns: 保存后文件的修改时间
+        """
+        summary = _summary(chat.chat_id, chat.updated_at, chat.metadata)
+        with self._lock:
+            self._store(chat.chat_id, (mtime_ns, chat.metadata.get("user_id", ""), summary))
+
+    def summaries(self, entries: Iterable[os.DirEntry], owners: Set[str]) -> List[Dict[str, Any]]:
+        """返回属于指定归属的聊天摘要（未排序）
+
+        Args:
+            entries: 可能属于这些归属的聊天文件目录项（该用户的子目录和旧布局中的文件）
+            owners: 归属标识集合（用户ID，以及旧版本使用的用户名）
+
+        Returns:
+            摘要字典的拷贝列表
+        """
+        listed: List[Tuple[str, str, int]] = []
+        for entry in entries:
+            try:
+                listed.append((entry.name[:-5], entry.path, entry.stat().st_mtime_ns))
+            except OSError as e:
+                # 文件在列出后被删除或移动，下次列出时重试
+                logger.warning(f"读取聊天摘要失败: {entry.name}: {str(e)}")
+
+        # 只取出这些文件和这些归属的条目，不复制整个索引
+        current: Dict[str, Tuple[int, str, Dict[str, Any]]] = {}
+        with self._lock:
+            known = {chat_id for owner in owners for chat_id in self._by_owner.get(owner, ())}
+            for chat_id, _, mtime in listed:
+                cached = self._entries.get(chat_id)
+                if cached is not None and cached[0] == mtime:
+                    current[chat_id] = cached
+                    self._entries.move_to_end(chat_id)
+
+        parsed: Dict[str, Tuple[int, str, Dict[str, Any]]] = {}
+        for chat_id, path, mtime in listed:
+            if chat_id in current:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    chat_data = json.load(f)
+            except Exception as e:
+                # 文件在列出后被删除、移动或正被外部程序写入，下次列出时重试
+                logger.warning(f"读取聊天摘要失败: {chat_id}: {str(e)}")
+                continue
+            metadata = chat_data.get("metadata", {})
+            summary = _summary(chat_data.get("chat_id", chat_id), chat_data.get("updated_at"), metadata)
+            parsed[chat_id] = (mtime, metadata.get("user_id", ""), summary)
+        current.update(parsed)
+
+        with self._lock:
+            for chat_id, entry in parsed.items():
+                # 扫描期间本进程可能写入了更新的摘要
+                existing = self._entries.get(chat_id)
+                if existing is None or existing[0] <= entry[0]:
+                    self._store(chat_id, entry)
+            # 只列出了这些归属的文件，其他用户的条目保持不变；扫描期间新写入的条目也保留
+            for chat_id in known - current.keys():
+                self._drop(chat_id)
+        return [dict(summary) for _, owner, summary in current.values() if owner in owners]
+
+
+# 进程级单例
+chat_index = ChatIndex()
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Iterable, Iterator, Optional, TextIO
+
+from app.config import CHATS_DIR, CHAT_LAYOUT_CONFIG
+
+logger = logging.getLogger("xiaohaochat.storage.layout")
+
+# 归属无效（为空、以点开头或包含路径分隔符）的聊天放在这个目录下
+UNOWNED_DIR = "_unowned"
+
+
+def _is_chat_file(entry: os.DirEntry) -> bool:
+    return entry.name.endswith(".json") and not entry.name.startswith(".")
+
+
+@dataclass
+class LayoutMigrationReport:
+    """一次布局迁移的统计"""
+
+    scanned: int = 0  # 旧布局中的聊天文件数
+    moved: int = 0
+    owner_rewritten: int = 0  # 同时把归属从用户名改为用户ID的聊天数
+    superseded: int = 0  # 新布局中已有更新版本、直接删除旧文件的聊天数
+    failed: int = 0
+    elapsed: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "scanned": self.scanned,
+            "moved": self.moved,
+            "owner_rewritten": self.owner_rewritten,
+            "superseded": self.superseded,
+            "failed": self.failed,
+            "elapsed_s": round(self.elapsed, 2),
+        }
+
+
+class ChatLayout:
+    """聊天文件的分片目录布局
+
+    聊天保存在 chats/<用户ID>/<哈希前缀>/<chat_id>.json：每个用户一个子目录，用户目录下再按
+    chat_id 哈希的前几位分散到多个子目录，单个目录中的文件数保持在较小的范围内。列出某个用户的
+    聊天只需要遍历该用户的子目录。
+
+    旧版本把所有聊天平铺在 chats/ 下，这些文件仍可以正常读取（兼容读取），保存时写到新位置并
+    删除旧文件；migrate() 在应用运行期间逐个把旧文件移动到新布局。只知道 chat_id 时通过内存中
+    记录的归属定位文件，找不到时再依次检查旧位置和各用户目录。
+    """
+
+    def __init__(self, chats_dir: str, prefix_chars: int, max_locations: int):
+        """初始化目录布局
+
+        Args:
+            chats_dir: 聊天根目录
+            prefix_chars: 哈希前缀的十六进制位数，每位把文件分散到16个子目录
+            max_locations: 内存中记录的 chat_id -> 归属 条目数上限
+        """
+        self.chats_dir = chats_dir
+        self.prefix_chars = max(0, prefix_chars)
+        self.max_locations = max_locations
+        self._locations: "OrderedDict[str, str]" = OrderedDict()  # chat_id -> 归属目录名
+        self._lock = threading.Lock()
+
+    def owner_dir(self, owner: str) -> str:
+        """归属对应的子目录名"""
+        if not owner or owner.startswith(".") or os.path.basename(owner) != owner:
+            return UNOWNED_DIR
+        return owner
+
+    def path(self, chat_id: str, owner: str) -> str:
+        """聊天在新布局中的文件路径"""
+        name = f"{chat_id}.json"
+        if not self.prefix_chars:
+            return os.path.join(self.chats_dir, self.owner_dir(owner), name)
+        prefix = hashlib.sha1(chat_id.encode("utf-8")).hexdigest()[:self.prefix_chars]
+        return os.path.join(self.chats_dir, self.owner_dir(owner), prefix, name)
+
+    def legacy_path(self, chat_id: str) -> str:
+        """聊天在旧的平铺布局中的文件路径"""
+        return os.path.join(self.chats_dir, f"{chat_id}.json")
+
+    def remember(self, chat_id: str, owner: str) -> None:
+        """记录聊天的归属，之后只凭 chat_id 也能直接定位文件"""
+        with self._lock:
+            self._locations[chat_id] = self.owner_dir(owner)
+            self._locations.move_to_end(chat_id)
+            while len(self._locations) > self.max_locations:
+                self._locations.popitem(last=False)
+
+    def forget(self, chat_id: str) -> None:
+        with self._lock:
+            self._locations.pop(chat_id, None)
+
+    def locate(self, chat_id: str, owner: Optional[str] = None, scan: bool = True) -> Optional[str]:
+        """查找聊天文件当前所在的路径
+
+        依次检查：指定归属下的新位置、内存中记录的归属下的新位置、旧布局中的位置，
+        最后（scan为True时）检查每个用户目录。
+
+        Args:
+            chat_id: 聊天ID
+            owner: 已知的归属
+            scan: 为False时不遍历用户目录（用于保存新聊天等不需要找到旧位置的场景）
+
+        Returns:
+            文件路径，不存在时返回None
+        """
+        if not chat_id or chat_id.startswith(".") or os.path.basename(chat_id) != chat_id:
+            return None
+        if owner is not None:
+            path = self.path(chat_id, owner)
+            if os.path.exists(path):
+                return path
+        with self._lock:
+            known = self._locations.get(chat_id)
+        if known is not None and known != owner:
+            path = self.path(chat_id, known)
+            if os.path.exists(path):
+                return path
+        path = self.legacy_path(chat_id)
+        if os.path.exists(path):
+            return path
+        if not scan:
+            return None
+        try:
+            with os.scandir(self.chats_dir) as entries:
+                owner_dirs = [entry.name for entry in entries if entry.is_dir()]
+        except FileNotFoundError:
+            return None
+        for name in owner_dirs:
+            path = self.path(chat_id, name)
+            if os.path.exists(path):
+                self.remember(chat_id, name)
+                return path
+        return None
+
+    def iter_entries(self, owners: Optional[Iterable[str]] = None) -> Iterator[os.DirEntry]:
+        """逐个列出聊天文件（新布局和旧布局），不解析内容
+
+        Args:
+            owners: 只列出这些归属的子目录；旧布局中的文件无法按归属筛选，总是全部列出
+
+        Yields:
+            聊天文件的目录项，文件名为 <chat_id>.json
+        """
+        owner_dirs = None if owners is None else {self.owner_dir(owner) for owner in owners}
+        try:
+            with os.scandir(self.chats_dir) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir():
+                        if owner_dirs is None or entry.name in owner_dirs:
+                            subdirs.append(entry.path)
+                    elif _is_chat_file(entry):
+                        yield entry
+        except FileNotFoundError:
+            return
+        for owner_path in subdirs:
+            yield from self._walk(owner_path, self.prefix_chars and 1)
+
+    def _walk(self, path: str, depth: int) -> Iterator[os.DirEntry]:
+        try:
+            with os.scandir(path) as entries:
+                subdirs = []
+                for entry in entries:
+                    if depth and entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif not depth and _is_chat_file(entry):
+                        yield entry
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            yield from self._walk(subdir, depth - 1)
+
+    def iter_legacy_entries(self) -> Iterator[os.DirEntry]:
+        """逐个列出仍在旧的平铺布局中的聊天文件"""
+        try:
+            with os.scandir(self.chats_dir) as entries:
+                for entry in entries:
+                    if _is_chat_file(entry) and entry.is_file():
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    def migrate(self, owner_ids: Optional[Dict[str, str]] = None, max_files_per_second: float = 0,
+                dry_run: bool = False, progress: Optional[TextIO] = None,
+                stop: Optional[threading.Event] = None) -> LayoutMigrationReport:
+        """把旧布局中的聊天文件逐个移动到新布局，应用可以继续运行
+
+        每个文件用硬链接放到新位置后再删除旧文件，新位置已存在（应用已经保存过更新的版本）时
+        不覆盖，只删除旧文件；移动前后文件内容和修改时间不变，缓存和摘要索引仍然有效。
+        以用户名标记归属的旧聊天同时改为以用户ID标记。
+
+        Args:
+            owner_ids: 用户名 -> 用户ID，用于迁移旧版本的归属
+            max_files_per_second: 每秒最多移动的文件数，0表示不限
+            dry_run: 为True时只统计旧布局中的文件数
+            progress: 进度输出流
+            stop: 设置后在当前文件处理完后停止
+
+        Returns:
+            迁移统计
+        """
+        owner_ids = owner_ids or {}
+        report = LayoutMigrationReport()
+        started = time.perf_counter()
+        for entry in self.iter_legacy_entries():
+            if stop is not None and stop.is_set():
+                break
+            report.scanned += 1
+            if dry_run:
+                continue
+            if max_files_per_second > 0:
+                ahead = report.scanned / max_files_per_second - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+            try:
+                self._migrate_file(entry.path, entry.name[:-5], owner_ids, report)
+            except FileNotFoundError:
+                # 迁移期间应用保存或删除了这个聊天
+                continue
+            except Exception as e:
+                report.failed += 1
+                logger.error(f"迁移聊天文件失败: {entry.name}: {str(e)}")
+            if progress is not None and report.scanned % CHAT_LAYOUT_CONFIG["progress_every"] == 0:
+                print(f"已处理 {report.scanned} 个文件，移动 {report.moved} 个", file=progress)
+        report.elapsed = time.perf_counter() - started
+        if report.moved or report.failed:
+            logger.info(f"聊天目录布局迁移完成: {report.to_dict()}")
+        return report
+
+    def _migrate_file(self, legacy: str, chat_id: str, owner_ids: Dict[str, str],
+                      report: LayoutMigrationReport) -> None:
+        with open(legacy, 'r', encoding='utf-8') as f:
+            chat_data = json.load(f)
+        metadata = chat_data.setdefault("metadata", {})
+        owner = metadata.get("user_id", "")
+        rewrite = owner in owner_ids
+        if rewrite:
+            owner = metadata["user_id"] = owner_ids[owner]
+        target = self.path(chat_id, owner)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # 先记录归属：移动期间只凭 chat_id 查找的读取方能找到新位置
+        self.remember(chat_id, owner)
+        source = legacy
+        if rewrite:
+            fd, source = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(chat_data, f, ensure_ascii=False, indent=4)
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            report.superseded += 1
+        else:
+            report.moved += 1
+            report.owner_rewritten += 1 if rewrite else 0
+        finally:
+            if rewrite:
+                os.remove(source)
+        os.remove(legacy)
+
+
+# 进程级单例
+chat_layout = ChatLayout(CHATS_DIR, CHAT_LAYOUT_CONFIG["prefix_chars"], CHAT_LAYOUT_CONFIG["max_locations"])
@@ -0,0 +1,36 @@
+"""跨进程的目录锁
+
+多进程部署时，几个工作进程（和API服务）可能同时读取-修改-写入同一个目录下的文件。
+目录锁在目录中的锁文件上加排他的flock，持有期间其他进程（以及本进程的其他线程）的同一操作等待。
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁，多进程部署需要POSIX系统
+    fcntl = None
+
+
+@contextmanager
+def directory_lock(directory: str, name: str, thread_lock: threading.RLock) -> Iterator[None]:
+    """在进程内的锁和目录中锁文件的flock下执行，目录需已存在
+
+    Args:
+        directory: 被保护的目录
+        name: 锁文件名
+        thread_lock: 进程内的锁，先取得它，同一进程的线程不必争用文件锁
+    """
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(os.path.join(directory, name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
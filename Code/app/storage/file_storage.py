@@ -1,15 +1,64 @@
 import os
 import json
 import logging
-from typing import Dict, List, Any, Optional
+import time
+import tempfile
+import threading
+from typing import Dict, List, Any, Optional, Iterator, Set, Tuple, TextIO
 
-from app.config import USERS_DIR, CHATS_DIR, PERSONAS_DIR
+from app.config import USERS_DIR, PERSONAS_DIR, PERSONAS_DATA
 from app.models.user import User
 from app.models.chat import Chat
 from app.models.persona import Persona
+from app.storage.chat_cache import chat_cache
+from app.storage.chat_index import chat_index
+from app.storage.chat_layout import chat_layout, LayoutMigrationReport
+from app.storage.user_directory import user_directory
+from app.telemetry.tracing import span
+from app.telemetry.metrics import STORAGE_READ_DURATION, STORAGE_WRITE_DURATION, STORAGE_WRITTEN_BYTES
 
 logger = logging.getLogger("xiaohaochat.storage")
 
+# 聊天归属迁移每个进程只执行一次
+_owner_migration_lock = threading.Lock()
+_owner_migration_done = False
+
+def _atomic_write_json(path: str, data: Any) -> None:
+    """先写入同目录下的临时文件再原子替换，读取方不会看到写了一半的文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _exclusive_write_json(path: str, data: Any) -> bool:
+    """完整写入临时文件后以硬链接发布，目标已存在时不覆盖并返回False"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 class FileStorage:
     """文件存储实现类，用于处理用户、聊天记录和角色等数据的存储和读取"""
 
@@ -28,14 +77,33 @@ class FileStorage:
             os.makedirs(USERS_DIR, exist_ok=True)
             
             user_file = os.path.join(USERS_DIR, f"{user.username}.json")
-            with open(user_file, 'w', encoding='utf-8') as f:
-                json.dump(user.to_dict(), f, ensure_ascii=False, indent=4)
+            _atomic_write_json(user_file, user.to_dict())
+            user_directory.put(user)
             logger.info(f"用户保存成功: {user.username}")
             return True
         except Exception as e:
             logger.error(f"保存用户数据失败: {str(e)}")
             return False
 
+    @staticmethod
+    def create_user(user: User) -> bool:
+        """原子地创建新用户，用户名已存在时不覆盖
+        
+        Args:
+            user: 用户对象
+            
+        Returns:
+            创建成功返回True，用户名已存在、无效或写入失败返回False
+        """
+        try:
+            created = user_directory.create(user)
+        except Exception as e:
+            logger.error(f"创建用户失败: {str(e)}")
+            return False
+        if created:
+            logger.info(f"用户创建成功: {user.username}")
+        return created
+
     @staticmethod
     def load_user(username: str) -> Optional[User]:
         """通过用户名加载用户数据
@@ -46,15 +114,19 @@ class FileStorage:
         Returns:
             如果用户存在，返回用户对象，否则返回None
         """
-        user_file = os.path.join(USERS_DIR, f"{username}.json")
-        if os.path.exists(user_file):
-            try:
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-                    return User.from_dict(user_data)
-            except Exception as e:
-                logger.error(f"加载用户数据失败: {str(e)}")
-        return None
+        return user_directory.get(username)
+
+    @staticmethod
+    def load_user_by_id(user_id: str) -> Optional[User]:
+        """通过用户ID加载用户数据
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            如果用户存在，返回用户对象，否则返回None
+        """
+        return user_directory.get_by_id(user_id)
 
     @staticmethod
     def user_exists(username: str) -> bool:
@@ -66,8 +138,7 @@ class FileStorage:
         Returns:
             用户存在返回True，否则返回False
         """
-        user_file = os.path.join(USERS_DIR, f"{username}.json")
-        return os.path.exists(user_file)
+        return user_directory.exists(username)
 
     @staticmethod
     def save_chat(chat: Chat) -> bool:
@@ -79,44 +150,230 @@ class FileStorage:
         Returns:
             保存成功返回True，否则返回False
         """
-        try:
-            # 确保目录存在
-            os.makedirs(CHATS_DIR, exist_ok=True)
-            
-            # 确保metadata中包含persona_id（兼容旧版本）
-            if "persona" in chat.metadata and "persona_id" not in chat.metadata:
-                chat.metadata["persona_id"] = chat.metadata["persona"]
-            if "persona_id" not in chat.metadata:
-                chat.metadata["persona_id"] = "default"
+        with span("storage.save_chat", chat_id=chat.chat_id) as s:
+            try:
+                # 确保metadata中包含persona_id（兼容旧版本）
+                if "persona" in chat.metadata and "persona_id" not in chat.metadata:
+                    chat.metadata["persona_id"] = chat.metadata["persona"]
+                if "persona_id" not in chat.metadata:
+                    chat.metadata["persona_id"] = "default"
                 
-            chat_file = os.path.join(CHATS_DIR, f"{chat.chat_id}.json")
-            with open(chat_file, 'w', encoding='utf-8') as f:
-                json.dump(chat.to_dict(), f, ensure_ascii=False, indent=4)
-            logger.info(f"聊天记录保存成功: {chat.chat_id}")
-            return True
-        except Exception as e:
-            logger.error(f"保存聊天记录失败: {str(e)}")
-            return False
+                # 旧布局中的文件或归属变更前的文件在写入新位置后删除
+                chat_file = chat_layout.path(chat.chat_id, chat.user_id)
+                previous = chat_layout.locate(chat.chat_id, chat.user_id, scan=False)
+                os.makedirs(os.path.dirname(chat_file), exist_ok=True)
+                started = time.perf_counter()
+                _atomic_write_json(chat_file, chat.to_dict())
+                STORAGE_WRITE_DURATION.observe(time.perf_counter() - started)
+                chat_layout.remember(chat.chat_id, chat.user_id)
+                if previous is not None and previous != chat_file:
+                    _remove_quietly(previous)
+            
+                # 写入后刷新缓存，避免下次加载重新解析
+                stat = os.stat(chat_file)
+                chat_cache.put(chat, stat.st_mtime_ns, stat.st_size)
+                chat_index.put(chat, stat.st_mtime_ns)
+                s.set("bytes", stat.st_size)
+                STORAGE_WRITTEN_BYTES.inc(stat.st_size)
+                logger.info(f"聊天记录保存成功: {chat.chat_id}")
+                return True
+            except Exception as e:
+                logger.error(f"保存聊天记录失败: {str(e)}")
+                return False
+
+    @staticmethod
+    def save_chats(chats: List[Chat], overwrite: bool = False) -> int:
+        """批量写入聊天记录（用于导入）
+        
+        与save_chat不同，写入的聊天不放入缓存和摘要索引，大批量导入不会挤掉正在使用的聊天，
+        内存占用也不随导入的数量增长。
+        
+        Args:
+            chats: 聊天对象列表
+            overwrite: 为False时跳过已存在的聊天
+            
+        Returns:
+            实际写入的聊天数量
+        """
+        written = 0
+        with span("storage.save_chats", chats=len(chats)) as s:
+            started = time.perf_counter()
+            for chat in chats:
+                chat_file = chat_layout.path(chat.chat_id, chat.user_id)
+                previous = chat_layout.locate(chat.chat_id, chat.user_id)
+                if not overwrite and previous is not None:
+                    continue
+                try:
+                    os.makedirs(os.path.dirname(chat_file), exist_ok=True)
+                    _atomic_write_json(chat_file, chat.to_dict())
+                    stat = os.stat(chat_file)
+                except Exception as e:
+                    logger.error(f"保存聊天记录失败: {chat.chat_id}: {str(e)}")
+                    continue
+                chat_layout.remember(chat.chat_id, chat.user_id)
+                if previous is not None and previous != chat_file:
+                    _remove_quietly(previous)
+                    chat_cache.invalidate(chat.chat_id)
+                # 不写入摘要索引：导入的聊天数量不限，下次列出时按修改时间解析即可
+                STORAGE_WRITTEN_BYTES.inc(stat.st_size)
+                written += 1
+            STORAGE_WRITE_DURATION.observe(time.perf_counter() - started)
+            s.set("written", written)
+        return written
+
+    @staticmethod
+    def iter_chats(owners: Optional[Set[str]] = None) -> Iterator[Chat]:
+        """逐个读取聊天记录（用于导出等全量遍历）
+        
+        按目录顺序逐个解析文件，任意时刻只持有一个聊天，也不经过缓存。
+        指定归属时只遍历这些用户的子目录（以及旧布局中的文件）。
+        
+        Args:
+            owners: 只返回归属在该集合中的聊天，None表示全部
+            
+        Yields:
+            聊天对象
+        """
+        seen = set()
+        for entry in chat_layout.iter_entries(owners):
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    chat = Chat.from_dict(json.load(f))
+            except FileNotFoundError:
+                # 遍历期间被迁移到新布局，会在用户子目录中再次遇到
+                continue
+            except Exception as e:
+                logger.error(f"读取聊天记录失败: {entry.name}: {str(e)}")
+                continue
+            if chat.chat_id in seen:
+                continue
+            seen.add(chat.chat_id)
+            if owners is None or chat.user_id in owners:
+                yield chat
 
     @staticmethod
-    def load_chat(chat_id: str) -> Optional[Chat]:
+    def load_chat(chat_id: str, cache: bool = True, user_id: Optional[str] = None) -> Optional[Chat]:
         """加载指定ID的聊天记录
         
         Args:
             chat_id: 聊天ID
+            cache: 为False时绕过缓存直接读取文件，也不放入缓存（用于归档等一次性遍历）
+            user_id: 已知的归属，用于直接定位文件；也兼容旧的平铺布局
             
         Returns:
             如果聊天记录存在，返回Chat对象，否则返回None
         """
-        chat_file = os.path.join(CHATS_DIR, f"{chat_id}.json")
-        if os.path.exists(chat_file):
+        with span("storage.load_chat", chat_id=chat_id) as s:
+            started = time.perf_counter()
+            chat_file = chat_layout.locate(chat_id, user_id)
+            if chat_file is None:
+                return None
+            try:
+                stat = os.stat(chat_file)
+            except OSError:
+                # 刚被迁移到新布局或归属变更后重新保存
+                chat_file = chat_layout.locate(chat_id, user_id)
+                try:
+                    stat = os.stat(chat_file) if chat_file else None
+                except OSError:
+                    stat = None
+                if stat is None:
+                    return None
+            
+            # 文件未变化时直接使用缓存
+            cached = chat_cache.get(chat_id, stat.st_mtime_ns) if cache else None
+            s.set("cache_hit", cached is not None)
+            if cached is not None:
+                STORAGE_READ_DURATION.labels(source="cache").observe(time.perf_counter() - started)
+                return cached
+            
             try:
                 with open(chat_file, 'r', encoding='utf-8') as f:
                     chat_data = json.load(f)
-                    return Chat.from_dict(chat_data)
+                chat = Chat.from_dict(chat_data)
+                chat_layout.remember(chat_id, chat.user_id)
+                if cache:
+                    chat_cache.put(chat, stat.st_mtime_ns, stat.st_size)
+                STORAGE_READ_DURATION.labels(source="disk").observe(time.perf_counter() - started)
+                return chat
             except Exception as e:
                 logger.error(f"加载聊天记录失败: {str(e)}")
-        return None
+            return None
+
+    @staticmethod
+    def delete_chat(chat_id: str, expected_mtime_ns: Optional[int] = None,
+                    user_id: Optional[str] = None) -> bool:
+        """删除聊天记录文件
+        
+        Args:
+            chat_id: 聊天ID
+            expected_mtime_ns: 指定时只在文件修改时间仍为该值时删除（读取后没有被再次写入）
+            user_id: 已知的归属，用于直接定位文件
+            
+        Returns:
+            删除成功返回True，文件不存在、已被修改或删除失败返回False
+        """
+        chat_file = chat_layout.locate(chat_id, user_id)
+        if chat_file is None:
+            return False
+        try:
+            if expected_mtime_ns is not None and os.stat(chat_file).st_mtime_ns != expected_mtime_ns:
+                return False
+            os.remove(chat_file)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"删除聊天记录失败: {chat_id}: {str(e)}")
+            return False
+        # 删除时文件可能正被迁移工具链接到新布局（移动不改变修改时间），一并删除
+        moved = chat_layout.locate(chat_id, user_id, scan=False)
+        try:
+            if moved is not None and (expected_mtime_ns is None or
+                                      os.stat(moved).st_mtime_ns == expected_mtime_ns):
+                os.remove(moved)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"删除聊天记录失败: {chat_id}: {str(e)}")
+            return False
+        chat_cache.invalidate(chat_id)
+        chat_layout.forget(chat_id)
+        logger.info(f"聊天记录删除成功: {chat_id}")
+        return True
+
+    @staticmethod
+    def list_chat_files() -> Iterator[Tuple[str, int, int]]:
+        """逐个列出热存储中的聊天文件（新布局和旧布局），不解析内容
+        
+        Yields:
+            (聊天ID, 修改时间mtime_ns, 文件大小)
+        """
+        for entry in chat_layout.iter_entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry.name[:-5], stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def is_chat_cached(chat_id: str, user_id: Optional[str] = None) -> bool:
+        """检查聊天记录是否已在缓存中且与文件一致
+        
+        Args:
+            chat_id: 聊天ID
+            user_id: 已知的归属，用于直接定位文件
+            
+        Returns:
+            已缓存且未过期返回True，否则返回False
+        """
+        chat_file = chat_layout.locate(chat_id, user_id, scan=False)
+        try:
+            stat = os.stat(chat_file) if chat_file else None
+        except OSError:
+            return False
+        if stat is None:
+            return False
+        return chat_cache.contains(chat_id, stat.st_mtime_ns)
 
     @staticmethod
     def get_user_chats(user_id: str) -> List[Dict]:
@@ -129,39 +386,84 @@ class FileStorage:
             聊天记录摘要列表
         """
         user_chats = []
-        try:
-            # 确保目录存在
-            os.makedirs(CHATS_DIR, exist_ok=True)
+        owners = {user_id}
+        if not _owner_migration_done:
+            # 旧版本以用户名作为聊天的归属，归属迁移完成前这些记录同样属于该用户；
+            # 迁移之后仍以用户名标记的聊天没有对应的用户，不再按用户名匹配
+            legacy_owner = user_directory.username_for(user_id)
+            if legacy_owner:
+                owners.add(legacy_owner)
+        with span("storage.list_chats") as s:
+            try:
+                # 只遍历该用户的子目录（和尚未迁移的旧布局文件），摘要索引只重新解析修改过的文件
+                user_chats = chat_index.summaries(chat_layout.iter_entries(owners), owners)
             
-            for filename in os.listdir(CHATS_DIR):
-                if not filename.endswith(".json"):
-                    continue
-                    
-                chat_file = os.path.join(CHATS_DIR, filename)
-                with open(chat_file, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)
-                    metadata = chat_data.get("metadata", {})
-                    
-                    # 只包含属于该用户的聊天
-                    if metadata.get("user_id") == user_id:
-                        # 确保persona_id字段（兼容旧版本）
-                        persona_id = metadata.get("persona_id", metadata.get("persona", "default"))
-                        
-                        chat_summary = {
-                            "chat_id": chat_data.get("chat_id"),
-                            "title": metadata.get("title", "无标题对话"),
-                            "updated_at": chat_data.get("updated_at"),
-                            "persona_id": persona_id
-                        }
-                        user_chats.append(chat_summary)
-            
-            # 按更新时间降序排序
-            user_chats.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-        except Exception as e:
-            logger.error(f"获取用户聊天记录列表失败: {str(e)}")
+                # 按更新时间降序排序
+                user_chats.sort(key=lambda x: x.get("updated_at") or "", reverse=True)
+                s.set("chats", len(user_chats))
+            except Exception as e:
+                logger.error(f"获取用户聊天记录列表失败: {str(e)}")
         
         return user_chats
 
+    @staticmethod
+    def migrate_chat_owners() -> int:
+        """把旧版本以用户名标记归属的聊天改为以用户ID标记
+        
+        每个进程只扫描一次，之后的调用直接返回0。
+        
+        Returns:
+            本次迁移的聊天数量
+        """
+        global _owner_migration_done
+        with _owner_migration_lock:
+            if _owner_migration_done:
+                return 0
+            user_ids = user_directory.usernames()
+            known_ids = set(user_ids.values())
+            migrated = 0
+            try:
+                # 新布局中的聊天总是以用户ID标记归属，只需检查旧布局中的文件
+                paths = [entry.path for entry in chat_layout.iter_legacy_entries()]
+                for chat_file in paths:
+                    try:
+                        with open(chat_file, 'r', encoding='utf-8') as f:
+                            chat_data = json.load(f)
+                        metadata = chat_data.setdefault("metadata", {})
+                        owner = metadata.get("user_id")
+                        if owner in known_ids or owner not in user_ids:
+                            continue
+                        metadata["user_id"] = user_ids[owner]
+                        _atomic_write_json(chat_file, chat_data)
+                        migrated += 1
+                    except Exception as e:
+                        logger.error(f"迁移聊天归属失败: {chat_file}: {str(e)}")
+            except FileNotFoundError:
+                pass
+            if migrated:
+                logger.info(f"已将 {migrated} 个聊天的归属从用户名迁移为用户ID")
+            _owner_migration_done = True
+            return migrated
+
+    @staticmethod
+    def migrate_chat_layout(max_files_per_second: float = 0, dry_run: bool = False,
+                            progress: Optional[TextIO] = None) -> LayoutMigrationReport:
+        """把旧的平铺布局中的聊天文件移动到分片布局，可以在应用运行期间执行
+        
+        Args:
+            max_files_per_second: 每秒最多移动的文件数，0表示不限
+            dry_run: 为True时只统计旧布局中的文件数
+            progress: 进度输出流
+            
+        Returns:
+            迁移统计
+        """
+        with span("storage.migrate_chat_layout", dry_run=dry_run) as s:
+            report = chat_layout.migrate(user_directory.usernames(), max_files_per_second,
+                                         dry_run=dry_run, progress=progress)
+            s.set("moved", report.moved)
+        return report
+
     @staticmethod
     def save_persona(persona: Persona) -> bool:
         """保存角色配置到文件
@@ -185,6 +487,30 @@ class FileStorage:
             logger.error(f"保存角色失败: {str(e)}")
             return False
 
+    @staticmethod
+    def create_persona(persona: Persona) -> bool:
+        """创建新的角色配置文件，角色已存在时不覆盖
+        
+        多个进程同时创建同一ID的角色只有一个成功。
+        
+        Args:
+            persona: 角色对象
+            
+        Returns:
+            创建成功返回True，角色已存在或保存失败返回False
+        """
+        try:
+            os.makedirs(PERSONAS_DIR, exist_ok=True)
+            persona_file = os.path.join(PERSONAS_DIR, f"{persona.persona_id}.json")
+            if not _exclusive_write_json(persona_file, persona.to_dict()):
+                logger.info(f"创建角色失败: 角色已存在: {persona.persona_id}")
+                return False
+            logger.info(f"角色创建成功: {persona.persona_id}")
+            return True
+        except Exception as e:
+            logger.error(f"创建角色失败: {str(e)}")
+            return False
+
     @staticmethod
     def load_persona(persona_id: str) -> Optional[Persona]:
         """加载指定ID的角色配置
@@ -205,6 +531,20 @@ class FileStorage:
                 logger.error(f"加载角色配置失败: {str(e)}")
         return None
 
+    @staticmethod
+    def resolve_persona(persona_id: str) -> Optional[Persona]:
+        """加载角色，内置角色优先，其次是保存的自定义角色
+        
+        Args:
+            persona_id: 角色ID
+            
+        Returns:
+            角色对象，不存在时返回None
+        """
+        if persona_id in PERSONAS_DATA:
+            return Persona.from_dict(persona_id, PERSONAS_DATA[persona_id])
+        return FileStorage.load_persona(persona_id)
+
     @staticmethod
     def load_all_personas() -> Dict[str, Persona]:
         """加载所有可用的角色配置
@@ -217,16 +557,16 @@ class FileStorage:
             # 确保目录存在
             os.makedirs(PERSONAS_DIR, exist_ok=True)
             
-            for filename in os.listdir(PERSONAS_DIR):
-                if not filename.endswith(".json"):
-                    continue
+            with os.scandir(PERSONAS_DIR) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json"):
+                        continue
                     
-                persona_id = filename[:-5]  # 去掉.json后缀
-                persona_file = os.path.join(PERSONAS_DIR, filename)
-                
-                with open(persona_file, 'r', encoding='utf-8') as f:
-                    persona_data = json.load(f)
-                    personas[persona_id] = Persona.from_dict(persona_id, persona_data)
+                    persona_id = entry.name[:-5]  # 去掉.json后缀
+                    
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        persona_data = json.load(f)
+                        personas[persona_id] = Persona.from_dict(persona_id, persona_data)
         except Exception as e:
             logger.error(f"加载所有角色配置失败: {str(e)}")
         
@@ -243,4 +583,25 @@ class FileStorage:
             角色存在返回True，否则返回False
         """
         persona_file = os.path.join(PERSONAS_DIR, f"{persona_id}.json")
-        return os.path.exists(persona_file) 
\ No newline at end of file
+        return os.path.exists(persona_file) 
+
+    @staticmethod
+    def delete_persona(persona_id: str) -> bool:
+        """删除角色配置文件
+        
+        Args:
+            persona_id: 角色ID
+            
+        Returns:
+            删除成功返回True，角色不存在或删除失败返回False
+        """
+        persona_file = os.path.join(PERSONAS_DIR, f"{persona_id}.json")
+        try:
+            os.remove(persona_file)
+            logger.info(f"角色删除成功: {persona_id}")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"删除角色失败: {str(e)}")
+            return False
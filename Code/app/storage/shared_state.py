@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.config import SHARED_STATE_CONFIG
+
+logger = logging.getLogger("xiaohaochat.storage.state")
+
+
+class SharedState:
+    """进程间共享的键值状态
+
+    多进程部署时，会话令牌、角色列表版本、登录限流、交互式生成计数和后台任务的租约等需要在
+    所有工作进程之间一致的状态都保存在这里。值是可JSON序列化的对象，按命名空间分组，可设置
+    过期时间（秒），过期的键视为不存在。update 在一个事务内完成读取和写入，是其余原子操作的基础。
+    """
+
+    # 状态是否真正跨进程共享（内存实现只在本进程内可见）
+    shared = False
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> bool:
+        raise NotImplementedError
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        """命名空间中所有未过期的键值"""
+        raise NotImplementedError
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], ttl: Optional[float] = None) -> Any:
+        """原子地读取-修改-写入一个键
+
+        Args:
+            namespace: 命名空间
+            key: 键
+            func: 参数为当前值（不存在时为None），返回新值；返回None时删除该键，
+                返回参数对象本身时不做修改（过期时间也不变）
+            ttl: 新值的过期秒数，None表示不过期
+
+        Returns:
+            新值
+        """
+        raise NotImplementedError
+
+    def incr(self, namespace: str, key: str, delta: int = 1) -> int:
+        """计数器加delta，返回新值"""
+        return self.update(namespace, key, lambda value: (value or 0) + delta)
+
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """键不存在时写入
+
+        Returns:
+            写入成功返回True，键已存在返回False
+        """
+        added = []
+
+        def put(current: Any) -> Any:
+            if current is not None:
+                return current
+            added.append(True)
+            return value
+
+        self.update(namespace, key, put, ttl)
+        return bool(added)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续期一个租约，同一时刻只有一个持有者（用于只应在一个进程中运行的后台任务）
+
+        Args:
+            name: 租约名
+            owner: 持有者标识，通常为主机名和进程ID
+            ttl: 租约有效秒数，持有者需要在此之前续期
+
+        Returns:
+            本持有者持有租约时返回True
+        """
+        return self.update("leases", name, lambda current: owner if current in (None, owner) else current,
+                           ttl) == owner
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """释放本持有者的租约"""
+        self.update("leases", name, lambda current: None if current == owner else current)
+
+
+class MemorySharedState(SharedState):
+    """进程内实现，用于单进程运行和测试；值以JSON保存，与SQLite实现一样返回副本"""
+
+    def __init__(self):
+        self._data: Dict[Tuple[str, str], Tuple[str, Optional[float]]] = {}
+        self._lock = threading.RLock()
+
+    def _read(self, namespace: str, key: str) -> Any:
+        entry = self._data.get((namespace, key))
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._data[(namespace, key)]
+            return None
+        return json.loads(entry[0])
+
+    def _write(self, namespace: str, key: str, value: Any, ttl: Optional[float]) -> None:
+        if value is None:
+            self._data.pop((namespace, key), None)
+        else:
+            self._data[(namespace, key)] = (json.dumps(value), time.time() + ttl if ttl is not None else None)
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._read(namespace, key)
+        return default if value is None else value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._write(namespace, key, value, ttl)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._read(namespace, key) is not None and self._data.pop((namespace, key), None) is not None
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        with self._lock:
+            keys = [key for ns, key in self._data if ns == namespace]
+            values = {key: self._read(namespace, key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], ttl: Optional[float] = None) -> Any:
+        with self._lock:
+            current = self._read(namespace, key)
+            value = func(current)
+            if value is not current:
+                self._write(namespace, key, value, ttl)
+            return value
+
+
+class SqliteSharedState(SharedState):
+    """SQLite实现，同一台机器上的所有工作进程共享一个数据库文件
+
+    使用WAL模式，读取不阻塞写入；每个线程使用自己的连接。过期的键在读取时忽略，
+    每 purge_every 次写入清理一次。
+    """
+
+    shared = True
+
+    def __init__(self, path: str, busy_timeout: float = 5.0, purge_every: int = 1000):
+        """初始化共享状态
+
+        Args:
+            path: 数据库文件
+            busy_timeout: 等待其他进程释放写锁的秒数
+            purge_every: 每多少次写入清理一次过期的键
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute("CREATE TABLE IF NOT EXISTS state (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                                   "value TEXT NOT NULL, expires REAL, PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, conn: sqlite3.Connection, namespace: str, key: str) -> Any:
+        row = conn.execute("SELECT value FROM state WHERE namespace = ? AND key = ? "
+                           "AND (expires IS NULL OR expires > ?)", (namespace, key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, conn: sqlite3.Connection, namespace: str, key: str, value: Any, ttl: Optional[float]) -> None:
+        if value is None:
+            conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+        else:
+            conn.execute("INSERT OR REPLACE INTO state (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                         (namespace, key, json.dumps(value), time.time() + ttl if ttl is not None else None))
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute("DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        value = self._read(self._connection(), namespace, key)
+        return default if value is None else value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._write(self._connection(), namespace, key, value, ttl)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        cursor = self._connection().execute("DELETE FROM state WHERE namespace = ? AND key = ? "
+                                            "AND (expires IS NULL OR expires > ?)", (namespace, key, time.time()))
+        return cursor.rowcount > 0
+
+    def items(self, namespace: str) -> Dict[str, Any]:
+        rows = self._connection().execute("SELECT key, value FROM state WHERE namespace = ? "
+                                          "AND (expires IS NULL OR expires > ?)", (namespace, time.time()))
+        return {key: json.loads(value) for key, value in rows}
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], ttl: Optional[float] = None) -> Any:
+        conn = self._connection()
+        # IMMEDIATE：开始时即取得写锁，读取的值在提交前不会被其他进程修改
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._read(conn, namespace, key)
+            value = func(current)
+            if value is not current:
+                self._write(conn, namespace, key, value, ttl)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return value
+
+
+def process_id() -> str:
+    """本进程在共享状态中的标识（主机名:进程ID）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def create_shared_state(backend: Optional[str] = None) -> SharedState:
+    """创建 SHARED_STATE_CONFIG["backend"] 指定的共享状态（"sqlite" 或 "memory"）"""
+    backend = backend or SHARED_STATE_CONFIG["backend"]
+    if backend == "memory":
+        return MemorySharedState()
+    if backend == "sqlite":
+        return SqliteSharedState(SHARED_STATE_CONFIG["path"], SHARED_STATE_CONFIG["busy_timeout"])
+    raise ValueError(f"未知的共享状态后端: {backend}")
+
+
+# 进程级单例
+shared_state = create_shared_state()
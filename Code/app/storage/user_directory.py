@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import logging
+import tempfile
+import threading
+from dataclasses import replace
+from typing import Dict, Optional
+
+from app.config import USERS_DIR
+from app.models.user import User
+
+logger = logging.getLogger("xiaohaochat.storage.users")
+
+
+# 形如用户ID（UUID，带或不带连字符）的字符串
+_USER_ID_LIKE = re.compile(r"^[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}$", re.IGNORECASE)
+
+
+def _valid_username(username: str) -> bool:
+    """用户名直接用作文件名，不能为空、以点开头或包含路径分隔符；也不能形如用户ID，
+    以免与以用户ID标记归属的聊天、索引等混淆"""
+    return (bool(username) and not username.startswith(".") and "/" not in username and "\\" not in username
+            and not _USER_ID_LIKE.match(username))
+
+
+class UserDirectory:
+    """用户目录：用户名与用户ID的内存索引
+
+    首次使用时从用户目录一次性加载全部用户记录，之后查询只访问内存。每次查询前对目录做一次
+    stat，目录的修改时间变化（其他进程注册了用户或修改了密码——写入都是原子替换，会改变目录
+    的修改时间）时重新扫描，只重新解析修改时间变化过的文件。本进程的写入直接更新索引。
+    """
+
+    def __init__(self, users_dir: str):
+        self.users_dir = users_dir
+        self._by_name: Dict[str, User] = {}
+        self._name_by_id: Dict[str, str] = {}
+        self._file_mtimes: Dict[str, int] = {}  # 用户名 -> 记录文件的修改时间
+        self._dir_mtime_ns: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, username: str) -> str:
+        return os.path.join(self.users_dir, f"{username}.json")
+
+    def _index(self, user: User, mtime_ns: int) -> None:
+        previous = self._by_name.get(user.username)
+        if previous is not None and previous.user_id != user.user_id:
+            self._name_by_id.pop(previous.user_id, None)
+        self._by_name[user.username] = user
+        self._name_by_id[user.user_id] = user.username
+        self._file_mtimes[user.username] = mtime_ns
+
+    def _refresh(self) -> None:
+        """目录有变化时同步索引，调用方需持有锁"""
+        try:
+            dir_mtime = os.stat(self.users_dir).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        if self._dir_mtime_ns is not None and dir_mtime == self._dir_mtime_ns:
+            return
+
+        seen = set()
+        if dir_mtime is not None:
+            with os.scandir(self.users_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json") or not entry.is_file():
+                        continue
+                    username = entry.name[:-5]
+                    seen.add(username)
+                    mtime = entry.stat().st_mtime_ns
+                    if self._file_mtimes.get(username) == mtime:
+                        continue
+                    try:
+                        with open(entry.path, 'r', encoding='utf-8') as f:
+                            user = User.from_dict(json.load(f))
+                    except Exception as e:
+                        logger.error(f"加载用户数据失败: {entry.name}: {str(e)}")
+                        continue
+                    self._index(user, mtime)
+        for username in [name for name in self._by_name if name not in seen]:
+            self._name_by_id.pop(self._by_name.pop(username).user_id, None)
+            self._file_mtimes.pop(username, None)
+        if self._dir_mtime_ns is None:
+            logger.info(f"用户目录已加载: {len(self._by_name)} 个用户")
+        self._dir_mtime_ns = dir_mtime if dir_mtime is not None else 0
+
+    def get(self, username: str) -> Optional[User]:
+        """按用户名查找用户，返回独立的拷贝"""
+        with self._lock:
+            self._refresh()
+            user = self._by_name.get(username)
+            return replace(user) if user is not None else None
+
+    def get_by_id(self, user_id: str) -> Optional[User]:
+        """按用户ID查找用户，返回独立的拷贝"""
+        with self._lock:
+            self._refresh()
+            username = self._name_by_id.get(user_id)
+            return replace(self._by_name[username]) if username is not None else None
+
+    def username_for(self, user_id: str) -> Optional[str]:
+        """返回用户ID对应的用户名"""
+        with self._lock:
+            self._refresh()
+            return self._name_by_id.get(user_id)
+
+    def exists(self, username: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return username in self._by_name
+
+    def usernames(self) -> Dict[str, str]:
+        """返回 用户名 -> 用户ID 的映射快照"""
+        with self._lock:
+            self._refresh()
+            return {name: user.user_id for name, user in self._by_name.items()}
+
+    def create(self, user: User) -> bool:
+        """原子地创建用户记录，用户名已存在时不覆盖
+
+        记录先完整写入临时文件，再以硬链接发布到最终路径：链接在目标已存在时失败，
+        多个进程同时注册同一用户名只有一个成功，读取方也不会看到写了一半的记录。
+
+        Args:
+            user: 新用户
+
+        Returns:
+            创建成功返回True，用户名已存在或无效时返回False
+        """
+        if not _valid_username(user.username):
+            logger.info(f"注册失败: 用户名无效: {user.username!r}")
+            return False
+        if self.username_for(user.username) is not None:
+            logger.info(f"注册失败: 用户名与已有用户的ID相同: {user.username!r}")
+            return False
+        os.makedirs(self.users_dir, exist_ok=True)
+        path = self._path(user.username)
+        fd, tmp_path = tempfile.mkstemp(dir=self.users_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(user.to_dict(), f, ensure_ascii=False, indent=4)
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        self.put(user)
+        return True
+
+    def put(self, user: User) -> None:
+        """写穿：记录文件写入成功后更新索引"""
+        try:
+            mtime = os.stat(self._path(user.username)).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            self._index(replace(user), mtime)
+
+
+# 进程级单例
+user_directory = UserDirectory(USERS_DIR)
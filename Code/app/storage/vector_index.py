@@ -0,0 +1,414 @@
+import os
+import json
+import math
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from app.config import VECTOR_INDEX_CONFIG
+from app.storage.file_lock import directory_lock
+from app.storage.file_storage import _atomic_write_json
+
+logger = logging.getLogger("xiaohaochat.storage.vectors")
+
+META_FILE = "index.json"
+LOCK_FILE = "index.lock"
+# 训练和归簇时每批计算的行数，限制临时矩阵的大小
+_BATCH_ROWS = 16384
+
+
+class _Snapshot:
+    """某一时刻的索引内容；检索只读取快照，与追加和删除互不阻塞"""
+
+    __slots__ = ("mtime", "version", "count", "indexed", "deleted_count", "trained_rows",
+                 "vectors", "keys", "deleted", "centroids", "lists")
+
+    def __init__(self):
+        self.mtime = 0
+        self.version = 0
+        self.count = 0
+        self.indexed = 0  # 前indexed行按簇排列，之后是训练后追加、尚未归簇的行
+        self.deleted_count = 0
+        self.trained_rows = 0  # 训练聚类中心时的行数
+        self.vectors: Optional[np.ndarray] = None
+        self.keys: Optional[np.ndarray] = None
+        self.deleted: Optional[np.ndarray] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: Optional[np.ndarray] = None  # 第i个簇占据 [lists[i], lists[i+1]) 行
+
+
+class VectorIndex:
+    """基于内存映射文件的向量索引
+
+    相似度为内积，向量应事先归一化（此时即余弦相似度）。一个目录保存一个索引：index.json
+    记录维度、行数和当前版本，各数组文件名带版本号：
+
+        vectors.<版本>.f32    count × dim 个float32
+        keys.<版本>.i64       每行的键（调用方的ID），检索结果按键返回
+        deleted.<版本>.u8     墓碑，删除只把对应字节置1
+        centroids.<版本>.f32  IVF聚类中心
+        lists.<版本>.i64      每个簇的起始行
+
+    追加的向量写到当前版本文件的末尾，替换 index.json 后生效；读取方只使用 index.json 中记录
+    的前count行，追加不影响正在进行的检索。打开索引只建立内存映射，不把向量读入内存。
+
+    行数较少时检索对全部向量做一次矩阵-向量乘法（精确）。行数达到 ivf_min_rows 后由
+    optimize 训练IVF：k-means把向量分为nlist个簇，重写文件使同一簇的向量连续存放，检索时只
+    扫描与问题最接近的nprobe个簇，以及训练后追加、尚未归簇的尾部。nprobe越大召回率越高、越慢。
+    压缩（丢弃墓碑）与重新归簇一起进行，写出新版本文件后替换 index.json，之前打开的内存映射
+    仍指向旧文件。
+
+    追加、删除和重写在索引目录的文件锁（flock）下进行，多个进程写入同一个索引时依次执行。
+    """
+
+    def __init__(self, directory: str, dim: Optional[int] = None, readonly: bool = False,
+                 ivf_min_rows: Optional[int] = None, nprobe: Optional[int] = None):
+        """打开索引，不存在且给出dim时创建空索引
+
+        Args:
+            directory: 索引目录
+            dim: 向量维度，打开已有索引时可省略（给出时必须一致）
+            readonly: 只读打开，其他进程写入后检索时自动重新加载
+            ivf_min_rows: 有效行数达到该值后 optimize 训练IVF
+            nprobe: 默认扫描的簇数
+
+        Raises:
+            FileNotFoundError: 索引不存在且未给出dim，或以只读方式打开不存在的索引
+            ValueError: 维度与已有索引不一致
+        """
+        self.directory = directory
+        self.readonly = readonly
+        self.ivf_min_rows = ivf_min_rows or VECTOR_INDEX_CONFIG["ivf_min_rows"]
+        self.nprobe = nprobe or VECTOR_INDEX_CONFIG["nprobe"]
+        self._lock = threading.RLock()
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(meta_path):
+            if dim is None or readonly:
+                raise FileNotFoundError(f"向量索引不存在: {directory}")
+            os.makedirs(directory, exist_ok=True)
+            _atomic_write_json(meta_path, {"dim": dim, "version": 1, "count": 0, "indexed": 0,
+                                           "deleted": 0, "nlist": 0, "trained_rows": 0})
+        with open(meta_path, "r", encoding="utf-8") as f:
+            self.dim = int(json.load(f)["dim"])
+        if dim is not None and dim != self.dim:
+            raise ValueError(f"向量维度与索引不一致: {dim} != {self.dim}")
+        self._snapshot = self._load()
+
+    # 文件
+
+    def _path(self, name: str, version: int, ext: str) -> str:
+        return os.path.join(self.directory, f"{name}.{version:06d}.{ext}")
+
+    def _map(self, name: str, version: int, ext: str, dtype, shape: Tuple[int, ...], writable: bool = False):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._path(name, version, ext), dtype=dtype, mode="r+" if writable else "r", shape=shape)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """在进程内的锁和索引目录的文件锁下修改索引"""
+        with directory_lock(self.directory, LOCK_FILE, self._lock):
+            yield
+
+    def _load(self) -> _Snapshot:
+        meta_path = os.path.join(self.directory, META_FILE)
+        mtime = os.stat(meta_path).st_mtime_ns
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        snap = _Snapshot()
+        snap.mtime = mtime
+        snap.version = meta["version"]
+        snap.count = meta["count"]
+        snap.indexed = meta["indexed"]
+        snap.deleted_count = meta["deleted"]
+        snap.trained_rows = meta.get("trained_rows", 0)
+        snap.vectors = self._map("vectors", snap.version, "f32", np.float32, (snap.count, self.dim))
+        snap.keys = self._map("keys", snap.version, "i64", np.int64, (snap.count,))
+        snap.deleted = self._map("deleted", snap.version, "u8", np.uint8, (snap.count,), writable=not self.readonly)
+        if meta["nlist"]:
+            snap.centroids = self._map("centroids", snap.version, "f32", np.float32, (meta["nlist"], self.dim))
+            snap.lists = self._map("lists", snap.version, "i64", np.int64, (meta["nlist"] + 1,))
+        return snap
+
+    def _commit(self, snap: _Snapshot) -> None:
+        """写入 index.json 并切换到新的快照"""
+        meta = {
+            "dim": self.dim, "version": snap.version, "count": snap.count, "indexed": snap.indexed,
+            "deleted": snap.deleted_count, "nlist": 0 if snap.centroids is None else len(snap.centroids),
+            "trained_rows": snap.trained_rows,
+        }
+        _atomic_write_json(os.path.join(self.directory, META_FILE), meta)
+        self._snapshot = self._load()
+
+    def _current(self) -> _Snapshot:
+        """当前快照；只读打开时 index.json 被其他进程替换后重新加载"""
+        snap = self._snapshot
+        if self.readonly:
+            try:
+                mtime = os.stat(os.path.join(self.directory, META_FILE)).st_mtime_ns
+            except FileNotFoundError:
+                return snap
+            if mtime != snap.mtime:
+                with self._lock:
+                    if self._snapshot.mtime != mtime:
+                        self._snapshot = self._load()
+                    snap = self._snapshot
+        return snap
+
+    # 状态
+
+    def __len__(self) -> int:
+        """有效（未删除）的向量数"""
+        snap = self._current()
+        return snap.count - snap.deleted_count
+
+    @property
+    def deleted_count(self) -> int:
+        return self._current().deleted_count
+
+    @property
+    def is_trained(self) -> bool:
+        """是否已训练IVF"""
+        return self._current().centroids is not None
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._current()
+        return {
+            "dim": self.dim, "rows": snap.count, "deleted": snap.deleted_count, "indexed": snap.indexed,
+            "nlist": 0 if snap.centroids is None else len(snap.centroids), "version": snap.version,
+        }
+
+    # 写入
+
+    def add(self, vectors: np.ndarray, keys: np.ndarray) -> None:
+        """追加向量
+
+        Args:
+            vectors: n × dim 的数组
+            keys: n个int64键，检索结果按键返回；同一个键不应同时对应多条有效向量
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        keys = np.ascontiguousarray(keys, dtype=np.int64).reshape(-1)
+        if len(vectors) != len(keys):
+            raise ValueError(f"向量数与键数不一致: {len(vectors)} != {len(keys)}")
+        if not len(keys):
+            return
+        with self._locked():
+            snap = self._load()
+            files = (("vectors", "f32", self.dim * 4, vectors.tobytes()),
+                     ("keys", "i64", 8, keys.tobytes()),
+                     ("deleted", "u8", 1, bytes(len(keys))))
+            for name, ext, row_bytes, data in files:
+                with open(self._path(name, snap.version, ext), "ab") as f:
+                    # 丢弃上次追加中断时写了一半、未被 index.json 提交的内容
+                    f.truncate(snap.count * row_bytes)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            snap.count += len(keys)
+            self._commit(snap)
+
+    def delete(self, keys: np.ndarray) -> int:
+        """删除键对应的向量（写入墓碑，压缩时才真正移除）
+
+        Returns:
+            删除的向量数
+        """
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1)
+        with self._locked():
+            snap = self._load()
+            if not snap.count or not len(keys):
+                return 0
+            rows = np.nonzero(np.isin(snap.keys, keys) & (snap.deleted == 0))[0]
+            if len(rows):
+                snap.deleted[rows] = 1
+                snap.deleted.flush()
+                snap.deleted_count += len(rows)
+                self._commit(snap)
+            return len(rows)
+
+    def get(self, keys: np.ndarray) -> np.ndarray:
+        """按键读取有效向量
+
+        Raises:
+            KeyError: 键不存在或已删除
+        """
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1)
+        snap = self._current()
+        if not len(keys):
+            return np.zeros((0, self.dim), dtype=np.float32)
+        rows = np.nonzero(np.isin(snap.keys, keys) & (snap.deleted == 0))[0]
+        found = dict(zip(snap.keys[rows].tolist(), rows.tolist()))
+        return np.asarray(snap.vectors[[found[key] for key in keys.tolist()]])
+
+    def max_key(self) -> int:
+        """所有行（含已删除）中最大的键，空索引为-1"""
+        snap = self._current()
+        return int(snap.keys.max()) if snap.count else -1
+
+    # 检索
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None,
+               exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """检索与query内积最大的k个向量
+
+        Args:
+            query: dim维向量
+            k: 返回的数量
+            nprobe: 扫描的簇数，默认取构造时的值；未训练IVF时忽略
+            exact: 扫描全部向量（用于计算召回率的基准）
+
+        Returns:
+            (键, 相似度)，按相似度从高到低排列，可能少于k个
+        """
+        snap = self._current()
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if snap.count - snap.deleted_count <= 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if exact or snap.centroids is None:
+            ranges = [(0, snap.count)]
+        else:
+            nlist = len(snap.centroids)
+            nprobe = max(1, min(nprobe or self.nprobe, nlist))
+            probes = np.argpartition(snap.centroids @ query, -nprobe)[-nprobe:]
+            ranges = [(int(snap.lists[p]), int(snap.lists[p + 1])) for p in probes]
+            ranges.append((snap.indexed, snap.count))
+            ranges = [(start, end) for start, end in ranges if end > start]
+            if not ranges:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            scores = snap.vectors[start:end] @ query
+            rows = None
+            dead = snap.deleted[start:end]
+        else:
+            scores = np.concatenate([snap.vectors[start:end] @ query for start, end in ranges])
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            dead = snap.deleted[rows]
+        if snap.deleted_count:
+            scores[dead != 0] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        found = top + ranges[0][0] if rows is None else rows[top]
+        return np.asarray(snap.keys[found]), scores[top]
+
+    # 维护
+
+    def optimize(self) -> bool:
+        """按需训练IVF或压缩：有效行数首次达到 ivf_min_rows、训练后追加的行超过已归簇行的一定比例、
+        或墓碑超过一定比例时重写索引
+
+        Returns:
+            是否重写了索引
+        """
+        snap = self._current()
+        live = snap.count - snap.deleted_count
+        if snap.centroids is None:
+            needed = live >= self.ivf_min_rows
+        else:
+            needed = snap.count - snap.indexed > VECTOR_INDEX_CONFIG["rebuild_tail_fraction"] * max(1, snap.indexed)
+        needed = needed or snap.deleted_count > VECTOR_INDEX_CONFIG["compact_deleted_fraction"] * max(1, snap.count)
+        if needed:
+            self.compact()
+        return needed
+
+    def compact(self, retrain: bool = False) -> None:
+        """重写索引：丢弃已删除的行；有效行数达到 ivf_min_rows 时按簇重新排列
+
+        聚类中心在有效行数比上次训练时增长或减少一倍以上（或 retrain 为True）时重新训练，
+        否则沿用原有的中心，只把行重新归簇。
+        """
+        with self._locked():
+            snap = self._load()
+            live = np.nonzero(snap.deleted == 0)[0] if snap.deleted_count else np.arange(snap.count)
+            centroids = None
+            order = live
+            lists = None
+            trained_rows = 0
+            if len(live) >= self.ivf_min_rows:
+                centroids = snap.centroids
+                trained_rows = snap.trained_rows
+                if centroids is None or retrain or not 0.5 <= len(live) / max(1, trained_rows) <= 2.0:
+                    centroids = self._train(snap.vectors, live)
+                    trained_rows = len(live)
+                else:
+                    centroids = np.array(centroids)
+                assign = np.empty(len(live), dtype=np.int64)
+                for start in range(0, len(live), _BATCH_ROWS):
+                    batch = np.asarray(snap.vectors[live[start:start + _BATCH_ROWS]])
+                    assign[start:start + _BATCH_ROWS] = np.argmax(batch @ centroids.T, axis=1)
+                permutation = np.argsort(assign, kind="stable")
+                order = live[permutation]
+                counts = np.bincount(assign, minlength=len(centroids))
+                lists = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+            old_version = snap.version
+            version = old_version + 1
+            with open(self._path("vectors", version, "f32"), "wb") as vf, \
+                    open(self._path("keys", version, "i64"), "wb") as kf:
+                for start in range(0, len(order), _BATCH_ROWS):
+                    rows = order[start:start + _BATCH_ROWS]
+                    vf.write(np.ascontiguousarray(snap.vectors[rows]).tobytes())
+                    kf.write(np.ascontiguousarray(snap.keys[rows]).tobytes())
+                for f in (vf, kf):
+                    f.flush()
+                    os.fsync(f.fileno())
+            with open(self._path("deleted", version, "u8"), "wb") as f:
+                f.write(bytes(len(order)))
+            if centroids is not None:
+                with open(self._path("centroids", version, "f32"), "wb") as f:
+                    f.write(np.ascontiguousarray(centroids, dtype=np.float32).tobytes())
+                with open(self._path("lists", version, "i64"), "wb") as f:
+                    f.write(lists.tobytes())
+
+            new = _Snapshot()
+            new.version = version
+            new.count = len(order)
+            new.indexed = len(order) if centroids is not None else 0
+            new.trained_rows = trained_rows
+            new.centroids = centroids
+            self._commit(new)
+            self._remove_version(old_version)
+            logger.info(f"向量索引已重写: {self.directory}: {new.count} 行，"
+                        f"{0 if centroids is None else len(centroids)} 个簇")
+
+    def _train(self, vectors: np.ndarray, live: np.ndarray) -> np.ndarray:
+        """在有效行的样本上训练球面k-means，返回归一化的聚类中心"""
+        nlist = VECTOR_INDEX_CONFIG["nlist"] or int(math.sqrt(len(live)))
+        nlist = max(1, min(nlist, len(live)))
+        rng = np.random.default_rng(VECTOR_INDEX_CONFIG["seed"])
+        sample_size = min(len(live), nlist * VECTOR_INDEX_CONFIG["train_points_per_list"])
+        sample = np.asarray(vectors[np.sort(rng.choice(live, sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(VECTOR_INDEX_CONFIG["kmeans_iterations"]):
+            assign = np.empty(sample_size, dtype=np.int64)
+            for start in range(0, sample_size, _BATCH_ROWS):
+                assign[start:start + _BATCH_ROWS] = np.argmax(sample[start:start + _BATCH_ROWS] @ centroids.T, axis=1)
+            # 按簇排序后分段求和，比逐行累加快得多
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = np.nonzero(counts)[0]
+            sums = np.zeros_like(centroids)
+            sums[nonempty] = np.add.reduceat(sample[order], np.searchsorted(assign[order], nonempty), axis=0)
+            empty = counts == 0
+            # 空簇重新取一个随机样本点作为中心
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def _remove_version(self, version: int) -> None:
+        """删除旧版本文件（其他读取方仍打开的内存映射不受影响）"""
+        suffix = f".{version:06d}."
+        for name in os.listdir(self.directory):
+            if suffix in name:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    logger.warning(f"删除旧版本索引文件失败: {name}: {e}")
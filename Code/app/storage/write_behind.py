@@ -0,0 +1,252 @@
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from app.config import PERSISTENCE_CONFIG
+from app.models.chat import Chat
+from app.storage.file_storage import FileStorage
+from app.telemetry.metrics import REGISTRY
+
+logger = logging.getLogger("xiaohaochat.storage.write_behind")
+
+class WriteBehindQueue:
+    """聊天记录后台写入队列
+
+    提交的聊天按chat_id合并：同一聊天多次提交只保留最新快照，只写一次。
+    队列有界，积压的不同聊天数达到上限时提交方阻塞，避免内存无限增长。
+    由单个后台线程按提交顺序写入，进程正常退出时通过atexit排空队列。
+
+    写入失败的聊天放回队尾，按指数退避重试，不阻塞其他聊天的写入；连续失败 MAX_RETRIES 次后
+    记录错误并搁置（仍可通过 get_pending 读取），直到该聊天再次被提交。
+    """
+
+    # 写入失败后第一次重试前的等待时间（秒），之后每次加倍
+    RETRY_DELAY = 1.0
+    # 重试等待时间的上限（秒）
+    RETRY_DELAY_MAX = 30.0
+    # 连续失败多少次后搁置该聊天
+    MAX_RETRIES = 5
+
+    def __init__(self, storage: FileStorage, max_pending: int, enabled: bool = True):
+        """初始化写入队列
+
+        Args:
+            storage: 存储实例
+            max_pending: 最多积压的不同聊天数
+            enabled: 为False时提交即同步写入
+        """
+        self.storage = storage
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self._pending: "OrderedDict[str, Chat]" = OrderedDict()
+        self._writing: Optional[Chat] = None
+        self._failures: Dict[str, int] = {}  # 连续写入失败次数
+        self._retry_at: Dict[str, float] = {}  # 失败的聊天最早的重试时间（monotonic）
+        self._failed: "OrderedDict[str, Chat]" = OrderedDict()  # 多次失败后搁置的聊天
+        self._discarded: Set[str] = set()  # 写入期间被丢弃的聊天，写入失败时不再放回队列
+        self._flushing = 0  # 正在等待排空的调用数，期间重试不再等待退避时间
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._stopped = False
+
+    @property
+    def backlog(self) -> int:
+        """尚未落盘的聊天数（包括正在写入的，不包括已搁置的）"""
+        with self._cond:
+            return len(self._pending) + (1 if self._writing is not None else 0)
+
+    def failed_chats(self) -> List[str]:
+        """多次写入失败后被搁置的聊天ID"""
+        with self._cond:
+            return list(self._failed)
+
+    def submit(self, chat: Chat) -> bool:
+        """提交聊天快照等待写入
+
+        Args:
+            chat: 聊天对象，提交后调用方不应再修改它
+
+        Returns:
+            已接受返回True；同步写入模式下返回写入结果
+        """
+        if not self.enabled or self._stopped:
+            return self.storage.save_chat(chat)
+
+        with self._cond:
+            self._ensure_worker()
+            if self._failed.pop(chat.chat_id, None) is not None:
+                # 重新提交的聊天再给一次完整的重试机会
+                self._failures.pop(chat.chat_id, None)
+            if chat.chat_id in self._pending:
+                # 合并：替换为最新快照，保留原有排队位置
+                self._pending[chat.chat_id] = chat
+                return True
+            while len(self._pending) >= self.max_pending:
+                self._cond.wait()
+            self._pending[chat.chat_id] = chat
+            self._cond.notify_all()
+        return True
+
+    def get_pending(self, chat_id: str) -> Optional[Chat]:
+        """获取尚未落盘的最新快照
+
+        Args:
+            chat_id: 聊天ID
+
+        Returns:
+            存在未落盘的版本时返回其拷贝，否则返回None
+        """
+        with self._cond:
+            chat = self._pending.get(chat_id) or self._failed.get(chat_id)
+            if chat is None and self._writing is not None and self._writing.chat_id == chat_id:
+                chat = self._writing
+            return chat.copy() if chat is not None else None
+
+    def discard(self, chat_id: str) -> None:
+        """丢弃聊天尚未写入的快照，并等待正在进行的写入完成（用于删除或归档前）
+
+        Args:
+            chat_id: 聊天ID
+        """
+        with self._cond:
+            self._failed.pop(chat_id, None)
+            self._failures.pop(chat_id, None)
+            self._retry_at.pop(chat_id, None)
+            if self._pending.pop(chat_id, None) is not None:
+                self._cond.notify_all()
+            if self._writing is not None and self._writing.chat_id == chat_id:
+                self._discarded.add(chat_id)
+            while self._writing is not None and self._writing.chat_id == chat_id:
+                self._cond.wait()
+
+    def pending_chats(self) -> List[Chat]:
+        """返回所有尚未落盘的聊天快照（包括已搁置的）"""
+        with self._cond:
+            chats = list(self._pending.values())
+            chats.extend(chat for chat_id, chat in self._failed.items() if chat_id not in self._pending)
+            if self._writing is not None and self._writing.chat_id not in self._pending:
+                chats.append(self._writing)
+            return chats
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待队列排空
+
+        排空期间失败的聊天不再等待退避时间，立即重试直到搁置，因此排空不会因为个别无法保存的
+        聊天而超时；搁置的聊天记录在日志中。
+
+        Args:
+            timeout: 最长等待秒数，None表示一直等待
+
+        Returns:
+            所有聊天都已保存返回True，超时或有聊天被搁置时返回False
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self._writing is not None:
+                    if self._worker is None or not self._worker.is_alive():
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+            leftover = list(self._pending.values())
+            self._pending.clear()
+        # 后台线程不可用时由调用线程兜底写入
+        for chat in leftover:
+            if not self.storage.save_chat(chat):
+                with self._cond:
+                    self._failed[chat.chat_id] = chat
+        failed = self.failed_chats()
+        if failed:
+            logger.error(f"{len(failed)} 个聊天多次保存失败，未能保存: {', '.join(failed)}")
+        return not failed
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """排空队列并停止接受异步提交，之后的提交改为同步写入"""
+        drained = self.flush(timeout)
+        self._stopped = True
+        with self._cond:
+            self._cond.notify_all()
+        if not drained and self.backlog:
+            logger.error(f"退出时仍有 {self.backlog} 个聊天未保存")
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+            self._worker.start()
+
+    def _next(self) -> Optional[Chat]:
+        """按排队顺序取出第一个不在退避中的聊天，调用方持有锁"""
+        now = time.monotonic()
+        for chat_id in self._pending:
+            if self._flushing or self._stopped or self._retry_at.get(chat_id, 0.0) <= now:
+                return self._pending.pop(chat_id)
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                chat = self._next()
+                while chat is None:
+                    if self._stopped and not self._pending:
+                        return
+                    # 队列中只剩退避中的聊天时等到最早的重试时间
+                    wait = min((self._retry_at.get(chat_id, 0.0) for chat_id in self._pending), default=None)
+                    self._cond.wait(None if wait is None else max(0.0, wait - time.monotonic()))
+                    chat = self._next()
+                self._writing = chat
+                self._cond.notify_all()
+
+            ok = False
+            try:
+                ok = self.storage.save_chat(chat)
+            except Exception as e:
+                logger.error(f"后台保存聊天失败: {chat.chat_id}: {str(e)}")
+
+            with self._cond:
+                self._writing = None
+                if chat.chat_id in self._discarded:
+                    # 已删除或归档，写入失败也不重试
+                    self._discarded.discard(chat.chat_id)
+                    self._failures.pop(chat.chat_id, None)
+                    self._retry_at.pop(chat.chat_id, None)
+                elif ok:
+                    self._failures.pop(chat.chat_id, None)
+                    self._retry_at.pop(chat.chat_id, None)
+                else:
+                    self._retry(chat)
+                self._cond.notify_all()
+
+    def _retry(self, chat: Chat) -> None:
+        """写入失败：放回队尾按退避时间重试，连续失败次数达到上限时搁置，调用方持有锁"""
+        chat_id = chat.chat_id
+        failures = self._failures.get(chat_id, 0) + 1
+        if chat_id not in self._pending:
+            # 没有更新的快照时重试这一份
+            if failures >= self.MAX_RETRIES:
+                self._failures.pop(chat_id, None)
+                self._retry_at.pop(chat_id, None)
+                self._failed[chat_id] = chat
+                logger.error(f"聊天 {chat_id} 连续 {failures} 次保存失败，暂不再重试")
+                return
+            self._pending[chat_id] = chat
+        self._failures[chat_id] = failures
+        self._retry_at[chat_id] = time.monotonic() + min(self.RETRY_DELAY * 2 ** (failures - 1), self.RETRY_DELAY_MAX)
+
+
+# 进程级单例，跨Streamlit会话共享同一个写入线程
+chat_write_queue = WriteBehindQueue(
+    FileStorage(),
+    max_pending=PERSISTENCE_CONFIG["max_pending"],
+    enabled=PERSISTENCE_CONFIG["write_behind"]
+)
+atexit.register(chat_write_queue.shutdown, PERSISTENCE_CONFIG["flush_timeout"])
+REGISTRY.gauge("xiaohao_write_queue_depth", "Chats waiting to be persisted").set_function(lambda: chat_write_queue.backlog)
@@ -0,0 +1,9 @@
+"""可观测性模块：请求追踪、耗时统计与指标导出"""
+
+from app.telemetry.tracing import span, request_context, record_span, current_request_id, get_span_stats
+from app.telemetry.metrics import REGISTRY, start_http_server
+
+__all__ = [
+    "span", "request_context", "record_span", "current_request_id", "get_span_stats",
+    "REGISTRY", "start_http_server"
+]
@@ -0,0 +1,489 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from typing import Any, Dict, List, Tuple, Optional, Callable, Sequence
+
+from app.config import METRICS_CONFIG
+
+logger = logging.getLogger("xiaohaochat.telemetry")
+
+# 默认直方图桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _Striped:
+    """按线程分片的数值单元
+
+    每个线程只写自己的单元，热路径上无需加锁；读取时汇总所有单元。
+    只有线程第一次写入时才需要加锁登记单元。Streamlit每次重新运行脚本都使用新线程，
+    已结束线程的单元（不会再被写入）在登记新单元和读取时并入基数后丢弃，单元数不随线程总数增长。
+    """
+
+    def __init__(self, width: int):
+        self._width = width
+        self._local = threading.local()
+        self._base = [0.0] * width
+        self._cells: List[Tuple[threading.Thread, List[float]]] = []
+        self._sweep_at = 64
+        self._lock = threading.Lock()
+
+    def cell(self) -> List[float]:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = [0.0] * self._width
+            with self._lock:
+                self._cells.append((threading.current_thread(), cell))
+                if len(self._cells) >= self._sweep_at:
+                    self._fold_dead()
+                    self._sweep_at = max(64, 2 * len(self._cells))
+            self._local.cell = cell
+        return cell
+
+    def _fold_dead(self) -> None:
+        """把已结束线程的单元并入基数（调用方持有锁）"""
+        alive = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                for i, value in enumerate(cell):
+                    self._base[i] += value
+        self._cells = alive
+
+    def totals(self) -> List[float]:
+        with self._lock:
+            self._fold_dead()
+            totals = list(self._base)
+            cells = [cell for _, cell in self._cells]
+        for cell in cells:
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """带标签的指标基类，子指标按标签值缓存"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str, **kwargs: str):
+        """返回指定标签值对应的子指标"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("_value",)
+
+    def __init__(self):
+        self._value = _Striped(1)
+
+    def inc(self, amount: float = 1) -> None:
+        self._value.cell()[0] += amount
+
+    def get(self) -> float:
+        return self._value.totals()[0]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def _render_samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+                for values, child in self._items()]
+
+
+class _GaugeChild:
+    __slots__ = ("_value", "_function", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """采集时调用function获取当前值，热路径上零开销"""
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception as e:
+                logger.warning(f"采集指标失败: {str(e)}")
+                return float("nan")
+        return self._value
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default().set_function(function)
+
+    def _render_samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+                for values, child in self._items()]
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_values")
+
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets = buckets
+        # 每个桶一个计数，末尾两个单元分别为总和与总数
+        self._values = _Striped(len(buckets) + 3)
+
+    def observe(self, value: float) -> None:
+        cell = self._values.cell()
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def snapshot(self) -> Tuple[List[float], float, float]:
+        totals = self._values.totals()
+        return totals[:-2], totals[-2], totals[-1]
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for values, child in self._items():
+            counts, total, count = child.snapshot()
+            cumulative = 0.0
+            for bound, c in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += c
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {_format_value(count)}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，负责创建指标并导出为Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        # 无标签的指标预先创建，未观测前也导出0值
+        if not metric.labelnames:
+            metric.labels()
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """导出所有指标（Prometheus text exposition format 0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 进程级注册表
+REGISTRY = MetricsRegistry()
+
+# 对话
+TURNS = REGISTRY.counter("xiaohao_turns_total", "Chat turns processed", ["persona", "mode", "outcome"])
+
+# LLM
+LLM_REQUESTS = REGISTRY.counter("xiaohao_llm_requests_total", "Requests sent to Ollama", ["outcome"])
+LLM_TOKENS = REGISTRY.counter("xiaohao_llm_generated_tokens_total", "Tokens generated by Ollama")
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "xiaohao_llm_tokens_per_second", "Generation speed reported by Ollama",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+)
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "xiaohao_llm_time_to_first_token_seconds", "Time until the first generated token"
+)
+LLM_REQUEST_DURATION = REGISTRY.histogram("xiaohao_llm_request_duration_seconds", "Wall-clock time of Ollama calls")
+LLM_CANCELLATIONS = REGISTRY.counter("xiaohao_llm_cancellations_total", "Generations cancelled before they finished", ["reason"])
+LLM_WASTED_TOKENS = REGISTRY.counter(
+    "xiaohao_llm_wasted_tokens_total", "Tokens generated for replies that were cancelled", ["reason"]
+)
+
+# 存储
+STORAGE_READ_DURATION = REGISTRY.histogram(
+    "xiaohao_storage_read_duration_seconds", "Chat storage read latency", ["source"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+STORAGE_WRITE_DURATION = REGISTRY.histogram(
+    "xiaohao_storage_write_duration_seconds", "Chat storage write latency",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+STORAGE_WRITTEN_BYTES = REGISTRY.counter("xiaohao_storage_written_bytes_total", "Bytes written to chat files")
+CHATS_ARCHIVED = REGISTRY.counter("xiaohao_chats_archived_total", "Chats moved to cold storage by the retention policy")
+CHATS_REHYDRATED = REGISTRY.counter("xiaohao_chats_rehydrated_total", "Archived chats brought back to the hot store")
+
+# 对话标题
+TITLES = REGISTRY.counter("xiaohao_chat_titles_total", "Chat titles written by the background titler", ["source"])
+TITLE_BATCH_SIZE = REGISTRY.histogram(
+    "xiaohao_chat_title_batch_size", "Chats titled per model request", buckets=(1, 2, 3, 4, 6, 8)
+)
+
+# 角色知识库
+KNOWLEDGE_RETRIEVALS = REGISTRY.counter(
+    "xiaohao_knowledge_retrievals_total", "Questions looked up in a persona knowledge base", ["outcome"]
+)
+KNOWLEDGE_RETRIEVAL_DURATION = REGISTRY.histogram(
+    "xiaohao_knowledge_retrieval_duration_seconds", "Time to embed a question and search the knowledge base",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+# 长期记忆
+MEMORY_FACTS = REGISTRY.counter(
+    "xiaohao_memory_facts_total", "Facts extracted from finished chats", ["outcome"]
+)
+MEMORY_RECALLS = REGISTRY.counter("xiaohao_memory_recalls_total", "Turns looked up in the user's memory", ["outcome"])
+MEMORY_RECALL_DURATION = REGISTRY.histogram(
+    "xiaohao_memory_recall_duration_seconds", "Time to embed a message and recall the user's facts",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+# 认证
+AUTH_ATTEMPTS = REGISTRY.counter("xiaohao_auth_attempts_total", "Login attempts", ["outcome"])
+
+# HTTP API
+API_REQUESTS = REGISTRY.counter("xiaohao_api_requests_total", "HTTP API requests", ["route", "status"])
+API_REQUEST_DURATION = REGISTRY.histogram(
+    "xiaohao_api_request_duration_seconds", "HTTP API request latency (until the last byte for streams)", ["route"]
+)
+
+# 会话
+ACTIVE_SESSIONS = REGISTRY.gauge("xiaohao_active_sessions", "Browser sessions seen in the activity window")
+SESSION_EVICTIONS = REGISTRY.counter(
+    "xiaohao_session_evictions_total", "Session histories trimmed to their tail window", ["reason"]
+)
+SESSION_REHYDRATIONS = REGISTRY.counter(
+    "xiaohao_session_rehydrations_total", "Trimmed session histories reloaded from storage", ["outcome"]
+)
+
+# 多进程部署（代理和进程管理在启动器进程中运行）
+PROXY_CONNECTIONS = REGISTRY.counter(
+    "xiaohao_proxy_connections_total", "Client connections forwarded by the serve-mode proxy", ["worker", "outcome"]
+)
+WORKER_RESTARTS = REGISTRY.counter("xiaohao_worker_restarts_total", "Streamlit workers restarted by the launcher", ["worker"])
+
+
+class SessionActivity:
+    """记录会话最近活跃时间，用于统计活跃会话数"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str) -> None:
+        with self._lock:
+            self._last_seen[session_id] = time.monotonic()
+
+    def active_count(self) -> int:
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            for session_id, seen in list(self._last_seen.items()):
+                if seen < cutoff:
+                    del self._last_seen[session_id]
+            return len(self._last_seen)
+
+
+session_activity = SessionActivity(METRICS_CONFIG["active_session_window"])
+ACTIVE_SESSIONS.set_function(session_activity.active_count)
+
+
+# 指标服务上的JSON调试页面：路径 -> 根据查询参数生成内容的函数
+_debug_pages: Dict[str, Callable[[Dict[str, str]], Any]] = {}
+
+
+def register_debug_page(path: str, provider: Callable[[Dict[str, str]], Any]) -> None:
+    """在指标服务上注册一个JSON调试页面（只监听本机，供运维查看进程内状态）
+
+    Args:
+        path: 页面路径，如 "/debug/sessions"
+        provider: 接收查询参数字典、返回可JSON序列化内容的函数
+    """
+    _debug_pages[path] = provider
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path in _debug_pages:
+            params = {key: values[-1] for key, values in parse_qs(query).items()}
+            try:
+                body = json.dumps(_debug_pages[path](params), ensure_ascii=False, indent=2).encode("utf-8")
+            except Exception as e:
+                logger.error(f"生成调试页面失败: {path}: {str(e)}")
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，不写入应用日志
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """在后台线程启动指标HTTP服务，重复调用只启动一次
+
+    Args:
+        port: 监听端口
+        host: 监听地址
+
+    Returns:
+        服务实例，端口被占用时返回None
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logger.error(f"指标服务启动失败: {host}:{port}: {str(e)}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"指标服务已启动: http://{host}:{port}/metrics")
+        return _server
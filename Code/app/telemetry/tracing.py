@@ -0,0 +1,223 @@
+import json
+import time
+import uuid
+import atexit
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterator
+
+from app.config import TRACING_CONFIG
+
+logger = logging.getLogger("xiaohaochat.telemetry")
+
+# 当前请求ID和当前span ID，通过contextvars在同一线程/协程内向下传递
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_span_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span_id", default=None)
+
+# 直方图桶上界（毫秒），覆盖从亚毫秒的缓存命中到分钟级的长生成
+HISTOGRAM_BUCKETS_MS = [
+    0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500,
+    1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000
+]
+
+
+class Span:
+    """一次计时区间，可以附加属性"""
+
+    __slots__ = ("name", "span_id", "parent_id", "request_id", "start", "duration_ms", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], request_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.request_id = request_id
+        self.start = time.time()
+        self.duration_ms = 0.0
+        self.attributes = attributes
+
+    def set(self, key: str, value: Any) -> None:
+        """设置span属性"""
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "request_id": self.request_id,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+        }
+
+
+class SpanHistogram:
+    """单个span名称的耗时直方图"""
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, duration_ms: float) -> None:
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, duration_ms)] += 1
+        self.count += 1
+        self.sum_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数（不超过观测到的最大值）"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(HISTOGRAM_BUCKETS_MS[i], self.max_ms) if i < len(HISTOGRAM_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum_ms, 3),
+            "avg_ms": round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+        }
+
+
+class JsonLinesExporter:
+    """将结束的span以JSON行格式追加写入文件，写入按批进行"""
+
+    def __init__(self, path: str, flush_every: int):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.flush_every:
+                return
+            lines, self._buffer = self._buffer, []
+        self._write(lines)
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        self._write(lines)
+
+    def _write(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            logger.error(f"写入追踪数据失败: {str(e)}")
+
+
+class Tracer:
+    """追踪器：维护每个span名称的直方图并把span交给导出器"""
+
+    def __init__(self, enabled: bool, exporter: Optional[JsonLinesExporter]):
+        self.enabled = enabled
+        self.exporter = exporter
+        self._histograms: Dict[str, SpanHistogram] = {}
+        self._lock = threading.Lock()
+
+    def finish(self, span: Span) -> None:
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = SpanHistogram()
+            histogram.observe(span.duration_ms)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: h.snapshot() for name, h in sorted(self._histograms.items())}
+
+
+def _build_tracer() -> Tracer:
+    path = TRACING_CONFIG.get("export_path")
+    exporter = JsonLinesExporter(path, TRACING_CONFIG["flush_every"]) if path else None
+    if exporter is not None:
+        atexit.register(exporter.flush)
+    return Tracer(TRACING_CONFIG["enabled"], exporter)
+
+
+# 进程级单例
+tracer = _build_tracer()
+
+
+def current_request_id() -> Optional[str]:
+    """返回当前上下文的请求ID"""
+    return _request_id.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """计时一个代码区间
+
+    用法：
+        with span("storage.load_chat", chat_id=chat_id) as s:
+            ...
+            s.set("cache_hit", True)
+    """
+    current = Span(name, _span_id.get(), _request_id.get(), attributes)
+    if not tracer.enabled:
+        yield current
+        return
+    token = _span_id.set(current.span_id)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.set("error", type(e).__name__)
+        raise
+    finally:
+        current.duration_ms = (time.perf_counter() - start) * 1000
+        _span_id.reset(token)
+        tracer.finish(current)
+
+
+@contextmanager
+def request_context(name: str, request_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """开始一个新请求，生成请求ID并打开根span
+
+    Args:
+        name: 根span名称
+        request_id: 指定请求ID，默认随机生成
+    """
+    token = _request_id.set(request_id or uuid.uuid4().hex[:12])
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _request_id.reset(token)
+
+
+def record_span(name: str, duration_ms: float, **attributes: Any) -> None:
+    """记录一个外部测得耗时的span（例如Ollama返回的prompt_eval_duration）"""
+    if not tracer.enabled:
+        return
+    recorded = Span(name, _span_id.get(), _request_id.get(), attributes)
+    recorded.duration_ms = duration_ms
+    tracer.finish(recorded)
+
+
+def get_span_stats() -> Dict[str, Dict[str, Any]]:
+    """返回每个span名称的耗时统计"""
+    return tracer.stats()
@@ -3,6 +3,7 @@ import logging
 from typing import Tuple, Optional
 
 from app.auth.user_manager import UserManager
+from app.auth.errors import AuthError
 
 logger = logging.getLogger("xiaohaochat.ui.auth")
 
@@ -84,17 +85,25 @@ class AuthView:
                     if not login_username or not login_password:
                         st.error("用户名和密码不能为空")
                     else:
-                        user_id = self.user_manager.authenticate_user(login_username, login_password)
+                        try:
+                            user_id = self.user_manager.authenticate_user(
+                                login_username, login_password, self._client_ip()
+                            )
+                            error = "用户名或密码错误"
+                        except AuthError as e:
+                            # 尝试过于频繁或登录请求过多
+                            user_id, error = None, str(e)
                         if user_id:
                             # 更新session_state
                             st.session_state.logged_in = True
                             st.session_state.current_user = login_username
+                            st.session_state.current_user_id = user_id
                             logger.info(f"用户 {login_username} 登录成功")
                             st.success("登录成功，正在跳转...")
                             # 强制重新加载页面
                             st.rerun()
                         else:
-                            st.error("用户名或密码错误")
+                            st.error(error)
                 
                 # 在登录表单内部底部添加注册链接
                 st.markdown("<div style='text-align: center; margin-top: 20px;'>没有账号？</div>", unsafe_allow_html=True)
@@ -173,7 +182,11 @@ class AuthView:
                     elif not reg_username or not reg_password:
                         st.error("用户名和密码不能为空")
                     else:
-                        user_id = self.user_manager.register_user(reg_username, reg_password)
+                        try:
+                            user_id = self.user_manager.register_user(reg_username, reg_password, self._client_ip())
+                            error = "用户名已存在"
+                        except AuthError as e:
+                            user_id, error = None, str(e)
                         if user_id:
                             st.success("注册成功，请登录")
                             # 清除注册表单数据
@@ -184,7 +197,7 @@ class AuthView:
                             st.session_state.auth_view = 'login'
                             st.rerun()
                         else:
-                            st.error("用户名已存在")
+                            st.error(error)
                 
                 # 在注册表单内部底部添加登录链接
                 st.markdown("<div style='text-align: center; margin-top: 20px;'>已有账号？</div>", unsafe_allow_html=True)
@@ -194,6 +207,19 @@ class AuthView:
                     st.session_state.auth_view = 'login'
                     st.rerun()
     
+    @staticmethod
+    def _client_ip() -> Optional[str]:
+        """返回浏览器的客户端地址，旧版本Streamlit不支持时返回None"""
+        context = getattr(st, "context", None)
+        ip = getattr(context, "ip_address", None) if context is not None else None
+        if ip in ("127.0.0.1", "::1"):
+            # 多进程部署时经由本机的反向代理访问，代理在 X-Forwarded-For 中给出真实的客户端地址
+            headers = getattr(context, "headers", None) or {}
+            forwarded = headers.get("X-Forwarded-For")
+            if forwarded:
+                ip = forwarded.split(",")[-1].strip()
+        return ip
+    
     def _switch_to_register(self):
         """切换到注册页面"""
         st.session_state.auth_view = 'register'
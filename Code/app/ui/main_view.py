@@ -1,11 +1,63 @@
+import time
 import streamlit as st
 import logging
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from streamlit.runtime.scriptrunner import RerunException, StopException
 
 from app.chat.message_handler import MessageHandler
+from app.llm.cancellation import CancelToken
+from app.models.message import Message
+from app.models.persona import Persona
+from app.telemetry.tracing import span
 
 logger = logging.getLogger("xiaohaochat.ui.main")
 
+# 流式显示时两次刷新之间的最短间隔（秒）
+STREAM_REFRESH_INTERVAL = 0.05
+# 只有最近的这么多条消息显示编辑/重新生成按钮，长对话不必为每条消息创建控件
+ACTION_WINDOW = 20
+
+
+class ReplyStream:
+    """把模型的流式输出显示在页面上，并把页面上的中断转换为取消生成
+
+    生成期间用户点击“停止生成”、切换聊天或进行其他操作时，Streamlit在脚本下一次更新页面时
+    抛出 RerunException（关闭页面时为 StopException）。这里捕获该异常并取消生成，使调用方
+    能够保存已生成的部分，之后再调用 reraise() 让Streamlit继续处理这次操作。
+
+    多角色对比时每个角色一个占位符，以角色ID为键；单个回复的键为空字符串。
+    """
+
+    def __init__(self, placeholders: Dict[str, Any], format_partial: Callable[[str], str], cancel: CancelToken):
+        self.placeholders = placeholders
+        self.format_partial = format_partial
+        self.cancel = cancel
+        self.interrupt: Optional[BaseException] = None
+        self._parts: Dict[str, List[str]] = {key: [] for key in placeholders}
+        self._last_refresh: Dict[str, float] = {key: 0.0 for key in placeholders}
+
+    def on_delta(self, text: str, key: str = "") -> None:
+        """流式回调（在脚本线程中调用）"""
+        parts = self._parts[key]
+        parts.append(text)
+        now = time.monotonic()
+        if self.interrupt is not None or now - self._last_refresh[key] < STREAM_REFRESH_INTERVAL:
+            return
+        self._last_refresh[key] = now
+        try:
+            self.placeholders[key].markdown(self.format_partial("".join(parts)) + " ▌")
+        except RerunException as e:
+            self.interrupt = e
+            self.cancel.cancel("interrupted")
+        except StopException as e:
+            self.interrupt = e
+            self.cancel.cancel("closed")
+
+    def reraise(self) -> None:
+        """重新抛出生成期间捕获的Streamlit中断"""
+        if self.interrupt is not None:
+            raise self.interrupt
+
 class MainView:
     """主聊天界面组件，处理聊天消息显示和输入"""
     
@@ -18,16 +70,35 @@ class MainView:
         self.message_handler = message_handler
     
     def render(self, 
-              messages: List[Dict[str, str]], 
+              messages: List[Message], 
               on_message_sent: Callable[[str], None],
-              deep_thinking_mode: bool = False) -> None:
+              deep_thinking_mode: bool = False,
+              error: Optional[str] = None,
+              fan_out: Optional[Dict[int, List[Tuple[str, Message]]]] = None,
+              alternatives: Optional[Dict[int, Tuple[int, int]]] = None,
+              on_regenerate: Optional[Callable[[int], None]] = None,
+              on_edit: Optional[Callable[[int, str], None]] = None,
+              on_switch_branch: Optional[Callable[[int, int], None]] = None) -> None:
         """渲染主聊天界面
         
         Args:
-            messages: 聊天消息列表
+            messages: 聊天消息列表（当前路径）
             on_message_sent: 消息发送回调函数
             deep_thinking_mode: 是否启用深度思考模式
+            error: 上一轮获取回复失败时的错误提示
+            fan_out: 多角色对比的回答，回答位置 -> [(角色ID, 消息)]（见 ChatManager.get_fan_out_replies）
+            alternatives: 有多个版本的消息，位置 -> (当前版本序号, 版本数)
+            on_regenerate: 重新生成回调，参数为助手消息的位置
+            on_edit: 编辑回调，参数为用户消息的位置和新内容
+            on_switch_branch: 切换版本回调，参数为消息位置和方向（-1/1）
         """
+        fan_out = fan_out or {}
+        alternatives = alternatives or {}
+        # 上一次运行中点击了重新生成或编辑：只显示分叉点之前的消息，新的回复显示在其后
+        action = st.session_state.pop("chat_action", None)
+        if action is not None:
+            messages = messages[:action[1]]
+        
         # 标题
         st.title("晓昊助手")
         
@@ -41,10 +112,35 @@ class MainView:
         chat_container = st.container()
         
         # 显示现有消息
-        with chat_container:
-            for message in messages:
+        with chat_container, span("ui.render_messages", messages=len(messages)):
+            for index, message in enumerate(messages):
+                if index in fan_out:
+                    # 同一轮对比的回答并排显示，切换版本即选择继续对话的回答
+                    self._render_side_by_side(fan_out[index])
+                    if action is None:
+                        self._render_actions(index, message, alternatives.get(index), on_switch_branch,
+                                             index >= len(messages) - ACTION_WINDOW)
+                    continue
                 with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
+                    if st.session_state.get("editing_message") == index and action is None:
+                        self._render_editor(index, message)
+                    else:
+                        self._render_content(message)
+                    if action is None and (index >= len(messages) - ACTION_WINDOW or index in alternatives):
+                        self._render_actions(index, message, alternatives.get(index), on_switch_branch,
+                                             index >= len(messages) - ACTION_WINDOW)
+            
+            # 显示上一轮的错误（错误不属于聊天历史）
+            if error and action is None:
+                st.error(error)
+        
+        if action is not None:
+            kind, index, content = action
+            if kind == "regenerate" and on_regenerate is not None:
+                on_regenerate(index)
+            elif kind == "edit" and on_edit is not None:
+                on_edit(index, content)
+            st.rerun()
         
         # 聊天输入 - 不使用session_state直接设置值
         # 直接使用chat_input并处理返回值
@@ -54,4 +150,114 @@ class MainView:
         if prompt:
             on_message_sent(prompt)
             # 立即重新渲染页面以显示回复
-            st.rerun() 
\ No newline at end of file
+            st.rerun()
+    
+    def _render_actions(self, index: int, message: Message, alternative: Optional[Tuple[int, int]],
+                        on_switch_branch: Optional[Callable[[int, int], None]], editable: bool) -> None:
+        """消息下方的操作：切换版本、编辑用户消息、重新生成助手回复"""
+        columns = st.columns([1, 1, 1, 1, 8])
+        if alternative is not None and on_switch_branch is not None:
+            current, total = alternative
+            if columns[0].button("◀", key=f"branch_prev_{index}", help="上一个版本"):
+                on_switch_branch(index, -1)
+                st.rerun()
+            columns[1].caption(f"{current + 1}/{total}")
+            if columns[2].button("▶", key=f"branch_next_{index}", help="下一个版本"):
+                on_switch_branch(index, 1)
+                st.rerun()
+        if not editable:
+            return
+        if message["role"] == "user":
+            if columns[3].button("✏️", key=f"edit_{index}", help="编辑这条消息，原消息保留为另一个版本"):
+                st.session_state.editing_message = index
+                st.rerun()
+        elif message["role"] == "assistant":
+            if columns[3].button("🔄", key=f"regenerate_{index}", help="重新生成，原回复保留为另一个版本"):
+                st.session_state.chat_action = ("regenerate", index, None)
+                st.rerun()
+    
+    @staticmethod
+    def _render_editor(index: int, message: Message) -> None:
+        """编辑用户消息：发送后从这条消息处分出新的版本"""
+        content = st.text_area("编辑消息", value=message.content, key=f"edit_text_{index}")
+        send_column, cancel_column = st.columns(2)
+        if send_column.button("发送", key=f"edit_send_{index}", type="primary"):
+            st.session_state.editing_message = None
+            if content.strip():
+                st.session_state.chat_action = ("edit", index, content)
+            st.rerun()
+        if cancel_column.button("取消", key=f"edit_cancel_{index}"):
+            st.session_state.editing_message = None
+            st.rerun()
+    
+    @staticmethod
+    def _render_content(message: Message) -> None:
+        st.markdown(message["content"])
+        if message.truncated:
+            st.caption("⏹ 回复已中断，只保存了已生成的部分")
+    
+    @staticmethod
+    def _persona_names() -> Dict[str, str]:
+        return {persona.id: persona.name for persona in st.session_state.get("personas", [])}
+    
+    def _render_side_by_side(self, entries: List[Tuple[str, Message]]) -> None:
+        """把同一轮对比中各角色的回答并排显示，当前路径上的回答在最左"""
+        names = self._persona_names()
+        for column, (persona_id, reply) in zip(st.columns(len(entries)), entries):
+            with column, st.chat_message("assistant"):
+                st.markdown(f"**{names.get(persona_id, persona_id)}**")
+                self._render_content(reply)
+    
+    def begin_reply(self, prompt: Optional[str], deep_thinking_mode: bool, cancel: CancelToken) -> ReplyStream:
+        """显示刚发送的消息、停止按钮和逐步更新的回复
+        
+        Args:
+            prompt: 用户刚发送的消息，为None时不显示（重新生成时该消息已在历史中）
+            deep_thinking_mode: 是否启用深度思考模式
+            cancel: 本轮生成的取消令牌
+            
+        Returns:
+            ReplyStream，其 on_delta 作为流式回调传给消息处理器
+        """
+        if prompt is not None:
+            with st.chat_message("user"):
+                st.markdown(prompt)
+        # 点击后脚本在下一次更新页面时被中断，由ReplyStream取消生成
+        st.button("⏹ 停止生成", key="stop_generation")
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            placeholder.markdown("思考中..." if deep_thinking_mode else "▌")
+        return ReplyStream(
+            {"": placeholder},
+            lambda text: self.message_handler.format_partial(text, deep_thinking_mode),
+            cancel
+        )
+    
+    def begin_fan_out(self, prompt: Optional[str], personas: List[Persona], deep_thinking_mode: bool,
+                      cancel: CancelToken) -> ReplyStream:
+        """显示刚发送的消息、停止按钮，以及每个角色一列并排更新的回复
+        
+        Args:
+            prompt: 用户刚发送的消息，为None时不显示
+            personas: 参与对比的角色
+            deep_thinking_mode: 是否启用深度思考模式
+            cancel: 本轮生成的取消令牌（所有角色共享）
+            
+        Returns:
+            ReplyStream，以角色ID为键
+        """
+        if prompt is not None:
+            with st.chat_message("user"):
+                st.markdown(prompt)
+        st.button("⏹ 停止生成", key="stop_generation")
+        placeholders = {}
+        for column, persona in zip(st.columns(len(personas)), personas):
+            with column, st.chat_message("assistant"):
+                st.markdown(f"**{persona.name}**")
+                placeholders[persona.id] = st.empty()
+                placeholders[persona.id].markdown("思考中..." if deep_thinking_mode else "▌")
+        return ReplyStream(
+            placeholders,
+            lambda text: self.message_handler.format_partial(text, deep_thinking_mode),
+            cancel
+        ) 
\ No newline at end of file
@@ -13,12 +13,20 @@ class PersonaView:
     def __init__(self):
         pass
     
-    def render_creator(self, on_persona_created: Callable[[Persona], None]) -> None:
+    def render_creator(self, on_persona_created: Callable[[Persona], Optional[str]]) -> None:
         """渲染角色创建界面
         
         Args:
-            on_persona_created: 角色创建成功回调函数
+            on_persona_created: 创建角色回调函数，失败时返回错误提示
         """
+        # 上一次运行中创建成功：在创建输入框之前清空表单
+        if st.session_state.pop("persona_created", False):
+            st.session_state.new_persona_id = f"custom_{uuid.uuid4().hex[:8]}"
+            st.session_state.new_persona_name = ""
+            st.session_state.new_persona_desc = ""
+            st.session_state.new_persona_prompt = ""
+            st.success("角色创建成功")
+        
         new_persona_id = st.text_input("角色ID (英文字母和数字)", key="new_persona_id", 
                                       value=f"custom_{uuid.uuid4().hex[:8]}")
         new_persona_name = st.text_input("角色名称", key="new_persona_name")
@@ -41,16 +49,14 @@ class PersonaView:
                     system_prompt=new_persona_prompt
                 )
                 
-                # 调用回调函数
-                on_persona_created(new_persona)
-                
-                # 清空表单
-                st.session_state.new_persona_id = f"custom_{uuid.uuid4().hex[:8]}"
-                st.session_state.new_persona_name = ""
-                st.session_state.new_persona_desc = ""
-                st.session_state.new_persona_prompt = ""
+                # 调用回调函数，失败时保留表单内容
+                error = on_persona_created(new_persona)
+                if error:
+                    st.error(error)
+                    return
                 
-                st.success("角色创建成功")
+                st.session_state.persona_created = True
+                st.rerun()
     
     def render_info(self, persona: Optional[Persona] = None) -> None:
         """渲染角色信息
@@ -4,7 +4,9 @@ import logging
 from typing import List, Dict, Any, Optional, Callable
 
 from app.chat.chat_manager import ChatManager
+from app.config import CHAT_CACHE_CONFIG, FANOUT_CONFIG
 from app.models.persona import Persona
+from app.models.message import Message
 from app.ui.persona_view import PersonaView
 
 logger = logging.getLogger("xiaohaochat.ui.sidebar")
@@ -22,43 +24,69 @@ class SidebarView:
         self.persona_view = PersonaView()
     
     def render(self, 
-              current_user: str,
-              on_chat_selected: Callable[[str, List[Dict[str, str]], str], None],
+              user_id: str,
+              username: str,
+              on_chat_selected: Callable[[str, List[Message], str], None],
               on_new_chat: Callable[[], None],
               on_persona_selected: Callable[[str], None],
-              on_persona_created: Callable[[Persona], None],
-              on_deep_thinking_toggled: Callable[[bool], None]) -> None:
+              on_persona_created: Callable[[Persona], Optional[str]],
+              on_deep_thinking_toggled: Callable[[bool], None],
+              on_chat_removed: Callable[[str], None]) -> None:
         """渲染侧边栏
         
         Args:
-            current_user: 当前用户ID
+            user_id: 当前用户ID
+            username: 当前用户名（用于显示）
             on_chat_selected: 选择聊天回调函数
             on_new_chat: 新建聊天回调函数
             on_persona_selected: 选择角色回调函数
             on_persona_created: 创建角色回调函数
             on_deep_thinking_toggled: 切换深度思考模式回调函数
+            on_chat_removed: 当前对话被删除或归档后的回调函数
         """
         with st.sidebar:
             # 用户信息和新建按钮
-            st.subheader(f"👤 {current_user}")
+            st.subheader(f"👤 {username}")
             
             # 新建对话按钮
             if st.button("✨ 新建对话", use_container_width=True):
                 on_new_chat()
                 st.rerun()
             
+            # 当前对话的归档/删除
+            current_chat_id = st.session_state.current_chat_id
+            if current_chat_id:
+                col_archive, col_delete = st.columns(2)
+                with col_archive:
+                    if st.button("📦 归档", use_container_width=True, help="移入归档，点击列表中的对话即可恢复"):
+                        if self.chat_manager.archive_chat(user_id, current_chat_id):
+                            on_chat_removed(current_chat_id)
+                            st.rerun()
+                with col_delete:
+                    confirming = st.session_state.get("confirm_delete_chat") == current_chat_id
+                    if st.button("⚠️ 确认删除" if confirming else "🗑️ 删除", use_container_width=True,
+                                 type="primary" if confirming else "secondary"):
+                        if not confirming:
+                            st.session_state.confirm_delete_chat = current_chat_id
+                        elif self.chat_manager.delete_chat(user_id, current_chat_id):
+                            st.session_state.confirm_delete_chat = None
+                            on_chat_removed(current_chat_id)
+                        st.rerun()
+            
             st.divider()
             
             # 聊天历史
             st.subheader("💬 对话历史")
-            chats = self.chat_manager.get_user_chats(current_user)
+            chats = self.chat_manager.get_user_chats(user_id)
             
             for chat in chats:
                 chat_id = chat["chat_id"]
                 title = chat["title"] if "title" in chat and chat["title"] else f"对话 {chat_id[:6]}"
+                if chat.get("archived"):
+                    title = f"📦 {title}"
                 
                 if st.button(title, key=chat_id, use_container_width=True):
-                    chat_data = self.chat_manager.load_chat(current_user, chat_id)
+                    chat_data = self.chat_manager.load_chat(user_id, chat_id)
                     if chat_data:
                         on_chat_selected(
                             chat_id, 
@@ -67,6 +95,11 @@ class SidebarView:
                         )
                         st.rerun()
             
+            # 列表渲染后在后台预取最近的对话，切换时直接命中缓存
+            top_k = CHAT_CACHE_CONFIG["prefetch_top_k"]
+            recent = [chat["chat_id"] for chat in chats if not chat.get("archived")][:top_k]
+            self.chat_manager.prefetch_chats(user_id, recent)
+            
             st.divider()
             
             # 设置部分
@@ -86,6 +119,17 @@ class SidebarView:
             if selected_persona != st.session_state.selected_persona:
                 on_persona_selected(selected_persona)
             
+            # 多角色对比：选择两个以上角色时，同一问题同时发给这些角色
+            st.session_state.fanout_personas = st.multiselect(
+                "🔀 多角色对比",
+                options=list(persona_options.keys()),
+                format_func=lambda x: persona_options[x],
+                max_selections=FANOUT_CONFIG["max_personas"],
+                key="fanout_selector",
+                help="选择两个以上角色后，每条消息会同时发给这些角色，回答并排显示；"
+                     "其他角色的回答另存为当前对话的分支"
+            )
+            
             # 在侧边栏显示创建角色的表单
             with st.expander("创建新角色", expanded=False):
                 self.persona_view.render_creator(on_persona_created)
@@ -0,0 +1 @@
+"""微基准测试：存储、解析和提示词组装热路径"""
@@ -0,0 +1,159 @@
+"""基准测试入口
+
+示例：
+    # 生成（或复用）小规模语料并运行全部基准，结果写入JSON
+    python -m benchmarks run --output bench-before.json
+
+    # 完整规模：10k 用户 / 100k 对话，语料保存在指定目录以便重复使用
+    python -m benchmarks run --scale full --corpus-dir /tmp/xiaohao-corpus-full --output bench-full.json
+
+    # 只运行存储相关基准
+    python -m benchmarks run --only storage. --output bench-after.json
+
+    # 会话历史的内存占用：普通字典消息与 Message 对象对比
+    python -m benchmarks memory --sessions 200 --messages 500
+
+    # 向量索引：精确扫描与不同nprobe下IVF检索的召回率和延迟
+    python -m benchmarks vectors --rows 1000000 --dim 384 --nprobe 4 8 16 32
+
+    # 比较两次结果，任一基准中位数变慢超过10%时以非零状态退出
+    python -m benchmarks compare bench-before.json bench-after.json --threshold 0.10
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+from benchmarks.corpus import SCALES, generate_corpus
+from benchmarks.compare import compare_results, format_comparison
+
+
+def cmd_run(args) -> int:
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="xiaohao-bench-")
+    print(f"准备语料: scale={args.scale} dir={corpus_dir}")
+    started = time.perf_counter()
+    corpus = generate_corpus(corpus_dir, args.scale, args.seed)
+    print(f"语料就绪，用时 {time.perf_counter() - started:.1f}s")
+
+    # 必须在导入app之前设置，app.config在导入时读取
+    os.environ["XIAOHAO_DATA_DIR"] = corpus_dir
+    from app.telemetry.tracing import tracer
+    from benchmarks.suite import run_suite
+
+    # 基准测试不写追踪文件
+    tracer.exporter = None
+
+    try:
+        results = run_suite(corpus, args.only, args.min_time, args.max_iterations)
+    finally:
+        if args.corpus_dir is None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    output = {
+        "meta": {
+            "scale": args.scale,
+            "params": SCALES[args.scale],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+def cmd_memory(args) -> int:
+    from benchmarks.memory import run_memory, format_memory
+
+    results = run_memory(args.sessions, args.messages, args.words, args.seed)
+    print(format_memory(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": {"python": platform.python_version(), "timestamp": time.time()},
+                       "memory": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+def cmd_vectors(args) -> int:
+    from benchmarks.vectors import run_vectors, format_vectors
+
+    results = run_vectors(args.rows, args.dim, args.queries, args.k, args.nprobe, args.topics, args.noise, args.seed)
+    print(format_vectors(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": {"python": platform.python_version(), "timestamp": time.time()},
+                       "vectors": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    rows = compare_results(baseline, current, args.threshold)
+    print(format_comparison(rows))
+    regressions = [row["name"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} 个基准退化超过 {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="晓昊助手微基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="运行基准测试")
+    run_parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="语料规模")
+    run_parser.add_argument("--corpus-dir", type=str, default=None, help="语料目录，指定后保留并复用")
+    run_parser.add_argument("--seed", type=int, default=42, help="语料随机种子")
+    run_parser.add_argument("--only", nargs="*", default=None, help="只运行名称包含这些子串的基准")
+    run_parser.add_argument("--min-time", type=float, default=1.0, help="每个基准的最短计时时间（秒）")
+    run_parser.add_argument("--max-iterations", type=int, default=10000, help="每个基准的最多迭代次数")
+    run_parser.add_argument("--output", type=str, default=None, help="结果JSON文件")
+    run_parser.set_defaults(func=cmd_run)
+
+    memory_parser = subparsers.add_parser("memory", help="测量会话历史消息的内存占用")
+    memory_parser.add_argument("--sessions", type=int, default=200, help="会话数")
+    memory_parser.add_argument("--messages", type=int, default=500, help="每个会话的消息数")
+    memory_parser.add_argument("--words", type=int, default=20, help="每条消息的单词数")
+    memory_parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    memory_parser.add_argument("--output", type=str, default=None, help="结果JSON文件")
+    memory_parser.set_defaults(func=cmd_memory)
+
+    vectors_parser = subparsers.add_parser("vectors", help="测量向量索引的召回率和检索延迟")
+    vectors_parser.add_argument("--rows", type=int, default=200000, help="向量数")
+    vectors_parser.add_argument("--dim", type=int, default=384, help="向量维度")
+    vectors_parser.add_argument("--queries", type=int, default=200, help="查询数")
+    vectors_parser.add_argument("--k", type=int, default=10, help="每次检索返回的数量")
+    vectors_parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="要测量的nprobe")
+    vectors_parser.add_argument("--topics", type=int, default=1000, help="合成数据的主题中心数")
+    vectors_parser.add_argument("--noise", type=float, default=1.5, help="向量相对主题中心的噪声")
+    vectors_parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    vectors_parser.add_argument("--output", type=str, default=None, help="结果JSON文件")
+    vectors_parser.set_defaults(func=cmd_vectors)
+
+    compare_parser = subparsers.add_parser("compare", help="比较两次结果")
+    compare_parser.add_argument("baseline", help="基线结果JSON")
+    compare_parser.add_argument("current", help="当前结果JSON")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="允许的相对变慢比例")
+    compare_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
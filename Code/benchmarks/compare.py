@@ -0,0 +1,40 @@
+"""基准结果比较"""
+
+from typing import Dict, Any, List
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """比较两次运行的中位数耗时
+
+    Args:
+        baseline: 基线结果文件内容
+        current: 当前结果文件内容
+        threshold: 允许的相对变慢比例，例如0.1表示慢10%以内不算退化
+
+    Returns:
+        每个共同基准的比较行，regression为True表示超过阈值
+    """
+    rows = []
+    base_results = baseline.get("results", {})
+    for name, result in current.get("results", {}).items():
+        base = base_results.get(name)
+        if base is None:
+            continue
+        ratio = result["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+        rows.append({
+            "name": name,
+            "baseline_s": base["median_s"],
+            "current_s": result["median_s"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'benchmark':<45} {'baseline ms':>12} {'current ms':>12} {'change':>9}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['name']:<45} {row['baseline_s'] * 1000:12.3f} {row['current_s'] * 1000:12.3f} "
+                     f"{(row['ratio'] - 1) * 100:+8.1f}%{flag}")
+    return "\n".join(lines)
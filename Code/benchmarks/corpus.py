@@ -0,0 +1,138 @@
+"""合成语料生成器
+
+生成的数据与真实数据格式一致（data/users、data/chats、data/personas），对话使用
+分片布局 chats/<用户ID>/<哈希前缀>/<chat_id>.json，
+直接写入文件，不经过应用代码，因此可以在导入app之前生成。
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import random
+import datetime
+from typing import List, Dict, Any
+
+WORDS = ["晓昊", "助手", "模型", "回答", "问题", "思考", "数据", "系统", "用户", "测试",
+         "the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog"]
+
+# 语料规模：小规模用于日常快速比较，完整规模对应 10k 用户 / 100k 对话
+SCALES = {
+    "small": {"users": 200, "chats": 2000, "personas": 20, "messages_per_chat": 8},
+    "full": {"users": 10000, "chats": 100000, "personas": 50, "messages_per_chat": 8},
+}
+
+# 与 CHAT_LAYOUT_CONFIG["prefix_chars"] 的默认值一致；旧版本生成的平铺布局语料会被重新生成
+LAYOUT = "sharded-2"
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_messages(rng: random.Random, count: int, words_per_message: int = 60) -> List[Dict[str, str]]:
+    """生成交替的用户/助手消息"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": random_text(rng, words_per_message)}
+        for i in range(count)
+    ]
+
+
+def make_chat(rng: random.Random, user_id: str, messages: int, when: datetime.datetime) -> Dict[str, Any]:
+    chat_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    return {
+        "chat_id": chat_id,
+        "messages": make_messages(rng, messages),
+        "metadata": {
+            "user_id": user_id,
+            "title": f"新对话 {when.strftime('%Y-%m-%d %H:%M')}",
+            "persona_id": rng.choice(["default", "medical", "legal"]),
+        },
+        "updated_at": when.isoformat(),
+    }
+
+
+def make_thinking_response(rng: random.Random, size_bytes: int, blocks: int = 4) -> str:
+    """生成包含多个<think>段落、总长约size_bytes的模型原始回复"""
+    parts = []
+    per_block = max(1, size_bytes // (blocks * 2))
+    for _ in range(blocks):
+        thinking = "\n".join(random_text(rng, 12) for _ in range(max(1, per_block // 80)))
+        parts.append(f"<think>{thinking}</think>")
+        parts.append(random_text(rng, max(1, per_block // 6)))
+    return "\n".join(parts)
+
+
+def _write_json(path: str, data: Any) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def generate_corpus(data_dir: str, scale: str, seed: int = 42) -> Dict[str, Any]:
+    """在data_dir下生成用户、对话和角色文件，已存在同规模语料时直接复用
+
+    Returns:
+        语料描述（规模参数和几个采样ID，供基准测试使用）
+    """
+    manifest_path = os.path.join(data_dir, "corpus.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("scale") == scale and manifest.get("seed") == seed and manifest.get("layout") == LAYOUT:
+            return manifest
+
+    params = SCALES[scale]
+    rng = random.Random(seed)
+    users_dir = os.path.join(data_dir, "users")
+    chats_dir = os.path.join(data_dir, "chats")
+    personas_dir = os.path.join(data_dir, "personas")
+    for directory in (users_dir, chats_dir, personas_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    user_ids = []
+    for i in range(params["users"]):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        username = f"user{i:05d}"
+        user_ids.append(user_id)
+        _write_json(os.path.join(users_dir, f"{username}.json"), {
+            "user_id": user_id, "username": username, "password": "x",
+            "created_at": "2025-01-01T00:00:00"
+        })
+
+    # 旧版本生成的平铺布局对话文件
+    with os.scandir(chats_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json") and entry.is_file():
+                os.remove(entry.path)
+
+    start = datetime.datetime(2025, 1, 1)
+    sample_chat_ids = []
+    for i in range(params["chats"]):
+        # 用户活跃度服从长尾分布：少数用户拥有大量对话
+        user_id = user_ids[min(len(user_ids) - 1, int(rng.paretovariate(1.2)) - 1)]
+        when = start + datetime.timedelta(minutes=rng.randint(0, 500000))
+        chat = make_chat(rng, user_id, params["messages_per_chat"], when)
+        prefix = hashlib.sha1(chat["chat_id"].encode("utf-8")).hexdigest()[:2]
+        shard_dir = os.path.join(chats_dir, user_id, prefix)
+        os.makedirs(shard_dir, exist_ok=True)
+        _write_json(os.path.join(shard_dir, f"{chat['chat_id']}.json"), chat)
+        if len(sample_chat_ids) < 200:
+            sample_chat_ids.append(chat["chat_id"])
+
+    for i in range(params["personas"]):
+        _write_json(os.path.join(personas_dir, f"persona_{i:03d}.json"), {
+            "name": f"角色{i}", "description": random_text(rng, 10),
+            "system_prompt": random_text(rng, 80), "created_at": "2025-01-01T00:00:00"
+        })
+
+    manifest = {
+        "scale": scale,
+        "seed": seed,
+        "layout": LAYOUT,
+        "params": params,
+        "heavy_user_id": user_ids[0],
+        "light_user_id": user_ids[-1],
+        "sample_chat_ids": sample_chat_ids,
+    }
+    _write_json(manifest_path, manifest)
+    return manifest
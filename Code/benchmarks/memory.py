@@ -0,0 +1,80 @@
+"""会话内存占用基准
+
+模拟多个会话各自从磁盘加载一段长历史后保留在内存中（st.session_state.messages），
+用 tracemalloc 统计保留的内存，对比普通字典消息与 Message 对象两种表示。
+"""
+
+import gc
+import json
+import random
+import tracemalloc
+from typing import Dict, Any, List, Callable
+
+from app.models.chat import Chat
+from benchmarks.corpus import make_messages
+
+
+def _retained_bytes(build: Callable[[], List[Any]]) -> int:
+    """返回 build() 返回的对象在其返回后仍占用的内存字节数"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def run_memory(sessions: int, messages_per_session: int, words_per_message: int, seed: int = 42) -> Dict[str, Any]:
+    """测量每个会话的历史消息占用的内存
+
+    Args:
+        sessions: 会话数
+        messages_per_session: 每个会话的消息数
+        words_per_message: 每条消息的单词数
+        seed: 随机种子
+
+    Returns:
+        两种表示的总字节数、每个会话和每条消息的字节数
+    """
+    rng = random.Random(seed)
+    # 与从磁盘读取时一样，每个会话的历史各自由JSON解析得到，字符串不在会话之间共享
+    payloads = [json.dumps({"chat_id": f"bench-{i}", "messages": make_messages(rng, messages_per_session,
+                                                                                words_per_message),
+                            "metadata": {"user_id": "bench-user"}}, ensure_ascii=False)
+                for i in range(sessions)]
+
+    results: Dict[str, Any] = {"sessions": sessions, "messages_per_session": messages_per_session,
+                               "words_per_message": words_per_message}
+    variants = {
+        "dict": lambda: [json.loads(payload)["messages"] for payload in payloads],
+        "message": lambda: [Chat.from_dict(json.loads(payload)).messages for payload in payloads],
+    }
+    for name, build in variants.items():
+        total = _retained_bytes(build)
+        results[name] = {
+            "total_bytes": total,
+            "bytes_per_session": total / sessions,
+            "bytes_per_message": total / (sessions * messages_per_session),
+        }
+    # 消息内容本身在两种表示中相同，差值就是每条消息节省的容器开销
+    results["saved_bytes_per_message"] = (results["dict"]["bytes_per_message"]
+                                          - results["message"]["bytes_per_message"])
+    results["ratio"] = results["message"]["total_bytes"] / results["dict"]["total_bytes"]
+    return results
+
+
+def format_memory(results: Dict[str, Any]) -> str:
+    lines = [f"{results['sessions']} 个会话 × {results['messages_per_session']} 条消息"
+             f"（每条约 {results['words_per_message']} 个单词）",
+             f"{'representation':<16} {'KiB/session':>12} {'B/message':>10}"]
+    for name in ("dict", "message"):
+        lines.append(f"{name:<16} {results[name]['bytes_per_session'] / 1024:12.1f} "
+                     f"{results[name]['bytes_per_message']:10.1f}")
+    lines.append(f"每条消息节省 {results['saved_bytes_per_message']:.1f} 字节，"
+                 f"总占用为原来的 {results['ratio']:.0%}")
+    return "\n".join(lines)
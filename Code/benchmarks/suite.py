@@ -0,0 +1,141 @@
+"""基准测试用例
+
+注意：app.config 在导入时读取 XIAOHAO_DATA_DIR，必须先生成语料并设置环境变量再导入本模块
+（见 benchmarks/__main__.py）。
+"""
+
+import time
+import random
+import statistics
+from typing import Callable, Dict, Any, List, Optional
+
+from app.chat.message_handler import MessageHandler
+from app.models.chat import Chat
+from app.storage.file_storage import FileStorage
+from app.storage.chat_cache import chat_cache
+from benchmarks.corpus import make_messages, make_thinking_response
+
+# 注册的基准：名称 -> 准备函数
+BENCHMARKS: Dict[str, Callable[[Dict[str, Any]], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+    """注册基准，被装饰函数接收语料描述，返回要计时的无参函数"""
+    def decorator(setup: Callable[[Dict[str, Any]], Callable[[], Any]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def measure(func: Callable[[], Any], min_time: float, max_iterations: int) -> Dict[str, Any]:
+    """重复调用func直到累计耗时达到min_time或次数达到上限，返回每次调用耗时的统计"""
+    func()  # 预热
+    timings: List[float] = []
+    total = 0.0
+    while total < min_time and len(timings) < max_iterations:
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        timings.append(elapsed)
+        total += elapsed
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "min_s": timings[0],
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.fmean(timings),
+        "p95_s": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+@benchmark("storage.get_user_chats.heavy_user")
+def _get_user_chats_heavy(corpus):
+    return lambda: FileStorage.get_user_chats(corpus["heavy_user_id"])
+
+
+@benchmark("storage.get_user_chats.light_user")
+def _get_user_chats_light(corpus):
+    return lambda: FileStorage.get_user_chats(corpus["light_user_id"])
+
+
+@benchmark("storage.load_chat.cold")
+def _load_chat_cold(corpus):
+    chat_ids = corpus["sample_chat_ids"]
+    state = {"i": 0}
+
+    def run():
+        chat_id = chat_ids[state["i"] % len(chat_ids)]
+        state["i"] += 1
+        chat_cache.invalidate(chat_id)
+        FileStorage.load_chat(chat_id)
+    return run
+
+
+@benchmark("storage.load_chat.warm")
+def _load_chat_warm(corpus):
+    chat_id = corpus["sample_chat_ids"][0]
+    FileStorage.load_chat(chat_id)
+    return lambda: FileStorage.load_chat(chat_id)
+
+
+@benchmark("storage.save_chat")
+def _save_chat(corpus):
+    chat = Chat(user_id="bench-user", messages=make_messages(random.Random(1), 20),
+                metadata={"title": "bench", "persona_id": "default", "user_id": "bench-user"})
+    return lambda: FileStorage.save_chat(chat)
+
+
+@benchmark("storage.load_all_personas")
+def _load_all_personas(corpus):
+    return FileStorage.load_all_personas
+
+
+@benchmark("message.format_thinking.256k")
+def _format_thinking(corpus):
+    handler = MessageHandler(None)
+    response = make_thinking_response(random.Random(2), 256 * 1024)
+    return lambda: handler._format_thinking(response)
+
+
+@benchmark("message.remove_thinking.256k")
+def _remove_thinking(corpus):
+    handler = MessageHandler(None)
+    response = make_thinking_response(random.Random(3), 256 * 1024)
+    return lambda: handler._remove_thinking(response)
+
+
+@benchmark("model.chat_from_dict.1000_messages")
+def _chat_from_dict(corpus):
+    data = Chat(user_id="bench-user", messages=make_messages(random.Random(4), 1000),
+                metadata={"user_id": "bench-user"}).to_dict()
+    return lambda: Chat.from_dict(data)
+
+
+@benchmark("model.chat_to_dict.1000_messages")
+def _chat_to_dict(corpus):
+    chat = Chat(user_id="bench-user", messages=make_messages(random.Random(5), 1000),
+                metadata={"user_id": "bench-user"})
+    return chat.to_dict
+
+
+def run_suite(corpus: Dict[str, Any], selected: Optional[List[str]] = None,
+              min_time: float = 1.0, max_iterations: int = 10000) -> Dict[str, Dict[str, Any]]:
+    """运行基准测试
+
+    Args:
+        corpus: 语料描述
+        selected: 只运行名称包含其中任一子串的基准，None表示全部
+        min_time: 每个基准的最短计时时间（秒）
+        max_iterations: 每个基准的最多迭代次数
+
+    Returns:
+        基准名称到统计结果的字典
+    """
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = measure(setup(corpus), min_time, max_iterations)
+        print(f"{name:<45} median={results[name]['median_s'] * 1000:10.3f} ms  "
+              f"iterations={results[name]['iterations']}")
+    return results
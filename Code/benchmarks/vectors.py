@@ -0,0 +1,105 @@
+"""向量索引的召回率与延迟基准
+
+在临时目录中用合成的聚类数据（模拟文本嵌入的分布：若干主题中心加噪声后归一化）建立
+VectorIndex，分别测量精确扫描和不同nprobe下IVF检索的延迟，以精确扫描的结果为基准计算
+IVF的recall@k。
+"""
+
+import time
+import shutil
+import tempfile
+from typing import Dict, Any, List
+
+import numpy as np
+
+from app.storage.vector_index import VectorIndex
+
+# 每批生成的行数，生成百万级数据时限制内存占用
+_GENERATE_BATCH = 100000
+
+
+def make_vectors(rng: np.random.Generator, centers: np.ndarray, n: int, noise: float) -> np.ndarray:
+    """围绕随机选取的中心生成n个归一化向量"""
+    vectors = centers[rng.integers(0, len(centers), n)]
+    vectors = vectors + noise * rng.standard_normal(vectors.shape, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32, copy=False)
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+def run_vectors(rows: int, dim: int, queries: int, k: int, nprobes: List[int],
+                topics: int = 1000, noise: float = 1.5, seed: int = 42) -> Dict[str, Any]:
+    """测量精确检索与IVF检索的延迟和召回率
+
+    Args:
+        rows: 索引中的向量数
+        dim: 向量维度
+        queries: 查询数
+        k: 每次检索返回的数量
+        nprobes: 要测量的nprobe取值
+        topics: 数据中的主题中心数
+        noise: 每个向量相对主题中心的噪声
+        seed: 随机种子
+
+    Returns:
+        建立索引的用时、精确检索的延迟，以及每个nprobe的recall@k和延迟
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    directory = tempfile.mkdtemp(prefix="xiaohao-vectors-")
+    results: Dict[str, Any] = {"rows": rows, "dim": dim, "queries": queries, "k": k}
+    try:
+        index = VectorIndex(directory, dim, ivf_min_rows=max(1, rows))
+        started = time.perf_counter()
+        for start in range(0, rows, _GENERATE_BATCH):
+            n = min(_GENERATE_BATCH, rows - start)
+            index.add(make_vectors(rng, centers, n, noise), np.arange(start, start + n))
+        results["append_s"] = time.perf_counter() - started
+        query_vectors = make_vectors(rng, centers, queries, noise)
+
+        exact_keys = []
+        latencies = []
+        for query in query_vectors:
+            started = time.perf_counter()
+            keys, _ = index.search(query, k, exact=True)
+            latencies.append(time.perf_counter() - started)
+            exact_keys.append(set(keys.tolist()))
+        results["exact"] = {"p50_ms": _percentile_ms(latencies, 50), "p95_ms": _percentile_ms(latencies, 95)}
+
+        started = time.perf_counter()
+        index.compact()
+        results["train_s"] = time.perf_counter() - started
+        results["nlist"] = index.stats()["nlist"]
+
+        results["ivf"] = []
+        for nprobe in nprobes:
+            latencies = []
+            hits = 0
+            for query, expected in zip(query_vectors, exact_keys):
+                started = time.perf_counter()
+                keys, _ = index.search(query, k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - started)
+                hits += len(expected.intersection(keys.tolist()))
+            results["ivf"].append({
+                "nprobe": nprobe,
+                "recall": hits / max(1, sum(len(expected) for expected in exact_keys)),
+                "p50_ms": _percentile_ms(latencies, 50),
+                "p95_ms": _percentile_ms(latencies, 95),
+            })
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def format_vectors(results: Dict[str, Any]) -> str:
+    lines = [f"{results['rows']} 个 {results['dim']} 维向量，{results['queries']} 次查询，k={results['k']}",
+             f"追加用时 {results['append_s']:.1f}s，训练IVF（{results['nlist']} 个簇）用时 {results['train_s']:.1f}s",
+             f"{'mode':<16} {'recall':>8} {'p50 ms':>9} {'p95 ms':>9}",
+             f"{'exact':<16} {1.0:8.3f} {results['exact']['p50_ms']:9.2f} {results['exact']['p95_ms']:9.2f}"]
+    for row in results["ivf"]:
+        lines.append(f"{'ivf nprobe=' + str(row['nprobe']):<16} {row['recall']:8.3f} "
+                     f"{row['p50_ms']:9.2f} {row['p95_ms']:9.2f}")
+    return "\n".join(lines)
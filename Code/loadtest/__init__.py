@@ -0,0 +1 @@
+"""负载测试工具：模拟Ollama服务与并发用户负载生成器"""
@@ -0,0 +1,102 @@
+"""负载测试入口
+
+示例：
+    # 20个用户恒定负载60秒，模拟服务每秒30个token、首token延迟服从对数正态分布
+    python -m loadtest --users 20 --duration 60 --token-rate 30 --latency lognormal:0.2:0.5
+
+    # 2分钟内从1个用户爬升到50个用户
+    python -m loadtest --profile ramp --users 50 --ramp-seconds 120 --duration 180
+
+    # 浸泡测试：30个用户运行1小时，每5分钟输出一次分段统计
+    python -m loadtest --profile soak --users 30 --duration 3600 --report-interval 300
+
+    # 对真实Ollama服务施压
+    python -m loadtest --ollama-url http://localhost:11434 --users 4
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+from loadtest.stub_ollama import StubOllamaServer, add_stub_arguments, stub_config_from_args
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="晓昊助手负载测试")
+    parser.add_argument("--profile", choices=["constant", "ramp", "soak"], default="constant", help="负载曲线")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数（ramp为目标用户数）")
+    parser.add_argument("--duration", type=float, default=60.0, help="测试时长（秒）")
+    parser.add_argument("--start-users", type=int, default=1, help="ramp起始用户数")
+    parser.add_argument("--ramp-seconds", type=float, default=30.0, help="ramp爬升时长（秒）")
+    parser.add_argument("--report-interval", type=float, default=60.0, help="soak分段统计间隔（秒）")
+    parser.add_argument("--turns-per-chat", type=int, default=6, help="每个对话的回合数")
+    parser.add_argument("--think-time", type=float, default=1.0, help="回合间平均等待（秒）")
+    parser.add_argument("--deep-ratio", type=float, default=0.2, help="深度思考模式回合比例")
+    parser.add_argument("--data-dir", type=str, default=None, help="数据目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--ollama-url", type=str, default=None, help="使用真实Ollama服务而不是模拟服务")
+    parser.add_argument("--output", type=str, default=None, help="将JSON报告写入文件")
+    add_stub_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    stub = None
+    if args.ollama_url:
+        ollama_url = args.ollama_url
+    else:
+        stub = StubOllamaServer(stub_config_from_args(args)).start()
+        ollama_url = stub.url
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="xiaohao-loadtest-")
+    # 必须在导入app之前设置，app.config在导入时读取
+    os.environ["XIAOHAO_DATA_DIR"] = data_dir
+    os.environ["XIAOHAO_OLLAMA_HOST"] = ollama_url
+
+    from loadtest.harness import Profile, UserOptions, run_load_test
+    from app.chat.chat_manager import ChatManager
+    from app.chat.message_handler import MessageHandler
+    from app.llm.ollama_client import OllamaClient
+    from app.storage.file_storage import FileStorage
+    from app.telemetry.tracing import tracer
+
+    # 负载测试不写追踪文件，只保留内存直方图
+    tracer.exporter = None
+
+    profile = Profile(
+        kind=args.profile, users=args.users, duration=args.duration,
+        start_users=args.start_users, ramp_seconds=args.ramp_seconds,
+        report_interval=args.report_interval,
+    )
+    options = UserOptions(
+        turns_per_chat=args.turns_per_chat, think_time=args.think_time,
+        deep_thinking_ratio=args.deep_ratio,
+    )
+
+    print(f"负载测试开始: profile={profile.kind} users={profile.users} duration={profile.duration}s ollama={ollama_url}")
+    try:
+        report = run_load_test(
+            profile, options, ChatManager(FileStorage()), MessageHandler(OllamaClient()),
+            seed=args.seed,
+            on_interval=lambda r: print(f"[{r['t_s']:>7}s] users={r['users']} turns/s={r['throughput_turns_per_s']} "
+                                        f"p95={r['latency_p95_s']}s errors={r['error_rate']:.2%} rss={r['rss_bytes'] // 2**20}MiB")
+        )
+    finally:
+        if stub is not None:
+            stub.stop()
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(json.dumps({k: v for k, v in report.items() if k != "intervals"}, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["turns"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
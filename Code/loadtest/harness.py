@@ -0,0 +1,252 @@
+"""负载测试核心逻辑
+
+不经过Streamlit界面，直接驱动 MessageHandler + ChatManager + FileStorage，
+模拟N个并发用户的完整对话回合：加载聊天 → 获取回复 → 保存聊天。
+
+注意：app.config 在导入时读取 XIAOHAO_DATA_DIR / XIAOHAO_OLLAMA_HOST 环境变量，
+因此必须在导入本模块之前设置好环境变量（见 loadtest/__main__.py）。
+"""
+
+import os
+import time
+import random
+import threading
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+
+from app.chat.chat_manager import ChatManager
+from app.chat.message_handler import MessageHandler
+from app.config import PERSONAS_DATA
+from app.telemetry.metrics import STORAGE_WRITTEN_BYTES
+
+QUESTIONS = [
+    "帮我总结一下今天的新闻",
+    "解释一下什么是注意力机制",
+    "给我写一首关于秋天的诗",
+    "如何提高睡眠质量？",
+    "合同违约需要承担哪些责任？",
+    "Python里的GIL是什么？",
+]
+
+
+@dataclass
+class Profile:
+    """负载曲线
+
+    constant: 从一开始就运行 users 个用户，持续 duration 秒
+    ramp: 在 ramp_seconds 内从 start_users 线性增加到 users，然后保持到 duration 结束
+    soak: 与 constant 相同，但按 report_interval 输出分段统计，用于发现随时间的退化
+    """
+
+    kind: str = "constant"
+    users: int = 10
+    duration: float = 60.0
+    start_users: int = 1
+    ramp_seconds: float = 30.0
+    report_interval: float = 60.0
+
+    def target_users(self, elapsed: float) -> int:
+        if self.kind != "ramp" or elapsed >= self.ramp_seconds or self.ramp_seconds <= 0:
+            return self.users
+        fraction = elapsed / self.ramp_seconds
+        return max(self.start_users, int(self.start_users + (self.users - self.start_users) * fraction))
+
+
+@dataclass
+class TurnSample:
+    """一个对话回合的测量结果"""
+
+    finished_at: float
+    latency: float
+    ok: bool
+    error_kind: Optional[str] = None
+    tokens: int = 0
+
+
+@dataclass
+class UserOptions:
+    """模拟用户的行为参数"""
+
+    turns_per_chat: int = 6  # 每个对话的回合数，之后新建对话
+    think_time: float = 1.0  # 回合之间的平均等待秒数（指数分布），0表示不等待
+    deep_thinking_ratio: float = 0.2  # 使用深度思考模式的回合比例
+
+
+def percentile(values: List[float], q: float) -> float:
+    """计算分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[TurnSample], elapsed: float) -> Dict[str, Any]:
+    """汇总一组回合样本"""
+    latencies = [s.latency for s in samples if s.ok]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s.ok:
+            errors[s.error_kind or "unknown"] = errors.get(s.error_kind or "unknown", 0) + 1
+    tokens = sum(s.tokens for s in samples)
+    return {
+        "turns": len(samples),
+        "ok": len(latencies),
+        "errors": errors,
+        "error_rate": round((len(samples) - len(latencies)) / len(samples), 4) if samples else 0.0,
+        "throughput_turns_per_s": round(len(samples) / elapsed, 3) if elapsed > 0 else 0.0,
+        "tokens_per_s": round(tokens / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_p50_s": round(percentile(latencies, 0.50), 4),
+        "latency_p95_s": round(percentile(latencies, 0.95), 4),
+        "latency_p99_s": round(percentile(latencies, 0.99), 4),
+        "latency_max_s": round(max(latencies), 4) if latencies else 0.0,
+    }
+
+
+def _rss_bytes() -> int:
+    """当前进程常驻内存（仅Linux），不可用时返回0"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class SimulatedUser(threading.Thread):
+    """一个模拟用户：循环进行对话回合直到被停止"""
+
+    def __init__(self, index: int, chat_manager: ChatManager, message_handler: MessageHandler,
+                 options: UserOptions, samples: List[TurnSample], samples_lock: threading.Lock,
+                 stop: threading.Event, seed: Optional[int]):
+        super().__init__(name=f"loadtest-user-{index}", daemon=True)
+        self.user_id = f"loadtest-user-{index}"
+        self.chat_manager = chat_manager
+        self.message_handler = message_handler
+        self.options = options
+        self.samples = samples
+        self.samples_lock = samples_lock
+        self.stop_event = stop
+        self.rng = random.Random(None if seed is None else seed + index)
+        self.personas = list(PERSONAS_DATA.keys())
+
+    def run(self):
+        chat_id = None
+        turns = 0
+        persona_id = self.rng.choice(self.personas)
+        while not self.stop_event.is_set():
+            if chat_id is None or turns >= self.options.turns_per_chat:
+                persona_id = self.rng.choice(self.personas)
+                chat_id = self.chat_manager.create_chat(self.user_id, persona_id)
+                turns = 0
+            self._turn(chat_id, persona_id)
+            turns += 1
+            if self.options.think_time > 0:
+                self.stop_event.wait(self.rng.expovariate(1.0 / self.options.think_time))
+
+    def _turn(self, chat_id: str, persona_id: str) -> None:
+        started = time.perf_counter()
+        ok, error_kind, tokens = False, None, 0
+        try:
+            chat = self.chat_manager.load_chat(self.user_id, chat_id)
+            if chat is None:
+                error_kind = "chat_missing"
+            else:
+                messages = list(chat["messages"])
+                question = self.rng.choice(QUESTIONS)
+                deep = self.rng.random() < self.options.deep_thinking_ratio
+                reply = self.message_handler.get_response(
+                    question, messages, PERSONAS_DATA[persona_id]["system_prompt"], deep
+                )
+                tokens = reply.stats.get("eval_count", 0)
+                if reply.ok:
+                    messages.append({"role": "user", "content": question})
+                    messages.append({"role": "assistant", "content": reply.content})
+                    ok = self.chat_manager.save_chat(self.user_id, chat_id, messages, persona_id)
+                    if not ok:
+                        error_kind = "save_failed"
+                else:
+                    error_kind = reply.error_kind
+        except Exception as e:
+            error_kind = type(e).__name__
+        sample = TurnSample(time.time(), time.perf_counter() - started, ok, error_kind, tokens)
+        with self.samples_lock:
+            self.samples.append(sample)
+
+
+def run_load_test(profile: Profile, options: UserOptions, chat_manager: ChatManager,
+                  message_handler: MessageHandler, seed: Optional[int] = None,
+                  on_interval=None) -> Dict[str, Any]:
+    """按负载曲线运行负载测试
+
+    Args:
+        profile: 负载曲线
+        options: 模拟用户行为参数
+        chat_manager: 聊天管理器
+        message_handler: 消息处理器
+        seed: 随机种子
+        on_interval: 每个统计区间结束时的回调，参数为该区间的统计字典
+
+    Returns:
+        测试报告字典
+    """
+    samples: List[TurnSample] = []
+    samples_lock = threading.Lock()
+    stop = threading.Event()
+    users: List[SimulatedUser] = []
+    bytes_before = STORAGE_WRITTEN_BYTES.labels().get()
+    rss_before = _rss_bytes()
+
+    started_wall = time.time()
+    started = time.perf_counter()
+    intervals = []
+    next_report = profile.report_interval
+    interval_start_index = 0
+    interval_started = started
+
+    while True:
+        elapsed = time.perf_counter() - started
+        if elapsed >= profile.duration:
+            break
+        while len(users) < profile.target_users(elapsed):
+            user = SimulatedUser(len(users), chat_manager, message_handler, options,
+                                 samples, samples_lock, stop, seed)
+            users.append(user)
+            user.start()
+        if profile.kind == "soak" and elapsed >= next_report:
+            with samples_lock:
+                window = samples[interval_start_index:]
+                interval_start_index = len(samples)
+            now = time.perf_counter()
+            interval = summarize(window, now - interval_started)
+            interval.update({"t_s": round(elapsed, 1), "users": len(users), "rss_bytes": _rss_bytes()})
+            intervals.append(interval)
+            if on_interval:
+                on_interval(interval)
+            interval_started = now
+            next_report += profile.report_interval
+        time.sleep(0.05)
+
+    stop.set()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started
+
+    # 等待后台写入队列落盘后再统计写盘字节数
+    chat_manager.write_queue.flush()
+
+    report = summarize(samples, elapsed)
+    report.update({
+        "profile": profile.kind,
+        "users": profile.users,
+        "duration_s": round(elapsed, 2),
+        "started_at": started_wall,
+        "disk_bytes_written": int(STORAGE_WRITTEN_BYTES.labels().get() - bytes_before),
+        "rss_growth_bytes": _rss_bytes() - rss_before,
+        "data_dir": os.environ.get("XIAOHAO_DATA_DIR"),
+    })
+    if intervals:
+        report["intervals"] = intervals
+    return report
@@ -0,0 +1,258 @@
+"""模拟Ollama服务
+
+实现 /api/chat（流式与非流式）、/api/embed 和 /api/tags，按配置的延迟分布与生成速率返回假数据，
+并在响应中附带与Ollama一致的 eval_count / eval_duration / prompt_eval_duration 等统计字段。
+
+单独运行：
+    python -m loadtest.stub_ollama --port 11500 --token-rate 30 --latency lognormal:0.2:0.5
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional
+
+
+@dataclass
+class LatencyDistribution:
+    """首token前延迟（模拟模型加载和prompt评估）的分布
+
+    规格字符串格式：
+        fixed:<秒>
+        uniform:<最小秒>:<最大秒>
+        exponential:<均值秒>
+        lognormal:<中位数秒>:<sigma>
+    """
+
+    kind: str = "fixed"
+    a: float = 0.05
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyDistribution':
+        parts = spec.split(":")
+        kind = parts[0]
+        values = [float(p) for p in parts[1:]]
+        if kind == "fixed" and len(values) == 1:
+            return cls(kind, values[0])
+        if kind in ("uniform", "lognormal") and len(values) == 2:
+            return cls(kind, values[0], values[1])
+        if kind == "exponential" and len(values) == 1:
+            return cls(kind, values[0])
+        raise ValueError(f"无法解析延迟分布: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "exponential":
+            return rng.expovariate(1.0 / self.a) if self.a > 0 else 0.0
+        if self.kind == "lognormal":
+            return rng.lognormvariate(0, self.b) * self.a
+        return self.a
+
+
+@dataclass
+class StubConfig:
+    """模拟服务配置"""
+
+    token_rate: float = 50.0  # 每秒生成的token数，0表示不限速
+    latency: LatencyDistribution = None  # 首token前延迟分布
+    mean_tokens: int = 120  # 平均回复长度（token）
+    error_rate: float = 0.0  # 以HTTP 500失败的请求比例
+    think: bool = True  # 回复中是否包含<think>段落
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        if self.latency is None:
+            self.latency = LatencyDistribution()
+
+
+EMBEDDING_DIM = 256
+WORDS = ["晓昊", "助手", "模型", "回答", "问题", "思考", "数据", "系统", "用户", "测试", "性能", "延迟"]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = StubConfig()
+    rng = random.Random()
+    rng_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._send_json(200, {"models": [{"name": "stub:latest", "model": "stub:latest"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.startswith("/api/embed"):
+            self._embed(request)
+            return
+        if not self.path.startswith("/api/chat"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        with self.rng_lock:
+            fail = self.rng.random() < self.config.error_rate
+            first_token_delay = self.config.latency.sample(self.rng)
+            num_predict = (request.get("options") or {}).get("num_predict") or 1024
+            tokens = max(1, min(num_predict, int(self.rng.gauss(self.config.mean_tokens, self.config.mean_tokens / 4))))
+            words = [self.rng.choice(WORDS) for _ in range(tokens)]
+
+        if fail:
+            time.sleep(first_token_delay)
+            self._send_json(500, {"error": "stub injected failure"})
+            return
+
+        if self.config.think and len(words) > 4:
+            split = len(words) // 3
+            words = ["<think>"] + words[:split] + ["</think>"] + words[split:]
+
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 2
+        model = request.get("model", "stub")
+        if request.get("stream", True):
+            self._stream(model, words, tokens, prompt_tokens, first_token_delay)
+        else:
+            self._respond(model, words, tokens, prompt_tokens, first_token_delay)
+
+    def _embed(self, request: Dict[str, Any]) -> None:
+        """按文本内容确定性地生成向量（与本地哈希嵌入相同），相同文本总是得到相同向量"""
+        from app.llm.embeddings import HashingEmbedder
+        texts = request.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = HashingEmbedder(EMBEDDING_DIM).embed(texts)
+        self._send_json(200, {"model": request.get("model", "stub"), "embeddings": vectors.tolist()})
+
+    def _stats(self, tokens: int, prompt_tokens: int, first_token_delay: float, eval_seconds: float) -> Dict[str, Any]:
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((first_token_delay + eval_seconds) * 1e9),
+            "load_duration": int(first_token_delay * 0.1 * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(first_token_delay * 0.9 * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(eval_seconds * 1e9),
+        }
+
+    def _respond(self, model, words, tokens, prompt_tokens, first_token_delay):
+        eval_seconds = tokens / self.config.token_rate if self.config.token_rate > 0 else 0.0
+        time.sleep(first_token_delay + eval_seconds)
+        payload = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": "".join(words)},
+        }
+        payload.update(self._stats(tokens, prompt_tokens, first_token_delay, eval_seconds))
+        self._send_json(200, payload)
+
+    def _stream(self, model, words, tokens, prompt_tokens, first_token_delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.config.token_rate if self.config.token_rate > 0 else 0.0
+        started = time.perf_counter()
+        try:
+            time.sleep(first_token_delay)
+            for word in words:
+                self._write_chunk({"model": model, "message": {"role": "assistant", "content": word}, "done": False})
+                if interval:
+                    time.sleep(interval)
+            final = {"model": model, "message": {"role": "assistant", "content": ""}}
+            final.update(self._stats(tokens, prompt_tokens, first_token_delay,
+                                     time.perf_counter() - started - first_token_delay))
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途断开（例如取消生成）
+            pass
+
+    def _write_chunk(self, payload: Dict[str, Any]) -> None:
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubOllamaServer:
+    """在后台线程运行的模拟Ollama服务"""
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        handler = type("StubHandler", (_Handler,), {
+            "config": config,
+            "rng": random.Random(config.seed),
+            "rng_lock": threading.Lock(),
+        })
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'StubOllamaServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """向命令行解析器添加模拟服务参数"""
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每秒生成的token数，0表示不限速")
+    parser.add_argument("--latency", type=str, default="fixed:0.05",
+                        help="首token前延迟分布，如 fixed:0.1、uniform:0.05:0.3、exponential:0.2、lognormal:0.2:0.5")
+    parser.add_argument("--mean-tokens", type=int, default=120, help="平均回复长度（token）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入HTTP 500失败的比例")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+
+
+def stub_config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        token_rate=args.token_rate,
+        latency=LatencyDistribution.parse(args.latency),
+        mean_tokens=args.mean_tokens,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟Ollama服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    server = StubOllamaServer(stub_config_from_args(args), args.host, args.port).start()
+    print(f"模拟Ollama服务已启动: {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
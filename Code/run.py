@@ -6,15 +6,70 @@
 
 import os
 import sys
+import json
 import argparse
 import subprocess
 import streamlit as st
 from app.main import XiaoHaoAssistant
+from app.config import METRICS_CONFIG, API_CONFIG, BATCH_CONFIG, EXPORT_CONFIG, CHAT_LAYOUT_CONFIG, DEPLOY_CONFIG
+from app.telemetry.metrics import start_http_server
 
 # 解析命令行参数
 parser = argparse.ArgumentParser(description="晓昊助手启动脚本")
 parser.add_argument("--use-ngrok", action="store_true", help="使用ngrok进行内网穿透")
 parser.add_argument("--ngrok-token", type=str, help="ngrok授权token")
+subparsers = parser.add_subparsers(dest="command", help="不指定时启动Streamlit界面")
+
+# HTTP/JSON API服务（不经过Streamlit）
+api_parser = subparsers.add_parser("api", help="启动HTTP/JSON API服务")
+api_parser.add_argument("--host", type=str, default=API_CONFIG["host"], help="监听地址")
+api_parser.add_argument("--port", type=int, default=API_CONFIG["port"], help="监听端口")
+
+# 多进程部署
+serve_parser = subparsers.add_parser("serve", help="启动多个Streamlit工作进程和粘性反向代理，使用全部CPU核心")
+serve_parser.add_argument("--workers", type=int, default=DEPLOY_CONFIG["workers"], help="工作进程数，默认每个CPU核心一个")
+serve_parser.add_argument("--host", type=str, default=DEPLOY_CONFIG["host"], help="代理监听地址")
+serve_parser.add_argument("--port", type=int, default=DEPLOY_CONFIG["port"], help="代理监听端口")
+
+# 批量/离线推理
+batch_parser = subparsers.add_parser("batch", help="对JSONL问题文件批量获取回复")
+batch_parser.add_argument("input", help="JSONL输入文件，每行包含prompt字段")
+batch_parser.add_argument("--output", required=True, help="JSONL结果文件，已存在时跳过已完成的条目继续运行")
+batch_parser.add_argument("--persona", default="default", help="默认角色ID")
+batch_parser.add_argument("--deep-thinking", action="store_true", help="默认启用深度思考模式")
+batch_parser.add_argument("--concurrency", type=int, default=BATCH_CONFIG["concurrency"], help="同时进行的请求数")
+batch_parser.add_argument("--retry-failed", action="store_true", help="重新处理结果文件中失败的条目")
+
+# 聊天导出/导入
+export_parser = subparsers.add_parser("export", help="导出聊天记录（jsonl / markdown / html，可压缩）")
+export_parser.add_argument("--output", required=True, help="输出文件，扩展名决定格式和压缩方式，如 chats.jsonl.gz、chats.md.zip")
+export_parser.add_argument("--format", choices=["jsonl", "markdown", "html"], help="导出格式，默认按扩展名推断")
+export_parser.add_argument("--user", action="append", help="只导出该用户名的聊天，可重复指定；默认导出全部用户")
+export_parser.add_argument("--since", help="只导出在该日期/时间及之后更新的聊天，如 2025-07-01")
+export_parser.add_argument("--until", help="只导出在该日期（含当天）之前更新的聊天")
+import_parser = subparsers.add_parser("import", help="从jsonl导出文件批量导入聊天记录")
+import_parser.add_argument("input", help="jsonl导出文件（可为 .gz / .bz2 / .xz / .zip）")
+import_parser.add_argument("--user", help="把导入的聊天全部归属到该用户名")
+import_parser.add_argument("--overwrite", action="store_true", help="覆盖已存在的同ID聊天")
+import_parser.add_argument("--batch-size", type=int, default=EXPORT_CONFIG["import_batch_size"], help="每批写入的聊天数")
+
+# 保留策略
+retention_parser = subparsers.add_parser("retention", help="立即执行一次保留策略，把长期未修改的聊天移入归档")
+retention_parser.add_argument("--days", type=float, help="覆盖配置中的保留天数")
+retention_parser.add_argument("--dry-run", action="store_true", help="只统计符合条件的聊天，不做修改")
+
+# 聊天目录布局迁移
+migrate_parser = subparsers.add_parser("migrate-chats", help="把平铺的聊天文件移动到分片目录布局，可在应用运行期间执行")
+migrate_parser.add_argument("--rate", type=float, default=CHAT_LAYOUT_CONFIG["migrate_files_per_second"],
+                            help="每秒最多移动的文件数，0表示不限")
+migrate_parser.add_argument("--dry-run", action="store_true", help="只统计仍在旧布局中的文件数")
+
+# 角色知识库
+ingest_parser = subparsers.add_parser("ingest", help="把文本/Markdown文件导入角色的知识库（增量，按内容哈希跳过未修改的文件）")
+ingest_parser.add_argument("persona", help="角色ID，如 medical、legal")
+ingest_parser.add_argument("paths", nargs="+", help="文件或目录，目录中按扩展名递归查找；PDF请先转换为文本")
+ingest_parser.add_argument("--rebuild", action="store_true", help="重新切分和嵌入全部文件（更换嵌入模型后使用）")
+
 args = parser.parse_args()
 
 # 如果指定了ngrok参数，设置环境变量
@@ -29,17 +84,153 @@ if args.use_ngrok:
 # 定义主函数
 def main():
     """应用入口点"""
+    # 启动指标服务（Streamlit每次重新运行脚本都会调用，重复调用只启动一次）
+    if METRICS_CONFIG["enabled"]:
+        start_http_server(METRICS_CONFIG["port"], METRICS_CONFIG["host"])
     app = XiaoHaoAssistant()
     app.run()
 
+def run_api(host: str, port: int):
+    """API服务入口点"""
+    from app.api.server import run_api_server
+    
+    if METRICS_CONFIG["enabled"]:
+        start_http_server(METRICS_CONFIG["port"], METRICS_CONFIG["host"])
+    print(f"正在启动晓昊助手API服务: http://{host}:{port}")
+    run_api_server(host, port)
+
+def run_serve(args):
+    """多进程部署入口点"""
+    from app.deploy.launcher import Launcher
+    
+    Launcher(os.path.abspath(__file__), args.workers, args.host, args.port).run()
+
+def run_batch(args):
+    """批量推理入口点"""
+    from app.chat.batch_runner import BatchRunner
+    from app.chat.message_handler import MessageHandler
+    from app.llm.ollama_client import OllamaClient
+    from app.storage.file_storage import FileStorage
+    
+    runner = BatchRunner(MessageHandler(OllamaClient()), FileStorage(), args.concurrency)
+    report = runner.run(
+        args.input,
+        args.output,
+        persona_id=args.persona,
+        deep_thinking=args.deep_thinking,
+        retry_failed=args.retry_failed,
+        progress=sys.stderr
+    )
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    if report.interrupted:
+        print(f"已中断，重新运行相同命令即可从 {args.output} 继续", file=sys.stderr)
+        sys.exit(130)
+
+def _resolve_user_id(storage, username: str) -> str:
+    user = storage.load_user(username)
+    if user is None:
+        print(f"用户不存在: {username}", file=sys.stderr)
+        sys.exit(2)
+    return user.user_id
+
+def run_export(args):
+    """聊天导出入口点"""
+    from app.chat.export import ChatExporter, parse_date
+    from app.storage.file_storage import FileStorage
+    
+    storage = FileStorage()
+    user_ids = {_resolve_user_id(storage, name) for name in args.user} if args.user else None
+    try:
+        report = ChatExporter(storage).export(
+            args.output,
+            fmt=args.format,
+            user_ids=user_ids,
+            since=parse_date(args.since),
+            until=parse_date(args.until, end=True),
+            progress=sys.stderr
+        )
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+
+def run_import(args):
+    """聊天导入入口点"""
+    from app.chat.export import ChatImporter
+    from app.storage.file_storage import FileStorage
+    
+    storage = FileStorage()
+    owner_id = _resolve_user_id(storage, args.user) if args.user else None
+    try:
+        report = ChatImporter(storage, args.batch_size).import_file(
+            args.input, owner_id=owner_id, overwrite=args.overwrite, progress=sys.stderr
+        )
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+
+def run_retention(args):
+    """保留策略入口点"""
+    from app.chat.retention import retention_engine
+    
+    report = retention_engine.run_once(dry_run=args.dry_run, archive_after_days=args.days)
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+
+def run_migrate_chats(args):
+    """聊天目录布局迁移入口点"""
+    from app.storage.file_storage import FileStorage
+    
+    storage = FileStorage()
+    report = storage.migrate_chat_layout(args.rate, dry_run=args.dry_run, progress=sys.stderr)
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    if report.failed:
+        sys.exit(1)
+
+def run_ingest(args):
+    """知识库导入入口点"""
+    from app.chat.knowledge import knowledge_base
+    from app.llm.errors import LLMError
+    from app.storage.file_storage import FileStorage
+    
+    if FileStorage().resolve_persona(args.persona) is None:
+        print(f"角色不存在: {args.persona}", file=sys.stderr)
+        sys.exit(2)
+    try:
+        report = knowledge_base.ingest(args.persona, args.paths, rebuild=args.rebuild, progress=sys.stderr)
+    except (ValueError, LLMError) as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2 if isinstance(e, ValueError) else 1)
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+
 # 直接运行应用
 if __name__ == "__main__":
+    if args.command == "api":
+        run_api(args.host, args.port)
+    elif args.command == "serve":
+        run_serve(args)
+    elif args.command == "batch":
+        run_batch(args)
+    elif args.command == "export":
+        run_export(args)
+    elif args.command == "import":
+        run_import(args)
+    elif args.command == "retention":
+        run_retention(args)
+    elif args.command == "migrate-chats":
+        run_migrate_chats(args)
+    elif args.command == "ingest":
+        run_ingest(args)
     # 检查是否由streamlit直接运行
-    if os.environ.get("STREAMLIT_RUNNING") == "true":
+    elif os.environ.get("STREAMLIT_RUNNING") == "true":
         main()
     else:
         # 设置环境变量标记，避免递归调用
         os.environ["STREAMLIT_RUNNING"] = "true"
+        # 上次运行留下的ngrok地址已失效
+        from app.storage.shared_state import shared_state
+        from app.deploy.launcher import NGROK_URL_KEY
+        shared_state.delete(*NGROK_URL_KEY)
         # 启动streamlit
         print("正在启动晓昊助手...")
         subprocess.call(["streamlit", "run", __file__]) 
\ No newline at end of file
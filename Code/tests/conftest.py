@@ -0,0 +1,37 @@
+"""测试环境
+
+在导入 app 之前设置：数据目录使用临时目录，共享状态使用进程内实现，嵌入使用本地哈希嵌入，
+不读写 data/ 下的真实数据，也不需要Ollama。环境变量由测试启动的子进程继承。
+"""
+
+import os
+import tempfile
+
+os.environ["XIAOHAO_DATA_DIR"] = tempfile.mkdtemp(prefix="xiaohao-test-")
+os.environ["XIAOHAO_STATE_BACKEND"] = "memory"
+os.environ["XIAOHAO_EMBEDDER"] = "hashing"
+os.environ.pop("XIAOHAO_SESSION_SECRET", None)
+
+import pytest
+
+from app.storage.shared_state import MemorySharedState, SqliteSharedState
+
+
+class SharedMemoryState(MemorySharedState):
+    """同一个实例被多个“工作进程”使用时，状态对它们都可见"""
+
+    shared = True
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def worker_states(request, tmp_path):
+    """两个工作进程各自使用的共享状态
+
+    memory：两个工作进程共用同一个进程内实例；sqlite：同一个数据库文件上的两个独立实例，
+    与多进程部署时各工作进程的情况相同。
+    """
+    if request.param == "memory":
+        state = SharedMemoryState()
+        return state, state
+    path = str(tmp_path / "state.sqlite3")
+    return SqliteSharedState(path), SqliteSharedState(path)
@@ -0,0 +1,106 @@
+import os
+import uuid
+
+import pytest
+
+from app.chat.chat_manager import ChatManager
+from app.models.chat import Chat
+from app.models.message import Message
+from app.storage.archive_store import INDEX_FILE, ArchiveStore
+from app.storage.file_storage import FileStorage
+from app.storage.write_behind import WriteBehindQueue
+
+
+def make_chat(user_id, title="t", content="hello"):
+    return Chat(user_id=user_id, messages=[Message("user", content)],
+                metadata={"user_id": user_id, "title": title, "persona_id": "default"})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArchiveStore(str(tmp_path / "archive"))
+
+
+def test_archive_and_load(store):
+    chats = [make_chat("u1", title=f"chat {i}", content=f"message {i}") for i in range(3)]
+    assert store.archive("u1", chats) > 0
+    summaries = {s["chat_id"]: s for s in store.summaries("u1")}
+    assert set(summaries) == {chat.chat_id for chat in chats}
+    assert summaries[chats[1].chat_id]["title"] == "chat 1" and summaries[chats[1].chat_id]["archived"]
+    loaded = store.load("u1", chats[2].chat_id)
+    assert loaded.messages[0].content == "message 2"
+    assert store.contains("u1", chats[0].chat_id) and not store.contains("u2", chats[0].chat_id)
+    assert store.summaries("u2") == [] and store.load("u2", chats[0].chat_id) is None
+
+
+def test_remove_drops_unreferenced_bundles(store):
+    first, second = make_chat("u1"), make_chat("u1")
+    store.archive("u1", [first, second])
+    user_dir = os.path.join(store.archive_dir, "u1")
+    bundles = [name for name in os.listdir(user_dir) if name.endswith(".jsonl.gz")]
+    assert len(bundles) == 1
+    assert store.remove("u1", [first.chat_id, "missing"]) == 1
+    assert os.listdir(user_dir).count(bundles[0]) == 1  # 包中还有 second
+    assert store.remove("u1", [second.chat_id]) == 1
+    assert not any(name.endswith(".jsonl.gz") or name == INDEX_FILE for name in os.listdir(user_dir))
+    assert store.summaries("u1") == []
+
+
+def test_rearchive_replaces_entry(store):
+    chat = make_chat("u1", title="old")
+    store.archive("u1", [chat])
+    chat.metadata["title"] = "new"
+    store.archive("u1", [chat])
+    assert [s["title"] for s in store.summaries("u1")] == ["new"]
+    bundles = [name for name in os.listdir(os.path.join(store.archive_dir, "u1")) if name.endswith(".jsonl.gz")]
+    assert len(bundles) == 1
+
+
+def test_remove_for_unknown_user_is_noop(store):
+    assert store.remove("nobody", ["x"]) == 0
+    assert store.remove("../escape", ["x"]) == 0
+
+
+def test_index_written_by_another_instance_is_seen(store):
+    other = ArchiveStore(store.archive_dir)
+    chat = make_chat("u1")
+    store.summaries("u1")
+    other.archive("u1", [chat])
+    assert store.contains("u1", chat.chat_id)
+    store.remove("u1", [chat.chat_id])
+    assert not other.contains("u1", chat.chat_id)
+
+
+class FailingDelete(FileStorage):
+    @staticmethod
+    def delete_chat(chat_id, expected_mtime_ns=None, user_id=None):
+        return False
+
+
+def make_manager(storage, store):
+    queue = WriteBehindQueue(storage, max_pending=8, enabled=False)
+    return ChatManager(storage, write_queue=queue, archive=store)
+
+
+def test_archive_chat_moves_chat_to_cold_storage(store):
+    user_id = uuid.uuid4().hex
+    manager = make_manager(FileStorage(), store)
+    chat = make_chat(user_id)
+    FileStorage.save_chat(chat)
+    assert manager.archive_chat(user_id, chat.chat_id)
+    assert FileStorage.load_chat(chat.chat_id, cache=False, user_id=user_id) is None
+    assert store.contains(user_id, chat.chat_id)
+    assert manager.delete_chat(user_id, chat.chat_id)
+    assert not store.contains(user_id, chat.chat_id)
+
+
+def test_failed_hot_delete_is_reported(store):
+    user_id = uuid.uuid4().hex
+    manager = make_manager(FailingDelete(), store)
+    chat = make_chat(user_id)
+    FileStorage.save_chat(chat)
+    # 归档后热存储中的文件删不掉：撤销归档，聊天只留在热存储中
+    assert not manager.archive_chat(user_id, chat.chat_id)
+    assert not store.contains(user_id, chat.chat_id)
+    assert FileStorage.load_chat(chat.chat_id, cache=False, user_id=user_id) is not None
+    assert not manager.delete_chat(user_id, chat.chat_id)
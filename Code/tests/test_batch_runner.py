@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from app.chat.batch_runner import BatchRunner
+from app.models.persona import Persona
+from app.models.reply import Reply
+
+
+class StubHandler:
+    """回显问题的消息处理器，raise_on 中的问题抛出异常"""
+
+    def __init__(self, raise_on=()):
+        self.raise_on = set(raise_on)
+        self.prompts = []
+
+    def get_response(self, message, history, system_prompt, deep_thinking_mode=False, **kwargs):
+        self.prompts.append(message)
+        if message in self.raise_on:
+            raise RuntimeError("boom")
+        return Reply(content=f"re: {message}", stats={"eval_count": 1})
+
+
+class StubStorage:
+    @staticmethod
+    def resolve_persona(persona_id):
+        if persona_id in ("default", "legal"):
+            return Persona(persona_id=persona_id, name=persona_id, description="", system_prompt="")
+        return None
+
+
+def write_input(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def read_output(path):
+    return {r["id"]: r for r in map(json.loads, path.read_text(encoding="utf-8").splitlines())}
+
+
+def test_invalid_lines_are_recorded_and_do_not_stop_the_run(tmp_path):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_input(input_path, [
+        json.dumps({"id": "a", "prompt": "one"}),
+        "{not json",
+        json.dumps({"id": "b"}),
+        json.dumps([1, 2]),
+        json.dumps({"id": "c", "prompt": "two", "persona_id": "missing"}),
+        json.dumps("three"),
+    ])
+    handler = StubHandler()
+    report = BatchRunner(handler, StubStorage(), concurrency=2).run(str(input_path), str(output_path))
+
+    records = read_output(output_path)
+    assert report.total == 6 and report.ok == 2 and report.failed == 4
+    assert records["a"]["content"] == "re: one"
+    assert records["6"]["content"] == "re: three"
+    assert records["2"]["error_kind"] == "invalid_line"
+    assert records["b"]["error_kind"] == "invalid_line"
+    assert records["4"]["error_kind"] == "invalid_line"
+    assert records["c"]["error_kind"] == "invalid_persona"
+    assert sorted(handler.prompts) == ["one", "three"]
+
+
+def test_checkpoint_skips_completed_and_retries_failed(tmp_path):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_input(input_path, [json.dumps({"id": "a", "prompt": "one"}),
+                             json.dumps({"id": "b", "prompt": "two"})])
+    BatchRunner(StubHandler(raise_on={"two"}), StubStorage()).run(str(input_path), str(output_path))
+    assert read_output(output_path)["b"]["error_kind"] == "RuntimeError"
+
+    handler = StubHandler()
+    report = BatchRunner(handler, StubStorage()).run(str(input_path), str(output_path), retry_failed=True)
+    assert report.skipped == 1 and report.ok == 1
+    assert handler.prompts == ["two"]
+    assert read_output(output_path)["b"]["ok"]
+
+
+def test_in_flight_results_are_written_when_reading_input_fails(tmp_path):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    # 有效的行之后不是有效的UTF-8，读取到那里时抛出 UnicodeDecodeError
+    lines = [json.dumps({"id": str(i), "prompt": f"question {i:04d}"}) for i in range(1000)]
+    input_path.write_bytes("\n".join(lines).encode() + b"\n" + b"\xff" * 100)
+
+    handler = StubHandler()
+    with pytest.raises(UnicodeDecodeError):
+        BatchRunner(handler, StubStorage(), concurrency=4).run(str(input_path), str(output_path))
+    records = read_output(output_path)
+    assert records and len(records) == len(handler.prompts)
+    assert all(r["ok"] for r in records.values())
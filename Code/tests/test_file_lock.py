@@ -0,0 +1,63 @@
+"""多个进程同时写入同一个向量索引和同一个用户的记忆"""
+
+import os
+import json
+import multiprocessing
+
+import numpy as np
+
+from app.storage.vector_index import VectorIndex
+
+WORKERS = 4
+ROUNDS = 20
+
+
+def _append(directory, worker):
+    index = VectorIndex(directory, 8)
+    rng = np.random.default_rng(worker)
+    for i in range(ROUNDS):
+        keys = np.array([worker * 1000 + i * 2, worker * 1000 + i * 2 + 1])
+        index.add(rng.random((2, 8)), keys)
+        if i % 5 == 4:
+            index.delete(keys[:1])
+
+
+def _remember(root, worker):
+    from app.chat.user_memory import UserMemory
+    from app.storage.file_storage import FileStorage
+    memory = UserMemory(FileStorage(), None, root=root)
+    for i in range(ROUNDS // 2):
+        chat_id = f"chat-{worker}-{i}"
+        memory._remember("u1", {chat_id: [f"用户的第{worker}组第{i}条事实 独特词{worker}x{i}"]}, {chat_id: 2})
+
+
+def _run_workers(target, path):
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=target, args=(path, worker)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert all(process.exitcode == 0 for process in processes)
+
+
+def test_concurrent_index_writers(tmp_path):
+    directory = str(tmp_path / "index")
+    VectorIndex(directory, 8)
+    _run_workers(_append, directory)
+    index = VectorIndex(directory)
+    assert index.stats()["rows"] == WORKERS * ROUNDS * 2
+    assert len(index) == WORKERS * ROUNDS * 2 - WORKERS * ROUNDS // 5
+    keys = np.asarray(index._current().keys)
+    assert len(set(keys.tolist())) == len(keys)
+
+
+def test_concurrent_memory_writers(tmp_path):
+    root = str(tmp_path / "memory")
+    _run_workers(_remember, root)
+    with open(os.path.join(root, "u1", "memory.json"), "r", encoding="utf-8") as f:
+        state = json.load(f)
+    expected = WORKERS * (ROUNDS // 2)
+    assert len(state["chats"]) == expected
+    assert len(state["facts"]) == expected and len({fact["id"] for fact in state["facts"]}) == expected
+    assert len(VectorIndex(os.path.join(root, "u1", "index"))) == expected
@@ -0,0 +1,108 @@
+import json
+
+from app.models.chat import Chat
+from app.models.message import Message
+from app.models.tree import MessageTree, ROOT
+
+
+def m(role, content):
+    return Message(role, content)
+
+
+def branched_chat():
+    """两次重新生成最后一个回答、一次编辑第一个问题后的聊天"""
+    q1, a1 = m("user", "q1"), m("assistant", "a1")
+    chat = Chat(chat_id="c1", messages=[q1, a1])
+    chat.set_path([q1, m("assistant", "a1 v2")])
+    chat.set_path([q1, m("assistant", "a1 v3")])
+    chat.set_path([m("user", "q1 edited"), m("assistant", "a2")])
+    return chat
+
+
+def reload(chat):
+    return Chat.from_dict(json.loads(json.dumps(chat.to_dict(), ensure_ascii=False)))
+
+
+def test_appending_keeps_chat_linear():
+    q1, a1 = m("user", "q1"), m("assistant", "a1")
+    chat = Chat(messages=[q1])
+    chat.set_path([q1, a1])
+    assert chat.tree is None
+    assert "tree" not in chat.to_dict()
+
+
+def test_round_trip_keeps_ids_order_and_active_path():
+    chat = branched_chat()
+    tree = chat.tree
+    data = tree.to_dict()
+    # 当前路径上的节点只记录ID，其余节点完整保存
+    assert data["path"] == tree.path_ids()
+    assert len(data["nodes"]) == len(tree.messages) - len(data["path"])
+
+    loaded = reload(chat)
+    assert loaded.messages == chat.messages
+    assert loaded.tree.parents == tree.parents
+    assert [(x.role, x.content) for x in loaded.tree.messages] == [(x.role, x.content) for x in tree.messages]
+    assert loaded.tree.active == tree.active
+    # 当前路径的节点就是聊天中的消息对象
+    assert all(a is b for a, b in zip(loaded.tree.path(), loaded.messages))
+    assert loaded.tree.to_dict() == data
+
+
+def test_alternatives_and_switching_branches():
+    chat = branched_chat()
+    assert chat.tree.alternatives() == {0: (1, 2)}
+    assert chat.switch_branch(0, -1)
+    # 回到原来的问题时沿最近的分支到达末端
+    assert [x.content for x in chat.messages] == ["q1", "a1 v3"]
+    assert chat.tree.alternatives() == {0: (0, 2), 1: (2, 3)}
+    assert chat.switch_branch(1, 1)
+    assert [x.content for x in chat.messages] == ["q1", "a1"]
+    assert not chat.switch_branch(5, 1)
+
+    loaded = reload(chat)
+    assert [x.content for x in loaded.messages] == ["q1", "a1"]
+    assert loaded.tree.alternatives() == chat.tree.alternatives()
+
+
+def test_fan_out_round_trip():
+    q1 = m("user", "q1")
+    chat = Chat(messages=[q1, m("assistant", "legal answer")])
+    assert chat.add_fan_out("legal", [("doctor", m("assistant", "doctor answer")),
+                                      ("teacher", m("assistant", "teacher answer"))])
+    assert [x.content for x in chat.messages] == ["q1", "legal answer"]
+    rounds = chat.tree.fan_out_rounds()
+    assert list(rounds) == [1] and len(rounds[1]) == 3
+
+    loaded = reload(chat)
+    assert loaded.tree.fan_out == chat.tree.fan_out
+    assert loaded.tree.fan_out_rounds() == rounds
+    assert not Chat(messages=[q1]).add_fan_out("legal", [])
+
+
+def test_inconsistent_tree_falls_back_to_path():
+    chat = branched_chat()
+    data = chat.to_dict()
+    # 旧版本改写了当前路径，消息树数据不再匹配
+    data["messages"] = data["messages"][:1]
+    loaded = Chat.from_dict(data)
+    assert loaded.tree.path_ids() == [0] and len(loaded.tree.messages) == 1
+
+    data = chat.to_dict()
+    data["tree"]["nodes"][0]["parent"] = 99
+    loaded = Chat.from_dict(data)
+    assert [x.content for x in loaded.tree.messages] == [x.content for x in loaded.messages]
+
+
+def test_copy_is_independent():
+    chat = branched_chat()
+    copy = chat.copy()
+    copy.set_path(copy.messages + [m("user", "q2")])
+    assert len(copy.tree.messages) == len(chat.tree.messages) + 1
+    assert chat.tree.active != copy.tree.active
+
+
+def test_empty_tree():
+    tree = MessageTree.from_path([])
+    assert tree.active == ROOT and tree.path() == []
+    assert MessageTree.from_dict(tree.to_dict(), []).path() == []
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from app.auth.errors import AuthBusyError
+from app.auth.password_hasher import PasswordHasher, VerifiedCredentialCache, is_password_hash
+
+
+def make_hasher(rounds=4, workers=1, max_pending=4):
+    return PasswordHasher(rounds=rounds, workers=workers, max_pending=max_pending)
+
+
+def test_hash_and_verify():
+    hasher = make_hasher()
+    stored = hasher.hash("correct horse")
+    assert is_password_hash(stored)
+    assert not is_password_hash("correct horse")
+    assert hasher.verify("correct horse", stored)
+    assert not hasher.verify("wrong", stored)
+    # 格式无效的哈希按不匹配处理
+    assert not hasher.verify("correct horse", "not-a-hash")
+
+
+def test_needs_rehash_when_cost_is_lower():
+    stored = make_hasher(rounds=4).hash("pw")
+    assert not make_hasher(rounds=4).needs_rehash(stored)
+    assert make_hasher(rounds=5).needs_rehash(stored)
+    assert make_hasher().needs_rehash("plain")
+
+
+def test_saturated_pool_sheds_new_attempts():
+    hasher = make_hasher(max_pending=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    worker = threading.Thread(target=hasher._submit, args=(slow,))
+    worker.start()
+    started.wait(5)
+    try:
+        with pytest.raises(AuthBusyError):
+            hasher.hash("pw")
+    finally:
+        release.set()
+        worker.join()
+    assert hasher.verify("pw", hasher.hash("pw"))
+
+
+def test_verified_cache_hits_expires_and_invalidates():
+    cache = VerifiedCredentialCache(ttl=60)
+    cache.put("alice", "pw", "user-1")
+    assert cache.get("alice", "pw") == "user-1"
+    assert cache.get("alice", "other") is None
+    cache.invalidate_user("alice")
+    assert cache.get("alice", "pw") is None
+
+    expired = VerifiedCredentialCache(ttl=-1)
+    expired.put("alice", "pw", "user-1")
+    assert expired.get("alice", "pw") is None
+
+
+def test_verified_cache_is_bounded():
+    cache = VerifiedCredentialCache(ttl=60, max_entries=2)
+    for name in ("a", "b", "c"):
+        cache.put(name, "pw", name)
+    assert len(cache._entries) <= 2
+    assert cache.get("c", "pw") == "c"
@@ -0,0 +1,34 @@
+import uuid
+
+from app.chat.persona_registry import PersonaRegistry
+from app.models.persona import Persona
+from app.storage.file_storage import FileStorage
+
+
+def make_persona(persona_id, prompt="prompt"):
+    return Persona(persona_id=persona_id, name=persona_id, description="", system_prompt=prompt)
+
+
+def test_created_persona_appears_on_other_worker(worker_states):
+    a, b = PersonaRegistry(FileStorage(), worker_states[0]), PersonaRegistry(FileStorage(), worker_states[1])
+    persona_id = f"custom_{uuid.uuid4().hex[:8]}"
+    before = [p.id for p in b.all()]
+    assert persona_id not in before
+    assert a.create(make_persona(persona_id))
+    assert persona_id in [p.id for p in b.all()]
+    assert b.delete(persona_id)
+    assert persona_id not in [p.id for p in a.all()]
+
+
+def test_create_does_not_overwrite(worker_states):
+    a, b = PersonaRegistry(FileStorage(), worker_states[0]), PersonaRegistry(FileStorage(), worker_states[1])
+    persona_id = f"custom_{uuid.uuid4().hex[:8]}"
+    assert a.create(make_persona(persona_id, "original"))
+    assert not b.create(make_persona(persona_id, "replacement"))
+    assert b.get(persona_id).system_prompt == "original"
+
+
+def test_create_rejects_builtin_and_invalid_ids(worker_states):
+    registry = PersonaRegistry(FileStorage(), worker_states[0])
+    assert not registry.create(make_persona("default"))
+    assert not registry.create(make_persona("../escape"))
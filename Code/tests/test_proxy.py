@@ -0,0 +1,122 @@
+import asyncio
+from http.cookies import SimpleCookie
+
+from app.config import DEPLOY_CONFIG
+from app.deploy.proxy import StickyProxy, Upstream
+
+COOKIE = DEPLOY_CONFIG["cookie_name"]
+
+
+async def start_backend(index: int):
+    """模拟的工作进程：响应内容为 "<编号>|<X-Forwarded-For>"，然后关闭连接"""
+
+    async def handle(reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        headers = dict(line.split(b": ", 1) for line in head[:-4].split(b"\r\n")[1:])
+        body = f"{index}|{headers.get(b'X-Forwarded-For', b'').decode()}".encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, Upstream(index, "127.0.0.1", server.sockets[0].getsockname()[1], healthy=True)
+
+
+async def request(proxy: StickyProxy, cookie=None, headers=b""):
+    """通过代理发送一个请求，返回(状态码, 粘性Cookie的值, 响应内容)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+    head = b"GET / HTTP/1.1\r\nHost: test\r\n" + headers
+    if cookie is not None:
+        head += f"Cookie: other=1; {COOKIE}={cookie}\r\n".encode()
+    writer.write(head + b"\r\n")
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    sticky = None
+    for line in lines[1:]:
+        name, _, value = line.partition(": ")
+        if name.lower() == "set-cookie":
+            morsel = SimpleCookie(value).get(COOKIE)
+            sticky = morsel.value if morsel is not None else sticky
+    return int(lines[0].split(" ")[1]), sticky, body.decode()
+
+
+def run(scenario, backends=2):
+    """启动模拟的工作进程和代理，运行 scenario(proxy, servers)"""
+
+    async def main():
+        started = [await start_backend(i) for i in range(backends)]
+        proxy = StickyProxy([upstream for _, upstream in started], "127.0.0.1", 0)
+        await proxy.start()
+        try:
+            await scenario(proxy, [server for server, _ in started])
+        finally:
+            await proxy.close()
+            for server, _ in started:
+                server.close()
+                await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_same_session_goes_to_same_backend():
+    async def scenario(proxy, servers):
+        status, sticky, body = await request(proxy)
+        assert status == 200 and sticky is not None
+        assert body.split("|")[0] == sticky
+        for _ in range(5):
+            status, again, body = await request(proxy, cookie=sticky)
+            assert status == 200 and again is None  # 已固定的浏览器不再设置Cookie
+            assert body.split("|")[0] == sticky
+        # Cookie指定另一个工作进程时转发到该进程
+        other = str(1 - int(sticky))
+        assert (await request(proxy, cookie=other))[2].split("|")[0] == other
+
+    run(scenario)
+
+
+def test_forwarded_for_is_overwritten():
+    async def scenario(proxy, servers):
+        _, _, body = await request(proxy, headers=b"X-Forwarded-For: 203.0.113.9\r\n")
+        assert body.split("|")[1] == "127.0.0.1"
+
+    run(scenario)
+
+
+def test_invalid_cookie_is_reassigned():
+    async def scenario(proxy, servers):
+        for value in ("7", "abc"):
+            status, sticky, _ = await request(proxy, cookie=value)
+            assert status == 200 and sticky in ("0", "1")
+
+    run(scenario)
+
+
+def test_unhealthy_backend_fails_over():
+    async def scenario(proxy, servers):
+        proxy.upstreams[1].healthy = False
+        status, sticky, body = await request(proxy, cookie="1")
+        assert status == 200 and sticky == "0" and body.startswith("0|")
+
+    run(scenario)
+
+
+def test_unreachable_backend_is_marked_unhealthy():
+    async def scenario(proxy, servers):
+        servers[1].close()
+        await servers[1].wait_closed()
+        status, sticky, body = await request(proxy, cookie="1")
+        assert status == 200 and sticky == "0" and body.startswith("0|")
+        assert not proxy.upstreams[1].healthy
+
+    run(scenario)
+
+
+def test_no_healthy_backend_returns_502():
+    async def scenario(proxy, servers):
+        for upstream in proxy.upstreams:
+            upstream.healthy = False
+        assert (await request(proxy))[0] == 502
+
+    run(scenario)
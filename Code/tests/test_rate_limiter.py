@@ -0,0 +1,68 @@
+import time
+
+from app.auth.rate_limiter import KeyedRateLimiter
+from app.storage.shared_state import MemorySharedState
+
+
+def make_limiter(state, capacity=3):
+    return KeyedRateLimiter(capacity, 0.001, state=state, name="login")
+
+
+def test_limit_is_shared_between_workers(worker_states):
+    a, b = make_limiter(worker_states[0]), make_limiter(worker_states[1])
+    assert a.try_acquire("alice")[0]
+    assert b.try_acquire("alice")[0]
+    assert a.try_acquire("alice")[0]
+    for limiter in (a, b):
+        allowed, retry_after = limiter.try_acquire("alice")
+        assert not allowed and retry_after > 0
+    # 其他键不受影响
+    assert b.try_acquire("bob")[0]
+
+
+def test_reset_applies_to_all_workers(worker_states):
+    a, b = make_limiter(worker_states[0], capacity=1), make_limiter(worker_states[1], capacity=1)
+    assert a.try_acquire("alice")[0]
+    assert not b.try_acquire("alice")[0]
+    b.reset("alice")
+    assert a.try_acquire("alice")[0]
+
+
+def test_limiters_are_independent_by_name(worker_states):
+    a = KeyedRateLimiter(1, 0.001, state=worker_states[0], name="username")
+    b = KeyedRateLimiter(1, 0.001, state=worker_states[1], name="address")
+    assert a.try_acquire("alice")[0]
+    assert b.try_acquire("alice")[0]
+
+
+def test_process_local_state_keeps_local_buckets():
+    # 内存实现不跨进程共享，每个限流器使用自己的桶
+    state = MemorySharedState()
+    a, b = make_limiter(state, capacity=1), make_limiter(state, capacity=1)
+    assert a.try_acquire("alice")[0]
+    assert b.try_acquire("alice")[0]
+    assert not a.try_acquire("alice")[0]
+    assert state.items("ratelimit:login") == {}
+
+
+def test_local_bucket_refills_over_time():
+    limiter = KeyedRateLimiter(2, 20.0)
+    assert limiter.try_acquire("alice")[0]
+    assert limiter.try_acquire("alice")[0]
+    allowed, retry_after = limiter.try_acquire("alice")
+    assert not allowed and 0 < retry_after <= 0.05
+    time.sleep(retry_after + 0.01)
+    assert limiter.try_acquire("alice")[0]
+
+
+def test_local_reset_and_eviction():
+    limiter = KeyedRateLimiter(1, 0.001, max_keys=2)
+    assert limiter.try_acquire("alice")[0]
+    assert not limiter.try_acquire("alice")[0]
+    limiter.reset("alice")
+    assert limiter.try_acquire("alice")[0]
+    # 超过上限时淘汰最久未使用的桶
+    limiter.try_acquire("bob")
+    limiter.try_acquire("carol")
+    assert list(limiter._buckets) == ["bob", "carol"]
+    assert limiter.try_acquire("alice")[0]
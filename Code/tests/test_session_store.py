@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+
+import pytest
+
+from app.auth.session_store import SessionStore, load_session_secret
+
+SECRET = b"s" * 32
+
+
+def make_store(state, **overrides):
+    options = dict(secret=SECRET, idle_timeout=3600, max_lifetime=86400, rotate_after=3600,
+                   rotation_grace=30, touch_interval=60, state=state)
+    options.update(overrides)
+    return SessionStore(**options)
+
+
+def test_session_created_on_one_worker_is_valid_on_another(worker_states):
+    a, b = make_store(worker_states[0]), make_store(worker_states[1])
+    token = a.create("user-1", "alice")
+    session, new_token = b.validate(token)
+    assert session is not None and session.user_id == "user-1" and session.username == "alice"
+    assert new_token is None
+
+
+def test_revoke_applies_to_all_workers(worker_states):
+    a, b = make_store(worker_states[0]), make_store(worker_states[1])
+    token = a.create("user-1", "alice")
+    other = a.create("user-1", "alice")
+    b.revoke(token)
+    assert a.validate(token) == (None, None)
+    assert b.revoke_user("user-1") == 1
+    assert a.validate(other) == (None, None)
+
+
+def test_forged_or_foreign_tokens_are_rejected(worker_states):
+    a = make_store(worker_states[0])
+    foreign = make_store(worker_states[1], secret=b"x" * 32)
+    token = foreign.create("user-1", "alice")
+    assert a.validate(token) == (None, None)
+    session_id, issued, signature = a.create("user-1", "alice").split(".")
+    assert a.validate(f"{session_id}.{int(issued) + 1}.{signature}") == (None, None)
+    assert a.validate("garbage") == (None, None)
+
+
+def test_rotation_is_visible_to_other_worker(worker_states):
+    a = make_store(worker_states[0])
+    b = make_store(worker_states[1], rotate_after=0)
+    token = a.create("user-1", "alice")
+
+    session, rotated = b.validate(token)
+    assert session is not None and rotated is not None and rotated != token
+    # 另一个工作进程上的旧令牌（例如另一个标签页）在宽限期内换成同一个新令牌
+    assert a.validate(token)[1] == rotated
+    replacement, new_token = a.validate(rotated)
+    assert replacement.session_id == session.session_id and new_token is None
+    assert replacement.created_at == session.created_at and replacement.expires_at == session.expires_at
+
+
+def test_old_token_expires_after_grace(worker_states):
+    a = make_store(worker_states[0], rotate_after=0, rotation_grace=0.05)
+    token = a.create("user-1", "alice")
+    _, rotated = a.validate(token)
+    time.sleep(0.1)
+    assert a.validate(token) == (None, None)
+    assert a.validate(rotated)[0] is not None
+
+
+def test_concurrent_rotation_converges(worker_states):
+    stores = [make_store(worker_states[i % 2], rotate_after=0) for i in range(8)]
+    token = stores[0].create("user-1", "alice")
+    barrier = threading.Barrier(len(stores))
+    results = []
+
+    def rotate(store):
+        barrier.wait()
+        results.append(store.validate(token)[1])
+
+    threads = [threading.Thread(target=rotate, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == len(stores) and None not in results
+    assert len(set(results)) == 1
+    # 只保留旧会话（宽限期内）和一个新会话，落败的轮换结果已删除
+    assert stores[0].active_count() == 2
+
+
+def test_expired_session_is_removed(worker_states):
+    a = make_store(worker_states[0], idle_timeout=0.05, touch_interval=0)
+    token = a.create("user-1", "alice")
+    time.sleep(0.1)
+    assert a.validate(token) == (None, None)
+    assert a.active_count() == 0
+
+
+@pytest.fixture
+def no_env_secret(monkeypatch):
+    monkeypatch.delenv("XIAOHAO_SESSION_SECRET", raising=False)
+
+
+def test_secret_is_shared_by_concurrent_starts(tmp_path, no_env_secret):
+    path = str(tmp_path / "session_secret")
+    barrier = threading.Barrier(16)
+    secrets_loaded = []
+
+    def start():
+        barrier.wait()
+        secrets_loaded.append(load_session_secret(path))
+
+    threads = [threading.Thread(target=start) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(secrets_loaded) == 16
+    assert len(set(secrets_loaded)) == 1 and len(secrets_loaded[0]) == 32
+    with open(path, 'rb') as f:
+        assert f.read() == secrets_loaded[0]
+    assert os.listdir(tmp_path) == ["session_secret"]  # 临时文件已删除
+
+
+def test_empty_secret_file_is_rejected(tmp_path, no_env_secret):
+    path = tmp_path / "session_secret"
+    path.write_bytes(b"")
+    with pytest.raises(RuntimeError):
+        load_session_secret(str(path), attempts=2)
+
+
+def test_environment_secret_takes_precedence(tmp_path, monkeypatch):
+    monkeypatch.setenv("XIAOHAO_SESSION_SECRET", "from-env")
+    assert load_session_secret(str(tmp_path / "session_secret")) == b"from-env"
+    assert not (tmp_path / "session_secret").exists()
@@ -0,0 +1,104 @@
+import time
+import threading
+
+import pytest
+
+from app.storage.shared_state import MemorySharedState, create_shared_state, process_id
+
+
+def test_values_are_visible_to_other_worker(worker_states):
+    a, b = worker_states
+    a.set("ns", "key", {"n": 1})
+    assert b.get("ns", "key") == {"n": 1}
+    assert b.items("ns") == {"key": {"n": 1}}
+    assert b.delete("ns", "key")
+    assert a.get("ns", "key", "missing") == "missing"
+    assert not a.delete("ns", "key")
+
+
+def test_values_are_copies(worker_states):
+    a, _ = worker_states
+    value = {"items": [1]}
+    a.set("ns", "key", value)
+    value["items"].append(2)
+    loaded = a.get("ns", "key")
+    loaded["items"].append(3)
+    assert a.get("ns", "key") == {"items": [1]}
+
+
+def test_expired_keys_are_absent(worker_states):
+    a, b = worker_states
+    a.set("ns", "short", 1, ttl=0.05)
+    a.set("ns", "long", 2, ttl=60)
+    time.sleep(0.1)
+    assert b.get("ns", "short") is None
+    assert b.items("ns") == {"long": 2}
+    assert not b.delete("ns", "short")
+
+
+def test_update_semantics(worker_states):
+    a, b = worker_states
+    assert a.update("ns", "key", lambda current: (current or 0) + 1) == 1
+    # 返回参数对象本身时不写入，过期时间也不变
+    b.set("ns", "ttl", {"v": 1}, ttl=0.05)
+    b.update("ns", "ttl", lambda current: current, ttl=60)
+    time.sleep(0.1)
+    assert a.get("ns", "ttl") is None
+    # 返回None时删除
+    assert a.update("ns", "key", lambda current: None) is None
+    assert b.get("ns", "key") is None
+
+
+def test_add_only_when_missing(worker_states):
+    a, b = worker_states
+    assert a.add("ns", "key", "first")
+    assert not b.add("ns", "key", "second")
+    assert a.get("ns", "key") == "first"
+
+
+def test_concurrent_incr_is_atomic(worker_states):
+    a, b = worker_states
+    barrier = threading.Barrier(8)
+
+    def work(state):
+        barrier.wait()
+        for _ in range(50):
+            state.incr("ns", "counter")
+
+    threads = [threading.Thread(target=work, args=(a if i % 2 else b,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert a.get("ns", "counter") == 400
+
+
+def test_lease_has_single_holder(worker_states):
+    a, b = worker_states
+    assert a.acquire_lease("job", "worker-a", ttl=60)
+    assert a.acquire_lease("job", "worker-a", ttl=60)  # 续期
+    assert not b.acquire_lease("job", "worker-b", ttl=60)
+    b.release_lease("job", "worker-b")  # 不是持有者，不影响租约
+    assert not b.acquire_lease("job", "worker-b", ttl=60)
+    a.release_lease("job", "worker-a")
+    assert b.acquire_lease("job", "worker-b", ttl=60)
+
+
+def test_expired_lease_can_be_taken_over(worker_states):
+    a, b = worker_states
+    assert a.acquire_lease("job", "worker-a", ttl=0.05)
+    time.sleep(0.1)
+    assert b.acquire_lease("job", "worker-b", ttl=60)
+    assert not a.acquire_lease("job", "worker-a", ttl=60)
+
+
+def test_create_shared_state():
+    assert isinstance(create_shared_state("memory"), MemorySharedState)
+    assert not create_shared_state("memory").shared
+    with pytest.raises(ValueError):
+        create_shared_state("redis")
+
+
+def test_process_id_names_host_and_pid():
+    import os
+    assert process_id().endswith(f":{os.getpid()}")
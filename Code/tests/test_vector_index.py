@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.storage.vector_index import VectorIndex
+
+DIM = 16
+
+
+def unit_vectors(n, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_index(tmp_path, n=200, **options):
+    index = VectorIndex(str(tmp_path / "index"), dim=DIM, **options)
+    vectors = unit_vectors(n)
+    index.add(vectors, np.arange(n) + 1000)
+    return index, vectors
+
+
+def exact_top(vectors, query, k, exclude=()):
+    scores = vectors @ query
+    order = [i for i in np.argsort(-scores) if i + 1000 not in exclude]
+    return [i + 1000 for i in order[:k]]
+
+
+def test_search_returns_top_k_by_similarity(tmp_path):
+    index, vectors = make_index(tmp_path)
+    keys, scores = index.search(vectors[7], 5)
+    assert keys[0] == 1007 and scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert keys.tolist() == exact_top(vectors, vectors[7], 5)
+    assert list(scores) == sorted(scores, reverse=True)
+    assert len(index.search(vectors[0], 500)[0]) == 200
+    assert len(index.search(vectors[0], 0)[0]) == 0
+    np.testing.assert_allclose(index.get(np.array([1003, 1001])), vectors[[3, 1]])
+
+
+def test_delete_hides_rows_until_compaction(tmp_path):
+    index, vectors = make_index(tmp_path)
+    assert index.delete(np.array([1007, 1008, 999999])) == 2
+    assert index.delete(np.array([1007])) == 0
+    assert len(index) == 198 and index.deleted_count == 2
+    keys, _ = index.search(vectors[7], 5)
+    assert 1007 not in keys and keys.tolist() == exact_top(vectors, vectors[7], 5, exclude={1007, 1008})
+    with pytest.raises(KeyError):
+        index.get(np.array([1007]))
+
+    index.compact()
+    assert index.stats()["rows"] == 198 and index.deleted_count == 0 and len(index) == 198
+    assert index.search(vectors[7], 5)[0].tolist() == keys.tolist()
+    # 旧版本文件已删除
+    assert not [name for name in os.listdir(index.directory) if ".000001." in name]
+    assert index.max_key() == 1199
+
+
+def test_compact_trains_ivf_above_threshold(tmp_path):
+    index, vectors = make_index(tmp_path, n=400, ivf_min_rows=100, nprobe=4)
+    assert not index.is_trained
+    assert index.optimize()
+    assert index.is_trained and index.stats()["nlist"] == 20
+    # 每个向量都能在自己所在的簇中找到
+    for row in (0, 123, 399):
+        assert index.search(vectors[row], 1)[0][0] == row + 1000
+    # 扫描全部簇时与精确检索一致
+    query = unit_vectors(1, seed=1)[0]
+    assert index.search(query, 10, nprobe=20)[0].tolist() == index.search(query, 10, exact=True)[0].tolist()
+
+    # 训练后追加的行在尾部扫描，不需要重新归簇
+    extra = unit_vectors(5, seed=2)
+    index.add(extra, np.arange(5) + 5000)
+    assert index.search(extra[3], 1)[0][0] == 5003
+    assert not index.optimize()
+
+
+def test_readonly_reader_sees_writes(tmp_path):
+    index, vectors = make_index(tmp_path, n=10)
+    reader = VectorIndex(index.directory, readonly=True)
+    assert len(reader) == 10
+    index.add(unit_vectors(3, seed=3), np.array([1, 2, 3]))
+    index.delete(np.array([1000]))
+    assert len(reader) == 12
+    assert 1000 not in reader.search(vectors[0], 3)[0]
+
+
+def test_open_errors(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        VectorIndex(str(tmp_path / "missing"))
+    with pytest.raises(FileNotFoundError):
+        VectorIndex(str(tmp_path / "missing"), dim=DIM, readonly=True)
+    index, _ = make_index(tmp_path, n=1)
+    assert VectorIndex(index.directory).dim == DIM
+    with pytest.raises(ValueError):
+        VectorIndex(index.directory, dim=DIM + 1)
+    with pytest.raises(ValueError):
+        index.add(unit_vectors(2), np.array([1]))
@@ -0,0 +1,145 @@
+import time
+import threading
+
+from app.models.chat import Chat
+from app.models.message import Message
+from app.storage.write_behind import WriteBehindQueue
+
+
+class StubStorage:
+    """记录写入的存储，fail 中的聊天写入失败"""
+
+    def __init__(self, fail=(), delay=0.0):
+        self.fail = set(fail)
+        self.delay = delay
+        self.saved = {}
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def save_chat(self, chat):
+        time.sleep(self.delay)
+        with self.lock:
+            self.attempts[chat.chat_id] = self.attempts.get(chat.chat_id, 0) + 1
+            if chat.chat_id in self.fail:
+                return False
+            self.saved[chat.chat_id] = chat
+            return True
+
+
+def make_chat(chat_id, *contents):
+    return Chat(chat_id=chat_id, messages=[Message("user", c) for c in contents])
+
+
+def make_queue(storage, max_pending=16):
+    queue = WriteBehindQueue(storage, max_pending=max_pending)
+    queue.RETRY_DELAY = 0.01
+    queue.RETRY_DELAY_MAX = 0.05
+    return queue
+
+
+def test_submissions_coalesce_to_latest_snapshot():
+    storage = StubStorage(delay=0.05)
+    queue = make_queue(storage)
+    queue.submit(make_chat("busy"))  # 占住写入线程，后面的提交在队列中合并
+    time.sleep(0.01)
+    for i in range(5):
+        queue.submit(make_chat("c", *[str(n) for n in range(i + 1)]))
+    assert len(queue.get_pending("c").messages) == 5
+    assert queue.flush(5)
+    assert storage.attempts["c"] == 1
+    assert len(storage.saved["c"].messages) == 5
+    assert queue.get_pending("c") is None and queue.backlog == 0
+
+
+def test_get_pending_returns_copy():
+    queue = make_queue(StubStorage(delay=0.05))
+    queue.submit(make_chat("busy"))
+    queue.submit(make_chat("c", "a"))
+    pending = queue.get_pending("c")
+    pending.messages.append(Message("user", "b"))
+    assert len(queue.get_pending("c").messages) == 1
+    queue.flush(5)
+
+
+def test_failing_chat_does_not_block_others():
+    storage = StubStorage(fail={"bad"})
+    queue = make_queue(storage)
+    queue.submit(make_chat("bad"))
+    for chat_id in ("a", "b", "c"):
+        queue.submit(make_chat(chat_id))
+    deadline = time.monotonic() + 2
+    while len(storage.saved) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert set(storage.saved) == {"a", "b", "c"}
+
+
+def test_failing_chat_is_parked_after_retries():
+    storage = StubStorage(fail={"bad"})
+    queue = make_queue(storage)
+    queue.submit(make_chat("bad", "x"))
+    queue.submit(make_chat("good"))
+    deadline = time.monotonic() + 2
+    while not queue.failed_chats() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.failed_chats() == ["bad"]
+    assert storage.attempts["bad"] == queue.MAX_RETRIES
+    assert queue.backlog == 0
+    # 搁置的快照仍可读取，重新提交后再次重试
+    assert queue.get_pending("bad").messages[0].content == "x"
+    storage.fail.clear()
+    queue.submit(make_chat("bad", "y"))
+    assert queue.flush(5)
+    assert storage.saved["bad"].messages[0].content == "y" and queue.failed_chats() == []
+
+
+def test_flush_reports_unsaveable_chats_instead_of_timing_out():
+    storage = StubStorage(fail={"bad"})
+    queue = make_queue(storage)
+    queue.RETRY_DELAY = queue.RETRY_DELAY_MAX = 60.0  # 排空时不等待退避
+    queue.submit(make_chat("bad"))
+    queue.submit(make_chat("good"))
+    started = time.monotonic()
+    assert not queue.flush(5)
+    assert time.monotonic() - started < 2
+    assert queue.failed_chats() == ["bad"] and "good" in storage.saved
+
+
+def test_discard_drops_pending_snapshot():
+    storage = StubStorage(delay=0.05)
+    queue = make_queue(storage)
+    queue.submit(make_chat("busy"))
+    queue.submit(make_chat("c"))
+    queue.discard("c")
+    assert queue.get_pending("c") is None
+    queue.flush(5)
+    assert "c" not in storage.saved
+
+
+def test_full_queue_blocks_submitters_until_written():
+    storage = StubStorage(delay=0.02)
+    queue = make_queue(storage, max_pending=2)
+    for i in range(10):
+        queue.submit(make_chat(f"c{i}"))
+        assert queue.backlog <= 3  # 2个排队加1个正在写入
+    assert queue.flush(5)
+    assert len(storage.saved) == 10
+
+
+def test_disabled_queue_writes_synchronously():
+    storage = StubStorage(fail={"bad"})
+    queue = WriteBehindQueue(storage, max_pending=4, enabled=False)
+    assert queue.submit(make_chat("c"))
+    assert "c" in storage.saved
+    assert not queue.submit(make_chat("bad"))
+
+
+def test_failed_write_of_discarded_chat_is_not_requeued():
+    storage = StubStorage(fail={"c"}, delay=0.1)
+    queue = make_queue(storage)
+    queue.submit(make_chat("c"))
+    time.sleep(0.02)  # 正在写入
+    queue.discard("c")
+    assert queue.get_pending("c") is None
+    time.sleep(0.2)
+    assert storage.attempts["c"] == 1
+    assert queue.backlog == 0 and queue.failed_chats() == []